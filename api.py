@@ -3,23 +3,62 @@
 # weed in an image. It uses the Custom Vision API to detect the
 # objects in the image.
 #####################################################################
+import asyncio
 import json
 import os
-from fastapi import Depends, FastAPI, APIRouter, File, UploadFile, HTTPException, status
+import threading
+from contextlib import nullcontext
+from fastapi import (
+    Depends,
+    FastAPI,
+    APIRouter,
+    File,
+    UploadFile,
+    HTTPException,
+    WebSocket,
+    Query,
+    Request,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response
 import traceback
 
 # import my own libraries
 from common_modules.common import constants
 from common_modules.common.common_logging import LogHelper
+from common_modules.bulk_analysis import BulkAnalysis
 from common_modules.grass_weed_detection import GrassWeedDetector
+from common_modules.live_feed import LiveFeedSession
+from common_modules.video_analysis import VideoAnalyzer
+from common_modules.common.analysis_scheduler import parse_priority
 from common_modules.common.common_config import Config
-from common_modules.common.azure_storage_utilities import AzureBlobStorageHelper
+from common_modules.common.deadline import Deadline, DeadlineExceededError
+from common_modules.common.image_buffer import ImageBuffer
+from common_modules.common.memory_instrumentation import MemoryTracker
+from common_modules.common.request_profiler import RequestProfiler, has_admin_key
+from common_modules.common.serialization import (
+    MEDIA_TYPE_JSON,
+    MEDIA_TYPE_MSGPACK,
+    dumps_compact_details,
+    dumps_json_bytes,
+    prefers_msgpack,
+)
+from common_modules.common.storage_backend import create_storage_helper
+from common_modules.image_processing.image_derivatives import (
+    derivative_media_type,
+    select_derivative,
+)
+from common_modules.image_processing.image_prescreen import ImageRejectedError
 
 
 MAX_PREDICTIONS = 1  # maximum number of predictions to return
 MAX_UPLOAD_FILE_SIZE = 2 * 1024 * 1024  # max file size - 2 MB
+# the details are returned as json or msgpack, depending on the Accept header
+NEGOTIATED_HEADERS = {"Vary": "Accept"}
+MAX_VIDEO_UPLOAD_FILE_SIZE = 200 * 1024 * 1024  # max video file size - 200 MB
+DISCONNECT_POLL_INTERVAL = 0.5  # seconds between the checks for a disconnected client
 
 
 def setup_config() -> Config:
@@ -35,10 +74,26 @@ Weed/Grass Detection API helps you to determine the presence of grass and weed i
 Use the api interaction with AI model to detected weed or grass in an image. You can upload an image or pick one of our preselected test images.
 
 
+* **Analyze a video.**  
+Upload a short video, e.g. recorded by a mower. Frames are sampled from the video and the detections are returned for each analyzed frame.
+
+
+* **Analyze a live feed.**  
+Stream jpeg frames over a websocket and receive the detected areas of each analyzed frame.
+
+
 * **Read prediction details.**  
 You can also query the detection details from the model, i.e. detected labels, confidence levels,etc.
 
 
+* **Query the prediction history.**  
+Page through the past analyses and get aggregates, e.g. number of weed detections above a confidence level in a period.
+
+
+* **Query the geotagged analyses.**  
+Find the analyses in an area or near a position, and read weed density tiles for a map.
+
+
 * **Read an annotated image.**  
 After an image is analyzed by the AI model, you can read back the annotated image with detected areas of grass or weed.
 
@@ -60,10 +115,19 @@ app = FastAPI(
 
 default_router = APIRouter()
 prediction_router = APIRouter()
+debug_router = APIRouter()
+profile_router = APIRouter()
+admin_router = APIRouter()
 
 logger = LogHelper(config, logger_name=__name__)
-azure_storage = AzureBlobStorageHelper(config, logger)
+storage_helper = create_storage_helper(config, logger)
 detector = GrassWeedDetector(config, logger)
+video_analyzer = VideoAnalyzer(config, logger, detector)
+memory_tracker = MemoryTracker(config, logger)
+request_profiler = RequestProfiler.from_config(config, logger)
+# bulk analysis jobs started through the admin endpoints, by job name
+bulk_jobs = {}
+bulk_jobs_lock = threading.Lock()
 logger.info("api started...")
 
 config_source = config.get(constants.CONFIG_APP_SOURCE_DESCR)
@@ -72,6 +136,23 @@ print(
     f"App version: {api_version}, build: {api_build_date},  config source: {config_source}, version: {config.config_version}"
 )
 
+
+@app.on_event("startup")
+async def warm_up_render_pool() -> None:
+    # start the worker processes now, the first renders don't pay for it
+    if detector.render_pool is not None:
+        await run_in_threadpool(detector.render_pool.warm_up)
+
+
+@app.on_event("shutdown")
+async def shut_down_detector() -> None:
+    # the keep-alive connections of the async prediction calls (live feed)
+    await detector.aclose()
+    # waits for the renders in flight, their shared memory is released
+    if detector.render_pool is not None:
+        await run_in_threadpool(detector.render_pool.shutdown)
+
+
 # Allow CORS
 app.add_middleware(
     CORSMiddleware,
@@ -136,15 +217,283 @@ def read_version() -> JSONResponse:
     )
 
 
+def read_pending_prediction_file(filename: str) -> bytes:
+    """Returns the prediction file from the local spool if its upload is still
+    pending (write-behind mode), None otherwise.
+    """
+    if detector.write_behind is None:
+        return None
+    return detector.write_behind.read_pending(filename)
+
+
+def prediction_file_response(
+    filename: str, media_type: str, read_file, headers: dict = None
+) -> Response:
+    """Returns a response with the stored prediction file.
+
+    - files still waiting for their upload are served from the local spool
+    - files in local storage are served from disk, without reading them into
+    memory (with sendfile where the server supports it)
+    - otherwise the file is read with read_file, e.g. from azure blob storage
+    """
+    pending_file = read_pending_prediction_file(filename)
+    if pending_file is not None:
+        return Response(pending_file, media_type=media_type, headers=headers)
+
+    path = storage_helper.prediction_file_path(filename)
+    if path is not None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    return Response(read_file(filename), media_type=media_type, headers=headers)
+
+
+def read_prediction_file_bytes(filename: str, read_file) -> bytes:
+    """Reads the stored prediction file, from the same places as
+    prediction_file_response().
+    """
+    pending_file = read_pending_prediction_file(filename)
+    if pending_file is not None:
+        return pending_file
+
+    path = storage_helper.prediction_file_path(filename)
+    if path is not None:
+        with open(path, "rb") as f:
+            return f.read()
+
+    return read_file(filename)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True if the client asked for the compact msgpack details with the
+    Accept header, json is the default.
+    """
+    return prefers_msgpack(request.headers.get("accept"))
+
+
+def get_prediction_history():
+    if detector.prediction_history is None:
+        raise HTTPException(
+            status_code=404,
+            detail="prediction history is not enabled, see PredictionHistoryEnabled.",
+        )
+    return detector.prediction_history
+
+
+def get_geo_index():
+    if detector.geo_index is None:
+        raise HTTPException(
+            status_code=404,
+            detail="geo index is not enabled, see GeoIndexEnabled.",
+        )
+    return detector.geo_index
+
+
+def create_deadline(request: Request) -> Deadline:
+    """Creates the deadline of the request, from the configuration or the
+    X-Request-Deadline header (seconds).
+    """
+    seconds = config.get_float(
+        constants.CONFIG_REQUEST_DEADLINE_SECONDS,
+        constants.DEFAULT_REQUEST_DEADLINE_SECONDS,
+    )
+    requested = request.headers.get(constants.REQUEST_DEADLINE_HEADER)
+    if requested:
+        try:
+            requested_seconds = float(requested)
+        except ValueError:
+            requested_seconds = 0
+        if not requested_seconds > 0:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{constants.REQUEST_DEADLINE_HEADER} should be a number of seconds.",
+            )
+        seconds = min(
+            requested_seconds,
+            config.get_float(
+                constants.CONFIG_REQUEST_DEADLINE_MAX_SECONDS,
+                constants.DEFAULT_REQUEST_DEADLINE_MAX_SECONDS,
+            ),
+        )
+    return Deadline(seconds)
+
+
+def get_analysis_priority(request: Request) -> constants.AnalysisPriority:
+    """Returns the priority class requested with the X-Analysis-Priority header,
+    interactive by default.
+    """
+    requested = request.headers.get(constants.ANALYSIS_PRIORITY_HEADER)
+    if not requested:
+        return constants.AnalysisPriority.INTERACTIVE
+    try:
+        return parse_priority(requested)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def run_with_deadline(request: Request, deadline: Deadline, func, *args):
+    """Runs the blocking function in the thread pool until it completes, the
+    deadline passes or the client disconnects. In the last two cases the deadline
+    is cancelled, so the function stops before its next stage.
+    """
+    task = asyncio.ensure_future(run_in_threadpool(func, *args))
+    try:
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=min(DISCONNECT_POLL_INTERVAL, deadline.remaining())
+            )
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise DeadlineExceededError("request", cancelled=True)
+            if deadline.expired:
+                raise DeadlineExceededError("request")
+    finally:
+        if not task.done():
+            deadline.cancel()
+            # the result is not needed anymore, only retrieve it to keep asyncio quiet
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
 class PredictionEndpoint:
 
+    @staticmethod
+    @prediction_router.get(
+        "/history",
+        description="Read the history of the analyses.",
+        summary="Read the history of the analyses.",
+    )
+    def read_prediction_history(
+        start: str = Query(None, description="Start time, e.g. 2024-05-01 00:00:00"),
+        end: str = Query(None, description="End time (exclusive)"),
+        label: str = Query(None, description="Only analyses that detected this label"),
+        min_confidence: float = Query(
+            None, ge=0, le=1, description="Only detections with at least this confidence"
+        ),
+        limit: int = Query(50, ge=1, le=1000),
+        cursor: int = Query(None, description="next_cursor of the previous page"),
+    ) -> Response:
+        """Reads a page of the analyses, newest first, from the local prediction history.
+
+        Returns:
+
+            - json: items with the prediction details, and next_cursor to read the next page
+            (null on the last page).
+        """
+        history = get_prediction_history()
+        page = history.query_history(start, end, label, min_confidence, limit, cursor)
+        return Response(dumps_json_bytes(page), media_type="application/json")
+
+    @staticmethod
+    @prediction_router.get(
+        "/history/aggregates",
+        description="Read the aggregates of the detections.",
+        summary="Read the aggregates of the detections.",
+    )
+    def read_prediction_aggregates(
+        start: str = Query(None, description="Start time, e.g. 2024-05-01 00:00:00"),
+        end: str = Query(None, description="End time (exclusive)"),
+        label: str = Query(None),
+        min_confidence: float = Query(None, ge=0, le=1),
+        bins: int = Query(10, ge=1, le=100, description="Number of histogram bins"),
+    ) -> Response:
+        """Reads the number of detections, the average confidence and a confidence
+        histogram for each label from the local prediction history.
+        """
+        history = get_prediction_history()
+        aggregates = history.query_aggregates(start, end, label, min_confidence, bins)
+        return Response(dumps_json_bytes(aggregates), media_type="application/json")
+
+    @staticmethod
+    @prediction_router.get(
+        "/geo/area",
+        description="Read the geotagged analyses in a bounding box.",
+        summary="Read the geotagged analyses in a bounding box.",
+    )
+    def read_geo_area(
+        south: float = Query(..., ge=-90, le=90),
+        west: float = Query(..., ge=-180, le=180),
+        north: float = Query(..., ge=-90, le=90),
+        east: float = Query(..., ge=-180, le=180),
+        min_weed_confidence: float = Query(None, ge=0, le=1),
+        limit: int = Query(1000, ge=1, le=10000),
+    ) -> Response:
+        """Reads the analyses of the images taken in the bounding box from the local
+        geo index, in no particular order (sort them on the client if needed).
+
+        Returns:
+
+            - json: items with the location and the weed measures of the analyses,
+            truncated is true when there are more than limit analyses in the box.
+        """
+        geo_index = get_geo_index()
+        try:
+            area = geo_index.query_area(
+                south, west, north, east, min_weed_confidence, limit
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return Response(dumps_json_bytes(area), media_type="application/json")
+
+    @staticmethod
+    @prediction_router.get(
+        "/geo/nearest",
+        description="Read the geotagged analyses nearest to a position.",
+        summary="Read the geotagged analyses nearest to a position.",
+    )
+    def read_geo_nearest(
+        latitude: float = Query(..., ge=-90, le=90),
+        longitude: float = Query(..., ge=-180, le=180),
+        count: int = Query(10, ge=1, le=1000),
+        max_distance: float = Query(
+            10000, gt=0, le=1000000, description="Maximum distance in meters"
+        ),
+        min_weed_confidence: float = Query(None, ge=0, le=1),
+    ) -> Response:
+        """Reads the analyses of the images taken nearest to the position, nearest
+        first, with their distance in meters.
+        """
+        geo_index = get_geo_index()
+        nearest = geo_index.query_nearest(
+            latitude, longitude, count, max_distance, min_weed_confidence
+        )
+        return Response(dumps_json_bytes(nearest), media_type="application/json")
+
+    @staticmethod
+    @prediction_router.get(
+        "/geo/tiles/{zoom}/{x}/{y}",
+        description="Read the weed density of a map tile.",
+        summary="Read the weed density of a map tile.",
+    )
+    def read_geo_tile(
+        zoom: int,
+        x: int,
+        y: int,
+        cells: int = Query(16, ge=1, le=256, description="Grid size of the tile"),
+        min_weed_confidence: float = Query(None, ge=0, le=1),
+    ) -> Response:
+        """Reads the weed density of the map tile zoom/x/y (the tiles of the web
+        maps, e.g. OpenStreetMap) on a grid of cells x cells.
+
+        Returns:
+
+            - json: the bounds of the tile and the cells with analyses (row 0 is the
+            north of the tile), with the number of analyses, the share of them with
+            weed, the weed confidence and the average weed coverage.
+        """
+        geo_index = get_geo_index()
+        try:
+            tile = geo_index.query_tile(zoom, x, y, cells, min_weed_confidence)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return Response(dumps_json_bytes(tile), media_type="application/json")
+
     @staticmethod
     @prediction_router.get(
         "/details/{filename}",
         description="Read the prediction details.",
         summary="Read the prediction details.",
     )
-    def read_prediction_details(filename: str) -> JSONResponse:
+    def read_prediction_details(filename: str, request: Request) -> Response:
         """Reads the prediction details from the server.
         Prediction details are json files containing predictions (Grass/Weed)
         and the confidence levels. The name of the file is returned by the
@@ -161,16 +510,34 @@ class PredictionEndpoint:
 
         Returns:
 
-            - json: json string containing the prediction details.
+            - json: json string containing the prediction details, or the compact
+            msgpack format with Accept: application/msgpack
         """
         print(f"api called for prediction details: {filename}")
         # all images are stored in azure blob storage
         # given a file name, read the image from azure blob storage
         try:
-            json_data = azure_storage.read_prediction_details(filename)
-            json_string = json.loads(json_data)
-            print(f"prediction details: {json_string}")
-            return JSONResponse(json_string, media_type="application/json")
+            if wants_msgpack(request):
+                details = json.loads(
+                    read_prediction_file_bytes(
+                        filename, storage_helper.read_prediction_details_bytes
+                    )
+                )
+                response = Response(
+                    dumps_compact_details(details),
+                    media_type=MEDIA_TYPE_MSGPACK,
+                    headers=NEGOTIATED_HEADERS,
+                )
+            else:
+                # the stored details are already json, pass the bytes through
+                response = prediction_file_response(
+                    filename,
+                    MEDIA_TYPE_JSON,
+                    storage_helper.read_prediction_details_bytes,
+                    NEGOTIATED_HEADERS,
+                )
+            print(f"prediction details have successfully been read: {filename}")
+            return response
         except Exception as e:
             logger.error(f"unable to read prediction details: {e}")
             logger.error(traceback.format_exc())
@@ -186,7 +553,14 @@ class PredictionEndpoint:
         description="Read the analyzed/annotated image.",
         summary="Read the analyzed/annotated image.",
     )
-    def read_prediction_image(filename: str) -> Response:
+    def read_prediction_image(
+        filename: str,
+        request: Request,
+        size: str = Query(
+            None,
+            description="Image size, e.g. thumbnail, medium or full (default).",
+        ),
+    ) -> Response:
         """Reads the analyzed and annotated image after the image analysis is completed.
             In the analyzed image, there are marked areas of detected grass and/or weed if the model is able to detect any.
 
@@ -194,6 +568,8 @@ class PredictionEndpoint:
 
             - filename (str): name of the file containing the prediction details
             as returned by the analyze endpoint. E.g. sample.jpg
+            - size (str): optional image size, e.g. thumbnail. Clients that send
+            image/webp in the Accept header receive a webp image.
 
         HTTPException:
 
@@ -202,13 +578,41 @@ class PredictionEndpoint:
         Returns:
             - Image: image file
         """
-        print(f"api called for prediction image: {filename}")
+        print(f"api called for prediction image: {filename}, size: {size}")
+        try:
+            variant, media_type = select_derivative(
+                filename, size, request.headers.get("accept"), config
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
         try:
-            # all images are stored in azure blob storage
-            #  given a file name, read the image from azure blob storage
-            image_file = azure_storage.read_prediction_image(filename)
-            print(f"prediction image has successfully been read: {filename}")
-            return Response(image_file, media_type="image/jpeg")
+            # with lazy rendering, the image is rendered by the first read
+            if detector.lazy_renderer is not None:
+                detector.lazy_renderer.ensure_rendered(filename)
+
+            # all images are stored in the configured storage (azure blob storage by default)
+            #  given a file name, read the image from the storage
+            headers = {"Vary": "Accept"}
+            try:
+                response = prediction_file_response(
+                    variant, media_type, storage_helper.read_prediction_image, headers
+                )
+            except Exception as e:
+                if variant == filename:
+                    raise
+                # images analyzed before the derivative was configured only have the full size jpeg
+                logger.warning(f"image derivative {variant} not available: {e}")
+                variant = filename
+                response = prediction_file_response(
+                    variant,
+                    derivative_media_type(constants.IMAGE_FORMAT_JPEG),
+                    storage_helper.read_prediction_image,
+                    headers,
+                )
+
+            print(f"prediction image has successfully been read: {variant}")
+            return response
         except Exception as e:
             logger.error(f"unable to read prediction image: {e}")
             logger.error(traceback.format_exc())
@@ -224,7 +628,7 @@ class PredictionEndpoint:
         description="Analyze the selected test image stored on our server.",
         summary="Analyze the selected test image stored on our server.",
     )
-    async def analyze_with_filename(file) -> JSONResponse:
+    async def analyze_with_filename(file, request: Request) -> JSONResponse:
         """Analyze the selected test image stored on the server and return the prediction details.
 
         Args:
@@ -239,6 +643,8 @@ class PredictionEndpoint:
 
                 - JSONResponse: JSON response containing the prediction details.
         """
+        deadline = create_deadline(request)
+        priority = get_analysis_priority(request)
         logger.debug("/analyze/filename invoked")
         print(f"api - /analyze/filename endpoint invoked with file: {file}")
         if not file:
@@ -249,7 +655,9 @@ class PredictionEndpoint:
         # analyze the image and save prediction to result to azure blob storage
         logger.debug("api - analyzing image...")
         print("api - analyzing image...")
-        return PredictionEndpoint.analyze_image(file)
+        return await PredictionEndpoint.analyze_image(
+            request, file, deadline, priority
+        )
 
     @staticmethod
     @prediction_router.post(
@@ -257,7 +665,7 @@ class PredictionEndpoint:
         description="Analyze an uploaded image.",
         summary="Analyze an uploaded image.",
     )
-    async def analyze(file: UploadFile = File(...)):
+    async def analyze(request: Request, file: UploadFile = File(...)):
         """Analyze an uploaded image and return the prediction details.
 
         Args:
@@ -272,6 +680,8 @@ class PredictionEndpoint:
 
                 - JSONResponse: JSON response containing the prediction details.
         """
+        deadline = create_deadline(request)
+        priority = get_analysis_priority(request)
         logger.debug("api - /analyze/file endpoint invoked.")
         print("api - /analyze/file endpoint invoked.")
         if not file:
@@ -279,10 +689,11 @@ class PredictionEndpoint:
 
         logger.debug(f"api - filename provided for analysis: {file.filename}")
 
-        # read the image as bytes
+        # map the spooled upload instead of reading it into bytes, the analysis
+        # stages read the image from the buffer
         image = None
         try:
-            image = await file.read()
+            image = ImageBuffer.from_file(file.file)
 
         except Exception as e:
             raise HTTPException(
@@ -290,6 +701,7 @@ class PredictionEndpoint:
             )
 
         if len(image) > MAX_UPLOAD_FILE_SIZE:
+            image.close()
             raise HTTPException(
                 status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                 detail=f"File size should not exceed {MAX_UPLOAD_FILE_SIZE/ (1024*1024)} MB",
@@ -297,36 +709,409 @@ class PredictionEndpoint:
         # call the detector to analyze the image and save predictions to azure blob storage
         logger.debug("api - analyzing image...")
         print("api - analyzing image...")
-        return PredictionEndpoint.analyze_image(image)
+        return await PredictionEndpoint.analyze_image(
+            request, image, deadline, priority
+        )
+
+    @staticmethod
+    @prediction_router.post(
+        "/analyze/video",
+        description="Analyze an uploaded video.",
+        summary="Analyze an uploaded video.",
+    )
+    async def analyze_video(file: UploadFile = File(...)):
+        """Analyze the frames of an uploaded video and return the detections per timestamp.
+        Frames are sampled from the video, frames that are nearly identical to the
+        previously analyzed frame are skipped.
+
+        Args:
+
+            - file (UploadFile): video file to analyze, e.g. mp4
+
+        Raises:
+
+            - HTTPException: HTTPException with status code 400 if the video cannot be analyzed.
+
+        Returns:
+
+                - JSONResponse: JSON response containing the detections of the analyzed frames.
+        """
+        logger.debug("api - /analyze/video endpoint invoked.")
+        print("api - /analyze/video endpoint invoked.")
+        if not file:
+            raise HTTPException(status_code=400, detail="No file provided")
+
+        logger.debug(f"api - video provided for analysis: {file.filename}")
+
+        if file.size is not None and file.size > MAX_VIDEO_UPLOAD_FILE_SIZE:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"File size should not exceed {MAX_VIDEO_UPLOAD_FILE_SIZE/ (1024*1024)} MB",
+            )
+
+        try:
+            # decoding and detection block, keep them off the event loop.
+            # the video is decoded straight from the uploaded (spooled) file
+            response = await run_in_threadpool(
+                video_analyzer.analyze, file.file, MAX_PREDICTIONS
+            )
+            logger.debug("api - analyzing video complete.")
+            print("api - analyzing video complete.")
+
+            return Response(response.to_json_bytes(), media_type="application/json")
+
+        except Exception as e:
+            logger.error(f"unable to analyze video: {e}")
+            logger.error(traceback.format_exc())
+            print(f"unable to analyze video: {e}")
+
+            raise HTTPException(
+                status_code=400, detail="unable to analyze video, see logs for details."
+            )
 
     @staticmethod
-    def analyze_image(image: any) -> JSONResponse:
+    @prediction_router.websocket("/live")
+    async def analyze_live_feed(websocket: WebSocket):
+        """Analyze the frames of a live camera feed.
+        The client sends jpeg frames as binary messages and receives a json message
+        with the marked areas for each analyzed frame. Frames sent while a frame is
+        being analyzed wait in a single slot, a newer frame replaces the waiting one.
+
+        Each message contains:
+
+            - frame: number of the analyzed frame, counting the frames sent from 1
+            - detected_details: marked areas of the frame
+            - stats: received, processed and dropped frames, and frames analyzed per second
+        """
+        logger.debug("api - /live websocket opened.")
+        print("api - /live websocket opened.")
+        await websocket.accept()
+
+        session = LiveFeedSession(websocket, detector, config, logger, MAX_PREDICTIONS)
+        await session.run()
+
+    @staticmethod
+    def analyze_within_deadline(
+        image: any,
+        deadline: Deadline,
+        priority: constants.AnalysisPriority,
+        profile_id: str = None,
+        compact: bool = False,
+    ) -> bytes:
+        """Analyzes the image and returns the json (or compact msgpack) response,
+        runs in the thread pool.
+        The scheduler slot was acquired on the event loop, it is released here
+        when the analysis ends. An ImageBuffer is closed here, the analysis can
+        outlive the request.
+        """
+        profiling = nullcontext()
+        if profile_id is not None:
+            profiling = request_profiler.profile(profile_id)
+
+        image_buffer = image if isinstance(image, ImageBuffer) else nullcontext()
+        slot = detector.held_analysis_slot(priority)
+        with slot, image_buffer, profiling, memory_tracker.measure("analyze"):
+            response = detector.analyze_now(
+                image, MAX_PREDICTIONS, constants.DetectionType.WEED, None, deadline
+            )
+            if compact:
+                return response.to_compact_bytes()
+            return response.to_json_bytes()
+
+    @staticmethod
+    async def analyze_image(
+        request: Request,
+        image: any,
+        deadline: Deadline,
+        priority: constants.AnalysisPriority = constants.AnalysisPriority.INTERACTIVE,
+    ) -> Response:
 
         print("api - inside generic method analyze image...")
+
+        # the profile id is returned in a header, to download the profile
+        profile_id = None
+        headers = None
+        if request_profiler is not None and request_profiler.should_profile(
+            request.headers
+        ):
+            profile_id = RequestProfiler.new_profile_id()
+            headers = {constants.PROFILE_ID_HEADER: profile_id}
+        compact = wants_msgpack(request)
+
         try:
-            response = detector.analyze(image, MAX_PREDICTIONS)
+            # wait for the scheduler slot here, a waiting request doesn't hold
+            # a thread of the thread pool
+            try:
+                await detector.acquire_analysis_slot(priority, deadline)
+            except BaseException:
+                if isinstance(image, ImageBuffer):
+                    image.close()
+                raise
+
+            # the analysis blocks, it runs in the thread pool within the deadline
+            response = await run_with_deadline(
+                request,
+                deadline,
+                PredictionEndpoint.analyze_within_deadline,
+                image,
+                deadline,
+                priority,
+                profile_id,
+                compact,
+            )
             logger.debug("api - analyzing image complete.")
             print("api - analyzing image complete.")
 
-            response_json = json.dumps(response.to_dict())
-
-            # convert to string
-            response_json = json.loads(response_json)
-
             # return the prediction details without the image, needs to do a fetch to get the image
-            return JSONResponse(response_json, media_type="application/json")
+            return Response(
+                response,
+                media_type=MEDIA_TYPE_MSGPACK if compact else MEDIA_TYPE_JSON,
+                headers={**NEGOTIATED_HEADERS, **(headers or {})},
+            )
 
+        except ImageRejectedError as e:
+            # an unusable image, the model was not called
+            logger.info(f"image rejected: {e}")
+            raise HTTPException(
+                status_code=422,
+                detail={"message": str(e), "prescreen": e.result.to_dict()},
+                headers=headers,
+            )
         except Exception as e:
             logger.error(f"unable to analyze image: {e}")
             logger.error(traceback.format_exc())
             print(f"unable to analyze image: {e}")
 
+            # a dependency that timed out used up the rest of the budget
+            if isinstance(e, DeadlineExceededError) or deadline.expired:
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    detail="unable to analyze image within the deadline.",
+                    headers=headers,
+                )
             raise HTTPException(
-                status_code=400, detail="unable to analyze image, see logs for details."
+                status_code=400,
+                detail="unable to analyze image, see logs for details.",
+                headers=headers,
             )
 
 
+@debug_router.get(
+    "/memory",
+    description="Read the memory usage of the service.",
+    summary="Read the memory usage of the service.",
+)
+def read_memory_usage(
+    limit: int = Query(20, ge=1, le=200, description="Number of allocation sites")
+) -> Response:
+    """Returns the memory metrics of the analysis requests and, when MemoryTracingEnabled
+    is set, the source lines holding the most allocated memory.
+    """
+    usage = memory_tracker.metrics()
+    usage["top_allocations"] = memory_tracker.top_allocations(limit)
+    return Response(dumps_json_bytes(usage), media_type="application/json")
+
+
+@debug_router.get(
+    "/scheduler",
+    description="Read the metrics of the analysis scheduler.",
+    summary="Read the metrics of the analysis scheduler.",
+)
+def read_scheduler_metrics() -> Response:
+    """Returns the running and waiting analyses, and the queue wait times
+    (average, p50, p95, max in seconds) of each priority class.
+    """
+    if detector.scheduler is None:
+        raise HTTPException(
+            status_code=404,
+            detail="the scheduler is not enabled, see SchedulerConcurrency.",
+        )
+    return Response(
+        dumps_json_bytes(detector.scheduler.metrics()), media_type="application/json"
+    )
+
+
+@debug_router.get(
+    "/prescreen",
+    description="Read the counters of the image pre-screen.",
+    summary="Read the counters of the image pre-screen.",
+)
+def read_prescreen_metrics() -> Response:
+    """Returns the screened, rejected and flagged images, the vision calls saved
+    and the rejections by reason.
+    """
+    if detector.prescreen is None:
+        raise HTTPException(
+            status_code=404,
+            detail="the pre-screen is not enabled, see PrescreenEnabled.",
+        )
+    return Response(
+        dumps_json_bytes(detector.prescreen.metrics()), media_type="application/json"
+    )
+
+
+@debug_router.get(
+    "/rendering",
+    description="Read the counters of the lazy rendering.",
+    summary="Read the counters of the lazy rendering.",
+)
+def read_rendering_metrics() -> Response:
+    """Returns the deferred and rendered images, the renders avoided so far,
+    the first reads coalesced into a render in progress and the average
+    render time.
+    """
+    if detector.lazy_renderer is None:
+        raise HTTPException(
+            status_code=404,
+            detail="lazy rendering is not enabled, see LazyRenderingEnabled.",
+        )
+    return Response(
+        dumps_json_bytes(detector.lazy_renderer.metrics()),
+        media_type="application/json",
+    )
+
+
+@debug_router.get(
+    "/prediction-targets",
+    description="Read the metrics of the prediction targets.",
+    summary="Read the metrics of the prediction targets.",
+)
+def read_prediction_target_metrics() -> Response:
+    """Returns the latency (EWMA, seconds), error rate (EWMA), calls, errors and
+    probes of each Custom Vision prediction target.
+    """
+    router = getattr(detector.detection_backend, "router", None)
+    if router is None:
+        raise HTTPException(
+            status_code=404,
+            detail="the detection backend has no prediction targets.",
+        )
+    return Response(dumps_json_bytes(router.metrics()), media_type="application/json")
+
+
+def require_admin_key(request: Request) -> None:
+    """Allows the request only with the AdminAccessKey in the X-Admin-Key header.
+    Without a configured AdminAccessKey, every request is refused.
+    """
+    admin_key = config.get(constants.CONFIG_ADMIN_ACCESS_KEY)
+    if not has_admin_key(request.headers, admin_key):
+        raise HTTPException(status_code=403, detail="admin access key required.")
+
+
+@profile_router.get(
+    "",
+    description="List the stored request profiles.",
+    summary="List the stored request profiles.",
+)
+def list_profiles() -> Response:
+    """Returns the stored request profiles, newest first."""
+    return Response(
+        dumps_json_bytes(request_profiler.list_profiles()),
+        media_type="application/json",
+    )
+
+
+@profile_router.get(
+    "/{name}",
+    description="Download a stored request profile.",
+    summary="Download a stored request profile.",
+)
+def read_profile(name: str) -> Response:
+    """Returns the stored profile, e.g. <id>.speedscope.json for https://www.speedscope.app"""
+    path = request_profiler.profile_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="profile not found.")
+    return FileResponse(path, media_type="application/json", filename=name)
+
+
+@admin_router.post(
+    "/bulk-analysis/{job}",
+    status_code=202,
+    description="Start a bulk analysis of the test data images.",
+    summary="Start a bulk analysis of the test data images.",
+)
+def start_bulk_analysis(
+    job: str, prefix: str = Query(None, description="Name prefix of the images")
+) -> Response:
+    """Analyzes all the test data images (with the name prefix) in the background,
+    the results are stored under BulkOutputPrefix/<job>/. A job started again
+    continues from its checkpoint.
+    """
+    # two requests for the same job must not both start it
+    with bulk_jobs_lock:
+        bulk_analysis = bulk_jobs.get(job)
+        if bulk_analysis is not None and not bulk_analysis.done.is_set():
+            raise HTTPException(status_code=409, detail=f"job {job} is running.")
+        try:
+            bulk_analysis = BulkAnalysis(config, logger, detector, job, prefix)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        bulk_jobs[job] = bulk_analysis
+        bulk_analysis.start()
+    return Response(
+        dumps_json_bytes(bulk_analysis.metrics()),
+        status_code=202,
+        media_type="application/json",
+    )
+
+
+@admin_router.get(
+    "/bulk-analysis/{job}",
+    description="Read the progress of a bulk analysis.",
+    summary="Read the progress of a bulk analysis.",
+)
+def read_bulk_analysis(job: str) -> Response:
+    """Returns the progress of the job and the throughput and utilization of each
+    stage, the stage with the highest utilization is the bottleneck.
+    """
+    bulk_analysis = bulk_jobs.get(job)
+    if bulk_analysis is None:
+        raise HTTPException(status_code=404, detail="job not found.")
+    return Response(
+        dumps_json_bytes(bulk_analysis.metrics()), media_type="application/json"
+    )
+
+
+@admin_router.delete(
+    "/bulk-analysis/{job}",
+    description="Cancel a bulk analysis.",
+    summary="Cancel a bulk analysis.",
+)
+def cancel_bulk_analysis(job: str) -> Response:
+    """Stops listing images, the images already listed are completed and the
+    checkpoint is saved, so the job can be started again later.
+    """
+    bulk_analysis = bulk_jobs.get(job)
+    if bulk_analysis is None:
+        raise HTTPException(status_code=404, detail="job not found.")
+    bulk_analysis.cancel()
+    return Response(
+        dumps_json_bytes(bulk_analysis.metrics()), media_type="application/json"
+    )
+
+
 app.include_router(default_router, tags=["Default endpoint"])
 app.include_router(
     prediction_router, prefix="/prediction", tags=["Prediction endpoint"]
 )
+
+# the debug endpoints expose internals of the service, they are opt-in
+if config.get_bool(constants.CONFIG_DEBUG_ENDPOINTS_ENABLED):
+    app.include_router(debug_router, prefix="/debug", tags=["Debug endpoint"])
+
+# the stored profiles are only served when profiling is enabled, with the admin key
+if request_profiler is not None:
+    app.include_router(
+        profile_router,
+        prefix="/debug/profiles",
+        tags=["Debug endpoint"],
+        dependencies=[Depends(require_admin_key)],
+    )
+
+app.include_router(
+    admin_router,
+    prefix="/admin",
+    tags=["Admin endpoint"],
+    dependencies=[Depends(require_admin_key)],
+)
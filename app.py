@@ -1,18 +1,146 @@
 #####################################################################
 ## This is the main entry point for the commandline version
+#
+# usage:
+#   python app.py <test image>      - analyze a test image
+#   python app.py backfill          - import the stored prediction details
+#                                     into the local prediction history (and
+#                                     the geo index, with GeoIndexEnabled)
+#   python app.py bulk <job> [prefix] - analyze all the test data images
+#                                     (with the name prefix), continues
+#                                     from the checkpoint of the job
+#   python app.py watch [folder]    - analyze the new images in the folder
+#                                     (default: WatchFolder) until Ctrl+C
 #####################################################################
+import json
 import sys
+import time
+from common_modules.common import constants
 from common_modules.common.common_logging import LogHelper
-from common_modules.grass_weed_detection import GrassWeedDetector
-from common_modules.common.common_config import ConfigHelper
+from common_modules.common.common_config import Config
+from common_modules.common.geo_index import GeoIndex
+from common_modules.common.prediction_history import PredictionHistory
+from common_modules.common.storage_backend import create_storage_helper
 
+# seconds between the progress lines of the bulk analysis and watch mode
+PROGRESS_INTERVAL = 10
 
-def main():
-    config = ConfigHelper()
-    logger = LogHelper(config).configure_logging()
-    logger.debug("app started...")
+
+def analyze(config: Config, logger: LogHelper, args: list[str]):
+    # imported here, the detector is not needed by the other commands
+    from common_modules.grass_weed_detection import GrassWeedDetector
+
+    detector = GrassWeedDetector(config, logger)
+    processed_image = detector.analyze(args[0], 3)
+
+
+def backfill_history(config: Config, logger: LogHelper, args: list[str]):
+    """
+    Imports the prediction details stored by earlier analyses into the
+    prediction history, and the geotagged ones into the geo index when it
+    is enabled. Files that are already recorded are skipped.
+    """
+    storage_helper = create_storage_helper(config, logger)
+    history = PredictionHistory(
+        config.get(constants.CONFIG_PREDICTION_HISTORY_PATH)
+        or constants.DEFAULT_PREDICTION_HISTORY_PATH
+    )
+    geo_index = GeoIndex.from_config(config, logger)
+
+    imported = 0
+    located = 0
+    skipped = 0
+    failed = 0
+    for filename in storage_helper.list_prediction_details():
+        try:
+            details = json.loads(storage_helper.read_prediction_details_bytes(filename))
+            details.setdefault("prediction_info_url", filename)
+            if history.record(details, skip_existing=True):
+                imported += 1
+            else:
+                skipped += 1
+            if geo_index is not None and geo_index.record(details, skip_existing=True):
+                located += 1
+        except Exception as e:
+            logger.warning(f"unable to import {filename}: {e}")
+            failed += 1
+
+    history.close()
+    if geo_index is not None:
+        geo_index.close()
+    print(
+        f"backfill complete - imported: {imported}, skipped: {skipped}, failed: {failed}, geotagged: {located}"
+    )
+
+
+def bulk_analysis(config: Config, logger: LogHelper, args: list[str]):
+    """
+    Analyzes all the test data images, prints the progress and the stage
+    metrics. Ctrl+C stops listing images and waits for the listed ones.
+    """
+    from common_modules.bulk_analysis import BulkAnalysis
+    from common_modules.grass_weed_detection import GrassWeedDetector
+
+    if len(args) < 1:
+        print("usage: python app.py bulk <job> [prefix]")
+        sys.exit(1)
 
     detector = GrassWeedDetector(config, logger)
+    bulk = BulkAnalysis(config, logger, detector, args[0], *args[1:2])
+    bulk.start()
+    try:
+        while not bulk.done.wait(PROGRESS_INTERVAL):
+            metrics = bulk.metrics()
+            print(
+                f"{metrics['completed']} images done ({metrics['throughput']}/s), "
+                f"bottleneck: {metrics['bottleneck']}"
+            )
+    except KeyboardInterrupt:
+        print("cancelling, waiting for the listed images...")
+        bulk.cancel()
+        bulk.done.wait()
+
+    print(json.dumps(bulk.metrics(), indent=2))
+
+
+def watch_folder(config: Config, logger: LogHelper, args: list[str]):
+    """
+    Analyzes the images that land in the folder until Ctrl+C, the queued
+    images are completed before the app exits.
+    """
+    from common_modules.grass_weed_detection import GrassWeedDetector
+    from common_modules.watch_folder import FolderWatcher
+
+    detector = GrassWeedDetector(config, logger)
+    watcher = FolderWatcher(config, logger, detector, *args[:1])
+    watcher.start()
+    print(f"watching {watcher.folder}, Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(PROGRESS_INTERVAL)
+            metrics = watcher.metrics()
+            print(
+                f"analyzed: {metrics['analyzed']}, uploaded: {metrics['uploaded']}, "
+                f"failed: {metrics['failed']}, waiting: {metrics['pending'] + metrics['queued']}"
+            )
+    except KeyboardInterrupt:
+        print("stopping, waiting for the queued images...")
+        watcher.stop()
+
+    print(json.dumps(watcher.metrics(), indent=2))
+
+
+COMMANDS = {
+    "backfill": backfill_history,
+    "bulk": bulk_analysis,
+    "watch": watch_folder,
+}
+
+
+def main():
+    config = Config()
+    logger = LogHelper(config, logger_name=__name__)
+    logger.debug("app started...")
 
     # argv holds the command line args.
     #   e.g. python app.py
@@ -20,8 +148,18 @@ def main():
     #
     #      python app.py test.png
     #         - argv[0] will hold app.py,  argv[1] holds test.png
+    if len(sys.argv) < 2:
+        print(
+            "usage: python app.py <test image> | backfill | bulk <job> [prefix] | watch [folder]"
+        )
+        sys.exit(1)
 
-    processed_image = detector.analyze(sys.argv[1], 3)
+    command = COMMANDS.get(sys.argv[1])
+    if command is None:
+        # no command, the argument is the test image to analyze
+        analyze(config, logger, sys.argv[1:])
+    else:
+        command(config, logger, sys.argv[2:])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+#####################################################################
+# Soak test of the annotation path.
+# Runs many offline analyses (local onnx model and local storage) and
+# fails if the memory of the process keeps growing.
+#
+#   python benchmarks/annotation_soak.py [image] [iterations] [max growth MB]
+#
+# Uses the dummy model in tests/data, so it measures the memory of the
+# image handling, rendering and storage, not of a real model. The first
+# 10% of the iterations are a warm-up (caches, fonts, allocator arenas),
+# the growth is measured from there to the end.
+#####################################################################
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.memory_instrumentation import MB, read_rss_bytes
+from common_modules.grass_weed_detection import GrassWeedDetector
+
+TESTS_DATA = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "tests", "data")
+)
+DEFAULT_IMAGE = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "test-images", "test-9-mixed.JPG")
+)
+DEFAULT_ITERATIONS = 2000
+DEFAULT_MAX_GROWTH_MB = 20
+SAMPLES = 20
+
+
+def create_config(folder: str) -> StaticConfig:
+    return StaticConfig(
+        {
+            constants.CONFIG_DETECTION_BACKEND: constants.DETECTION_BACKEND_ONNX,
+            constants.CONFIG_ONNX_MODEL_PATH: os.path.join(
+                TESTS_DATA, "dummy_detector.onnx"
+            ),
+            constants.CONFIG_ONNX_LABELS_PATH: os.path.join(
+                TESTS_DATA, "dummy_labels.txt"
+            ),
+            constants.CONFIG_STORAGE_BACKEND: constants.STORAGE_BACKEND_LOCAL_FILE,
+            constants.CONFIG_LOCAL_PREDICTIONS_FOLDER: os.path.join(
+                folder, "predictions"
+            ),
+            # the local files are stored under the same name, relative to the folder
+            constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME: "predictions.jpg",
+            constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME: "predictions.json",
+        }
+    )
+
+
+def main():
+    image_filename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+    max_growth = float(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_MAX_GROWTH_MB
+
+    if read_rss_bytes() is None:
+        print("the soak test reads the memory from /proc, run it on linux.")
+        sys.exit(2)
+
+    with open(image_filename, "rb") as f:
+        image_data = f.read()
+
+    logger = logging.getLogger("annotation_soak")
+    logger.setLevel(logging.WARNING)
+
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        config = create_config(folder)
+        detector = GrassWeedDetector(config, logger)
+
+        warm_up = max(1, iterations // 10)
+        sample_every = max(1, (iterations - warm_up) // SAMPLES)
+        baseline = None
+        samples = []
+
+        start = time.perf_counter()
+        for i in range(1, iterations + 1):
+            # the files are written to the same names, like the api does
+            detector.analyze(image_data, 1)
+
+            if i == warm_up:
+                gc.collect()
+                baseline = read_rss_bytes()
+                print(f"warm-up done after {i} analyses, rss: {baseline / MB:.1f} MB")
+            elif i > warm_up and (i - warm_up) % sample_every == 0:
+                rss = read_rss_bytes()
+                samples.append(rss)
+                print(
+                    f"{i:6d} analyses, rss: {rss / MB:.1f} MB ({(rss - baseline) / MB:+.1f} MB)"
+                )
+
+        elapsed = time.perf_counter() - start
+        os.chdir(working_dir)
+
+    gc.collect()
+    # the lowest of the last samples, a single spike is not a leak
+    final = min(samples[-3:]) if samples else read_rss_bytes()
+    growth = (final - baseline) / MB
+    print(
+        f"{iterations} analyses in {elapsed:.1f}s, rss growth after warm-up: {growth:+.1f} MB (max {max_growth} MB)"
+    )
+
+    if growth > max_growth:
+        print("FAILED - memory keeps growing.")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
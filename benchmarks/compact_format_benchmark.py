@@ -0,0 +1,54 @@
+#####################################################################
+# Compares the json and the compact msgpack prediction details
+#  - size of the response
+#  - encode: to_json_bytes() / to_compact_bytes() on the server
+#  - decode: json.loads() / msgpack + fixed width records on the client
+#
+#   python benchmarks/compact_format_benchmark.py [detected areas] [iterations]
+#####################################################################
+import json
+import os
+import sys
+
+import msgpack
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.serialization import DETECTION_RECORD, orjson
+
+sys.path.insert(0, os.path.dirname(__file__))
+from serialization_benchmark import create_analysis_details, measure
+
+DEFAULT_DETECTED_AREAS = 10
+DEFAULT_ITERATIONS = 20000
+
+
+def main():
+    detected_areas = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DETECTED_AREAS
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+
+    details = create_analysis_details(detected_areas)
+    json_bytes = details.to_json_bytes()
+    compact_bytes = details.to_compact_bytes()
+
+    print(
+        f"detected areas: {detected_areas}, iterations: {iterations}, orjson: {orjson is not None}"
+    )
+    print(f"{'json size':<36} {len(json_bytes):>8} bytes")
+    print(
+        f"{'compact size':<36} {len(compact_bytes):>8} bytes"
+        f"   {len(compact_bytes) / len(json_bytes):.0%} of json"
+    )
+
+    def decode_compact():
+        # what a client does: unpack the array, read the records
+        message = msgpack.unpackb(compact_bytes)
+        return list(DETECTION_RECORD.iter_unpack(message[7]))
+
+    baseline = measure("encode json", details.to_json_bytes, iterations)
+    measure("encode compact", details.to_compact_bytes, iterations, baseline)
+    baseline = measure("decode json", lambda: json.loads(json_bytes), iterations)
+    measure("decode compact", decode_compact, iterations, baseline)
+
+
+if __name__ == "__main__":
+    main()
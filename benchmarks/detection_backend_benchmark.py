@@ -0,0 +1,87 @@
+#####################################################################
+# Compares the throughput of the detection backends.
+#
+#   python benchmarks/detection_backend_benchmark.py [image] [iterations]
+#
+# The configuration is read the same way as the app (.env or environment).
+#  - the Onnx backend is benchmarked when OnnxModelPath is set,
+#    e.g. with the bundled dummy model:
+#       OnnxModelPath=tests/data/dummy_detector.onnx
+#       OnnxLabelsPath=tests/data/dummy_labels.txt
+#  - the CustomVision backend is benchmarked when PredictionEndpoint is set
+#    (note: every iteration is a billable prediction call)
+#####################################################################
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.detection.detection_backends import (
+    CustomVisionDetectionBackend,
+    OnnxDetectionBackend,
+)
+
+DEFAULT_IMAGE = os.path.join(
+    os.path.dirname(__file__), "..", "test-images", "test-9-mixed.JPG"
+)
+DEFAULT_ITERATIONS = 20
+
+
+def run_benchmark(name: str, backend, image_data: bytes, iterations: int) -> None:
+    # warm up, the first call includes connection setup / session initialization
+    backend.detect(image_data)
+
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        backend.detect(image_data)
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    print(
+        f"{name:<14} {iterations / elapsed:>10.1f} images/s   p50: {p50:>8.1f} ms   p95: {p95:>8.1f} ms"
+    )
+
+
+def main():
+    image_filename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+
+    config = Config()
+    logger = logging.getLogger(__name__)
+
+    with open(image_filename, "rb") as f:
+        image_data = f.read()
+
+    print(f"image: {image_filename} ({len(image_data) / 1024:.0f} KB), iterations: {iterations}")
+
+    if config.get(constants.CONFIG_ONNX_MODEL_PATH):
+        run_benchmark(
+            constants.DETECTION_BACKEND_ONNX,
+            OnnxDetectionBackend(config, logger),
+            image_data,
+            iterations,
+        )
+    else:
+        print("skipping Onnx backend, OnnxModelPath is not configured.")
+
+    if config.get(constants.CONFIG_PREDICTION_ENDPOINT):
+        run_benchmark(
+            constants.DETECTION_BACKEND_CUSTOM_VISION,
+            CustomVisionDetectionBackend(config, logger),
+            image_data,
+            iterations,
+        )
+    else:
+        print("skipping CustomVision backend, PredictionEndpoint is not configured.")
+
+
+if __name__ == "__main__":
+    main()
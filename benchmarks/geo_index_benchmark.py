@@ -0,0 +1,114 @@
+#####################################################################
+# Measures the queries of the geo index over a large number of
+# geotagged analyses, spread over fields around a few farms
+#  - area: bounding box of a field, of a farm (at most 1000 analyses)
+#  - nearest: 10 and 100 nearest analyses
+#  - tile: weed density of a map tile at zoom 16 (a field) and 12 (a region)
+#
+#   python benchmarks/geo_index_benchmark.py [analyses] [iterations]
+#####################################################################
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.geo_index import GeoIndex, to_world
+
+DEFAULT_ANALYSES = 300000
+DEFAULT_ITERATIONS = 200
+
+FARMS = [(52.37, 4.89), (51.92, 4.47), (52.09, 5.12), (53.22, 6.57)]
+
+
+def create_details(index: int, rng: random.Random) -> dict:
+    farm_latitude, farm_longitude = FARMS[index % len(FARMS)]
+    weed = rng.random() < 0.3
+    return {
+        "prediction_image_url": f"field/{index}.jpg",
+        "prediction_info_url": f"field/{index}.jpg.json",
+        "timestamp": "2024-05-01 10:00:00",
+        "weed_coverage": rng.uniform(0, 40) if weed else 0.0,
+        "weed_detections": rng.randint(1, 8) if weed else 0,
+        "location": {
+            "latitude": farm_latitude + rng.gauss(0, 0.02),
+            "longitude": farm_longitude + rng.gauss(0, 0.03),
+            "altitude": None,
+            "captured_at": None,
+        },
+        "detected_details": (
+            [{"predictedLabel": "Weed", "confidenceLevel": rng.uniform(0.5, 1)}]
+            if weed
+            else []
+        ),
+    }
+
+
+def measure(name: str, function, iterations: int) -> None:
+    result = function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    per_call = (time.perf_counter() - start) / iterations * 1000
+    rows = len(result.get("items", []))
+    print(f"{name:<36} {per_call:>8.3f} ms/query   {rows:>6} rows")
+
+
+def main():
+    analyses = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ANALYSES
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+
+    with tempfile.TemporaryDirectory() as folder:
+        geo_index = GeoIndex(os.path.join(folder, "geo_index.db"))
+        rng = random.Random(1)
+        start = time.perf_counter()
+        for index in range(analyses):
+            geo_index.record(create_details(index, rng))
+        elapsed = time.perf_counter() - start
+        print(
+            f"analyses: {analyses}, iterations: {iterations},"
+            f" record: {elapsed / analyses * 1_000_000:.1f} us/analysis"
+        )
+
+        latitude, longitude = FARMS[0]
+        measure(
+            "area - field (1 km)",
+            lambda: geo_index.query_area(
+                latitude - 0.0045,
+                longitude - 0.0075,
+                latitude + 0.0045,
+                longitude + 0.0075,
+            ),
+            iterations,
+        )
+        measure(
+            "area - farm (limit 1000)",
+            lambda: geo_index.query_area(
+                latitude - 0.05, longitude - 0.08, latitude + 0.05, longitude + 0.08
+            ),
+            iterations,
+        )
+        measure(
+            "nearest 10",
+            lambda: geo_index.query_nearest(latitude, longitude, 10),
+            iterations,
+        )
+        measure(
+            "nearest 100",
+            lambda: geo_index.query_nearest(latitude, longitude, 100),
+            iterations,
+        )
+        for zoom in (16, 12):
+            x, y = to_world(latitude, longitude)
+            tile_x, tile_y = int(x * 2**zoom), int(y * 2**zoom)
+            measure(
+                f"tile zoom {zoom} (16 x 16 cells)",
+                lambda: geo_index.query_tile(zoom, tile_x, tile_y),
+                iterations,
+            )
+        geo_index.close()
+
+
+if __name__ == "__main__":
+    main()
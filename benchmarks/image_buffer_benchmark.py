@@ -0,0 +1,128 @@
+#####################################################################
+# Peak memory of an analysis of an uploaded image
+#  - bytes:  the upload is read into bytes, like await file.read()
+#  - buffer: the spooled upload is mapped with ImageBuffer.from_file()
+#
+#   python benchmarks/image_buffer_benchmark.py [image] [scale]
+#
+# The image is scaled up (default 4x) and saved as a jpeg under the 2 MB
+# upload limit, spooled like an upload and analyzed once with the local
+# onnx model, in a new process for each mode. The peak is the highest
+# rss of the process during the analysis (VmHWM, reset just before the
+# analysis), above the rss before it. Linux only.
+#####################################################################
+import io
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from tempfile import SpooledTemporaryFile
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.memory_instrumentation import MB, read_rss_bytes
+
+sys.path.insert(0, os.path.dirname(__file__))
+from annotation_soak import DEFAULT_IMAGE, create_config
+
+DEFAULT_SCALE = 4
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024
+# same as the upload parser of the api
+SPOOL_MAX_SIZE = 1024 * 1024
+MODES = ["bytes", "buffer"]
+
+
+def create_upload_image(image_filename: str, scale: int) -> bytes:
+    """
+    Scales the image up and encodes it as a jpeg under the upload limit.
+    """
+    image = Image.open(image_filename).convert("RGB")
+    image = image.resize((image.width * scale, image.height * scale))
+    for quality in (90, 80, 70, 60, 50, 40):
+        byte_stream = io.BytesIO()
+        image.save(byte_stream, format="JPEG", quality=quality)
+        if byte_stream.tell() <= MAX_UPLOAD_SIZE:
+            break
+    return byte_stream.getvalue()
+
+
+def reset_peak_rss() -> None:
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def read_peak_rss_bytes() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def analyze_upload(mode: str, upload_filename: str) -> None:
+    """
+    Runs in the child process, prints the peak memory of one analysis.
+    """
+    from common_modules.common.image_buffer import ImageBuffer
+    from common_modules.grass_weed_detection import GrassWeedDetector
+
+    logger = logging.getLogger("image_buffer_benchmark")
+    logger.setLevel(logging.WARNING)
+
+    with open(upload_filename, "rb") as f:
+        upload_data = f.read()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        detector = GrassWeedDetector(create_config(folder), logger)
+
+        # warm up with a small image, the first analysis loads fonts and modules
+        small_image = io.BytesIO()
+        Image.new("RGB", (64, 64)).save(small_image, format="JPEG")
+        detector.analyze(small_image.getvalue(), 1)
+
+        upload = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        upload.write(upload_data)
+        upload.seek(0)
+        del upload_data
+
+        reset_peak_rss()
+        baseline = read_rss_bytes()
+        if mode == "bytes":
+            detector.analyze(upload.read(), 1)
+        else:
+            with ImageBuffer.from_file(upload) as image_buffer:
+                detector.analyze(image_buffer, 1)
+        peak = read_peak_rss_bytes()
+        upload.close()
+
+    print(f"{mode:<8} peak above baseline: {(peak - baseline) / MB:8.1f} MB")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] in MODES:
+        analyze_upload(sys.argv[1], sys.argv[2])
+        return
+
+    image_filename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE
+    scale = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SCALE
+
+    with tempfile.TemporaryDirectory() as folder:
+        upload_filename = os.path.join(folder, "upload.jpg")
+        upload_data = create_upload_image(image_filename, scale)
+        with open(upload_filename, "wb") as f:
+            f.write(upload_data)
+
+        width, height = Image.open(upload_filename).size
+        print(f"upload: {width}x{height} jpeg, {len(upload_data) / MB:.2f} MB")
+        for mode in MODES:
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), mode, upload_filename],
+                check=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
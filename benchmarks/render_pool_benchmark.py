@@ -0,0 +1,88 @@
+#####################################################################
+# Compares rendering the annotated images in the request threads with
+# rendering them in the process pool, for 1-16 concurrent images.
+#
+#   python benchmarks/render_pool_benchmark.py [image] [pool size] [rounds]
+#
+# The annotated images are written to a temporary folder.
+#####################################################################
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.models import GrassPredictionData, PredictionBoundingBox
+from common_modules.image_processing.image_utilities import mark_image_with_rectangle
+from common_modules.image_processing.render_pool import AnnotationRenderPool
+
+DEFAULT_IMAGE = os.path.join(
+    os.path.dirname(__file__), "..", "test-images", "test-9-mixed.JPG"
+)
+DEFAULT_ROUNDS = 3
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16]
+
+TEST_PREDICTIONS = [
+    GrassPredictionData("Grass", 0.91, PredictionBoundingBox(0.1, 0.1, 0.4, 0.3)),
+    GrassPredictionData("Weed", 0.72, PredictionBoundingBox(0.5, 0.4, 0.3, 0.4)),
+]
+
+
+def measure(render, concurrency: int, rounds: int) -> float:
+    """
+    Renders concurrency images at the same time, rounds times.
+    Returns the throughput in images per second.
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            list(executor.map(lambda _: render(), range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return concurrency * rounds / elapsed
+
+
+def main():
+    image_filename = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_IMAGE
+    pool_size = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_ROUNDS
+
+    with open(image_filename, "rb") as f:
+        image_data = f.read()
+
+    logger = logging.getLogger(__name__)
+    output_dir = tempfile.mkdtemp(prefix="render_pool_benchmark_")
+    config = StaticConfig(
+        {
+            constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME: os.path.join(
+                output_dir, "predictions.jpg"
+            )
+        }
+    )
+
+    render_pool = AnnotationRenderPool(config, logger, pool_size)
+    render_pool.warm_up()
+
+    def render_in_thread():
+        mark_image_with_rectangle(image_data, TEST_PREDICTIONS, config, logger)
+
+    def render_in_pool():
+        render_pool.render(image_data, TEST_PREDICTIONS)
+
+    print(f"image: {image_filename}, pool size: {pool_size}, rounds: {rounds}")
+    print(f"{'concurrent':>10} {'in-thread':>14} {'pooled':>14}")
+    for concurrency in CONCURRENCY_LEVELS:
+        in_thread = measure(render_in_thread, concurrency, rounds)
+        pooled = measure(render_in_pool, concurrency, rounds)
+        print(
+            f"{concurrency:>10} {in_thread:>10.1f} i/s {pooled:>10.1f} i/s   ({pooled / in_thread:.1f}x)"
+        )
+
+    render_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
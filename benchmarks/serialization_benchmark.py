@@ -0,0 +1,85 @@
+#####################################################################
+# Compares the cost of building the analyze/details responses
+#  - before: json.dumps(to_dict()) -> json.loads -> JSONResponse (3 passes)
+#  - after:  to_json_bytes() -> Response (1 pass)
+#
+#   python benchmarks/serialization_benchmark.py [detected areas] [iterations]
+#####################################################################
+import json
+import os
+import sys
+import time
+
+from fastapi.responses import JSONResponse, Response
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.models import GrassAnalysisDetails, MarkedDetectedArea
+from common_modules.common.serialization import orjson
+
+DEFAULT_DETECTED_AREAS = 10
+DEFAULT_ITERATIONS = 20000
+
+
+def create_analysis_details(detected_areas: int) -> GrassAnalysisDetails:
+    marked_areas = [
+        MarkedDetectedArea(
+            name="Weed" if i % 2 else "Grass",
+            confidence_level=0.5 + i / (2 * detected_areas),
+            marked_color="#D9381E" if i % 2 else "#A3C566",
+            bounding_box=((12.5 * i, 30.25 * i), (400.5 + i, 380.75 + i)),
+        )
+        for i in range(detected_areas)
+    ]
+    return GrassAnalysisDetails(
+        predictions_image_url="predictions.jpg",
+        predictions_info_url="predictions.json",
+        timestamp="2024-09-18 10:11:12",
+        top_n=len(marked_areas),
+        summary="There is a moderate chance that your lawn has both Grass and Weed.",
+        detected_details=marked_areas,
+    )
+
+
+def measure(name: str, function, iterations: int, baseline: float = None) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    per_call = (time.perf_counter() - start) / iterations * 1_000_000
+    speedup = f"   {baseline / per_call:.1f}x faster" if baseline else ""
+    print(f"{name:<36} {per_call:>8.2f} us/response{speedup}")
+    return per_call
+
+
+def main():
+    detected_areas = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_DETECTED_AREAS
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+
+    details = create_analysis_details(detected_areas)
+    stored_json = json.dumps(details.to_dict())
+    stored_bytes = stored_json.encode("utf-8")
+
+    print(
+        f"detected areas: {detected_areas}, iterations: {iterations}, orjson: {orjson is not None}"
+    )
+
+    def analyze_before():
+        response_json = json.loads(json.dumps(details.to_dict()))
+        return JSONResponse(response_json, media_type="application/json")
+
+    def analyze_after():
+        return Response(details.to_json_bytes(), media_type="application/json")
+
+    def details_before():
+        return JSONResponse(json.loads(stored_json), media_type="application/json")
+
+    def details_after():
+        return Response(stored_bytes, media_type="application/json")
+
+    baseline = measure("analyze response (before)", analyze_before, iterations)
+    measure("analyze response (after)", analyze_after, iterations, baseline)
+    baseline = measure("details response (before)", details_before, iterations)
+    measure("details response (after)", details_after, iterations, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#####################################################################
+# Measures the weed coverage computation for a growing number of boxes
+#  - loop:       one slice of the grid per box
+#  - vectorized: compute_weed_coverage(), difference array + cumsum
+#
+#   python benchmarks/weed_coverage_benchmark.py [grid size] [iterations]
+#####################################################################
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+from common_modules.image_processing.weed_coverage import compute_weed_coverage
+
+DEFAULT_GRID_SIZE = 64
+DEFAULT_ITERATIONS = 20
+BOX_COUNTS = [10, 100, 1000, 5000, 20000]
+
+
+def create_predictions(count: int) -> list[DetectionPrediction]:
+    random = np.random.default_rng(0)
+    positions = random.random((count, 2)) * 0.9
+    sizes = random.random((count, 2)) * 0.1
+    probabilities = random.random(count)
+    return [
+        DetectionPrediction(
+            "Weed" if i % 2 else "Grass",
+            float(probabilities[i]),
+            PredictionBoundingBox(*positions[i].tolist(), *sizes[i].tolist()),
+        )
+        for i in range(count)
+    ]
+
+
+def coverage_with_loop(predictions: list, grid_size: int) -> float:
+    log_miss = np.zeros((grid_size, grid_size))
+    for p in predictions:
+        if p.tag_name != "Weed" or p.probability < 0.1:
+            continue
+        box = p.bounding_box
+        x0 = min(int(box.left * grid_size + 0.5), grid_size - 1)
+        y0 = min(int(box.top * grid_size + 0.5), grid_size - 1)
+        x1 = max(int((box.left + box.width) * grid_size + 0.5), x0 + 1)
+        y1 = max(int((box.top + box.height) * grid_size + 0.5), y0 + 1)
+        log_miss[y0:y1, x0:x1] += np.log1p(-min(p.probability, 0.999999))
+    return float((-np.expm1(log_miss)).mean()) * 100
+
+
+def measure(function, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def main():
+    grid_size = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_GRID_SIZE
+    iterations = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_ITERATIONS
+
+    print(f"grid size: {grid_size}, iterations: {iterations}")
+    print(f"{'boxes':>8} {'loop':>12} {'vectorized':>12}")
+    for count in BOX_COUNTS:
+        predictions = create_predictions(count)
+        loop = measure(lambda: coverage_with_loop(predictions, grid_size), iterations)
+        vectorized = measure(
+            lambda: compute_weed_coverage(predictions, grid_size), iterations
+        )
+        print(f"{count:>8} {loop:>9.2f} ms {vectorized:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
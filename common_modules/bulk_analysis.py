@@ -0,0 +1,455 @@
+#####################################################################
+# Bulk analysis of the images in the test data container, e.g. to
+# re-score the archive after the model was retrained.
+# The container is listed page by page and each image goes through four
+# stages, each with its own worker threads:
+#   download -> detect -> annotate -> upload
+# The stages are connected by bounded queues. A slow stage fills the
+# queue in front of it and the stages before it wait, so only a few
+# images per stage are held in memory, while the network bound stages
+# (download, Custom Vision, upload) overlap with the CPU bound ones.
+#
+# The images are listed in name order. The checkpoint holds the name up
+# to which all the images are done, and the page it is on, so a job
+# that is started again continues after it.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from logging import Logger
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.deadline import Deadline
+from common_modules.grass_weed_detection import GrassWeedDetector
+
+# tells the workers of a stage that there are no more images
+END_OF_ITEMS = None
+
+# seconds allowed for each download, detection and upload of an image
+REQUEST_TIMEOUT = 60
+
+# number of failed images kept in the checkpoint
+MAX_FAILURES = 1000
+
+JOB_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+
+class BulkItem:
+    """
+    An image on its way through the stages.
+    """
+
+    __slots__ = (
+        "sequence",
+        "name",
+        "page_token",
+        "image_data",
+        "analysis",
+        "error",
+    )
+
+    def __init__(self, sequence: int, name: str, page_token: str) -> None:
+        self.sequence = sequence
+        self.name = name
+        self.page_token = page_token
+        self.image_data = None
+        self.analysis = None
+        self.error = None
+
+
+class PipelineStage:
+    """
+    The workers of a stage, the queue in front of it and its metrics.
+    """
+
+    def __init__(self, name: str, workers: int, process, queue_size: int) -> None:
+        self.name = name
+        self.workers = max(1, workers)
+        self.process = process
+        self.input_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.running_workers = self.workers
+        self.lock = threading.Lock()
+
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+
+    def record(self, elapsed: float, failed: bool) -> None:
+        with self.lock:
+            self.busy_seconds += elapsed
+            if failed:
+                self.failed += 1
+            else:
+                self.processed += 1
+
+    def worker_finished(self) -> bool:
+        """
+        Returns True for the last worker of the stage to finish.
+        """
+        with self.lock:
+            self.running_workers -= 1
+            return self.running_workers == 0
+
+    def utilization(self, elapsed: float) -> float:
+        """
+        Fraction of the time the workers of the stage were busy. The stage
+        that is busy all the time holds up the others, it is the bottleneck.
+        """
+        capacity = elapsed * self.workers
+        return self.busy_seconds / capacity if capacity > 0 else 0.0
+
+    def metrics(self, elapsed: float) -> dict:
+        with self.lock:
+            done = self.processed + self.failed
+            return {
+                "workers": self.workers,
+                "queued": self.input_queue.qsize(),
+                "processed": self.processed,
+                "failed": self.failed,
+                "throughput": round(done / elapsed, 2) if elapsed > 0 else 0.0,
+                "seconds_per_image": (
+                    round(self.busy_seconds / done, 3) if done > 0 else None
+                ),
+                "utilization": round(self.utilization(elapsed), 3),
+            }
+
+
+class BulkAnalysis:
+    """
+    Analyzes all the images of the test data container (with a name prefix)
+    and stores the results under BulkOutputPrefix/<job>/<image name>.
+
+    usage:
+        bulk_analysis = BulkAnalysis(config, logger, detector, "retrain-2024-10")
+        bulk_analysis.start()
+        bulk_analysis.done.wait()
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        logger: Logger,
+        detector: GrassWeedDetector,
+        job: str,
+        prefix: str = None,
+        top_n: int = 1,
+    ) -> None:
+        if not JOB_NAME_PATTERN.match(job):
+            raise ValueError(f"invalid job name: {job}")
+
+        self.config = config
+        self.logger = logger
+        self.detector = detector
+        self.storage_helper = detector.storage_helper
+        self.job = job
+        self.prefix = prefix or None
+        self.top_n = top_n
+
+        self.page_size = config.get_int(
+            constants.CONFIG_BULK_PAGE_SIZE, constants.DEFAULT_BULK_PAGE_SIZE
+        )
+        self.output_prefix = (
+            config.get(constants.CONFIG_BULK_OUTPUT_PREFIX)
+            or constants.DEFAULT_BULK_OUTPUT_PREFIX
+        )
+        self.checkpoint_interval = config.get_int(
+            constants.CONFIG_BULK_CHECKPOINT_INTERVAL,
+            constants.DEFAULT_BULK_CHECKPOINT_INTERVAL,
+        )
+        checkpoint_folder = (
+            config.get(constants.CONFIG_BULK_CHECKPOINT_FOLDER)
+            or constants.DEFAULT_BULK_CHECKPOINT_FOLDER
+        )
+        os.makedirs(checkpoint_folder, exist_ok=True)
+        self.checkpoint_path = os.path.join(checkpoint_folder, f"{job}.json")
+
+        queue_size = config.get_int(
+            constants.CONFIG_BULK_QUEUE_SIZE, constants.DEFAULT_BULK_QUEUE_SIZE
+        )
+
+        def stage(name, process, workers_key, default_workers) -> PipelineStage:
+            workers = config.get_int(workers_key, default_workers)
+            return PipelineStage(name, workers, process, queue_size)
+
+        self.stages = [
+            stage(
+                "download",
+                self.download,
+                constants.CONFIG_BULK_DOWNLOAD_WORKERS,
+                constants.DEFAULT_BULK_DOWNLOAD_WORKERS,
+            ),
+            stage(
+                "detect",
+                self.detect,
+                constants.CONFIG_BULK_DETECT_WORKERS,
+                constants.DEFAULT_BULK_DETECT_WORKERS,
+            ),
+            stage(
+                "annotate",
+                self.annotate,
+                constants.CONFIG_BULK_ANNOTATE_WORKERS,
+                constants.DEFAULT_BULK_ANNOTATE_WORKERS,
+            ),
+            stage(
+                "upload",
+                self.upload,
+                constants.CONFIG_BULK_UPLOAD_WORKERS,
+                constants.DEFAULT_BULK_UPLOAD_WORKERS,
+            ),
+        ]
+
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.done = threading.Event()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.temp_folder = None
+
+        self.checkpoint = self.load_checkpoint()
+        self.since_checkpoint = 0
+        # the images are numbered in the order they are listed, the images
+        # before sequence watermark are all done
+        self.listed = 0
+        self.watermark = 0
+        self.completed = {}
+
+    def load_checkpoint(self) -> dict:
+        checkpoint = {
+            "job": self.job,
+            "prefix": self.prefix,
+            "page_token": None,
+            "completed_through": None,
+            "processed": 0,
+            "failed": 0,
+            "failures": [],
+            "complete": False,
+            "updated": None,
+        }
+        if os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint.update(json.load(f))
+            if checkpoint["prefix"] != self.prefix:
+                raise ValueError(
+                    f"job {self.job} was started with the prefix {checkpoint['prefix']}"
+                )
+        return checkpoint
+
+    def save_checkpoint(self) -> None:
+        """
+        Writes the checkpoint, called with the lock held.
+        """
+        self.checkpoint["updated"] = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.checkpoint, f, indent=2)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, name=f"bulk-{self.job}", daemon=True).start()
+
+    def cancel(self) -> None:
+        """
+        Stops listing images, the images already listed are completed.
+        """
+        self.cancelled.set()
+
+    def run(self) -> None:
+        if self.checkpoint["complete"]:
+            self.logger.info(f"bulk analysis {self.job} is already complete.")
+            self.done.set()
+            return
+
+        self.started = time.monotonic()
+        self.temp_folder = tempfile.mkdtemp(prefix="bulk-")
+        self.logger.info(
+            f"bulk analysis {self.job} started after: {self.checkpoint['completed_through']}"
+        )
+
+        workers = []
+        next_stages = self.stages[1:] + [None]
+        for stage, next_stage in zip(self.stages, next_stages):
+            for _ in range(stage.workers):
+                worker = threading.Thread(
+                    target=self.run_worker,
+                    args=(stage, next_stage),
+                    name=f"bulk-{self.job}-{stage.name}",
+                    daemon=True,
+                )
+                worker.start()
+                workers.append(worker)
+
+        try:
+            self.list_images()
+        except Exception as e:
+            self.error = f"unable to list the images: {e}"
+            self.logger.error(f"bulk analysis {self.job} - {self.error}")
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.stages[0].input_queue.put(END_OF_ITEMS)
+
+        for worker in workers:
+            worker.join()
+
+        self.finished = time.monotonic()
+        with self.lock:
+            self.checkpoint["complete"] = (
+                self.error is None and not self.cancelled.is_set()
+            )
+            self.save_checkpoint()
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+        self.logger.info(f"bulk analysis {self.job} {self.state()}.")
+        self.done.set()
+
+    def list_images(self) -> None:
+        completed_through = self.checkpoint["completed_through"]
+        for page_token, names in self.storage_helper.list_test_data_images(
+            self.prefix, self.checkpoint["page_token"], self.page_size
+        ):
+            for name in names:
+                if self.cancelled.is_set():
+                    return
+                # the page of the checkpoint is listed again, skip the done images
+                if completed_through is not None and name <= completed_through:
+                    continue
+                item = BulkItem(self.listed, name, page_token)
+                self.listed += 1
+                # waits while the download queue is full
+                self.stages[0].input_queue.put(item)
+
+    def run_worker(self, stage: PipelineStage, next_stage: PipelineStage) -> None:
+        while True:
+            item = stage.input_queue.get()
+            if item is END_OF_ITEMS:
+                break
+
+            # a failed image skips the remaining stages
+            if item.error is None:
+                started = time.monotonic()
+                try:
+                    stage.process(item)
+                except Exception as e:
+                    item.error = f"{stage.name}: {e}"
+                    self.logger.warning(
+                        f"bulk analysis {self.job} - {item.name} failed, {item.error}"
+                    )
+                stage.record(time.monotonic() - started, item.error is not None)
+
+            if next_stage is None:
+                self.complete(item)
+            else:
+                next_stage.input_queue.put(item)
+
+        # the last worker of the stage ends the next stage
+        if stage.worker_finished() and next_stage is not None:
+            for _ in range(next_stage.workers):
+                next_stage.input_queue.put(END_OF_ITEMS)
+
+    def output_name(self, name: str) -> str:
+        return f"{self.output_prefix}/{self.job}/{name}"
+
+    def download(self, item: BulkItem) -> None:
+        item.image_data = self.storage_helper.read_test_data_image_with_url_anonymous(
+            item.name, timeout=REQUEST_TIMEOUT
+        )
+        if len(item.image_data) == 0:
+            raise ValueError("the image is empty")
+
+    def detect(self, item: BulkItem) -> None:
+        item.analysis = self.detector.detect_batch_image(
+            item.image_data, self.top_n, Deadline(REQUEST_TIMEOUT)
+        )
+
+    def annotate(self, item: BulkItem) -> None:
+        self.detector.save_batch_image(
+            item.image_data,
+            item.analysis,
+            self.output_name(item.name),
+            self.temp_folder,
+        )
+        item.image_data = None
+
+    def upload(self, item: BulkItem) -> None:
+        self.detector.upload_batch_image(
+            item.analysis, self.temp_folder, REQUEST_TIMEOUT
+        )
+        self.detector.record_analysis(item.analysis.details)
+
+    def complete(self, item: BulkItem) -> None:
+        local_files = [] if item.analysis is None else item.analysis.local_files
+        for path in local_files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        item.image_data = None
+
+        with self.lock:
+            if item.error is None:
+                self.checkpoint["processed"] += 1
+            else:
+                self.checkpoint["failed"] += 1
+                if len(self.checkpoint["failures"]) < MAX_FAILURES:
+                    self.checkpoint["failures"].append(
+                        {"name": item.name, "error": item.error}
+                    )
+
+            # move the checkpoint past the images that are all done
+            self.completed[item.sequence] = item
+            while self.watermark in self.completed:
+                done_item = self.completed.pop(self.watermark)
+                self.checkpoint["completed_through"] = done_item.name
+                self.checkpoint["page_token"] = done_item.page_token
+                self.watermark += 1
+
+            self.since_checkpoint += 1
+            if self.since_checkpoint >= self.checkpoint_interval:
+                self.save_checkpoint()
+                self.since_checkpoint = 0
+
+    def state(self) -> str:
+        if not self.done.is_set():
+            return "running" if self.started is not None else "pending"
+        if self.error is not None:
+            return "failed"
+        if self.checkpoint["complete"]:
+            return "complete"
+        return "cancelled"
+
+    def metrics(self) -> dict:
+        elapsed = 0.0
+        if self.started is not None:
+            elapsed = (self.finished or time.monotonic()) - self.started
+
+        stages = {stage.name: stage.metrics(elapsed) for stage in self.stages}
+        bottleneck = None
+        if elapsed > 0 and self.listed > 0:
+            bottleneck = max(self.stages, key=lambda s: s.utilization(elapsed)).name
+
+        with self.lock:
+            completed = self.watermark
+            return {
+                "job": self.job,
+                "prefix": self.prefix,
+                "state": self.state(),
+                "error": self.error,
+                "elapsed": round(elapsed, 1),
+                "listed": self.listed,
+                "completed": completed,
+                "throughput": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+                "bottleneck": bottleneck,
+                "stages": stages,
+                "total_processed": self.checkpoint["processed"],
+                "total_failed": self.checkpoint["failed"],
+                "completed_through": self.checkpoint["completed_through"],
+            }
@@ -0,0 +1,330 @@
+#####################################################################
+# Priority scheduling of the analyses.
+# The analyses share the Custom Vision quota and the worker threads, so
+# a large batch would otherwise starve the interactive users. The
+# scheduler runs at most SchedulerConcurrency analyses at the same time
+# and hands the free slots to the priority classes with weighted fair
+# queuing (stride scheduling): with all classes waiting, each class gets
+# slots in proportion to its weight, an idle class doesn't build up credit.
+# The api waits for the slots on the event loop (acquire_async), a waiting
+# request doesn't hold one of the threads of the thread pool.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging import Logger
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.deadline import Deadline, DeadlineExceededError
+
+# number of recent queue waits kept per class for the percentiles
+WAIT_SAMPLES = 1000
+
+# seconds between the checks of a waiting analysis for a cancelled deadline
+CANCEL_CHECK_INTERVAL = 0.5
+
+
+def parse_priority(value: str) -> constants.AnalysisPriority:
+    """
+    Parses a priority class name, e.g. interactive. Raises ValueError if unknown.
+    """
+    try:
+        return constants.AnalysisPriority[value.strip().upper()]
+    except KeyError:
+        names = ", ".join(p.name.lower() for p in constants.AnalysisPriority)
+        raise ValueError(f"unknown priority: {value}, expected one of: {names}")
+
+
+def parse_class_values(value: str, key: str) -> dict:
+    """
+    Parses a comma separated list of class:number pairs, e.g. interactive:8,batch:2
+    key is the configuration key of the value, the errors name it.
+    Raises ValueError for an invalid entry.
+    """
+    values = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        name, _, number = item.partition(":")
+        try:
+            values[parse_priority(name)] = float(number)
+        except ValueError as ex:
+            raise ValueError(
+                f"invalid {key} entry: {item.strip()}, expected class:number ({ex})"
+            ) from None
+    return values
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class PriorityClass:
+    """
+    Waiting analyses and metrics of one priority class.
+    """
+
+    def __init__(
+        self, priority: constants.AnalysisPriority, weight: float, limit: int
+    ) -> None:
+        self.priority = priority
+        self.stride = 1.0 / weight
+        self.limit = limit
+        # virtual time of the class, the class with the lowest pass goes next
+        self.pass_value = 0.0
+        self.waiting = deque()
+        self.running = 0
+
+        self.completed = 0
+        self.timed_out = 0
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+
+    def eligible(self) -> bool:
+        if len(self.waiting) == 0:
+            return False
+        return self.limit <= 0 or self.running < self.limit
+
+    def metrics(self) -> dict:
+        waits = list(self.waits)
+        return {
+            "weight": round(1.0 / self.stride, 3),
+            "limit": self.limit,
+            "waiting": len(self.waiting),
+            "running": self.running,
+            "completed": self.completed,
+            "timed_out": self.timed_out,
+            "wait_avg": sum(waits) / len(waits) if waits else None,
+            "wait_p50": percentile(waits, 0.5),
+            "wait_p95": percentile(waits, 0.95),
+            "wait_max": max(waits) if waits else None,
+        }
+
+
+def resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Ticket:
+    """
+    A waiting analysis. future is set for an analysis waiting on an event loop.
+    """
+
+    __slots__ = ("granted", "enqueued", "future")
+
+    def __init__(self, future: asyncio.Future = None) -> None:
+        self.granted = False
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+class AnalysisScheduler:
+    """
+    Limits the number of analyses running at the same time and decides
+    which priority class gets the next free slot.
+
+    usage:
+        with scheduler.slot(constants.AnalysisPriority.BATCH, deadline):
+            detector.analyze(...)
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        weights: dict = None,
+        limits: dict = None,
+        logger: Logger = None,
+    ) -> None:
+        self.concurrency = concurrency
+        self.logger = logger
+        weights = weights or {}
+        limits = limits or {}
+
+        self.classes = {
+            priority: PriorityClass(
+                priority,
+                max(weights.get(priority, 1), 0.001),
+                int(limits.get(priority, 0)),
+            )
+            for priority in constants.AnalysisPriority
+        }
+        self.running = 0
+        # virtual time of the scheduler, the pass of the last class served
+        self.virtual_time = 0.0
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def from_config(config: Config, logger: Logger) -> "AnalysisScheduler":
+        """
+        Creates the scheduler, None if scheduling is not enabled.
+        """
+        concurrency = config.get_int(constants.CONFIG_SCHEDULER_CONCURRENCY)
+        if concurrency <= 0:
+            return None
+        return AnalysisScheduler(
+            concurrency,
+            parse_class_values(
+                config.get(constants.CONFIG_SCHEDULER_WEIGHTS)
+                or constants.DEFAULT_SCHEDULER_WEIGHTS,
+                constants.CONFIG_SCHEDULER_WEIGHTS,
+            ),
+            parse_class_values(
+                config.get(constants.CONFIG_SCHEDULER_CLASS_LIMITS),
+                constants.CONFIG_SCHEDULER_CLASS_LIMITS,
+            ),
+            logger,
+        )
+
+    def dispatch(self) -> None:
+        """
+        Grants the free slots to the waiting analyses. Called with the lock held.
+        """
+        granted = False
+        while self.running < self.concurrency:
+            eligible = [c for c in self.classes.values() if c.eligible()]
+            if not eligible:
+                break
+            # lowest pass first, ties go to the higher priority
+            next_class = min(eligible, key=lambda c: (c.pass_value, c.priority.value))
+
+            ticket = next_class.waiting.popleft()
+            ticket.granted = True
+            if ticket.future is not None:
+                ticket.future.get_loop().call_soon_threadsafe(resolve, ticket.future)
+            next_class.running += 1
+            next_class.waits.append(time.monotonic() - ticket.enqueued)
+            self.running += 1
+
+            self.virtual_time = next_class.pass_value
+            next_class.pass_value += next_class.stride
+            granted = True
+
+        if granted:
+            self.condition.notify_all()
+
+    def acquire(
+        self, priority: constants.AnalysisPriority, deadline: Deadline = None
+    ) -> None:
+        """
+        Waits for a slot. Raises DeadlineExceededError if the deadline passes
+        while the analysis is waiting.
+        """
+        priority_class = self.classes[priority]
+        ticket = Ticket()
+        with self.condition:
+            self.enqueue(priority_class, ticket)
+
+            while not ticket.granted:
+                timeout = None
+                if deadline is not None:
+                    # wake up now and then, a cancelled deadline doesn't notify
+                    timeout = min(deadline.remaining(), CANCEL_CHECK_INTERVAL)
+                    if deadline.expired:
+                        priority_class.waiting.remove(ticket)
+                        priority_class.timed_out += 1
+                        raise DeadlineExceededError(
+                            "analysis queue", cancelled=deadline.cancelled
+                        )
+                self.condition.wait(timeout)
+
+    def enqueue(self, priority_class: PriorityClass, ticket: Ticket) -> None:
+        """
+        Queues the ticket and grants the free slots. Called with the lock held.
+        """
+        if not priority_class.waiting and priority_class.running == 0:
+            # an idle class starts at the current virtual time, it doesn't
+            # get to catch up on the slots it didn't use
+            priority_class.pass_value = max(
+                priority_class.pass_value, self.virtual_time
+            )
+        priority_class.waiting.append(ticket)
+        self.dispatch()
+
+    async def acquire_async(
+        self, priority: constants.AnalysisPriority, deadline: Deadline = None
+    ) -> None:
+        """
+        Same as acquire(), waits on the event loop instead of blocking a thread.
+        The slot is released with release(), e.g. by the thread running the
+        analysis (see held_slot).
+        """
+        priority_class = self.classes[priority]
+        ticket = Ticket(asyncio.get_running_loop().create_future())
+        with self.condition:
+            self.enqueue(priority_class, ticket)
+
+        try:
+            while not ticket.future.done():
+                timeout = None
+                if deadline is not None:
+                    # wake up now and then, a cancelled deadline doesn't notify
+                    if deadline.expired:
+                        raise DeadlineExceededError(
+                            "analysis queue", cancelled=deadline.cancelled
+                        )
+                    timeout = min(deadline.remaining(), CANCEL_CHECK_INTERVAL)
+                await asyncio.wait({ticket.future}, timeout=timeout)
+        except BaseException as ex:
+            # e.g. the deadline passed or the request task was cancelled
+            with self.condition:
+                if ticket.granted:
+                    # granted meanwhile, hand the slot on
+                    priority_class.running -= 1
+                    self.running -= 1
+                    self.dispatch()
+                else:
+                    priority_class.waiting.remove(ticket)
+                if isinstance(ex, DeadlineExceededError):
+                    priority_class.timed_out += 1
+            raise
+
+    def release(self, priority: constants.AnalysisPriority) -> None:
+        with self.condition:
+            priority_class = self.classes[priority]
+            priority_class.running -= 1
+            priority_class.completed += 1
+            self.running -= 1
+            self.dispatch()
+
+    @contextmanager
+    def slot(
+        self, priority: constants.AnalysisPriority, deadline: Deadline = None
+    ):
+        """
+        Runs the with block in a slot of the priority class.
+        """
+        self.acquire(priority, deadline)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    @contextmanager
+    def held_slot(self, priority: constants.AnalysisPriority):
+        """
+        Runs the with block in a slot acquired before (acquire_async) and
+        releases it at the end.
+        """
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def metrics(self) -> dict:
+        with self.condition:
+            return {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "classes": {
+                    priority.name.lower(): priority_class.metrics()
+                    for priority, priority_class in self.classes.items()
+                },
+            }
@@ -1,11 +1,15 @@
 from logging import Logger
 import requests
-from azure.storage.blob import BlobClient
+from azure.storage.blob import BlobClient, ContainerClient
 from common_modules.common import constants
 from common_modules.common.common_config import Config as Config
+from common_modules.common.storage_backend import StorageBackend
 
+# limit of the anonymous image downloads without a timeout (connect and each read)
+DEFAULT_DOWNLOAD_TIMEOUT = 60.0
 
-class AzureBlobStorageHelper:
+
+class AzureBlobStorageHelper(StorageBackend):
     """
     This class It is meant to simplify the usage of common Azure Blob Storage tasks.
     Am sure there are many ways to interact with Azure Blob Storage, but
@@ -37,29 +41,44 @@ class AzureBlobStorageHelper:
     """
 
     def __init__(self, config: Config, logger: Logger):
-        self.config = config
-        self.logger = logger
+        super().__init__(config, logger)
 
     def write_blob_with_token(
-        self, storage_account, container, filename: str, token: str
+        self,
+        storage_account,
+        container,
+        filename: str,
+        token: str,
+        local_path: str = None,
+        timeout: float = None,
     ):
         """
         Write a file to an azure blob storage account using a shared access token.
         This methods can write both images and json files.
+        The blob is named after the file, local_path can be used to upload
+        the content of another local file under that name.
+        timeout (seconds) limits the connection and each read of the upload.
         """
+        # without a timeout, the sdk defaults apply
+        timeouts = {}
+        if timeout is not None:
+            timeouts = {"connection_timeout": timeout, "read_timeout": timeout}
         blob_client = BlobClient(
             account_url=storage_account,
             container_name=container,
             blob_name=filename,
             credential=token,
+            **timeouts,
         )
         blob_data = None
-        with open(filename, "rb") as f:
+        with open(local_path or filename, "rb") as f:
             blob_data = f.read()
 
         return blob_client.upload_blob(blob_data, overwrite=True)
 
-    def write_prediction_details(self, filename: str):
+    def write_prediction_details(
+        self, filename: str, local_path: str = None, timeout: float = None
+    ):
         """
         For my specific use case, it writes a file to a specific storage account.
         In this case, it writes to the predictions container.
@@ -69,9 +88,13 @@ class AzureBlobStorageHelper:
             self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_CONTAINER),
             filename,
             self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT_TOKEN),
+            local_path,
+            timeout,
         )
 
-    def write_prediction_image(self, filename: str):
+    def write_prediction_image(
+        self, filename: str, local_path: str = None, timeout: float = None
+    ):
         """
         For my specific use case, it writes a file to a specific storage account.
         In this case, it writes to the predictions container.
@@ -81,28 +104,38 @@ class AzureBlobStorageHelper:
             self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_CONTAINER),
             filename,
             self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT_TOKEN),
+            local_path,
+            timeout,
         )
 
     def read_image_with_url_anonymous(
-        self, storage_account_url: str, filename: str
+        self, storage_account_url: str, filename: str, timeout: float = None
     ) -> bytes:
         """
         This is the base method to read an image from an azure blob storage account.
         It is meant to be used when the blob storage account is public.
+        timeout (seconds) limits the connection and each read, None for the
+        default (DEFAULT_DOWNLOAD_TIMEOUT).
         """
+        if timeout is None:
+            timeout = DEFAULT_DOWNLOAD_TIMEOUT
         image_url = "{}{}".format(storage_account_url, filename)
         self.logger.debug(f"image path:{image_url}")
-        image_data = requests.get(image_url, stream=True).content
+        image_data = requests.get(image_url, stream=True, timeout=timeout).content
         # self.logger.debug(f"image data:{image_data}")
         return image_data
 
-    def read_test_data_image_with_url_anonymous(self, filename: str) -> bytes:
+    def read_test_data_image_with_url_anonymous(
+        self, filename: str, timeout: float = None
+    ) -> bytes:
         """
         For my specific use case, it reads an image from the default storage account.
         In this case, it reads from the test data container.
         """
         return self.read_image_with_url_anonymous(
-            self.config.get(constants.CONFIG_TEST_DATA_STORAGE_ACCOUNT), filename
+            self.config.get(constants.CONFIG_TEST_DATA_STORAGE_ACCOUNT),
+            filename,
+            timeout,
         )
 
     def read_image_with_token(
@@ -154,3 +187,61 @@ class AzureBlobStorageHelper:
             filename,
             self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT_TOKEN),
         )
+
+    def read_prediction_details_bytes(self, filename: str) -> bytes:
+        """
+        Reads the stored prediction details as raw json bytes,
+        so they can be returned as they are without parsing them.
+        """
+        self.logger.debug(
+            f"reading prediction details bytes for {filename}, {self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_CONTAINER)}"
+        )
+        return self.read_image_with_token(
+            self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT),
+            self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_CONTAINER),
+            filename,
+            self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT_TOKEN),
+        )
+
+    def list_prediction_details(self) -> list[str]:
+        """
+        Lists the json blobs in the predictions container.
+        The access token needs the list permission.
+        """
+        container_client = ContainerClient(
+            account_url=self.config.get(constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT),
+            container_name=self.config.get(
+                constants.CONFIG_PREDICTIONS_STORAGE_CONTAINER
+            ),
+            credential=self.config.get(
+                constants.CONFIG_PREDICTIONS_STORAGE_ACCOUNT_TOKEN
+            ),
+        )
+        return [
+            name
+            for name in container_client.list_blob_names()
+            if name.lower().endswith(".json")
+        ]
+
+    def list_test_data_images(
+        self, prefix: str = None, page_token: str = None, page_size: int = 1000
+    ):
+        """
+        Lists the image blobs in the test data container, page by page.
+        The container is read anonymously, it needs the container access
+        level (public read access for the container and its blobs).
+        """
+        container_client = ContainerClient.from_container_url(
+            self.config.get(constants.CONFIG_TEST_DATA_STORAGE_ACCOUNT)
+        )
+        pages = container_client.list_blob_names(
+            name_starts_with=prefix, results_per_page=page_size
+        ).by_page(continuation_token=page_token)
+        for page in pages:
+            names = [
+                name
+                for name in page
+                if name.lower().endswith(constants.IMAGE_EXTENSIONS)
+            ]
+            yield page_token, names
+            page_token = pages.continuation_token
@@ -48,3 +48,46 @@ class Config:
             return self.config.get(key)
         else:
             return os.getenv(key)
+
+    def get_int(self, key: str, default: int = 0) -> int:
+        value = self.get(key)
+        if value is None or value == "":
+            return default
+        return int(value)
+
+    def get_float(self, key: str, default: float = 0.0) -> float:
+        value = self.get(key)
+        if value is None or value == "":
+            return default
+        return float(value)
+
+    def get_bool(self, key: str, default: bool = False) -> bool:
+        # boolean settings are stored as strings, e.g. LogToFile=True
+        value = self.get(key)
+        if value is None or value == "":
+            return default
+        return str(value).lower() == "true"
+
+    def snapshot(self, keys: list[str]) -> "StaticConfig":
+        """
+        Returns a copy of the given configuration values that can be pickled,
+        e.g. to hand the configuration over to a worker process.
+        """
+        return StaticConfig({key: self.get(key) for key in keys})
+
+
+class StaticConfig(Config):
+    """
+    Read-only configuration backed by a plain dictionary.
+    """
+
+    def __init__(self, values: dict) -> None:
+        self.config_source = None
+        self.config = None
+        self.app_version = None
+        self.config_source_descr = None
+        self.config_version = None
+        self.values = values
+
+    def get(self, key: str):
+        return self.values.get(key)
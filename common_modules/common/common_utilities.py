@@ -4,7 +4,7 @@ import time
 
 
 def create_grass_detection_summary(
-    grass_confidence: float, weed_confidence: float
+    grass_confidence: float, weed_confidence: float, weed_coverage: float = None
 ) -> str:
     summary = "Use model prediction information with care when making decisions."
 
@@ -44,6 +44,10 @@ def create_grass_detection_summary(
         summary = (
             "Always use model prediction information with care when making decisions."
         )
+
+    # the coverage is computed from all the weed boxes, not only the top one
+    if weed_coverage is not None and weed_coverage > 0:
+        summary += f" Estimated weed coverage: {weed_coverage:.1f}% of the area."
     return summary
 
 
@@ -21,6 +21,13 @@ CONFING_AZURE_APP_CONFIGURATION_CONNECTION_STRING = "AzureConfigConnectionString
 DETECTED_TYPE_GRASS = "Grass"
 DETECTED_TYPE_WEED = "Weed"
 
+# labels kept from the predictions, comma separated e.g. Grass,Weed
+CONFIG_DETECTION_LABELS = "DetectionLabels"
+DEFAULT_DETECTION_LABELS = [DETECTED_TYPE_GRASS, DETECTED_TYPE_WEED]
+
+# minimum confidence of each label, comma separated e.g. Grass:0.2,Weed:0.35
+CONFIG_LABEL_MIN_CONFIDENCE = "LabelMinConfidence"
+
 BOUNDING_BOX_COLOR_GRASS = "#FFDF00"
 BOUNDING_BOX_COLOR_WEED = "#FF0000"
 
@@ -40,6 +47,9 @@ COLOR_LIST = {}
 COLOR_LIST[DETECTED_TYPE_GRASS] = COLOR_SPRING
 COLOR_LIST[DETECTED_TYPE_WEED] = COLOR_VERMILION_RED
 
+# color used for any other configured label
+DEFAULT_MARKED_COLOR = COLOR_AMBER
+
 # keys for reading the color codes from the configuration
 COLOR_CODE_GRASS = "ColorCodeGrass"
 COLOR_CODE_WEED = "ColorCodeWeed"
@@ -53,6 +63,127 @@ CONFIG_DEPLOYED_NAME = "DeployedName"
 CONFIG_PREDICTION_ENDPOINT = "PredictionEndpoint"
 CONFIG_PREDICTION_KEY = "PredictionKey"
 
+# multiple prediction resources with the same published iteration, e.g. in two regions
+# - PredictionTargets: json list of {"name", "endpoint", "key"} and optionally
+#   "project_id" and "deployed_name", used instead of PredictionEndpoint/PredictionKey
+# - each call goes to the fastest healthy target, see prediction_routing.py
+CONFIG_PREDICTION_TARGETS = "PredictionTargets"
+CONFIG_PREDICTION_TARGET_EWMA_ALPHA = "PredictionTargetEwmaAlpha"
+CONFIG_PREDICTION_TARGET_MAX_ERROR_RATE = "PredictionTargetMaxErrorRate"
+CONFIG_PREDICTION_TARGET_PROBE_SECONDS = "PredictionTargetProbeSeconds"
+
+DEFAULT_PREDICTION_TARGET_EWMA_ALPHA = 0.2
+DEFAULT_PREDICTION_TARGET_MAX_ERROR_RATE = 0.5
+DEFAULT_PREDICTION_TARGET_PROBE_SECONDS = 30.0
+
+# async Custom Vision calls (the live feed) - connections kept open to each
+# prediction target, the calls beyond it wait for a free connection
+CONFIG_PREDICTION_MAX_CONNECTIONS = "PredictionMaxConnections"
+
+DEFAULT_PREDICTION_MAX_CONNECTIONS = 100
+
+# detection backend - which model performs the object detection
+# - CustomVision: the published iteration in Azure Custom Vision (default)
+# - Onnx: the iteration exported from Custom Vision as ONNX, run locally on the CPU
+CONFIG_DETECTION_BACKEND = "DetectionBackend"
+DETECTION_BACKEND_CUSTOM_VISION = "CustomVision"
+DETECTION_BACKEND_ONNX = "Onnx"
+
+# local onnx model information, only used by the Onnx detection backend
+# - the model file and labels file are both part of the Custom Vision ONNX export
+CONFIG_ONNX_MODEL_PATH = "OnnxModelPath"
+CONFIG_ONNX_LABELS_PATH = "OnnxLabelsPath"
+CONFIG_ONNX_PROBABILITY_THRESHOLD = "OnnxProbabilityThreshold"
+CONFIG_ONNX_INTRA_OP_THREADS = "OnnxIntraOpThreads"
+
+DEFAULT_ONNX_PROBABILITY_THRESHOLD = 0.01
+
+# tiled detection - high resolution images are split into overlapping tiles
+# - TileSize: width and height of a tile in pixels
+# - TileOverlap: fraction of a tile shared with its neighbour, e.g. 0.2
+# - TileConcurrency: number of tiles sent to the detection backend at the same time
+# - TileNmsIouThreshold: boxes overlapping more than this are merged
+CONFIG_TILED_DETECTION_ENABLED = "TiledDetectionEnabled"
+CONFIG_TILE_SIZE = "TileSize"
+CONFIG_TILE_OVERLAP = "TileOverlap"
+CONFIG_TILE_CONCURRENCY = "TileConcurrency"
+CONFIG_TILE_NMS_IOU_THRESHOLD = "TileNmsIouThreshold"
+
+DEFAULT_TILE_SIZE = 1024
+DEFAULT_TILE_OVERLAP = 0.2
+DEFAULT_TILE_CONCURRENCY = 4
+DEFAULT_TILE_NMS_IOU_THRESHOLD = 0.5
+
+# derivatives of the annotated image - smaller sizes and modern formats
+# - ImageDerivativeSizes: comma separated name:width pairs, width 0 keeps the full size
+# - ImageDerivativeFormats: comma separated, jpeg and/or webp
+CONFIG_IMAGE_DERIVATIVES_ENABLED = "ImageDerivativesEnabled"
+CONFIG_IMAGE_DERIVATIVE_SIZES = "ImageDerivativeSizes"
+CONFIG_IMAGE_DERIVATIVE_FORMATS = "ImageDerivativeFormats"
+CONFIG_IMAGE_DERIVATIVE_QUALITY = "ImageDerivativeQuality"
+
+IMAGE_SIZE_FULL = "full"
+IMAGE_FORMAT_JPEG = "jpeg"
+IMAGE_FORMAT_WEBP = "webp"
+
+DEFAULT_IMAGE_DERIVATIVE_SIZES = "thumbnail:160,medium:640,full:0"
+DEFAULT_IMAGE_DERIVATIVE_FORMATS = "jpeg,webp"
+DEFAULT_IMAGE_DERIVATIVE_QUALITY = 80
+
+# weed coverage - all the weed boxes are rasterized into a grid over the image
+# - CoverageGridSize: number of cells along each side of the image
+# - CoverageMinConfidence: boxes with a lower confidence are ignored
+# - CoverageHeatmapEnabled: tint the annotated image with the weed density,
+#   CoverageHeatmapOpacity (0-1) is the tint of a cell that surely holds weed
+CONFIG_COVERAGE_GRID_SIZE = "CoverageGridSize"
+CONFIG_COVERAGE_MIN_CONFIDENCE = "CoverageMinConfidence"
+CONFIG_COVERAGE_HEATMAP_ENABLED = "CoverageHeatmapEnabled"
+CONFIG_COVERAGE_HEATMAP_OPACITY = "CoverageHeatmapOpacity"
+
+DEFAULT_COVERAGE_GRID_SIZE = 64
+DEFAULT_COVERAGE_MIN_CONFIDENCE = 0.1
+DEFAULT_COVERAGE_HEATMAP_OPACITY = 0.5
+
+# number of worker processes rendering the annotated images
+# - 0 (default) renders in the thread handling the request
+CONFIG_RENDER_PROCESS_POOL_SIZE = "RenderProcessPoolSize"
+
+# lazy rendering of the annotated images
+# - LazyRenderingEnabled: the analysis saves a render manifest (the source image
+#   and the selected predictions) instead of the annotated image, the image is
+#   rendered and saved the first time it is read (/prediction/image)
+# - an uploaded image is saved as it is (<image>.source), a test image is
+#   referenced by its name
+CONFIG_LAZY_RENDERING_ENABLED = "LazyRenderingEnabled"
+
+# video analysis - frames are sampled from the uploaded clip
+# - VideoSampleFps: number of frames sampled per second of video
+# - VideoDuplicateHashDistance: frames whose perceptual hash differs from the
+#   last analyzed frame by at most this many bits (of 64) are skipped
+# - VideoMaxConcurrency: number of frames sent to the detection backend at the same time
+CONFIG_VIDEO_SAMPLE_FPS = "VideoSampleFps"
+CONFIG_VIDEO_DUPLICATE_HASH_DISTANCE = "VideoDuplicateHashDistance"
+CONFIG_VIDEO_MAX_CONCURRENCY = "VideoMaxConcurrency"
+
+DEFAULT_VIDEO_SAMPLE_FPS = 1.0
+DEFAULT_VIDEO_DUPLICATE_HASH_DISTANCE = 6
+DEFAULT_VIDEO_MAX_CONCURRENCY = 4
+
+# storage backend - where the test images and prediction files are stored
+# - AzureBlob: azure blob storage (default)
+# - LocalFile: folders on the local file system
+CONFIG_STORAGE_BACKEND = "StorageBackend"
+STORAGE_BACKEND_AZURE_BLOB = "AzureBlob"
+STORAGE_BACKEND_LOCAL_FILE = "LocalFile"
+
+CONFIG_LOCAL_PREDICTIONS_FOLDER = "LocalPredictionsFolder"
+CONFIG_LOCAL_TEST_DATA_FOLDER = "LocalTestDataFolder"
+DEFAULT_LOCAL_PREDICTIONS_FOLDER = "predictions"
+DEFAULT_LOCAL_TEST_DATA_FOLDER = "test-images"
+
+# extensions of the images listed in the test data container/folder
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp")
+
 # storage account information
 CONFIG_TEST_DATA_STORAGE_ACCOUNT = "TestDataStorageAccount"
 
@@ -63,9 +194,187 @@ CONFIG_PREDICTIONS_STORAGE_ACCOUNT_TOKEN = "WriteAccessToken"
 CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME = "PredictionsImageFileName"
 CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME = "PredictionsInfoFileName"
 
+# write-behind - the analysis returns before the prediction files are uploaded
+# - the files are copied to a local spool folder and uploaded by a background thread
+# - while an upload is pending, the files are served from the spool folder
+CONFIG_WRITE_BEHIND_ENABLED = "WriteBehindEnabled"
+CONFIG_WRITE_BEHIND_SPOOL_DIR = "WriteBehindSpoolDir"
+CONFIG_WRITE_BEHIND_MAX_RETRIES = "WriteBehindMaxRetries"
+CONFIG_WRITE_BEHIND_RETRY_DELAY_SECONDS = "WriteBehindRetryDelaySeconds"
+
+DEFAULT_WRITE_BEHIND_SPOOL_DIR = "prediction_spool"
+DEFAULT_WRITE_BEHIND_MAX_RETRIES = 5
+DEFAULT_WRITE_BEHIND_RETRY_DELAY_SECONDS = 1.0
+
+
+# prediction history - every analysis is also recorded in a local sqlite database
+# for fast history and aggregate queries without reading the stored json files
+CONFIG_PREDICTION_HISTORY_ENABLED = "PredictionHistoryEnabled"
+CONFIG_PREDICTION_HISTORY_PATH = "PredictionHistoryPath"
+
+DEFAULT_PREDICTION_HISTORY_PATH = "prediction_history.db"
+
+# geo index - the location and capture time of the images are read from their
+# exif metadata and stored with the details, the geotagged analyses are also
+# recorded in a local spatial index (sqlite rtree) for the area, nearest and
+# weed density tile queries (/prediction/geo/...)
+CONFIG_GEO_INDEX_ENABLED = "GeoIndexEnabled"
+CONFIG_GEO_INDEX_PATH = "GeoIndexPath"
+
+DEFAULT_GEO_INDEX_PATH = "geo_index.db"
+
+
+# memory instrumentation
+# - MemoryTracingEnabled: trace the python allocations with tracemalloc (slow)
+# - MemoryTracingFrames: number of frames stored for each allocation
+# - DebugEndpointsEnabled: expose the /debug endpoints, e.g. /debug/memory
+CONFIG_MEMORY_TRACING_ENABLED = "MemoryTracingEnabled"
+CONFIG_MEMORY_TRACING_FRAMES = "MemoryTracingFrames"
+CONFIG_DEBUG_ENDPOINTS_ENABLED = "DebugEndpointsEnabled"
+
+DEFAULT_MEMORY_TRACING_FRAMES = 1
+
+
+# request deadline - time budget of an analysis request in seconds
+# - the image fetch, detection, rendering and upload take their timeouts
+#   from the remaining budget, the request fails with 504 when it runs out
+# - clients can ask for a shorter or longer budget with the X-Request-Deadline
+#   header (seconds), up to RequestDeadlineMaxSeconds
+CONFIG_REQUEST_DEADLINE_SECONDS = "RequestDeadlineSeconds"
+CONFIG_REQUEST_DEADLINE_MAX_SECONDS = "RequestDeadlineMaxSeconds"
+REQUEST_DEADLINE_HEADER = "X-Request-Deadline"
+
+DEFAULT_REQUEST_DEADLINE_SECONDS = 30.0
+DEFAULT_REQUEST_DEADLINE_MAX_SECONDS = 120.0
+
+
+# priority scheduling of the analyses
+# - SchedulerConcurrency: number of analyses running at the same time,
+#   0 (default) runs every analysis right away without scheduling
+# - SchedulerWeights: share of the slots each priority class gets when all
+#   classes are waiting, e.g. interactive:8,batch:2,background:1
+# - SchedulerClassLimits: maximum running analyses per class, e.g. batch:2
+# - clients pick the class with the X-Analysis-Priority header (default: interactive)
+CONFIG_SCHEDULER_CONCURRENCY = "SchedulerConcurrency"
+CONFIG_SCHEDULER_WEIGHTS = "SchedulerWeights"
+CONFIG_SCHEDULER_CLASS_LIMITS = "SchedulerClassLimits"
+ANALYSIS_PRIORITY_HEADER = "X-Analysis-Priority"
+
+DEFAULT_SCHEDULER_WEIGHTS = "interactive:8,batch:2,background:1"
+
+
+# on-demand profiling of the analysis requests
+# - ProfilingEnabled: profile the requests that send X-Profile-Request: true,
+#   and a ProfilingSampleRate fraction (0-1) of the other requests
+# - the profiles are stored in ProfilesFolder, at most ProfilingMaxProfiles
+# - the stored profiles are served under /debug/profiles, with the
+#   AdminAccessKey in the X-Admin-Key header
+CONFIG_PROFILING_ENABLED = "ProfilingEnabled"
+CONFIG_PROFILING_SAMPLE_RATE = "ProfilingSampleRate"
+CONFIG_PROFILING_INTERVAL_SECONDS = "ProfilingIntervalSeconds"
+CONFIG_PROFILES_FOLDER = "ProfilesFolder"
+CONFIG_PROFILING_MAX_PROFILES = "ProfilingMaxProfiles"
+CONFIG_ADMIN_ACCESS_KEY = "AdminAccessKey"
+PROFILE_REQUEST_HEADER = "X-Profile-Request"
+PROFILE_ID_HEADER = "X-Profile-Id"
+ADMIN_KEY_HEADER = "X-Admin-Key"
+
+DEFAULT_PROFILES_FOLDER = "profiles"
+DEFAULT_PROFILING_MAX_PROFILES = 100
+DEFAULT_PROFILING_INTERVAL_SECONDS = 0.001
+
+
+# bulk analysis of the images in the test data container
+# - the images are listed page by page (BulkPageSize) and pushed through the
+#   download, detect, annotate and upload stages, each with its own number of
+#   workers and a queue of at most BulkQueueSize images in front of it
+# - the results are stored under BulkOutputPrefix/<job>/<image name>
+# - the progress of each job is saved in BulkCheckpointFolder/<job>.json every
+#   BulkCheckpointInterval images, a job started again resumes from there
+CONFIG_BULK_PAGE_SIZE = "BulkPageSize"
+CONFIG_BULK_QUEUE_SIZE = "BulkQueueSize"
+CONFIG_BULK_DOWNLOAD_WORKERS = "BulkDownloadWorkers"
+CONFIG_BULK_DETECT_WORKERS = "BulkDetectWorkers"
+CONFIG_BULK_ANNOTATE_WORKERS = "BulkAnnotateWorkers"
+CONFIG_BULK_UPLOAD_WORKERS = "BulkUploadWorkers"
+CONFIG_BULK_OUTPUT_PREFIX = "BulkOutputPrefix"
+CONFIG_BULK_CHECKPOINT_FOLDER = "BulkCheckpointFolder"
+CONFIG_BULK_CHECKPOINT_INTERVAL = "BulkCheckpointInterval"
+
+DEFAULT_BULK_PAGE_SIZE = 1000
+DEFAULT_BULK_QUEUE_SIZE = 16
+DEFAULT_BULK_DOWNLOAD_WORKERS = 8
+DEFAULT_BULK_DETECT_WORKERS = 4
+DEFAULT_BULK_ANNOTATE_WORKERS = 2
+DEFAULT_BULK_UPLOAD_WORKERS = 8
+DEFAULT_BULK_OUTPUT_PREFIX = "bulk"
+DEFAULT_BULK_CHECKPOINT_FOLDER = "bulk-checkpoints"
+DEFAULT_BULK_CHECKPOINT_INTERVAL = 50
+
+# pre-screening of the images before the detection backend is called
+# - PrescreenEnabled: measure a small copy (PrescreenSize pixels) of each image
+# - an image is unusable when it is blurry (variance of the laplacian below
+#   PrescreenMinSharpness), too dark or too bright (mean brightness 0-255
+#   outside PrescreenMinBrightness-PrescreenMaxBrightness) or shows little
+#   vegetation (fraction of green pixels below PrescreenMinVegetationRatio),
+#   a threshold of 0 turns its check off
+# - PrescreenAction: reject the unusable images without calling the model
+#   (reject, the default), or analyze them and flag them in the details (flag)
+CONFIG_PRESCREEN_ENABLED = "PrescreenEnabled"
+CONFIG_PRESCREEN_SIZE = "PrescreenSize"
+CONFIG_PRESCREEN_MIN_SHARPNESS = "PrescreenMinSharpness"
+CONFIG_PRESCREEN_MIN_BRIGHTNESS = "PrescreenMinBrightness"
+CONFIG_PRESCREEN_MAX_BRIGHTNESS = "PrescreenMaxBrightness"
+CONFIG_PRESCREEN_MIN_VEGETATION_RATIO = "PrescreenMinVegetationRatio"
+CONFIG_PRESCREEN_ACTION = "PrescreenAction"
+PRESCREEN_ACTION_REJECT = "reject"
+PRESCREEN_ACTION_FLAG = "flag"
+
+DEFAULT_PRESCREEN_SIZE = 256
+DEFAULT_PRESCREEN_MIN_SHARPNESS = 20.0
+DEFAULT_PRESCREEN_MIN_BRIGHTNESS = 30.0
+DEFAULT_PRESCREEN_MAX_BRIGHTNESS = 230.0
+DEFAULT_PRESCREEN_MIN_VEGETATION_RATIO = 0.05
+
+# watch folder mode of the command line app (python app.py watch [folder])
+# - new images in WatchFolder (and its sub folders) are analyzed once they are
+#   fully written: closed after writing (inotify), or unchanged for
+#   WatchSettleSeconds
+# - filesystem events are used when watchdog is installed, the folder is also
+#   scanned every WatchScanSeconds (every WatchPollSeconds without watchdog or
+#   with WatchUsePolling) to pick up missed files and retry failed ones
+# - WatchWorkers analyze the images, at most WatchQueueSize images wait for them
+# - the results are uploaded under WatchOutputPrefix/<relative path> in batches
+#   of WatchUploadBatchSize images, or after WatchUploadBatchSeconds
+# - the uploaded images are listed in WatchCheckpointPath, they are not analyzed
+#   again after a restart
+CONFIG_WATCH_FOLDER = "WatchFolder"
+CONFIG_WATCH_USE_POLLING = "WatchUsePolling"
+CONFIG_WATCH_POLL_SECONDS = "WatchPollSeconds"
+CONFIG_WATCH_SCAN_SECONDS = "WatchScanSeconds"
+CONFIG_WATCH_SETTLE_SECONDS = "WatchSettleSeconds"
+CONFIG_WATCH_WORKERS = "WatchWorkers"
+CONFIG_WATCH_QUEUE_SIZE = "WatchQueueSize"
+CONFIG_WATCH_OUTPUT_PREFIX = "WatchOutputPrefix"
+CONFIG_WATCH_UPLOAD_BATCH_SIZE = "WatchUploadBatchSize"
+CONFIG_WATCH_UPLOAD_BATCH_SECONDS = "WatchUploadBatchSeconds"
+CONFIG_WATCH_CHECKPOINT_PATH = "WatchCheckpointPath"
+
+DEFAULT_WATCH_FOLDER = "watch"
+DEFAULT_WATCH_POLL_SECONDS = 2.0
+DEFAULT_WATCH_SCAN_SECONDS = 60.0
+DEFAULT_WATCH_SETTLE_SECONDS = 2.0
+DEFAULT_WATCH_WORKERS = 2
+DEFAULT_WATCH_QUEUE_SIZE = 8
+DEFAULT_WATCH_OUTPUT_PREFIX = "watch"
+DEFAULT_WATCH_UPLOAD_BATCH_SIZE = 20
+DEFAULT_WATCH_UPLOAD_BATCH_SECONDS = 10.0
+DEFAULT_WATCH_CHECKPOINT_PATH = "watch-checkpoint.jsonl"
 
 DetectionType = Enum("DetectionType", ["WEED", "GRASS", "BOTH"])
 
+AnalysisPriority = Enum("AnalysisPriority", ["INTERACTIVE", "BATCH", "BACKGROUND"])
+
 LOG_LEVEL_DEBUG = "DEBUG"
 LOG_LEVEL_INFO = "INFO"
 LOG_LEVEL_WARNING = "WARNING"
@@ -0,0 +1,72 @@
+#####################################################################
+# Time budget of a request.
+# The deadline is created when the request arrives and passed through
+# the analysis stages (image fetch, detection, rendering, upload). Each
+# stage takes its timeout from the remaining budget and checks the
+# deadline before it starts, so a hung dependency or a client that went
+# away doesn't keep a worker busy.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import time
+
+
+class DeadlineExceededError(Exception):
+    """
+    Raised when the deadline of the request has passed, or the request
+    was cancelled (e.g. the client disconnected) before the stage started.
+    """
+
+    def __init__(self, stage: str, cancelled: bool = False) -> None:
+        self.stage = stage
+        self.cancelled = cancelled
+        reason = "request cancelled" if cancelled else "deadline exceeded"
+        super().__init__(f"{reason} before or during: {stage}")
+
+
+class Deadline:
+    """
+    Point in time by which the request must be complete.
+    """
+
+    def __init__(self, seconds: float) -> None:
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        self.cancelled = False
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.cancelled or time.monotonic() >= self.expires_at
+
+    def cancel(self) -> None:
+        """
+        Stops the remaining stages, e.g. when the client disconnected.
+        """
+        self.cancelled = True
+
+    def check(self, stage: str) -> None:
+        """
+        Raises DeadlineExceededError if the stage should not start anymore.
+        """
+        if self.cancelled:
+            raise DeadlineExceededError(stage, cancelled=True)
+        if time.monotonic() >= self.expires_at:
+            raise DeadlineExceededError(stage)
+
+    def timeout(self, stage: str) -> float:
+        """
+        Returns the timeout of the stage in seconds, i.e. the remaining budget.
+        """
+        self.check(stage)
+        return self.remaining()
+
+
+def stage_timeout(deadline: Deadline, stage: str) -> float:
+    """
+    Returns the timeout of the stage, None (no timeout) without a deadline.
+    """
+    if deadline is None:
+        return None
+    return deadline.timeout(stage)
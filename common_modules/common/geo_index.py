@@ -0,0 +1,564 @@
+#####################################################################
+# Local spatial index of the geotagged analyses.
+# The location of each analysis (from the exif metadata of the image)
+# is recorded in a sqlite database with an R*Tree index (the sqlite
+# rtree module), one point per analysis with its weed measures. The
+# queries only touch the points in the area, they take milliseconds
+# with hundreds of thousands of analyses:
+# - area and nearest: the rtree finds the points in a box, the exact
+#   coordinates and the measures are read from the analyses table by id
+# - density tiles: the measures are also summed per cell of a grid for
+#   every zoom level up to MAX_CELL_LEVEL when an analysis is recorded,
+#   a tile reads at most cells x cells rows however many analyses it
+#   covers. Finer grids and filtered tiles are aggregated from the rtree
+#
+# The tree is built over web mercator coordinates (0-1 over the world,
+# y down, like the map tiles) instead of latitude / longitude, so the
+# map tiles are rectangles of the index. The rtree stores 32 bit floats,
+# rounded outwards, the points it returns are filtered again with the
+# exact coordinates.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import math
+import sqlite3
+import threading
+from logging import Logger
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+
+EARTH_RADIUS_METERS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_METERS / 180
+# web mercator is cut off at the poles
+MAX_LATITUDE = 85.05112878
+MAX_ZOOM = 24
+# finest grid of the aggregated cells, 2^20 cells around the world (about
+# 38 m at the equator), e.g. zoom 16 tiles with 16 x 16 cells
+MAX_CELL_LEVEL = 20
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS geo_analyses (
+    id INTEGER PRIMARY KEY,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    weed_confidence REAL NOT NULL,
+    weed_coverage REAL,
+    weed_detections INTEGER,
+    timestamp TEXT NOT NULL,
+    captured_at TEXT,
+    altitude REAL,
+    info_file TEXT,
+    image_file TEXT
+);
+CREATE INDEX IF NOT EXISTS geo_analyses_info_file ON geo_analyses (info_file);
+CREATE VIRTUAL TABLE IF NOT EXISTS geo_points USING rtree (
+    id, min_x, max_x, min_y, max_y
+);
+CREATE TABLE IF NOT EXISTS geo_cells (
+    level INTEGER NOT NULL,
+    cell_x INTEGER NOT NULL,
+    cell_y INTEGER NOT NULL,
+    analyses INTEGER NOT NULL,
+    with_weed INTEGER NOT NULL,
+    weed_confidence_sum REAL NOT NULL,
+    weed_confidence_max REAL NOT NULL,
+    weed_coverage_sum REAL NOT NULL,
+    weed_coverage_count INTEGER NOT NULL,
+    weed_detections INTEGER NOT NULL,
+    PRIMARY KEY (level, cell_y, cell_x)
+) WITHOUT ROWID;
+"""
+
+# the points of the rtree, joined with their analyses
+POINTS = "geo_points p JOIN geo_analyses a ON a.id = p.id"
+
+# keys of the returned analyses and their columns
+ITEM_COLUMNS = {
+    "id": "a.id",
+    "timestamp": "a.timestamp",
+    "captured_at": "a.captured_at",
+    "latitude": "a.latitude",
+    "longitude": "a.longitude",
+    "altitude": "a.altitude",
+    "prediction_info_url": "a.info_file",
+    "prediction_image_url": "a.image_file",
+    "weed_confidence": "a.weed_confidence",
+    "weed_coverage": "a.weed_coverage",
+    "weed_detections": "a.weed_detections",
+}
+ITEM_KEYS = tuple(ITEM_COLUMNS)
+ITEM_SELECT = ", ".join(ITEM_COLUMNS.values())
+
+ADD_TO_CELL = """
+INSERT INTO geo_cells VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (level, cell_y, cell_x) DO UPDATE SET
+    analyses = analyses + 1,
+    with_weed = with_weed + excluded.with_weed,
+    weed_confidence_sum = weed_confidence_sum + excluded.weed_confidence_sum,
+    weed_confidence_max = MAX(weed_confidence_max, excluded.weed_confidence_max),
+    weed_coverage_sum = weed_coverage_sum + excluded.weed_coverage_sum,
+    weed_coverage_count = weed_coverage_count + excluded.weed_coverage_count,
+    weed_detections = weed_detections + excluded.weed_detections
+"""
+
+
+def to_world(latitude: float, longitude: float) -> tuple[float, float]:
+    """
+    Returns the web mercator coordinates of the location, 0-1 from the
+    north west corner of the world.
+    """
+    latitude = min(max(latitude, -MAX_LATITUDE), MAX_LATITUDE)
+    sin_latitude = math.sin(math.radians(latitude))
+    x = (longitude + 180) / 360
+    y = 0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)
+    return x, y
+
+
+def tile_bounds(zoom: int, tile_x: int, tile_y: int) -> dict:
+    """
+    Returns the latitude / longitude bounds of the map tile.
+    """
+
+    def latitude(y: float) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y))))
+
+    size = 2**zoom
+    return {
+        "south": latitude((tile_y + 1) / size),
+        "west": tile_x / size * 360 - 180,
+        "north": latitude(tile_y / size),
+        "east": (tile_x + 1) / size * 360 - 180,
+    }
+
+
+def haversine_meters(
+    latitude1: float, longitude1: float, latitude2: float, longitude2: float
+) -> float:
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+    a = (
+        math.sin(delta_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_METERS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def weed_measures(details: dict) -> tuple[float, float, int]:
+    """
+    Returns the highest weed confidence, the weed coverage and the number
+    of weed boxes of the details.
+    """
+    weed_confidence = max(
+        (
+            detection["confidenceLevel"]
+            for detection in details.get("detected_details") or []
+            if detection["predictedLabel"] == constants.DETECTED_TYPE_WEED
+        ),
+        default=0.0,
+    )
+    return (
+        weed_confidence,
+        details.get("weed_coverage"),
+        details.get("weed_detections"),
+    )
+
+
+def check_bounds(south: float, west: float, north: float, east: float) -> None:
+    if not (-90 <= south <= north <= 90):
+        raise ValueError("latitudes must be between -90 and 90, south <= north")
+    if not (-180 <= west <= east <= 180):
+        # a box over the antimeridian is queried as two boxes
+        raise ValueError("longitudes must be between -180 and 180, west <= east")
+
+
+class GeoIndex:
+    """
+    Records the locations of the analyses and answers the spatial queries.
+
+    Like the prediction history, the details are recorded in the form they
+    are stored as json (GrassAnalysisDetails.to_dict()), details without a
+    location are ignored.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        # the connection is shared by the request threads, access goes through the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            if path != ":memory:":
+                # readers don't wait for writers
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                # the index can be rebuilt from the stored details (app.py backfill),
+                # no sync at every commit
+                self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def from_config(config: Config, logger: Logger) -> "GeoIndex":
+        """
+        Creates the index, None if it is not enabled.
+        """
+        if not config.get_bool(constants.CONFIG_GEO_INDEX_ENABLED):
+            return None
+        path = (
+            config.get(constants.CONFIG_GEO_INDEX_PATH)
+            or constants.DEFAULT_GEO_INDEX_PATH
+        )
+        logger.debug(f"geo index: {path}")
+        return GeoIndex(path)
+
+    def record(self, details: dict, skip_existing: bool = False) -> bool:
+        """
+        Records the location and the weed measures of one analysis.
+        Returns False if the details have no location, or with skip_existing,
+        if the same details were already recorded.
+        """
+        location = details.get("location")
+        if not location:
+            return False
+        latitude = location["latitude"]
+        longitude = location["longitude"]
+        x, y = to_world(latitude, longitude)
+        weed_confidence, weed_coverage, weed_detections = weed_measures(details)
+
+        with self.lock, self.connection:
+            if skip_existing:
+                existing = self.connection.execute(
+                    "SELECT 1 FROM geo_analyses WHERE info_file IS ? AND timestamp = ?",
+                    (details.get("prediction_info_url"), details["timestamp"]),
+                ).fetchone()
+                if existing is not None:
+                    return False
+
+            cursor = self.connection.execute(
+                "INSERT INTO geo_analyses (latitude, longitude, x, y, weed_confidence,"
+                " weed_coverage, weed_detections, timestamp, captured_at, altitude,"
+                " info_file, image_file) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    latitude,
+                    longitude,
+                    x,
+                    y,
+                    weed_confidence,
+                    weed_coverage,
+                    weed_detections,
+                    details["timestamp"],
+                    location.get("captured_at"),
+                    location.get("altitude"),
+                    details.get("prediction_info_url"),
+                    details.get("prediction_image_url"),
+                ),
+            )
+            self.connection.execute(
+                "INSERT INTO geo_points VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, x, x, y, y),
+            )
+            measures = (
+                1 if weed_confidence > 0 else 0,
+                weed_confidence,
+                weed_confidence,
+                weed_coverage or 0.0,
+                0 if weed_coverage is None else 1,
+                weed_detections or 0,
+            )
+            self.connection.executemany(
+                ADD_TO_CELL,
+                [
+                    (
+                        level,
+                        min(int(x * 2**level), 2**level - 1),
+                        min(int(y * 2**level), 2**level - 1),
+                    )
+                    + measures
+                    for level in range(MAX_CELL_LEVEL + 1)
+                ],
+            )
+        return True
+
+    def select_points(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        columns: str,
+        min_weed_confidence: float = None,
+        limit: int = None,
+    ) -> list[sqlite3.Row]:
+        """
+        Selects the columns of the analyses within the bounds, through the rtree.
+        """
+        min_x, max_y = to_world(south, west)
+        max_x, min_y = to_world(north, east)
+        conditions = ""
+        parameters = [max_x, min_x, max_y, min_y, south, north, west, east]
+        if min_weed_confidence is not None:
+            conditions += " AND a.weed_confidence >= ?"
+            parameters.append(min_weed_confidence)
+        if limit is not None:
+            conditions += " LIMIT ?"
+            parameters.append(limit)
+        with self.lock:
+            return self.connection.execute(
+                f"SELECT {columns} FROM {POINTS}"
+                " WHERE p.min_x <= ? AND p.max_x >= ? AND p.min_y <= ? AND p.max_y >= ?"
+                " AND a.latitude BETWEEN ? AND ? AND a.longitude BETWEEN ? AND ?"
+                f"{conditions}",
+                parameters,
+            ).fetchall()
+
+    def query_area(
+        self,
+        south: float,
+        west: float,
+        north: float,
+        east: float,
+        min_weed_confidence: float = None,
+        limit: int = 1000,
+    ) -> dict:
+        """
+        Returns the analyses within the bounding box, in no particular order.
+        truncated is True when there are more than limit analyses in the box,
+        then only some of them are returned: use a smaller box, or the tiles.
+        """
+        check_bounds(south, west, north, east)
+        rows = self.select_points(
+            south, west, north, east, ITEM_SELECT, min_weed_confidence, limit + 1
+        )
+        return {
+            "items": [row_to_item(row) for row in rows[:limit]],
+            "truncated": len(rows) > limit,
+        }
+
+    def query_nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        count: int = 10,
+        max_distance: float = 10000.0,
+        min_weed_confidence: float = None,
+    ) -> dict:
+        """
+        Returns the count analyses nearest to the location, at most max_distance
+        meters away, nearest first with their distance in meters.
+
+        The rtree has no nearest neighbour search: the box around the location
+        grows until it holds count analyses, the box is then widened to the
+        distance of the farthest of them (the nearest ones may be just outside
+        of the corners of the square) and the candidates are sorted. The box
+        grows with the density of the analyses found so far, so that it takes
+        one or two queries and a few times count candidates.
+        """
+        check_bounds(latitude, longitude, latitude, longitude)
+
+        def candidates(radius: float) -> list[tuple[float, int]]:
+            latitude_delta = radius / METERS_PER_DEGREE
+            # the box is widest at its edge nearest to the pole
+            edge_latitude = min(abs(latitude) + latitude_delta, 89.9)
+            cos_latitude = math.cos(math.radians(edge_latitude))
+            longitude_delta = min(180.0, latitude_delta / max(cos_latitude, 1e-6))
+            rows = self.select_points(
+                max(-90.0, latitude - latitude_delta),
+                max(-180.0, longitude - longitude_delta),
+                min(90.0, latitude + latitude_delta),
+                min(180.0, longitude + longitude_delta),
+                "a.id, a.latitude, a.longitude",
+                min_weed_confidence,
+            )
+            return sorted(
+                (
+                    haversine_meters(latitude, longitude, row[1], row[2]),
+                    row[0],
+                )
+                for row in rows
+            )
+
+        radius = min(100.0, max_distance)
+        found = candidates(radius)
+        while len(found) < count and radius < max_distance:
+            if found:
+                # the number of analyses grows with the area of the box
+                growth = max(1.5, 1.2 * math.sqrt(count / len(found)))
+            else:
+                growth = 4.0
+            radius = min(radius * growth, max_distance)
+            found = candidates(radius)
+        if len(found) >= count and found[count - 1][0] > radius:
+            found = candidates(min(found[count - 1][0], max_distance))
+
+        nearest = [
+            (distance, analysis_id)
+            for distance, analysis_id in found[:count]
+            if distance <= max_distance
+        ]
+        items = []
+        if nearest:
+            ids = [analysis_id for _, analysis_id in nearest]
+            placeholders = ",".join("?" * len(ids))
+            with self.lock:
+                rows = {
+                    row[0]: row
+                    for row in self.connection.execute(
+                        f"SELECT {ITEM_SELECT} FROM geo_analyses a"
+                        f" WHERE a.id IN ({placeholders})",
+                        ids,
+                    )
+                }
+            for distance, analysis_id in nearest:
+                item = row_to_item(rows[analysis_id])
+                item["distance"] = round(distance, 2)
+                items.append(item)
+        return {"items": items}
+
+    def query_tile(
+        self,
+        zoom: int,
+        tile_x: int,
+        tile_y: int,
+        cells: int = 16,
+        min_weed_confidence: float = None,
+    ) -> dict:
+        """
+        Returns the weed density of the map tile zoom/x/y (the tiles of the web
+        maps) on a grid of cells x cells. Only the cells with analyses are
+        listed, row 0 is the north of the tile.
+        """
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f"zoom must be between 0 and {MAX_ZOOM}")
+        size = 2**zoom
+        if not (0 <= tile_x < size and 0 <= tile_y < size):
+            raise ValueError(f"tile {zoom}/{tile_x}/{tile_y} is out of range")
+        if not 1 <= cells <= 256:
+            raise ValueError("cells must be between 1 and 256")
+
+        # cells is a power of two: the grid of the tile is a level of the cells table
+        level = zoom + cells.bit_length() - 1
+        if (
+            cells & (cells - 1) == 0
+            and level <= MAX_CELL_LEVEL
+            and min_weed_confidence is None
+        ):
+            rows = self.read_cells(level, tile_x * cells, tile_y * cells, cells)
+        else:
+            rows = self.aggregate_points(
+                zoom, tile_x, tile_y, cells, min_weed_confidence
+            )
+
+        return {
+            "zoom": zoom,
+            "x": tile_x,
+            "y": tile_y,
+            "cells": cells,
+            "bounds": tile_bounds(zoom, tile_x, tile_y),
+            "analyses": sum(row["analyses"] for row in rows),
+            "items": [
+                {
+                    "row": row["row"],
+                    "col": row["col"],
+                    "analyses": row["analyses"],
+                    # share of the analyses of the cell with weed
+                    "weed_density": round(row["with_weed"] / row["analyses"], 4),
+                    "average_weed_confidence": round(
+                        row["weed_confidence_sum"] / row["analyses"], 4
+                    ),
+                    "max_weed_confidence": row["weed_confidence_max"],
+                    "average_weed_coverage": (
+                        round(row["weed_coverage_sum"] / row["weed_coverage_count"], 2)
+                        if row["weed_coverage_count"] > 0
+                        else None
+                    ),
+                    "weed_detections": row["weed_detections"],
+                }
+                for row in rows
+            ],
+        }
+
+    def read_cells(
+        self, level: int, first_x: int, first_y: int, cells: int
+    ) -> list[sqlite3.Row]:
+        """
+        Reads the aggregated cells of a tile, a range of the primary key.
+        """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT cell_x - ? AS col, cell_y - ? AS row, analyses, with_weed,"
+                " weed_confidence_sum, weed_confidence_max, weed_coverage_sum,"
+                " weed_coverage_count, weed_detections FROM geo_cells"
+                " WHERE level = ? AND cell_y >= ? AND cell_y < ?"
+                " AND cell_x >= ? AND cell_x < ? ORDER BY row, col",
+                (
+                    first_x,
+                    first_y,
+                    level,
+                    first_y,
+                    first_y + cells,
+                    first_x,
+                    first_x + cells,
+                ),
+            ).fetchall()
+
+    def aggregate_points(
+        self,
+        zoom: int,
+        tile_x: int,
+        tile_y: int,
+        cells: int,
+        min_weed_confidence: float = None,
+    ) -> list[sqlite3.Row]:
+        """
+        Aggregates the points of a tile from the rtree, for the grids that
+        are not in the cells table.
+        """
+        size = 2**zoom
+        min_x = tile_x / size
+        min_y = tile_y / size
+        max_x = (tile_x + 1) / size
+        max_y = (tile_y + 1) / size
+        scale = size * cells
+        parameters = [min_x, scale, cells - 1, min_y, scale, cells - 1]
+        parameters += [max_x, min_x, max_y, min_y, min_x, max_x, min_y, max_y]
+        conditions = ""
+        if min_weed_confidence is not None:
+            conditions = " AND a.weed_confidence >= ?"
+            parameters.append(min_weed_confidence)
+
+        with self.lock:
+            return self.connection.execute(
+                "SELECT MIN(CAST((a.x - ?) * ? AS INTEGER), ?) AS col,"
+                " MIN(CAST((a.y - ?) * ? AS INTEGER), ?) AS row, COUNT(*) AS analyses,"
+                " SUM(a.weed_confidence > 0) AS with_weed,"
+                " SUM(a.weed_confidence) AS weed_confidence_sum,"
+                " MAX(a.weed_confidence) AS weed_confidence_max,"
+                " TOTAL(a.weed_coverage) AS weed_coverage_sum,"
+                " COUNT(a.weed_coverage) AS weed_coverage_count,"
+                " CAST(TOTAL(a.weed_detections) AS INTEGER) AS weed_detections"
+                f" FROM {POINTS}"
+                " WHERE p.min_x <= ? AND p.max_x >= ? AND p.min_y <= ? AND p.max_y >= ?"
+                f" AND a.x >= ? AND a.x < ? AND a.y >= ? AND a.y < ?{conditions}"
+                " GROUP BY row, col ORDER BY row, col",
+                parameters,
+            ).fetchall()
+
+    def count(self) -> int:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM geo_analyses"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def row_to_item(row: sqlite3.Row) -> dict:
+    """
+    Returns the analysis of a row of ITEM_SELECT.
+    """
+    return dict(zip(ITEM_KEYS, row))
@@ -0,0 +1,167 @@
+#####################################################################
+# Read-only buffer with the image of an analysis.
+# The uploaded image is spooled by the web framework, first in memory,
+# then in a temporary file once it is larger than 1 MB. The buffer maps
+# that file instead of reading it into a bytes object, and the analysis
+# stages (detection backend, tiling, rendering) read from the buffer
+# through their own reader, so no stage needs a full copy of the image.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import io
+import mmap
+import os
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO
+
+
+def held_in_memory(file: BinaryIO) -> bool:
+    """
+    True for a file without a file descriptor: a BytesIO, or a spooled file
+    that wasn't rolled over to disk yet. SpooledTemporaryFile has no public
+    check, it keeps its buffer in _file (Python 3.8 to 3.13); without it the
+    spooled file is rolled over and mapped, which still works.
+    """
+    if isinstance(file, SpooledTemporaryFile):
+        file = getattr(file, "_file", None)
+    return isinstance(file, io.BytesIO)
+
+
+class ImageBuffer:
+    """
+    The image bytes as a memoryview over bytes or a memory mapped file.
+
+    usage:
+        with ImageBuffer.from_file(upload.file) as image_buffer:
+            image = Image.open(image_buffer.open())
+    """
+
+    def __init__(self, data: any, mapping: mmap.mmap = None) -> None:
+        self.mapping = mapping
+        self.view = byte_view(data)
+
+    @staticmethod
+    def from_bytes(data: bytes) -> "ImageBuffer":
+        return ImageBuffer(data)
+
+    @staticmethod
+    def from_file(file: BinaryIO) -> "ImageBuffer":
+        """
+        Maps the file, e.g. the spooled file of an upload.
+        """
+        # fileno() would write a spooled file that is still in memory to disk,
+        # read it instead, BytesIO returns its own bytes when all of it is read
+        if held_in_memory(file):
+            file.seek(0)
+            return ImageBuffer(file.read())
+
+        file.flush()
+        size = os.fstat(file.fileno()).st_size
+        if size == 0:
+            # an empty file can't be mapped
+            return ImageBuffer(b"")
+        mapping = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ)
+        return ImageBuffer(mapping, mapping)
+
+    def __len__(self) -> int:
+        return self.view.nbytes
+
+    def open(self) -> BinaryIO:
+        """
+        Returns a new reader positioned at the start of the image.
+        Each caller gets its own reader, they can be used from several threads.
+        """
+        return ImageBufferReader(self.view)
+
+    def close(self) -> None:
+        self.view.release()
+        if self.mapping is not None:
+            try:
+                self.mapping.close()
+            except BufferError:
+                # a reader still holds a slice, the mapping is closed when
+                # the slice is collected
+                pass
+            self.mapping = None
+
+    def __enter__(self) -> "ImageBuffer":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ImageBufferReader(io.RawIOBase):
+    """
+    File object reading from a memoryview, for PIL and the http clients.
+    read() only copies the requested chunk.
+    """
+
+    def __init__(self, view: memoryview) -> None:
+        super().__init__()
+        self.view = view
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        start = self.position
+        end = len(self.view) if size is None or size < 0 else start + size
+        self.position = min(max(end, start), len(self.view))
+        return self.view[start : self.position].tobytes()
+
+    def readinto(self, buffer) -> int:
+        chunk = self.view[self.position : self.position + len(buffer)]
+        size = len(chunk)
+        buffer[:size] = chunk
+        self.position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self.position = offset
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+
+def open_image_data(image_data: any) -> BinaryIO:
+    """
+    Returns a file object over the image, given as bytes, a memoryview
+    (e.g. of shared memory) or an ImageBuffer, without copying it.
+    """
+    if isinstance(image_data, ImageBuffer):
+        return image_data.open()
+    if isinstance(image_data, bytes):
+        # BytesIO shares the bytes object until something is written
+        return io.BytesIO(image_data)
+    return ImageBufferReader(byte_view(image_data))
+
+
+def image_data_view(image_data: any) -> memoryview:
+    """
+    Returns a memoryview over the image, without copying it.
+    """
+    if isinstance(image_data, ImageBuffer):
+        return image_data.view
+    return byte_view(image_data)
+
+
+def byte_view(data: any) -> memoryview:
+    """
+    Returns a flat memoryview of bytes over the data. An existing byte view
+    is returned as is, so releasing it (e.g. shared memory) isn't blocked.
+    """
+    view = data if isinstance(data, memoryview) else memoryview(data)
+    if view.format != "B" or view.ndim != 1:
+        view = view.cast("B")
+    return view
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+from logging import Logger
+
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.storage_backend import StorageBackend
+
+
+class LocalFileStorageHelper(StorageBackend):
+    """
+    Stores the prediction files in a folder on the local file system,
+    for deployments next to the camera rig without access to azure storage.
+
+      - prediction files: LocalPredictionsFolder (default: predictions)
+      - test images: LocalTestDataFolder (default: test-images)
+
+    Files are written to a temporary file first and renamed into place, so
+    a reader never sees a partially written file.
+    """
+
+    def __init__(self, config: Config, logger: Logger):
+        super().__init__(config, logger)
+        self.predictions_folder = os.path.abspath(
+            self.config.get(constants.CONFIG_LOCAL_PREDICTIONS_FOLDER)
+            or constants.DEFAULT_LOCAL_PREDICTIONS_FOLDER
+        )
+        self.test_data_folder = os.path.abspath(
+            self.config.get(constants.CONFIG_LOCAL_TEST_DATA_FOLDER)
+            or constants.DEFAULT_LOCAL_TEST_DATA_FOLDER
+        )
+        os.makedirs(self.predictions_folder, exist_ok=True)
+
+    def resolve_path(self, folder: str, filename: str) -> str:
+        """
+        Returns the path of the file inside the folder.
+        Names that point outside the folder (e.g. ../app.py) are rejected.
+        """
+        path = os.path.normpath(os.path.join(folder, filename))
+        if not path.startswith(folder + os.sep):
+            raise ValueError(f"invalid file name: {filename}")
+        return path
+
+    def write_file(self, folder: str, filename: str, local_path: str = None):
+        path = self.resolve_path(folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        temp_file, temp_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), suffix=".tmp"
+        )
+        try:
+            with os.fdopen(temp_file, "wb") as target:
+                with open(local_path or filename, "rb") as source:
+                    shutil.copyfileobj(source, target)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        self.logger.debug(f"file saved to local storage: {path}")
+        return path
+
+    def read_file(self, folder: str, filename: str) -> bytes:
+        with open(self.resolve_path(folder, filename), "rb") as f:
+            return f.read()
+
+    # local file access has no network timeouts, the timeout is not used
+
+    def write_prediction_details(
+        self, filename: str, local_path: str = None, timeout: float = None
+    ):
+        return self.write_file(self.predictions_folder, filename, local_path)
+
+    def write_prediction_image(
+        self, filename: str, local_path: str = None, timeout: float = None
+    ):
+        return self.write_file(self.predictions_folder, filename, local_path)
+
+    def read_test_data_image_with_url_anonymous(
+        self, filename: str, timeout: float = None
+    ) -> bytes:
+        return self.read_file(self.test_data_folder, filename)
+
+    def read_prediction_image(self, filename: str) -> bytes:
+        return self.read_file(self.predictions_folder, filename)
+
+    def read_prediction_details(self, filename: str) -> str:
+        return self.read_file(self.predictions_folder, filename).decode("utf-8")
+
+    def read_prediction_details_bytes(self, filename: str) -> bytes:
+        return self.read_file(self.predictions_folder, filename)
+
+    def list_prediction_details(self) -> list[str]:
+        filenames = []
+        for folder, _, files in os.walk(self.predictions_folder):
+            for name in files:
+                if name.lower().endswith(".json"):
+                    path = os.path.join(folder, name)
+                    filenames.append(os.path.relpath(path, self.predictions_folder))
+        return sorted(filenames)
+
+    def list_test_data_images(
+        self, prefix: str = None, page_token: str = None, page_size: int = 1000
+    ):
+        """
+        Lists the images in the test data folder, page by page.
+        The page token is the last name of the page before.
+        """
+        names = []
+        for folder, _, files in os.walk(self.test_data_folder):
+            for name in files:
+                if name.lower().endswith(constants.IMAGE_EXTENSIONS):
+                    path = os.path.join(folder, name)
+                    name = os.path.relpath(path, self.test_data_folder)
+                    names.append(name.replace(os.sep, "/"))
+        names = sorted(
+            name
+            for name in names
+            if name.startswith(prefix or "")
+            and (page_token is None or name > page_token)
+        )
+
+        for start in range(0, len(names), page_size):
+            page = names[start : start + page_size]
+            yield page_token, page
+            page_token = page[-1]
+
+    def prediction_file_path(self, filename: str) -> str:
+        path = self.resolve_path(self.predictions_folder, filename)
+        if os.path.isfile(path):
+            return path
+        return None
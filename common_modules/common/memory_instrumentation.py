@@ -0,0 +1,157 @@
+#####################################################################
+# Memory instrumentation of the analysis requests.
+# - RSS of the process before and after each request (from /proc on linux)
+# - peak python allocation during the request, when tracemalloc is enabled
+#   with MemoryTracingEnabled (it slows down every allocation, keep it off
+#   unless you are looking for a leak)
+#
+# The peak is process wide, with concurrent requests it includes the
+# allocations of the other requests.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from logging import Logger
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+
+MB = 1024 * 1024
+
+
+def read_rss_bytes() -> int:
+    """
+    Returns the resident set size of the process in bytes,
+    None where /proc is not available (e.g. windows, mac).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class MemoryUsage:
+    __slots__ = ("name", "rss_before", "rss_after", "peak_allocated", "duration")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.rss_before = None
+        self.rss_after = None
+        self.peak_allocated = None
+        self.duration = 0.0
+
+    @property
+    def rss_delta(self) -> int:
+        if self.rss_before is None or self.rss_after is None:
+            return None
+        return self.rss_after - self.rss_before
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "rss_before": self.rss_before,
+            "rss_after": self.rss_after,
+            "rss_delta": self.rss_delta,
+            "peak_allocated": self.peak_allocated,
+            "duration": round(self.duration, 4),
+        }
+
+
+class MemoryTracker:
+    """
+    Measures the memory used by the requests and keeps simple metrics.
+    """
+
+    def __init__(self, config: Config, logger: Logger) -> None:
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.tracing = config.get_bool(constants.CONFIG_MEMORY_TRACING_ENABLED)
+        if self.tracing and not tracemalloc.is_tracing():
+            tracemalloc.start(
+                config.get_int(
+                    constants.CONFIG_MEMORY_TRACING_FRAMES,
+                    constants.DEFAULT_MEMORY_TRACING_FRAMES,
+                )
+            )
+
+        self.requests = 0
+        self.total_rss_delta = 0
+        self.max_peak_allocated = 0
+        self.last_usage = None
+
+    @contextmanager
+    def measure(self, name: str):
+        """
+        Measures the memory used by the code in the with block.
+        """
+        usage = MemoryUsage(name)
+        usage.rss_before = read_rss_bytes()
+        if self.tracing:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield usage
+        finally:
+            usage.duration = time.perf_counter() - start
+            usage.rss_after = read_rss_bytes()
+            if self.tracing:
+                usage.peak_allocated = tracemalloc.get_traced_memory()[1]
+            self.record(usage)
+
+    def record(self, usage: MemoryUsage) -> None:
+        with self.lock:
+            self.requests += 1
+            self.total_rss_delta += usage.rss_delta or 0
+            self.max_peak_allocated = max(
+                self.max_peak_allocated, usage.peak_allocated or 0
+            )
+            self.last_usage = usage
+
+        self.logger.debug(
+            f"memory - {usage.name}: rss {self.format_mb(usage.rss_after)} MB"
+            f" (delta {self.format_mb(usage.rss_delta)} MB),"
+            f" peak allocated {self.format_mb(usage.peak_allocated)} MB"
+        )
+
+    @staticmethod
+    def format_mb(value: int) -> str:
+        if value is None:
+            return "n/a"
+        return f"{value / MB:.1f}"
+
+    def top_allocations(self, limit: int = 20) -> list[dict]:
+        """
+        Returns the source lines holding the most allocated memory.
+        Empty if tracemalloc is not enabled.
+        """
+        if not tracemalloc.is_tracing():
+            return []
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        )
+        return [
+            {
+                "location": str(statistic.traceback[0]),
+                "size": statistic.size,
+                "count": statistic.count,
+            }
+            for statistic in snapshot.statistics("lineno")[:limit]
+        ]
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "rss": read_rss_bytes(),
+                "tracing": self.tracing,
+                "requests": self.requests,
+                "total_rss_delta": self.total_rss_delta,
+                "max_peak_allocated": self.max_peak_allocated,
+                "last_request": self.last_usage.to_dict() if self.last_usage else None,
+            }
@@ -1,11 +1,63 @@
+from common_modules.common.serialization import dumps_compact_details, dumps_json_bytes
+
+
+class PredictionBoundingBox:
+    """
+    Bounding box of a detected object, given as a fraction of the image size.
+    Mirrors the BoundingBox model returned by the Custom Vision SDK.
+    """
+
+    __slots__ = ("left", "top", "width", "height")
+
+    def __init__(self, left: float, top: float, width: float, height: float) -> None:
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+
+class DetectionPrediction:
+    """
+    A single detected object as returned by a detection backend.
+    Mirrors the Prediction model returned by the Custom Vision SDK, so
+    predictions from a local model can be used anywhere the sdk ones are.
+    """
+
+    __slots__ = ("tag_name", "probability", "bounding_box")
+
+    def __init__(
+        self, tag_name: str, probability: float, bounding_box: PredictionBoundingBox
+    ) -> None:
+        self.tag_name = tag_name
+        self.probability = probability
+        self.bounding_box = bounding_box
+
+
 class GrassPredictionData:
+    __slots__ = ("name", "confidence_level", "bounding_box")
+
     def __init__(self, name: str, confidence_level: int, bounding_box: any) -> None:
         self.name = name
         self.confidence_level = confidence_level
         self.bounding_box = bounding_box
 
+    def to_dict(self):
+        # the bounding box is given as a fraction of the image size
+        return {
+            "predictedLabel": self.name,
+            "confidenceLevel": self.confidence_level,
+            "boundingBox": {
+                "left": self.bounding_box.left,
+                "top": self.bounding_box.top,
+                "width": self.bounding_box.width,
+                "height": self.bounding_box.height,
+            },
+        }
+
 
 class MarkedDetectedArea:
+    __slots__ = ("name", "confidence_level", "marked_color", "bounding_box")
+
     def __init__(
         self, name: str, confidence_level: int, marked_color: str, bounding_box: any
     ) -> None:
@@ -24,12 +76,41 @@ class MarkedDetectedArea:
 
 
 class AnnotatedImageData:
-    def __init__(self, image: any, marked_areas: list[MarkedDetectedArea]) -> None:
+    __slots__ = ("image", "marked_areas", "derivative_files")
+
+    def __init__(
+        self,
+        image: any,
+        marked_areas: list[MarkedDetectedArea],
+        derivative_files: list[str] = None,
+    ) -> None:
         self.image = image
         self.marked_areas = marked_areas
+        self.derivative_files = derivative_files or []
+
+    def release(self) -> None:
+        """
+        Closes the annotated image, it is no longer needed once the
+        files have been saved.
+        """
+        if self.image is not None:
+            self.image.close()
+            self.image = None
 
 
 class GrassAnalysisDetails:
+    __slots__ = (
+        "predictions_image_url",
+        "predictions_info_url",
+        "timestamp",
+        "top_n",
+        "summary",
+        "detected_details",
+        "weed_coverage",
+        "weed_detections",
+        "prescreen",
+        "location",
+    )
 
     def __init__(
         self,
@@ -39,6 +120,10 @@ class GrassAnalysisDetails:
         top_n: int,
         summary: str,
         detected_details: list[GrassPredictionData],
+        weed_coverage: float = None,
+        weed_detections: int = None,
+        prescreen: dict = None,
+        location: dict = None,
     ) -> None:
         self.predictions_image_url = predictions_image_url
         self.predictions_info_url = predictions_info_url
@@ -46,6 +131,13 @@ class GrassAnalysisDetails:
         self.top_n = top_n
         self.summary = summary
         self.detected_details = detected_details
+        # percentage of the image covered by weed, from all the weed boxes
+        self.weed_coverage = weed_coverage
+        self.weed_detections = weed_detections
+        # measures of the pre-screen, with the reasons a flagged image is unusable
+        self.prescreen = prescreen
+        # gps position and capture time from the exif metadata of the image
+        self.location = location
 
     def to_dict(self):
         return {
@@ -54,5 +146,85 @@ class GrassAnalysisDetails:
             "timestamp": self.timestamp,
             "top_n": self.top_n,
             "summary": self.summary,
+            "weed_coverage": self.weed_coverage,
+            "weed_detections": self.weed_detections,
+            "prescreen": self.prescreen,
+            "location": self.location,
             "detected_details": [d.to_dict() for d in self.detected_details],
         }
+
+    def to_json_bytes(self) -> bytes:
+        """
+        Serializes the analysis details directly to json bytes,
+        ready to be returned by the api or written to storage.
+        """
+        return dumps_json_bytes(self.to_dict())
+
+    def to_compact_bytes(self) -> bytes:
+        """
+        Serializes the analysis details to the compact msgpack format of the
+        edge clients, see docs/compact-response-format.md
+        """
+        return dumps_compact_details(self.to_dict())
+
+
+class VideoFrameDetections:
+    """
+    Detections of a single analyzed video frame.
+    """
+
+    __slots__ = ("timestamp", "detections")
+
+    def __init__(self, timestamp: float, detections: list[GrassPredictionData]) -> None:
+        self.timestamp = timestamp
+        self.detections = detections
+
+    def to_dict(self):
+        return {
+            "timestamp": round(self.timestamp, 3),
+            "detections": [d.to_dict() for d in self.detections],
+        }
+
+
+class VideoAnalysisDetails:
+    """
+    Result of a video analysis. Only the analyzed frames are listed, a
+    skipped frame is nearly identical to the analyzed frame before it.
+    """
+
+    __slots__ = (
+        "timestamp",
+        "duration",
+        "sampled_frames",
+        "skipped_frames",
+        "analyzed_frames",
+        "frames",
+    )
+
+    def __init__(
+        self,
+        timestamp: str,
+        duration: float,
+        sampled_frames: int,
+        skipped_frames: int,
+        frames: list[VideoFrameDetections],
+    ) -> None:
+        self.timestamp = timestamp
+        self.duration = duration
+        self.sampled_frames = sampled_frames
+        self.skipped_frames = skipped_frames
+        self.analyzed_frames = len(frames)
+        self.frames = frames
+
+    def to_dict(self):
+        return {
+            "timestamp": self.timestamp,
+            "duration": round(self.duration, 3),
+            "sampled_frames": self.sampled_frames,
+            "skipped_frames": self.skipped_frames,
+            "analyzed_frames": self.analyzed_frames,
+            "frames": [f.to_dict() for f in self.frames],
+        }
+
+    def to_json_bytes(self) -> bytes:
+        return dumps_json_bytes(self.to_dict())
@@ -0,0 +1,240 @@
+#####################################################################
+# Local history of the prediction details.
+# Every analysis is recorded in a sqlite database next to the app, one
+# row per analysis and one row per detected object, indexed by label,
+# timestamp and confidence. Questions like "how many weed detections
+# above 0.7 last week" are answered from the indexes instead of
+# downloading and parsing every stored json file.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    info_file TEXT,
+    image_file TEXT,
+    summary TEXT,
+    top_n INTEGER
+);
+CREATE TABLE IF NOT EXISTS detections (
+    id INTEGER PRIMARY KEY,
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id),
+    timestamp TEXT NOT NULL,
+    label TEXT NOT NULL,
+    confidence REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_timestamp ON analyses (timestamp);
+CREATE INDEX IF NOT EXISTS detections_label_timestamp_confidence
+    ON detections (label, timestamp, confidence);
+CREATE INDEX IF NOT EXISTS detections_timestamp ON detections (timestamp);
+CREATE INDEX IF NOT EXISTS detections_analysis ON detections (analysis_id);
+"""
+
+
+class PredictionHistory:
+    """
+    Records the prediction details and answers the history queries.
+
+    The details are recorded in the same form as they are stored as json
+    (GrassAnalysisDetails.to_dict()), so the stored files can be imported
+    with the same method. Timestamps are "YYYY-MM-DD HH:MM:SS" strings,
+    which sort in time order.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        # the connection is shared by the request threads, access goes through the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            if path != ":memory:":
+                # readers don't wait for writers
+                self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+
+    def record(self, details: dict, skip_existing: bool = False) -> bool:
+        """
+        Records the prediction details of one analysis.
+        With skip_existing, details with the same timestamp and file that were
+        already recorded are skipped (e.g. when importing the stored files again),
+        returns False if the analysis was skipped.
+        """
+        detected_details = details.get("detected_details") or []
+        with self.lock, self.connection:
+            if skip_existing:
+                existing = self.connection.execute(
+                    "SELECT 1 FROM analyses WHERE timestamp = ? AND info_file IS ?",
+                    (details["timestamp"], details.get("prediction_info_url")),
+                ).fetchone()
+                if existing is not None:
+                    return False
+
+            cursor = self.connection.execute(
+                "INSERT INTO analyses (timestamp, info_file, image_file, summary, top_n)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (
+                    details["timestamp"],
+                    details.get("prediction_info_url"),
+                    details.get("prediction_image_url"),
+                    details.get("summary"),
+                    details.get("top_n"),
+                ),
+            )
+            analysis_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO detections (analysis_id, timestamp, label, confidence)"
+                " VALUES (?, ?, ?, ?)",
+                [
+                    (
+                        analysis_id,
+                        details["timestamp"],
+                        detection["predictedLabel"],
+                        detection["confidenceLevel"],
+                    )
+                    for detection in detected_details
+                ],
+            )
+        return True
+
+    def detection_filter(
+        self, start: str, end: str, label: str, min_confidence: float
+    ) -> tuple[str, list]:
+        conditions = []
+        parameters = []
+        if label:
+            conditions.append("label = ?")
+            parameters.append(label)
+        if start:
+            conditions.append("timestamp >= ?")
+            parameters.append(start)
+        if end:
+            conditions.append("timestamp < ?")
+            parameters.append(end)
+        if min_confidence is not None:
+            conditions.append("confidence >= ?")
+            parameters.append(min_confidence)
+        return " AND ".join(conditions) or "1", parameters
+
+    def query_history(
+        self,
+        start: str = None,
+        end: str = None,
+        label: str = None,
+        min_confidence: float = None,
+        limit: int = 50,
+        before_id: int = None,
+    ) -> dict:
+        """
+        Returns a page of analyses, newest first, with their detections.
+        With a label or a minimum confidence only the analyses with a matching
+        detection are returned. The next page starts before next_cursor.
+        """
+        conditions = []
+        parameters = []
+        if start:
+            conditions.append("a.timestamp >= ?")
+            parameters.append(start)
+        if end:
+            conditions.append("a.timestamp < ?")
+            parameters.append(end)
+        if before_id is not None:
+            conditions.append("a.id < ?")
+            parameters.append(before_id)
+        if label or min_confidence is not None:
+            detection_conditions, detection_parameters = self.detection_filter(
+                None, None, label, min_confidence
+            )
+            conditions.append(
+                f"EXISTS (SELECT 1 FROM detections WHERE analysis_id = a.id AND {detection_conditions})"
+            )
+            parameters.extend(detection_parameters)
+
+        where = " AND ".join(conditions) or "1"
+        with self.lock:
+            analyses = self.connection.execute(
+                f"SELECT * FROM analyses a WHERE {where} ORDER BY a.id DESC LIMIT ?",
+                parameters + [limit],
+            ).fetchall()
+
+            ids = [row["id"] for row in analyses]
+            detections = {}
+            if ids:
+                placeholders = ",".join("?" * len(ids))
+                for row in self.connection.execute(
+                    f"SELECT analysis_id, label, confidence FROM detections"
+                    f" WHERE analysis_id IN ({placeholders}) ORDER BY id",
+                    ids,
+                ):
+                    detections.setdefault(row["analysis_id"], []).append(
+                        {
+                            "predictedLabel": row["label"],
+                            "confidenceLevel": row["confidence"],
+                        }
+                    )
+
+        items = [
+            {
+                "id": row["id"],
+                "timestamp": row["timestamp"],
+                "prediction_info_url": row["info_file"],
+                "prediction_image_url": row["image_file"],
+                "summary": row["summary"],
+                "top_n": row["top_n"],
+                "detected_details": detections.get(row["id"], []),
+            }
+            for row in analyses
+        ]
+        next_cursor = ids[-1] if len(ids) == limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    def query_aggregates(
+        self,
+        start: str = None,
+        end: str = None,
+        label: str = None,
+        min_confidence: float = None,
+        bins: int = 10,
+    ) -> dict:
+        """
+        Returns the number of detections, their average confidence and a
+        confidence histogram (bins equal width buckets between 0 and 1) per label.
+        """
+        where, parameters = self.detection_filter(start, end, label, min_confidence)
+        with self.lock:
+            totals = self.connection.execute(
+                f"SELECT label, COUNT(*) AS count, AVG(confidence) AS average,"
+                f" COUNT(DISTINCT analysis_id) AS analyses"
+                f" FROM detections WHERE {where} GROUP BY label ORDER BY label",
+                parameters,
+            ).fetchall()
+            buckets = self.connection.execute(
+                f"SELECT label, MIN(CAST(confidence * ? AS INTEGER), ? - 1) AS bucket,"
+                f" COUNT(*) AS count FROM detections WHERE {where}"
+                f" GROUP BY label, bucket",
+                [bins, bins] + parameters,
+            ).fetchall()
+
+        labels = {
+            row["label"]: {
+                "count": row["count"],
+                "analyses": row["analyses"],
+                "average_confidence": row["average"],
+                "histogram": [0] * bins,
+            }
+            for row in totals
+        }
+        for row in buckets:
+            labels[row["label"]]["histogram"][max(row["bucket"], 0)] += row["count"]
+
+        return {
+            "bins": [round(i / bins, 6) for i in range(bins + 1)],
+            "labels": labels,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,169 @@
+#####################################################################
+# On-demand profiling of the analysis requests.
+# When ProfilingEnabled is set, a request is profiled if it asks for it
+# with the X-Profile-Request header, or if it is picked by the sampling
+# rate. The header is only honoured together with the AdminAccessKey in
+# the X-Admin-Key header, a profiled request costs more than a normal one
+# and anybody could otherwise ask for it.
+# The profile is stored on the local disk under the request id:
+# - <id>.speedscope.json with pyinstrument (sampling profiler, low
+#   overhead), open it in https://www.speedscope.app
+# - <id>.pstats with cProfile when pyinstrument is not installed (every
+#   call is traced, the overhead is higher), open it with pstats/snakeviz
+#
+# With profiling disabled no profiler object is created at all.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import cProfile
+import hmac
+import os
+import random
+import re
+import uuid
+from contextlib import contextmanager
+from logging import Logger
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+
+# the sampling profiler is optional
+try:
+    from pyinstrument import Profiler
+    from pyinstrument.renderers import SpeedscopeRenderer
+except ImportError:
+    Profiler = None
+
+SPEEDSCOPE_EXTENSION = ".speedscope.json"
+PSTATS_EXTENSION = ".pstats"
+
+PROFILE_NAME_PATTERN = re.compile(r"^[0-9a-f]{32}(\.speedscope\.json|\.pstats)$")
+
+
+def has_admin_key(headers, admin_key: str) -> bool:
+    """
+    True if the X-Admin-Key header holds the admin key. Always False without
+    a configured admin key.
+    """
+    provided_key = headers.get(constants.ADMIN_KEY_HEADER) or ""
+    return bool(admin_key) and hmac.compare_digest(
+        provided_key.encode(), admin_key.encode()
+    )
+
+
+class RequestProfiler:
+    def __init__(
+        self,
+        logger: Logger,
+        folder: str,
+        sample_rate: float = 0.0,
+        max_profiles: int = constants.DEFAULT_PROFILING_MAX_PROFILES,
+        interval: float = constants.DEFAULT_PROFILING_INTERVAL_SECONDS,
+        admin_key: str = None,
+    ) -> None:
+        self.logger = logger
+        self.folder = os.path.abspath(folder)
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+        self.interval = interval
+        self.admin_key = admin_key
+        os.makedirs(self.folder, exist_ok=True)
+
+    @staticmethod
+    def from_config(config: Config, logger: Logger) -> "RequestProfiler":
+        """
+        Creates the profiler, None if profiling is not enabled.
+        """
+        if not config.get_bool(constants.CONFIG_PROFILING_ENABLED):
+            return None
+        return RequestProfiler(
+            logger,
+            config.get(constants.CONFIG_PROFILES_FOLDER)
+            or constants.DEFAULT_PROFILES_FOLDER,
+            config.get_float(constants.CONFIG_PROFILING_SAMPLE_RATE),
+            config.get_int(
+                constants.CONFIG_PROFILING_MAX_PROFILES,
+                constants.DEFAULT_PROFILING_MAX_PROFILES,
+            ),
+            config.get_float(
+                constants.CONFIG_PROFILING_INTERVAL_SECONDS,
+                constants.DEFAULT_PROFILING_INTERVAL_SECONDS,
+            ),
+            config.get(constants.CONFIG_ADMIN_ACCESS_KEY),
+        )
+
+    def should_profile(self, headers) -> bool:
+        """
+        True if the request asked to be profiled, or was picked by the sampling rate.
+        The header is ignored without the admin key.
+        """
+        requested = headers.get(constants.PROFILE_REQUEST_HEADER)
+        if requested is not None and has_admin_key(headers, self.admin_key):
+            return requested.lower() in ("1", "true", "yes")
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @staticmethod
+    def new_profile_id() -> str:
+        return uuid.uuid4().hex
+
+    @contextmanager
+    def profile(self, profile_id: str):
+        """
+        Profiles the with block and stores the profile under the id.
+        Only profiles the calling thread.
+        """
+        if Profiler is not None:
+            profiler = Profiler(interval=self.interval)
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = os.path.join(self.folder, profile_id + SPEEDSCOPE_EXTENSION)
+                with open(path, "w") as f:
+                    f.write(profiler.output(renderer=SpeedscopeRenderer()))
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                path = os.path.join(self.folder, profile_id + PSTATS_EXTENSION)
+                profiler.dump_stats(path)
+
+        self.logger.info(f"request profile saved: {path}")
+        self.remove_old_profiles()
+
+    def list_profiles(self) -> list[dict]:
+        """
+        Returns the stored profiles, newest first.
+        """
+        profiles = []
+        for entry in os.scandir(self.folder):
+            if PROFILE_NAME_PATTERN.match(entry.name):
+                stat = entry.stat()
+                profiles.append(
+                    {
+                        "name": entry.name,
+                        "size": stat.st_size,
+                        "created": stat.st_mtime,
+                    }
+                )
+        return sorted(profiles, key=lambda p: p["created"], reverse=True)
+
+    def profile_path(self, name: str) -> str:
+        """
+        Returns the path of the stored profile, None if there is no such profile.
+        """
+        if not PROFILE_NAME_PATTERN.match(name):
+            return None
+        path = os.path.join(self.folder, name)
+        return path if os.path.isfile(path) else None
+
+    def remove_old_profiles(self) -> None:
+        for profile in self.list_profiles()[self.max_profiles :]:
+            try:
+                os.remove(os.path.join(self.folder, profile["name"]))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,184 @@
+#####################################################################
+# Serialization helpers for the api responses and stored predictions.
+# Results are written straight to utf-8 json bytes, so they can be
+# returned or stored without going through an intermediate str/dict.
+#
+# The edge and mower clients can ask for the compact msgpack format
+# of the prediction details instead (Accept: application/msgpack), see
+# docs/compact-response-format.md
+#####################################################################
+import json
+import struct
+
+import numpy as np
+
+# orjson is optional, it is several times faster than the json module
+# and writes bytes directly
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# msgpack is optional, without it the responses are always json
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MEDIA_TYPE_JSON = "application/json"
+MEDIA_TYPE_MSGPACK = "application/msgpack"
+MSGPACK_MEDIA_TYPES = (MEDIA_TYPE_MSGPACK, "application/x-msgpack")
+
+COMPACT_SCHEMA_VERSION = 1
+# label ids of the compact format, other labels are sent as UNKNOWN_LABEL_ID
+COMPACT_LABEL_IDS = {"Grass": 0, "Weed": 1}
+UNKNOWN_LABEL_ID = 255
+# one detection: label id, padding, confidence (1/10000), box x0, y0, x1, y1
+# (pixels), little endian, 12 bytes so the uint16 fields stay aligned
+DETECTION_RECORD = struct.Struct("<BxHHHHH")
+DETECTION_RECORD_DTYPE = np.dtype(
+    [("label", "u1"), ("padding", "u1"), ("confidence", "<u2"), ("box", "<u2", (4,))]
+)
+CONFIDENCE_SCALE = 10000
+MAX_UINT16 = 0xFFFF
+
+
+def dumps_json_bytes(data: any) -> bytes:
+    """
+    Serializes dicts/lists/tuples of plain values to compact json bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+
+def parse_accept(accept: str) -> dict[str, float]:
+    """
+    Parses an Accept header into media type (lower case) -> quality (q value,
+    1 by default), e.g. image/webp,*/*;q=0.8 -> {"image/webp": 1.0, "*/*": 0.8}
+    """
+    qualities = {}
+    for media_range in (accept or "").split(","):
+        media_type, *parameters = media_range.strip().split(";")
+        media_type = media_type.strip().lower()
+        if not media_type:
+            continue
+        quality = 1.0
+        for parameter in parameters:
+            name, _, value = parameter.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[media_type] = max(qualities.get(media_type, 0.0), quality)
+    return qualities
+
+
+def accept_quality(qualities: dict[str, float], media_types: tuple) -> float:
+    """
+    Returns the highest quality of the media types in the parsed Accept header.
+    """
+    return max(qualities.get(media_type, 0.0) for media_type in media_types)
+
+
+def prefers_msgpack(accept: str) -> bool:
+    """
+    True if the Accept header prefers msgpack over json and msgpack is
+    installed. Json stays the default, also for */* and a missing header.
+    """
+    if msgpack is None or not accept:
+        return False
+
+    qualities = parse_accept(accept)
+    msgpack_quality = accept_quality(qualities, MSGPACK_MEDIA_TYPES)
+    json_quality = accept_quality(qualities, (MEDIA_TYPE_JSON, "application/*", "*/*"))
+    return msgpack_quality > 0 and msgpack_quality >= json_quality
+
+
+def pack_detections(detected_details: list[dict]) -> bytes:
+    """
+    Packs the detected areas (as in the json details) into fixed width records.
+    """
+    labels = []
+    rows = []
+    for detail in detected_details:
+        # boundingBox: [[x0, y0], [x1, y1]], missing in very old details
+        (x0, y0), (x1, y1) = detail.get("boundingBox") or ((0, 0), (0, 0))
+        labels.append(
+            COMPACT_LABEL_IDS.get(detail.get("predictedLabel"), UNKNOWN_LABEL_ID)
+        )
+        rows.append((detail.get("confidenceLevel") or 0, x0, y0, x1, y1))
+
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), 5)
+    values[:, 0] *= CONFIDENCE_SCALE
+    values = np.clip(np.rint(values), 0, MAX_UINT16)
+
+    records = np.zeros(len(rows), dtype=DETECTION_RECORD_DTYPE)
+    records["label"] = labels
+    records["confidence"] = values[:, 0]
+    records["box"] = values[:, 1:]
+    return records.tobytes()
+
+
+def dumps_compact_details(details: dict) -> bytes:
+    """
+    Serializes the prediction details (GrassAnalysisDetails.to_dict() or the
+    stored json) to the compact msgpack format, a positional array:
+    [version, timestamp, summary, weed coverage, weed detections,
+     prediction image url, prediction info url, detection records]
+    """
+    return msgpack.packb(
+        [
+            COMPACT_SCHEMA_VERSION,
+            details.get("timestamp"),
+            details.get("summary"),
+            details.get("weed_coverage"),
+            details.get("weed_detections"),
+            details.get("prediction_image_url"),
+            details.get("prediction_info_url"),
+            pack_detections(details.get("detected_details") or []),
+        ],
+        use_bin_type=True,
+    )
+
+
+def loads_compact_details(data: bytes) -> dict:
+    """
+    Reads the compact format back, the reference decoder for the clients.
+    The boxes are returned as (x0, y0, x1, y1) pixel tuples.
+    """
+    message = msgpack.unpackb(data, raw=False)
+    version = message[0]
+    if version != COMPACT_SCHEMA_VERSION:
+        raise ValueError(f"unsupported compact schema version: {version}")
+    # fields appended by a newer server are ignored
+    (
+        timestamp,
+        summary,
+        weed_coverage,
+        weed_detections,
+        image_url,
+        info_url,
+        records,
+    ) = message[1:8]
+
+    labels = {label_id: label for label, label_id in COMPACT_LABEL_IDS.items()}
+    detections = []
+    for label_id, confidence, *box in DETECTION_RECORD.iter_unpack(records):
+        detections.append(
+            {
+                "label": labels.get(label_id),
+                "confidence": confidence / CONFIDENCE_SCALE,
+                "box": tuple(box),
+            }
+        )
+    return {
+        "timestamp": timestamp,
+        "summary": summary,
+        "weed_coverage": weed_coverage,
+        "weed_detections": weed_detections,
+        "prediction_image_url": image_url,
+        "prediction_info_url": info_url,
+        "detections": detections,
+    }
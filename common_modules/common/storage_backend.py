@@ -0,0 +1,101 @@
+from logging import Logger
+
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+
+
+class StorageBackend:
+    """
+    Base class for the storage of the test images and prediction files.
+    These are the read/write methods used by the detector and the api.
+
+    Implementations:
+    - AzureBlobStorageHelper: azure blob storage (default)
+    - LocalFileStorageHelper: folders on the local file system, e.g. for
+      on-prem and edge deployments
+    """
+
+    def __init__(self, config: Config, logger: Logger):
+        self.config = config
+        self.logger = logger
+
+    def write_prediction_details(
+        self, filename: str, local_path: str = None, timeout: float = None
+    ):
+        """
+        Stores the local file under the given name with the prediction details.
+        local_path can be used to store the content of another local file.
+        timeout (seconds) limits how long the write may take, None for no limit.
+        """
+        raise NotImplementedError()
+
+    def write_prediction_image(
+        self, filename: str, local_path: str = None, timeout: float = None
+    ):
+        """
+        Stores the local file under the given name with the prediction images.
+        local_path can be used to store the content of another local file.
+        timeout (seconds) limits how long the write may take, None for no limit.
+        """
+        raise NotImplementedError()
+
+    def read_test_data_image_with_url_anonymous(
+        self, filename: str, timeout: float = None
+    ) -> bytes:
+        raise NotImplementedError()
+
+    def read_prediction_image(self, filename: str) -> bytes:
+        raise NotImplementedError()
+
+    def read_prediction_details(self, filename: str) -> str:
+        raise NotImplementedError()
+
+    def read_prediction_details_bytes(self, filename: str) -> bytes:
+        raise NotImplementedError()
+
+    def list_prediction_details(self) -> list[str]:
+        """
+        Returns the names of the stored prediction details (json) files,
+        e.g. to import them into the prediction history.
+        """
+        raise NotImplementedError()
+
+    def list_test_data_images(
+        self, prefix: str = None, page_token: str = None, page_size: int = 1000
+    ):
+        """
+        Lists the images in the test data container, ordered by name, one page
+        at a time. Yields (page_token, names) - the token lists the same page
+        again, e.g. to resume a bulk analysis, None for the first page.
+        """
+        raise NotImplementedError()
+
+    def prediction_file_path(self, filename: str) -> str:
+        """
+        Returns the local path of a stored prediction file, so it can be
+        served directly from disk. None if the storage is not local or the
+        file does not exist.
+        """
+        return None
+
+
+def create_storage_helper(config: Config, logger: Logger) -> StorageBackend:
+    """
+    Creates the storage backend selected in the configuration.
+    Azure blob storage is used when no backend is configured.
+    """
+    # imported here, the implementations import this module
+    from common_modules.common.azure_storage_utilities import AzureBlobStorageHelper
+    from common_modules.common.local_storage_utilities import LocalFileStorageHelper
+
+    backend = config.get(constants.CONFIG_STORAGE_BACKEND)
+    if backend is None or backend == "":
+        backend = constants.STORAGE_BACKEND_AZURE_BLOB
+
+    logger.debug(f"creating storage backend: {backend}")
+    if backend == constants.STORAGE_BACKEND_AZURE_BLOB:
+        return AzureBlobStorageHelper(config, logger)
+    elif backend == constants.STORAGE_BACKEND_LOCAL_FILE:
+        return LocalFileStorageHelper(config, logger)
+
+    raise ValueError(f"unsupported storage backend: {backend}")
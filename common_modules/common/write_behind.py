@@ -0,0 +1,205 @@
+#####################################################################
+# Write-behind upload of the prediction files.
+# Instead of waiting for the uploads to azure storage, the prediction
+# files are copied to a local spool folder and uploaded by a background
+# thread with retries. The spool folder is the queue: files left in it
+# (e.g. the app was restarted before the upload completed) are uploaded
+# again the next time the app starts.
+#
+# Several workers on the same machine (e.g. uvicorn --workers) can share
+# the spool folder: each copy goes to a temporary file named after the
+# process, and an uploaded file is only removed if it is still the file
+# that was uploaded, not a newer one renamed into place by another worker.
+# Every worker recovers the spooled files when it starts, a file spooled
+# by a running worker can then be uploaded twice (with the same content).
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from logging import Logger
+from urllib.parse import quote, unquote
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+
+SPOOL_TEMP_EXTENSION = ".tmp"
+# a temporary file older than this was left by an interrupted copy, a
+# younger one can be a copy in progress of another worker
+STALE_TEMP_SECONDS = 3600
+
+
+def file_identity(path: str) -> tuple:
+    """
+    Identifies the version of the file, a file renamed into place has
+    another inode.
+    """
+    stat = os.stat(path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class WriteBehindUploader:
+    """
+    Uploads the prediction files in the background.
+
+    Each file is spooled under its blob name, a newer file with the same
+    name replaces the pending one and only the latest version is uploaded.
+    """
+
+    def __init__(self, config: Config, logger: Logger, storage_helper) -> None:
+        self.logger = logger
+        self.storage_helper = storage_helper
+        self.spool_dir = (
+            config.get(constants.CONFIG_WRITE_BEHIND_SPOOL_DIR)
+            or constants.DEFAULT_WRITE_BEHIND_SPOOL_DIR
+        )
+        self.max_retries = config.get_int(
+            constants.CONFIG_WRITE_BEHIND_MAX_RETRIES,
+            constants.DEFAULT_WRITE_BEHIND_MAX_RETRIES,
+        )
+        self.retry_delay = config.get_float(
+            constants.CONFIG_WRITE_BEHIND_RETRY_DELAY_SECONDS,
+            constants.DEFAULT_WRITE_BEHIND_RETRY_DELAY_SECONDS,
+        )
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        # blob name -> version of the spooled file
+        self.pending = {}
+        self.version = 0
+
+        self.recover()
+        self.worker = threading.Thread(
+            target=self.run, name="write-behind-uploader", daemon=True
+        )
+        self.worker.start()
+
+    def spool_path(self, filename: str) -> str:
+        # the blob name is encoded, so names with folders map to a single file
+        return os.path.join(self.spool_dir, quote(filename, safe=""))
+
+    def recover(self) -> None:
+        """
+        Queues the files left in the spool folder by a previous run.
+        """
+        for spool_filename in sorted(os.listdir(self.spool_dir)):
+            path = os.path.join(self.spool_dir, spool_filename)
+            if spool_filename.endswith(SPOOL_TEMP_EXTENSION):
+                # the copy was interrupted, the file was never acknowledged
+                try:
+                    if time.time() - os.path.getmtime(path) > STALE_TEMP_SECONDS:
+                        os.remove(path)
+                except FileNotFoundError:
+                    # renamed into place by the worker copying it
+                    pass
+                continue
+            self.logger.info(f"write-behind - recovering spooled file: {path}")
+            self.track(unquote(spool_filename))
+
+    def track(self, filename: str, temp_path: str = None) -> None:
+        with self.lock:
+            # the rename happens under the lock, so a finishing upload of an
+            # older version can't remove the new file
+            if temp_path is not None:
+                os.replace(temp_path, self.spool_path(filename))
+            self.version += 1
+            self.pending[filename] = self.version
+            version = self.version
+        self.queue.put((filename, version))
+
+    def enqueue(self, filename: str) -> None:
+        """
+        Spools the local file and schedules its upload under the same name.
+        """
+        # copy then rename, so the spool never holds a partially written file
+        temp_file, temp_path = tempfile.mkstemp(
+            dir=self.spool_dir, prefix=f"{os.getpid()}-", suffix=SPOOL_TEMP_EXTENSION
+        )
+        os.close(temp_file)
+        shutil.copyfile(filename, temp_path)
+        self.track(filename, temp_path)
+        self.logger.debug(f"write-behind - queued {filename} for upload.")
+
+    def read_pending(self, filename: str) -> bytes:
+        """
+        Returns the content of the file if its upload is still pending,
+        None otherwise. The spool folder is checked directly, so files spooled
+        by other workers on the same machine are found too.
+        """
+        try:
+            with open(self.spool_path(filename), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def upload(self, filename: str, path: str) -> None:
+        if filename.lower().endswith(".json"):
+            self.storage_helper.write_prediction_details(filename, local_path=path)
+        else:
+            self.storage_helper.write_prediction_image(filename, local_path=path)
+
+    def run(self) -> None:
+        while True:
+            filename, version = self.queue.get()
+            try:
+                if filename is None:
+                    return
+                self.upload_with_retries(filename, version)
+            finally:
+                self.queue.task_done()
+
+    def upload_with_retries(self, filename: str, version: int) -> None:
+        with self.lock:
+            if self.pending.get(filename) != version:
+                # replaced by a newer file, which has its own entry in the queue
+                return
+
+        path = self.spool_path(filename)
+        try:
+            identity = file_identity(path)
+        except FileNotFoundError:
+            # uploaded and removed by another worker sharing the spool folder
+            return
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                self.upload(filename, path)
+                break
+            except FileNotFoundError:
+                # uploaded and removed by another worker sharing the spool folder
+                return
+            except Exception as e:
+                self.logger.warning(
+                    f"write-behind - upload of {filename} failed (attempt {attempt}/{self.max_retries}): {e}"
+                )
+                if attempt == self.max_retries:
+                    self.logger.error(
+                        f"write-behind - giving up on {filename}, it stays in the spool folder until the next restart."
+                    )
+                    return
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        with self.lock:
+            if self.pending.get(filename) == version:
+                del self.pending[filename]
+                try:
+                    # another worker may have spooled a newer file meanwhile
+                    if file_identity(path) == identity:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self.logger.debug(f"write-behind - {filename} uploaded.")
+
+    def wait_until_idle(self) -> None:
+        """
+        Blocks until all the queued uploads have been processed.
+        """
+        self.queue.join()
+
+    def close(self) -> None:
+        self.queue.put((None, None))
+        self.worker.join()
@@ -0,0 +1,178 @@
+#####################################################################
+# Asyncio client of the Custom Vision prediction REST API.
+# The msrest CustomVisionPredictionClient is synchronous, every call in
+# flight holds a thread. This client posts the image to
+#   {endpoint}/customvision/v3.0/Prediction/{projectId}/detect/iterations/{publishedName}/image
+# over a pool of keep-alive connections (httpx), so a single event loop
+# can keep hundreds of calls in flight.
+# The predictions have the same shape as the ones of the sync client
+# (tag_name, probability, bounding_box), see DetectionPrediction.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import asyncio
+
+# 2. import azure libraries and other third party libraries
+# httpx is optional, without it the async calls run the sync client in a thread
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.image_buffer import image_data_view
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+
+# seconds, connect, read, write and pool timeout of the http client. It
+# applies when the call has no deadline, e.g. the live feed.
+DEFAULT_HTTP_TIMEOUT = 30.0
+
+DETECT_IMAGE_PATH = (
+    "/customvision/v3.0/Prediction/{project_id}/detect/iterations/{published_name}/image"
+)
+
+
+class PredictionHttpError(Exception):
+    """
+    Raised when the prediction API answers with an error status.
+    """
+
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(f"prediction failed with status {status_code}: {message}")
+        self.status_code = status_code
+
+
+def parse_predictions(body: dict) -> list[DetectionPrediction]:
+    """
+    Converts the predictions of the json response (ImagePrediction).
+    """
+    predictions = []
+    for prediction in body.get("predictions") or []:
+        box = prediction.get("boundingBox") or {}
+        predictions.append(
+            DetectionPrediction(
+                tag_name=prediction["tagName"],
+                probability=prediction["probability"],
+                bounding_box=PredictionBoundingBox(
+                    left=box.get("left", 0.0),
+                    top=box.get("top", 0.0),
+                    width=box.get("width", 0.0),
+                    height=box.get("height", 0.0),
+                ),
+            )
+        )
+    return predictions
+
+
+def error_message(response) -> str:
+    """
+    Returns the message of an error response, {"code": ..., "message": ...}.
+    """
+    try:
+        body = response.json()
+        return f"{body.get('code')}: {body.get('message')}"
+    except ValueError:
+        return response.text[:200]
+
+
+class AsyncCustomVisionPredictionClient:
+    """
+    Calls the published iteration of one prediction resource.
+
+    The http client is created by the first call and bound to its event
+    loop, use the client from a single event loop (e.g. the api).
+
+    usage:
+        client = AsyncCustomVisionPredictionClient(endpoint, key)
+        predictions = await client.detect_image(project_id, published_name, image)
+        await client.aclose()
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        prediction_key: str,
+        max_connections: int = constants.DEFAULT_PREDICTION_MAX_CONNECTIONS,
+    ) -> None:
+        if httpx is None:
+            raise ImportError(
+                "httpx is required for the async prediction client, "
+                "install it with: pip install httpx"
+            )
+        self.endpoint = endpoint.rstrip("/")
+        self.prediction_key = prediction_key
+        self.max_connections = max_connections
+        self.client = None
+        self.loop = None
+
+    def get_client(self) -> "httpx.AsyncClient":
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.loop is not loop:
+            # the connections of another loop can't be reused
+            self.close_client_of_other_loop()
+            self.client = httpx.AsyncClient(
+                base_url=self.endpoint,
+                headers={"Prediction-Key": self.prediction_key},
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+                # each step of a call, the total time is limited in detect_image
+                timeout=DEFAULT_HTTP_TIMEOUT,
+            )
+            self.loop = loop
+        return self.client
+
+    def close_client_of_other_loop(self) -> None:
+        """
+        Closes the client bound to another event loop, on that loop if it is
+        still open. The sockets of a closed loop are released with the client.
+        """
+        client, loop = self.client, self.loop
+        self.client = None
+        if client is None or loop.is_closed():
+            return
+        asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+
+    async def detect_image(
+        self,
+        project_id: str,
+        published_name: str,
+        image_data: any,
+        timeout: float = None,
+    ) -> list[DetectionPrediction]:
+        """
+        Detects the objects in the image (bytes, a memoryview or an ImageBuffer).
+        timeout (seconds) limits the whole call, including the wait for a free
+        connection, raises TimeoutError. Without it each step of the call
+        (connect, send, wait for the answer) is limited to DEFAULT_HTTP_TIMEOUT.
+        Raises PredictionHttpError when the API answers with an error.
+        """
+        client = self.get_client()
+        if not isinstance(image_data, bytes):
+            # httpx sends bytes, a memoryview would be iterated as integers
+            image_data = bytes(image_data_view(image_data))
+
+        path = DETECT_IMAGE_PATH.format(
+            project_id=project_id, published_name=published_name
+        )
+        request = client.post(
+            path,
+            content=image_data,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        response = await asyncio.wait_for(request, timeout)
+
+        if response.status_code >= 400:
+            raise PredictionHttpError(response.status_code, error_message(response))
+        return parse_predictions(response.json())
+
+    async def aclose(self) -> None:
+        """
+        Closes the connections, called from the loop the client was used on.
+        """
+        if self.client is not None and self.loop is not asyncio.get_running_loop():
+            self.close_client_of_other_loop()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,310 @@
+#####################################################################
+# Detection backends used by the GrassWeedDetector.
+# A backend takes the raw image (bytes or an ImageBuffer) and returns the list of detected
+# objects (tag_name, probability, bounding_box) that
+# GrassWeedDetector.get_top_n_predictions() consumes.
+#
+#  - CustomVisionDetectionBackend: calls the published iteration in
+#    Azure Custom Vision (the original behaviour), detect_async() calls
+#    it with the asyncio client, without a thread per call
+#  - OnnxDetectionBackend: runs the iteration exported from Custom Vision
+#    as ONNX locally on the CPU with onnxruntime
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import asyncio
+from logging import Logger
+
+# 2. import azure libraries and other third party libraries
+import numpy as np
+from PIL import Image
+
+from azure.cognitiveservices.vision.customvision.prediction import (
+    CustomVisionPredictionClient,
+)
+from azure.cognitiveservices.vision.customvision.training.models import (
+    CustomVisionErrorException,
+)
+from msrest.authentication import ApiKeyCredentials
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.image_buffer import open_image_data
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+from common_modules.detection.async_prediction_client import (
+    AsyncCustomVisionPredictionClient,
+    PredictionHttpError,
+    httpx,
+)
+from common_modules.detection.prediction_routing import (
+    PredictionRouter,
+    PredictionTarget,
+    parse_prediction_targets,
+)
+
+
+class DetectionBackend:
+    """
+    Base class for all detection backends.
+    """
+
+    def __init__(self, config: Config, logger: Logger) -> None:
+        self.config = config
+        self.logger = logger
+
+    def detect(self, image_data: bytes, timeout: float = None) -> list:
+        """
+        Detects objects in the image.
+        Returns a list of predictions, each with tag_name, probability and
+        a bounding_box (left, top, width, height as a fraction of the image size).
+        timeout (seconds) limits remote calls, None for no limit.
+        """
+        raise NotImplementedError()
+
+    async def detect_async(self, image_data: bytes, timeout: float = None) -> list:
+        """
+        Same as detect(), awaitable from the event loop.
+        By default detect() runs in a thread.
+        """
+        return await asyncio.to_thread(self.detect, image_data, timeout)
+
+    async def aclose(self) -> None:
+        """
+        Closes the connections of the async calls, at shutdown.
+        """
+
+
+class CustomVisionDetectionBackend(DetectionBackend):
+    """
+    Sends the image to the published iteration in Azure Custom Vision.
+    With PredictionTargets, the iteration is published to several prediction
+    resources and each call goes to the fastest healthy one.
+    """
+
+    def __init__(self, config: Config, logger: Logger) -> None:
+        super().__init__(config, logger)
+        self.logger.debug(
+            "CustomVisionDetectionBackend - setting up credential for Azure vision api..."
+        )
+        targets = parse_prediction_targets(self.config)
+        max_connections = self.config.get_int(
+            constants.CONFIG_PREDICTION_MAX_CONNECTIONS,
+            constants.DEFAULT_PREDICTION_MAX_CONNECTIONS,
+        )
+        for target in targets:
+            # Authenticate a client
+            credentials = ApiKeyCredentials(in_headers={"Prediction-key": target.key})
+            target.client = CustomVisionPredictionClient(
+                endpoint=target.endpoint,
+                credentials=credentials,
+            )
+            if httpx is not None:
+                target.async_client = AsyncCustomVisionPredictionClient(
+                    target.endpoint, target.key, max_connections
+                )
+        self.router = PredictionRouter.from_config(self.config, self.logger, targets)
+
+    def detect_with_target(
+        self, target: PredictionTarget, image_data: bytes, timeout: float = None
+    ):
+        # the timeout is passed on to requests (connect and read timeout).
+        # msrest replaces its default timeout with the operation keyword, even
+        # with None (no limit at all), so it is only passed when there is one
+        timeouts = {}
+        if timeout is not None:
+            timeouts = {"timeout": timeout}
+        # the image is read from a new reader for each attempt, requests reads
+        # it straight into the body of the form instead of copying it first
+        return target.client.detect_image(
+            target.project_id,
+            target.deployed_name,
+            open_image_data(image_data),
+            **timeouts,
+        )
+
+    def detect(self, image_data: bytes, timeout: float = None) -> list:
+        try:
+            ai_vision_response = self.router.call(
+                lambda target, remaining: self.detect_with_target(
+                    target, image_data, remaining
+                ),
+                timeout,
+            )
+        except CustomVisionErrorException as ex:
+            self.logger.error(ex)
+            raise
+
+        self.logger.debug(
+            "CustomVisionDetectionBackend - analysis from vision api complete."
+        )
+        return ai_vision_response.predictions
+
+    async def detect_async(self, image_data: bytes, timeout: float = None) -> list:
+        if httpx is None:
+            return await super().detect_async(image_data, timeout)
+
+        try:
+            predictions = await self.router.call_async(
+                lambda target, remaining: target.async_client.detect_image(
+                    target.project_id, target.deployed_name, image_data, remaining
+                ),
+                timeout,
+            )
+        except PredictionHttpError as ex:
+            self.logger.error(ex)
+            raise
+
+        self.logger.debug(
+            "CustomVisionDetectionBackend - async analysis from vision api complete."
+        )
+        return predictions
+
+    async def aclose(self) -> None:
+        for target in self.router.targets:
+            if target.async_client is not None:
+                await target.async_client.aclose()
+
+
+class OnnxDetectionBackend(DetectionBackend):
+    """
+    Runs the Custom Vision ONNX export locally with onnxruntime on the CPU.
+
+    Supports the object detection export of the compact [S1] domains, i.e.
+    a model with a single NCHW image input and the three post-processed outputs:
+      - detected_boxes:   [1, N, 4] - (x1, y1, x2, y2) as a fraction of the image size
+      - detected_classes: [1, N]    - index into the labels file
+      - detected_scores:  [1, N]    - probability
+    """
+
+    def __init__(self, config: Config, logger: Logger) -> None:
+        super().__init__(config, logger)
+
+        # onnxruntime is only needed when the local backend is selected
+        try:
+            import onnxruntime
+        except ImportError as ex:
+            raise ImportError(
+                "onnxruntime is required for the Onnx detection backend, "
+                "install it with: pip install onnxruntime"
+            ) from ex
+
+        model_path = self.config.get(constants.CONFIG_ONNX_MODEL_PATH)
+        labels_path = self.config.get(constants.CONFIG_ONNX_LABELS_PATH)
+        self.logger.debug(f"OnnxDetectionBackend - loading model: {model_path}")
+
+        with open(labels_path, "r") as f:
+            self.labels = [line.strip() for line in f if line.strip()]
+
+        self.probability_threshold = self.config.get_float(
+            constants.CONFIG_ONNX_PROBABILITY_THRESHOLD,
+            constants.DEFAULT_ONNX_PROBABILITY_THRESHOLD,
+        )
+
+        session_options = onnxruntime.SessionOptions()
+        intra_op_threads = self.config.get_int(constants.CONFIG_ONNX_INTRA_OP_THREADS)
+        if intra_op_threads > 0:
+            session_options.intra_op_num_threads = intra_op_threads
+
+        self.session = onnxruntime.InferenceSession(
+            model_path,
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"],
+        )
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # input shape is [N, C, H, W]
+        self.input_height = int(model_input.shape[2])
+        self.input_width = int(model_input.shape[3])
+        self.input_type = (
+            np.float16 if model_input.type == "tensor(float16)" else np.float32
+        )
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+        # the export describes the expected pixel format in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.is_bgr = metadata.get("Image.BitmapPixelFormat") == "Bgr8"
+        self.is_range255 = (
+            metadata.get("Image.NominalPixelRange") == "NominalRange_0_255"
+        )
+
+    def preprocess(self, image_data: bytes) -> np.ndarray:
+        """
+        Decodes the image and converts it into the model input tensor.
+        """
+        image = Image.open(open_image_data(image_data))
+        # let the jpeg decoder scale down while decoding, the model input is small
+        image.draft("RGB", (self.input_width, self.input_height))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image = image.resize((self.input_width, self.input_height))
+
+        # (H, W, C) -> (1, C, H, W)
+        input_array = np.asarray(image, dtype=np.float32).transpose((2, 0, 1))
+        input_array = input_array[np.newaxis, :, :, :]
+        if self.is_bgr:
+            input_array = input_array[:, (2, 1, 0), :, :]
+        if not self.is_range255:
+            input_array = input_array / 255.0
+        return np.ascontiguousarray(input_array, dtype=self.input_type)
+
+    def decode(self, outputs: dict) -> list[DetectionPrediction]:
+        """
+        Converts the model outputs into predictions in the Custom Vision shape.
+        """
+        boxes = np.asarray(outputs["detected_boxes"][0], dtype=np.float32)
+        classes = np.asarray(outputs["detected_classes"][0], dtype=np.int64)
+        scores = np.asarray(outputs["detected_scores"][0], dtype=np.float32)
+
+        keep = scores > self.probability_threshold
+        boxes = np.clip(boxes[keep], 0.0, 1.0)
+        classes = classes[keep]
+        scores = scores[keep]
+
+        # (x1, y1, x2, y2) -> (left, top, width, height)
+        widths = boxes[:, 2] - boxes[:, 0]
+        heights = boxes[:, 3] - boxes[:, 1]
+
+        predictions = []
+        for i in range(len(scores)):
+            predictions.append(
+                DetectionPrediction(
+                    tag_name=self.labels[classes[i]],
+                    probability=float(scores[i]),
+                    bounding_box=PredictionBoundingBox(
+                        left=float(boxes[i, 0]),
+                        top=float(boxes[i, 1]),
+                        width=float(widths[i]),
+                        height=float(heights[i]),
+                    ),
+                )
+            )
+        return predictions
+
+    def detect(self, image_data: bytes, timeout: float = None) -> list:
+        # the local model can't hang on the network, the timeout is not used
+        input_array = self.preprocess(image_data)
+        outputs = self.session.run(self.output_names, {self.input_name: input_array})
+        predictions = self.decode(dict(zip(self.output_names, outputs)))
+        self.logger.debug(
+            f"OnnxDetectionBackend - analysis from local model complete. detected areas: {len(predictions)}"
+        )
+        return predictions
+
+
+def create_detection_backend(config: Config, logger: Logger) -> DetectionBackend:
+    """
+    Creates the detection backend selected in the configuration.
+    Custom Vision is used when no backend is configured.
+    """
+    backend = config.get(constants.CONFIG_DETECTION_BACKEND)
+    if backend is None or backend == "":
+        backend = constants.DETECTION_BACKEND_CUSTOM_VISION
+
+    logger.debug(f"creating detection backend: {backend}")
+    if backend == constants.DETECTION_BACKEND_CUSTOM_VISION:
+        return CustomVisionDetectionBackend(config, logger)
+    elif backend == constants.DETECTION_BACKEND_ONNX:
+        return OnnxDetectionBackend(config, logger)
+
+    raise ValueError(f"unsupported detection backend: {backend}")
@@ -0,0 +1,284 @@
+#####################################################################
+# Routing of the Custom Vision calls across prediction targets.
+# The same iteration can be published to prediction resources in
+# several regions. The router keeps an exponentially weighted moving
+# average (EWMA) of the latency and the error rate of each target,
+# sends each call to the fastest healthy target and now and then probes
+# the other targets, so a target that got faster (or recovered) is
+# picked up again. When a call fails, the next target is tried.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import json
+import threading
+import time
+from logging import Logger
+
+# 2. import azure libraries and other third party libraries
+from msrest.exceptions import HttpOperationError
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.detection.async_prediction_client import PredictionHttpError
+
+
+class PredictionTarget:
+    """
+    A prediction resource with the published iteration, and its statistics.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        endpoint: str,
+        key: str,
+        project_id: str,
+        deployed_name: str,
+    ) -> None:
+        self.name = name
+        self.endpoint = endpoint
+        self.key = key
+        self.project_id = project_id
+        self.deployed_name = deployed_name
+        # the prediction clients (sync and async), created by the detection backend
+        self.client = None
+        self.async_client = None
+
+        self.latency = None  # EWMA of the successful calls, seconds
+        self.error_rate = 0.0  # EWMA of the calls that failed (0-1)
+        self.calls = 0
+        self.errors = 0
+        self.probes = 0
+        # the probe interval starts when the target is created, not at boot
+        self.last_used = time.monotonic()
+        self.last_error = None
+
+    def metrics(self) -> dict:
+        return {
+            "endpoint": self.endpoint,
+            "latency": self.latency,
+            "error_rate": round(self.error_rate, 4),
+            "calls": self.calls,
+            "errors": self.errors,
+            "probes": self.probes,
+            "last_error": self.last_error,
+        }
+
+
+def parse_prediction_targets(config: Config) -> list[PredictionTarget]:
+    """
+    Reads the prediction targets from PredictionTargets, a json list e.g.
+    [{"name": "westeurope", "endpoint": "https://...", "key": "..."}, ...]
+    project_id and deployed_name default to ProjectId and DeployedName.
+    Without PredictionTargets, the single PredictionEndpoint/PredictionKey is used.
+    """
+    project_id = config.get(constants.CONFIG_PROJECT_ID)
+    deployed_name = config.get(constants.CONFIG_DEPLOYED_NAME)
+
+    value = config.get(constants.CONFIG_PREDICTION_TARGETS)
+    if value is None or value == "":
+        return [
+            PredictionTarget(
+                "default",
+                config.get(constants.CONFIG_PREDICTION_ENDPOINT),
+                config.get(constants.CONFIG_PREDICTION_KEY),
+                project_id,
+                deployed_name,
+            )
+        ]
+
+    targets = []
+    for i, item in enumerate(json.loads(value)):
+        targets.append(
+            PredictionTarget(
+                item.get("name") or f"target{i + 1}",
+                item["endpoint"],
+                item["key"],
+                item.get("project_id") or project_id,
+                item.get("deployed_name") or deployed_name,
+            )
+        )
+    if len(targets) == 0:
+        raise ValueError(f"{constants.CONFIG_PREDICTION_TARGETS} has no targets")
+    return targets
+
+
+def is_target_error(ex: Exception) -> bool:
+    """
+    True if the error says something about the target (unreachable, timeout,
+    server error, rate limited), False if the request itself was rejected,
+    e.g. an invalid image, which would fail on every target.
+    """
+    if isinstance(ex, HttpOperationError) and ex.response is not None:
+        status_code = ex.response.status_code
+        return status_code >= 500 or status_code == 429
+    if isinstance(ex, PredictionHttpError):
+        return ex.status_code >= 500 or ex.status_code == 429
+    return True
+
+
+class PredictionRouter:
+    """
+    Picks the prediction target for each call and records the results.
+    """
+
+    def __init__(
+        self,
+        targets: list[PredictionTarget],
+        logger: Logger,
+        alpha: float = constants.DEFAULT_PREDICTION_TARGET_EWMA_ALPHA,
+        max_error_rate: float = constants.DEFAULT_PREDICTION_TARGET_MAX_ERROR_RATE,
+        probe_interval: float = constants.DEFAULT_PREDICTION_TARGET_PROBE_SECONDS,
+    ) -> None:
+        self.targets = targets
+        self.logger = logger
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def from_config(
+        config: Config, logger: Logger, targets: list[PredictionTarget]
+    ) -> "PredictionRouter":
+        return PredictionRouter(
+            targets,
+            logger,
+            config.get_float(
+                constants.CONFIG_PREDICTION_TARGET_EWMA_ALPHA,
+                constants.DEFAULT_PREDICTION_TARGET_EWMA_ALPHA,
+            ),
+            config.get_float(
+                constants.CONFIG_PREDICTION_TARGET_MAX_ERROR_RATE,
+                constants.DEFAULT_PREDICTION_TARGET_MAX_ERROR_RATE,
+            ),
+            config.get_float(
+                constants.CONFIG_PREDICTION_TARGET_PROBE_SECONDS,
+                constants.DEFAULT_PREDICTION_TARGET_PROBE_SECONDS,
+            ),
+        )
+
+    def healthy(self, target: PredictionTarget) -> bool:
+        return target.error_rate <= self.max_error_rate
+
+    def expected_latency(self, target: PredictionTarget) -> float:
+        if target.latency is not None:
+            return target.latency
+        # a target that hasn't been called yet is tried first, one that
+        # never succeeded last
+        return 0.0 if target.calls == 0 else float("inf")
+
+    def ranked_targets(self) -> list[PredictionTarget]:
+        """
+        Returns the targets in the order they should be tried: a target that
+        is due for a probe first, then the healthy targets from fastest to
+        slowest, then the unhealthy ones.
+        """
+        now = time.monotonic()
+        with self.lock:
+            ranked = sorted(
+                self.targets,
+                key=lambda t: (not self.healthy(t), self.expected_latency(t)),
+            )
+            for target in ranked[1:]:
+                if now - target.last_used >= self.probe_interval:
+                    # the probe replaces a regular call, one probe at a time
+                    target.last_used = now
+                    target.probes += 1
+                    ranked.remove(target)
+                    ranked.insert(0, target)
+                    break
+            ranked[0].last_used = now
+        return ranked
+
+    def record(
+        self, target: PredictionTarget, elapsed: float, error: Exception = None
+    ) -> None:
+        with self.lock:
+            target.calls += 1
+            failed = 0.0
+            if error is None:
+                if target.latency is None:
+                    target.latency = elapsed
+                else:
+                    target.latency += self.alpha * (elapsed - target.latency)
+            else:
+                failed = 1.0
+                target.errors += 1
+                target.last_error = str(error)[:200]
+            target.error_rate += self.alpha * (failed - target.error_rate)
+
+    def call(self, func, timeout: float = None):
+        """
+        Calls func(target, timeout) on the best target, and on the next ones
+        while the call fails because of the target. The timeout is the total
+        time for all the attempts, None for no limit.
+        """
+        started = time.monotonic()
+        last_error = None
+        for target in self.ranked_targets():
+            remaining = None
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+
+            attempt_started = time.monotonic()
+            try:
+                result = func(target, remaining)
+            except Exception as ex:
+                if not is_target_error(ex):
+                    raise
+                self.record(target, time.monotonic() - attempt_started, ex)
+                self.logger.warning(
+                    f"prediction target {target.name} failed, trying the next one: {ex}"
+                )
+                last_error = ex
+                continue
+
+            self.record(target, time.monotonic() - attempt_started)
+            return result
+
+        if last_error is None:
+            raise TimeoutError("no time left to call a prediction target")
+        raise last_error
+
+    async def call_async(self, func, timeout: float = None):
+        """
+        Same as call(), for a coroutine function func(target, timeout).
+        """
+        started = time.monotonic()
+        last_error = None
+        for target in self.ranked_targets():
+            remaining = None
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+
+            attempt_started = time.monotonic()
+            try:
+                result = await func(target, remaining)
+            except Exception as ex:
+                if not is_target_error(ex):
+                    raise
+                self.record(target, time.monotonic() - attempt_started, ex)
+                self.logger.warning(
+                    f"prediction target {target.name} failed, trying the next one: {ex}"
+                )
+                last_error = ex
+                continue
+
+            self.record(target, time.monotonic() - attempt_started)
+            return result
+
+        if last_error is None:
+            raise TimeoutError("no time left to call a prediction target")
+        raise last_error
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                target.name: dict(target.metrics(), healthy=self.healthy(target))
+                for target in self.targets
+            }
@@ -0,0 +1,115 @@
+#####################################################################
+# Selection of the top predictions returned by a detection backend.
+# Predictions are partitioned by label in a single pass and the top n
+# of each label are kept in a small heap, so the cost stays
+# O(N log n) even for thousands of boxes from tiled or local detection.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import heapq
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.models import GrassPredictionData
+
+
+def parse_label_list(value: str) -> list[str]:
+    """
+    Parses a comma separated list of labels, e.g. Grass,Weed
+    """
+    if value is None:
+        return []
+    return [label.strip() for label in value.split(",") if label.strip()]
+
+
+def parse_label_thresholds(value: str) -> dict[str, float]:
+    """
+    Parses a comma separated list of label:threshold pairs, e.g. Grass:0.2,Weed:0.35
+    """
+    thresholds = {}
+    for item in parse_label_list(value):
+        label, _, threshold = item.partition(":")
+        thresholds[label.strip()] = float(threshold)
+    return thresholds
+
+
+class PredictionSelector:
+    """
+    Selects the top n predictions of each label.
+
+    parameters:
+    - labels: list[str] - the labels to keep, in the order they are returned.
+      Predictions with any other label are ignored. Labels are matched case
+      insensitively and returned with the spelling given here.
+    - min_confidence: dict[str, float] - minimum probability for each label
+    """
+
+    def __init__(self, labels: list[str], min_confidence: dict[str, float] = None):
+        self.labels = labels
+        self.label_keys = {label.lower(): label for label in labels}
+
+        min_confidence = min_confidence or {}
+        self.min_confidence = {}
+        for label, threshold in min_confidence.items():
+            if label.lower() in self.label_keys:
+                self.min_confidence[self.label_keys[label.lower()]] = threshold
+
+        # tag name as returned by the backend -> configured label (or None)
+        # the backends return the same few tag names over and over again,
+        # so each distinct tag name is only lower-cased once
+        self.tag_name_cache = {}
+
+    @staticmethod
+    def from_config(config: Config) -> "PredictionSelector":
+        labels = parse_label_list(config.get(constants.CONFIG_DETECTION_LABELS))
+        if len(labels) == 0:
+            labels = constants.DEFAULT_DETECTION_LABELS
+        return PredictionSelector(
+            labels,
+            parse_label_thresholds(config.get(constants.CONFIG_LABEL_MIN_CONFIDENCE)),
+        )
+
+    def resolve_label(self, tag_name: str) -> str:
+        label = self.tag_name_cache.get(tag_name, False)
+        if label is False:
+            label = self.label_keys.get(tag_name.lower())
+            self.tag_name_cache[tag_name] = label
+        return label
+
+    def select(self, predictions: list, top_n: int) -> list[GrassPredictionData]:
+        """
+        Returns the top n predictions of each label, labels in the configured
+        order and predictions of a label by descending probability.
+        """
+        top_n = top_n if top_n > 0 else 1
+
+        heaps = {label: [] for label in self.labels}
+        thresholds = self.min_confidence
+        sequence = 0
+        for prediction in predictions:
+            label = self.resolve_label(prediction.tag_name)
+            if label is None:
+                continue
+
+            probability = prediction.probability
+            if probability < thresholds.get(label, 0.0):
+                continue
+
+            # min-heap of (probability, sequence, prediction), the sequence keeps
+            # the original order for equal probabilities and avoids comparing
+            # the prediction objects
+            heap = heaps[label]
+            item = (probability, -sequence, prediction)
+            sequence += 1
+            if len(heap) < top_n:
+                heapq.heappush(heap, item)
+            elif probability > heap[0][0]:
+                heapq.heapreplace(heap, item)
+
+        selected_predictions = []
+        for label in self.labels:
+            for probability, _, prediction in sorted(heaps[label], reverse=True):
+                selected_predictions.append(
+                    GrassPredictionData(label, probability, prediction.bounding_box)
+                )
+        return selected_predictions
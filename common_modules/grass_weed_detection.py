@@ -4,20 +4,16 @@
 # objects in the image.
 #####################################################################
 # 1. import libraries that are part of the standard python library
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import nullcontext
 from datetime import datetime
 from logging import Logger
 from typing import List
 
 # 2. import azure libraries and other third party libraries
-import json
-
-from azure.cognitiveservices.vision.customvision.prediction import (
-    CustomVisionPredictionClient,
-)
-from azure.cognitiveservices.vision.customvision.training.models import (
-    CustomVisionErrorException,
-)
-from msrest.authentication import ApiKeyCredentials
+from PIL import Image
 
 # 3. import my own libraries
 from common_modules.common.models import (
@@ -28,54 +24,283 @@ from common_modules.common.models import (
 )
 
 from common_modules.common import constants
+from common_modules.common.analysis_scheduler import AnalysisScheduler
 from common_modules.common.common_config import Config
+from common_modules.common.image_buffer import ImageBuffer, open_image_data
+from common_modules.common.deadline import (
+    Deadline,
+    DeadlineExceededError,
+    stage_timeout,
+)
 from common_modules.common.common_utilities import (
     create_grass_detection_summary,
     generate_random_filename,
 )
-from common_modules.common.azure_storage_utilities import AzureBlobStorageHelper
+from common_modules.common.geo_index import GeoIndex
+from common_modules.common.prediction_history import PredictionHistory
+from common_modules.common.storage_backend import create_storage_helper
+from common_modules.common.write_behind import WriteBehindUploader
+from common_modules.detection.detection_backends import create_detection_backend
+from common_modules.detection.prediction_selection import PredictionSelector
+from common_modules.image_processing.exif_utilities import read_location
+from common_modules.image_processing.image_tiling import (
+    compute_tiles,
+    crop_tiles,
+    map_tile_predictions,
+    merge_tile_predictions,
+)
+from common_modules.image_processing.image_prescreen import (
+    ImagePrescreen,
+    PrescreenResult,
+)
 from common_modules.image_processing.image_utilities import mark_image_with_rectangle
+from common_modules.image_processing.lazy_rendering import LazyRenderer
+from common_modules.image_processing.render_pool import AnnotationRenderPool
+from common_modules.image_processing.weed_coverage import (
+    WeedCoverage,
+    compute_weed_coverage,
+)
+
+
+class BatchImageAnalysis:
+    """
+    An image analyzed outside of a request (watch folder, bulk analysis),
+    see GrassWeedDetector.detect_batch_image, save_batch_image and
+    upload_batch_image.
+    """
+
+    __slots__ = (
+        "prescreen_result",
+        "location",
+        "selected_predictions",
+        "weed_coverage",
+        "details",
+        "local_files",
+    )
+
+    def __init__(
+        self,
+        prescreen_result: PrescreenResult,
+        location: dict,
+        selected_predictions: list,
+        weed_coverage: WeedCoverage,
+    ) -> None:
+        self.prescreen_result = prescreen_result
+        self.location = location
+        self.selected_predictions = selected_predictions
+        self.weed_coverage = weed_coverage
+        self.details = None
+        # local files to upload: annotated image, derivatives, details (json)
+        self.local_files = []
+
+
+def batch_file_path(local_folder: str, name: str) -> str:
+    """
+    Returns the path of the local file under the folder, the path relative
+    to the folder is the blob name.
+    """
+    parts = name.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        raise ValueError(f"invalid image name: {name}")
+    path = os.path.join(local_folder, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
 
 class GrassWeedDetector:
     def __init__(self, config: Config, logger: Logger) -> None:
         self.config = config
         self.logger = logger
-        self.azure_storage_helper = AzureBlobStorageHelper(self.config, self.logger)
+        self.storage_helper = create_storage_helper(self.config, self.logger)
+        self.detection_backend = create_detection_backend(self.config, self.logger)
+        self.prediction_selector = PredictionSelector.from_config(self.config)
+
+        # optionally skip the unusable images before the detection backend
+        self.prescreen = ImagePrescreen.from_config(self.config, self.logger)
+
+        # optionally run the analyses by priority, with a limited concurrency
+        self.scheduler = AnalysisScheduler.from_config(self.config, self.logger)
+
+        # optionally upload the prediction files in the background
+        self.write_behind = None
+        if self.config.get_bool(constants.CONFIG_WRITE_BEHIND_ENABLED):
+            self.write_behind = WriteBehindUploader(
+                self.config, self.logger, self.storage_helper
+            )
+
+        # optionally record the prediction details in the local history
+        self.prediction_history = None
+        if self.config.get_bool(constants.CONFIG_PREDICTION_HISTORY_ENABLED):
+            self.prediction_history = PredictionHistory(
+                self.config.get(constants.CONFIG_PREDICTION_HISTORY_PATH)
+                or constants.DEFAULT_PREDICTION_HISTORY_PATH
+            )
+
+        # optionally record the locations of the geotagged images
+        self.geo_index = GeoIndex.from_config(self.config, self.logger)
+
+        # optionally render the annotated images in worker processes
+        self.render_pool = None
+        render_pool_size = self.config.get_int(
+            constants.CONFIG_RENDER_PROCESS_POOL_SIZE
+        )
+        if render_pool_size > 0:
+            self.render_pool = AnnotationRenderPool(
+                self.config, self.logger, render_pool_size
+            )
+
+        # optionally render the annotated images when they are first read
+        self.lazy_renderer = LazyRenderer.from_config(
+            self.config,
+            self.logger,
+            self.storage_helper,
+            self.write_behind,
+            self.render_pool,
+        )
 
     def analyze(
         self,
         image: any,
         top_n: int,
         detection_type: constants.DetectionType = constants.DetectionType.WEED,
+        tiled: bool = None,
+        deadline: Deadline = None,
+        priority: constants.AnalysisPriority = constants.AnalysisPriority.INTERACTIVE,
     ) -> AnnotatedImageData:  # GrassAnalysisResponse:
+        """
+        Analyzes the image and saves the prediction details and annotated image.
+
+        parameters:
+        - image: str | bytes | ImageBuffer - name of a test image or the image
+          itself, the caller closes the ImageBuffer
+        - top_n: int - number of predictions to keep for each label
+        - tiled: bool - split the image into overlapping tiles before detection,
+          defaults to the TiledDetectionEnabled configuration
+        - deadline: Deadline - time budget of the request, each stage takes its
+          timeout from the remaining time. Raises DeadlineExceededError when the
+          deadline passes or the deadline is cancelled.
+        - priority: AnalysisPriority - scheduling class of the analysis, only
+          used when the scheduler is enabled (SchedulerConcurrency)
+
+        Raises ImageRejectedError when the pre-screen (PrescreenEnabled) rejects
+        the image, the detection backend is not called.
+        """
+        with self.analysis_slot(priority, deadline):
+            return self.analyze_now(image, top_n, detection_type, tiled, deadline)
 
+    def analysis_slot(
+        self, priority: constants.AnalysisPriority, deadline: Deadline = None
+    ):
+        """
+        Returns the context to run an analysis in, a scheduler slot of the
+        priority class when the scheduler is enabled.
+        """
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.slot(priority, deadline)
+
+    async def acquire_analysis_slot(
+        self, priority: constants.AnalysisPriority, deadline: Deadline = None
+    ) -> None:
+        """
+        Waits on the event loop for a scheduler slot of the priority class, the
+        analysis then runs in held_analysis_slot (which releases it).
+        """
+        if self.scheduler is not None:
+            await self.scheduler.acquire_async(priority, deadline)
+
+    def held_analysis_slot(self, priority: constants.AnalysisPriority):
+        """
+        Returns the context to run an analysis in a slot acquired with
+        acquire_analysis_slot, the slot is released at the end.
+        """
+        if self.scheduler is None:
+            return nullcontext()
+        return self.scheduler.held_slot(priority)
+
+    def analyze_now(
+        self,
+        image: any,
+        top_n: int,
+        detection_type: constants.DetectionType,
+        tiled: bool,
+        deadline: Deadline,
+    ) -> AnnotatedImageData:
+        """
+        Same as analyze(), without waiting for a scheduler slot.
+        """
         self.logger.debug("GrassDectector.analyze() - analyzing image...")
-        self.logger.debug(
-            "GrassDectector.analyze() - setting up credential for Azure vision api..."
-        )
-        # Authenticate a client
-        credentials = ApiKeyCredentials(
-            in_headers={
-                "Prediction-key": self.config.get(constants.CONFIG_PREDICTION_KEY)
-            }
-        )
-        prediction_client = CustomVisionPredictionClient(
-            endpoint=self.config.get(constants.CONFIG_PREDICTION_ENDPOINT),
-            credentials=credentials,
-        )
-        self.logger.debug(
-            "GrassDectector.analyze() - done setting up credential for Azure vision api."
+        image_data = self.load_image(image, deadline)
+        prescreen_result = self.prescreen_image(image_data)
+        location = read_location(image_data)
+
+        predictions = self.detect_predictions(image_data, tiled, deadline)
+        selected_predictions = self.get_top_n_predictions(predictions, top_n)
+
+        # the coverage uses all the weed boxes, not only the selected ones
+        weed_coverage = self.compute_weed_coverage(predictions)
+        heatmap = None
+        if self.config.get_bool(constants.CONFIG_COVERAGE_HEATMAP_ENABLED):
+            heatmap = weed_coverage.heatmap
+
+        if self.lazy_renderer is not None:
+            stage_timeout(deadline, "rendering")
+            annotated_image_data = self.lazy_renderer.defer(
+                self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME),
+                image_data,
+                selected_predictions,
+                detection_type,
+                heatmap,
+                image if isinstance(image, str) else None,
+            )
+        elif self.render_pool is not None:
+            try:
+                annotated_image_data = self.render_pool.render(
+                    image_data,
+                    selected_predictions,
+                    detection_type,
+                    stage_timeout(deadline, "rendering"),
+                    heatmap,
+                )
+            except FuturesTimeoutError:
+                raise DeadlineExceededError("rendering")
+        else:
+            stage_timeout(deadline, "rendering")
+            annotated_image_data = mark_image_with_rectangle(
+                image_data,
+                selected_predictions,
+                self.config,
+                self.logger,
+                detection_type,
+                heatmap,
+            )
+
+        # the annotated image is saved, don't keep it alive until the response is sent
+        annotated_image_data.release()
+
+        analysis_details = self.perform_post_detection_tasks(
+            annotated_image_data.marked_areas,
+            annotated_image_data.derivative_files,
+            deadline,
+            weed_coverage,
+            prescreen_result,
+            location,
+            image_deferred=self.lazy_renderer is not None,
         )
+
+        return analysis_details
+
+    def load_image(self, image: any, deadline: Deadline = None) -> any:
+        """
+        Returns the image bytes or buffer, reading the test image if a name is given.
+        """
         self.logger.debug(
             "GrassDectector.analyze() - checking input type - image object or image url?..."
         )
         if isinstance(image, str):
             self.logger.debug("GrassDectector.analyze() - input type is image url.")
-            image_data = (
-                self.azure_storage_helper.read_test_data_image_with_url_anonymous(
-                    filename=image
-                )
+            image_data = self.storage_helper.read_test_data_image_with_url_anonymous(
+                filename=image, timeout=stage_timeout(deadline, "image fetch")
             )
 
             if len(image_data) == 0:
@@ -89,106 +314,307 @@ class GrassWeedDetector:
         elif isinstance(image, bytes):
             self.logger.debug("GrassDectector.analyze() - input type is bytes.")
             image_data = image
+        elif isinstance(image, ImageBuffer):
+            # e.g. the mapped upload, read by all the stages without a copy
+            self.logger.debug("GrassDectector.analyze() - input type is buffer.")
+            image_data = image
         else:
             self.logger.debug("GrassDectector.analyze() - upsupported input type.")
             raise ValueError("GrassDectector.analyze() - image type not supported")
 
+        return image_data
+
+    def prescreen_image(self, image_data: any) -> PrescreenResult:
+        """
+        Checks that the image is usable before it is sent to the detection
+        backend, None when the pre-screen is not enabled.
+        Raises ImageRejectedError for an unusable image, with PrescreenAction reject.
+        """
+        if self.prescreen is None:
+            return None
+        return self.prescreen.screen(image_data)
+
+    def detect(
+        self,
+        image_data: bytes,
+        top_n: int,
+        tiled: bool = None,
+        deadline: Deadline = None,
+    ) -> list[GrassPredictionData]:
+        """
+        Detects the objects in the image and returns the top n predictions of
+        each label, without marking the image or saving anything.
+        """
+        predictions = self.detect_predictions(image_data, tiled, deadline)
+        return self.get_top_n_predictions(predictions, top_n)
+
+    async def detect_async(
+        self, image_data: bytes, top_n: int, timeout: float = None
+    ) -> list[GrassPredictionData]:
+        """
+        Same as detect(), awaitable from the event loop. With Custom Vision
+        the call doesn't hold a thread while it is in flight.
+        """
+        if self.config.get_bool(constants.CONFIG_TILED_DETECTION_ENABLED):
+            # the tiles are detected concurrently by the thread pool of detect_tiled()
+            deadline = None if timeout is None else Deadline(timeout)
+            return await asyncio.to_thread(
+                self.detect, image_data, top_n, None, deadline
+            )
+        predictions = await self.detection_backend.detect_async(image_data, timeout)
+        return self.get_top_n_predictions(predictions, top_n)
+
+    async def aclose(self) -> None:
+        """
+        Closes the connections of the async detection calls, at shutdown.
+        """
+        await self.detection_backend.aclose()
+
+    def detect_predictions(
+        self, image_data: bytes, tiled: bool = None, deadline: Deadline = None
+    ) -> list:
+        """
+        Detects the objects in the image and returns all the predictions of
+        the detection backend, before the top n are selected.
+        """
         self.logger.debug(
-            "GrassDectector.analyze() - ready to call vision api for analysis."
+            "GrassDectector.analyze() - ready to call detection backend for analysis."
         )
-        try:
-            ai_vision_response = prediction_client.detect_image(
-                self.config.get(constants.CONFIG_PROJECT_ID),
-                self.config.get(constants.CONFIG_DEPLOYED_NAME),
-                image_data,
-            )
-            self.logger.debug(
-                "GrassDectector.analyze() - analysis from vision api complete."
+        if tiled is None:
+            tiled = self.config.get_bool(constants.CONFIG_TILED_DETECTION_ENABLED)
+
+        if tiled:
+            predictions = self.detect_tiled(image_data, deadline)
+        else:
+            predictions = self.detection_backend.detect(
+                image_data, timeout=stage_timeout(deadline, "detection")
             )
-        except CustomVisionErrorException as ex:
-            self.logger.error(ex)
 
         self.logger.debug(
             "GrassDectector.analyze() - analysis complete. detected areas: {}".format(
-                len(ai_vision_response.predictions)
+                len(predictions)
             )
         )
 
-        selected_predictions = self.get_top_n_predictions(
-            ai_vision_response.predictions, top_n
-        )
+        return predictions
 
-        annotated_image_data = mark_image_with_rectangle(
-            image_data, selected_predictions, self.config, self.logger, detection_type
+    def detect_tiled(self, image_data: bytes, deadline: Deadline = None) -> list:
+        """
+        Splits the image into overlapping tiles, detects objects in the tiles
+        concurrently and merges the results into predictions for the full image.
+        The predictions have the same shape as the ones returned by the backend.
+        """
+        tile_size = self.config.get_int(
+            constants.CONFIG_TILE_SIZE, constants.DEFAULT_TILE_SIZE
         )
-
-        analysis_details = self.perform_post_detection_tasks(
-            annotated_image_data.marked_areas
+        overlap = self.config.get_float(
+            constants.CONFIG_TILE_OVERLAP, constants.DEFAULT_TILE_OVERLAP
         )
-
-        return analysis_details
-
-    def get_top_n_predictions(
-        self, ai_vision_predictions, top_n: int
-    ) -> list[GrassPredictionData]:
-
-        # put each category of predictions in its own list
-        grass_predictions = self.filter_predictions_by_label(
-            ai_vision_predictions, constants.DETECTED_TYPE_GRASS
+        concurrency = self.config.get_int(
+            constants.CONFIG_TILE_CONCURRENCY, constants.DEFAULT_TILE_CONCURRENCY
         )
-        weed_predictions = self.filter_predictions_by_label(
-            ai_vision_predictions, constants.DETECTED_TYPE_WEED
+        iou_threshold = self.config.get_float(
+            constants.CONFIG_TILE_NMS_IOU_THRESHOLD,
+            constants.DEFAULT_TILE_NMS_IOU_THRESHOLD,
         )
 
-        # now sport the predictions by confidence level
-        grass_predictions.sort(key=lambda x: x.probability, reverse=True)
-        weed_predictions.sort(key=lambda x: x.probability, reverse=True)
+        image = Image.open(open_image_data(image_data))
+        image_width, image_height = image.size
+        tiles = compute_tiles(image_width, image_height, tile_size, overlap)
 
-        # now select the top n predictions
-        selected_top_grass_predictions = []
+        # nothing to gain from tiling an image that fits into a single tile
+        if len(tiles) == 1:
+            return self.detection_backend.detect(
+                image_data, timeout=stage_timeout(deadline, "detection")
+            )
 
-        top_n = top_n if top_n > 0 else 1
-        if top_n > len(grass_predictions):
-            top_n = len(grass_predictions)
-        selected_top_grass_predictions = grass_predictions[:top_n]
+        self.logger.debug(
+            f"GrassDectector.detect_tiled() - {image_width}x{image_height} image split into {len(tiles)} tiles."
+        )
+        tile_images = crop_tiles(image, tiles)
 
-        if top_n > len(weed_predictions):
-            top_n = len(weed_predictions)
-        selected_top_weed_predictions = weed_predictions[:top_n]
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        try:
+            futures = [
+                executor.submit(
+                    self.detection_backend.detect,
+                    tile_image,
+                    timeout=stage_timeout(deadline, "tiled detection"),
+                )
+                for tile_image in tile_images
+            ]
+            tile_predictions = [
+                future.result(timeout=stage_timeout(deadline, "tiled detection"))
+                for future in futures
+            ]
+        except FuturesTimeoutError:
+            raise DeadlineExceededError("tiled detection")
+        finally:
+            # tiles that haven't started are not sent anymore after an error
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        predictions = []
+        for tile, tile_prediction in zip(tiles, tile_predictions):
+            predictions.extend(
+                map_tile_predictions(tile_prediction, tile, image_width, image_height)
+            )
 
-        # now combine the selected predictions
-        selected_predictions = selected_top_grass_predictions
-        selected_predictions.extend(selected_top_weed_predictions)
+        merged_predictions = merge_tile_predictions(predictions, iou_threshold)
+        self.logger.debug(
+            f"GrassDectector.detect_tiled() - {len(predictions)} tile detections merged into {len(merged_predictions)}."
+        )
+        return merged_predictions
 
-        # convert the selected predictions to GrassPredictionData objects
-        selected_predictions = [
-            GrassPredictionData(
-                prediction.tag_name, prediction.probability, prediction.bounding_box
-            )
-            for prediction in selected_predictions
-        ]
+    def get_top_n_predictions(
+        self, ai_vision_predictions, top_n: int
+    ) -> list[GrassPredictionData]:
+        """
+        Selects the top n predictions of each configured label.
+        """
+        selected_predictions = self.prediction_selector.select(
+            ai_vision_predictions, top_n
+        )
 
         print(f"selected_predictions count: {len(selected_predictions)}")
 
         return selected_predictions
 
-    def filter_predictions_by_label(self, predictions: any, label: str) -> any:
-        return [
-            prediction
-            for prediction in predictions
-            if prediction.tag_name.lower() == label.lower()
-        ]
+    def compute_weed_coverage(self, predictions: list) -> WeedCoverage:
+        """
+        Rasterizes all the weed predictions into the coverage grid.
+        """
+        weed_coverage = compute_weed_coverage(
+            predictions,
+            self.config.get_int(
+                constants.CONFIG_COVERAGE_GRID_SIZE,
+                constants.DEFAULT_COVERAGE_GRID_SIZE,
+            ),
+            self.config.get_float(
+                constants.CONFIG_COVERAGE_MIN_CONFIDENCE,
+                constants.DEFAULT_COVERAGE_MIN_CONFIDENCE,
+            ),
+        )
+        self.logger.debug(
+            f"weed coverage: {weed_coverage.coverage}% from {weed_coverage.detections} boxes"
+        )
+        return weed_coverage
 
     def perform_post_detection_tasks(
-        self, marked_areas: List[MarkedDetectedArea]
+        self,
+        marked_areas: List[MarkedDetectedArea],
+        derivative_files: List[str] = None,
+        deadline: Deadline = None,
+        weed_coverage: WeedCoverage = None,
+        prescreen_result: PrescreenResult = None,
+        location: dict = None,
+        image_deferred: bool = False,
     ) -> GrassAnalysisDetails:
         """
         This method performs the following tasks:
         1. create a detection summary
         2. upload the detection summary to azure blob storage
+        3. upload the annotated image and its derivatives to azure blob storage,
+           unless its rendering is deferred (image_deferred, lazy rendering)
 
         """
+        self.logger.debug(
+            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME)
+        )
+        self.logger.debug(
+            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME)
+        )
+
+        analysis_details = self.create_analysis_details(
+            marked_areas,
+            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME),
+            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME),
+            weed_coverage,
+            prescreen_result,
+            location,
+        )
+        prediction_details = analysis_details.to_json_bytes()
+        # write the prediction details to file for later use
+        with open(
+            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME), "wb"
+        ) as f:
+            f.write(prediction_details)
+
+        self.logger.debug(f"prediction details size: {len(prediction_details)} bytes")
+
+        self.record_analysis(analysis_details)
+
+        self.logger.debug("saving prediction information (json) to azure storage...")
 
+        # use method from comoom to generate rendom file name for the prediction information
+        # random_file_name = generate_random_filename("json")
+
+        if self.write_behind is not None:
+            # don't wait for the uploads, the files are uploaded in the background
+            self.write_behind.enqueue(
+                self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME)
+            )
+            if not image_deferred:
+                self.write_behind.enqueue(
+                    self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME)
+                )
+            for derivative_file in derivative_files or []:
+                self.write_behind.enqueue(derivative_file)
+
+            self.logger.debug("prediction information (json) queued for upload.")
+            return analysis_details
+
+        self.storage_helper.write_prediction_details(
+            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME),
+            timeout=stage_timeout(deadline, "upload"),
+        )
+
+        if not image_deferred:
+            self.storage_helper.write_prediction_image(
+                self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME),
+                timeout=stage_timeout(deadline, "upload"),
+            )
+
+        for derivative_file in derivative_files or []:
+            self.storage_helper.write_prediction_image(
+                derivative_file, timeout=stage_timeout(deadline, "upload")
+            )
+
+        self.logger.debug("done saving prediction information (json) to azure storage.")
+
+        return analysis_details
+
+    def record_analysis(self, analysis_details: GrassAnalysisDetails) -> None:
+        """
+        Records the details in the prediction history and the geo index,
+        when they are enabled.
+        """
+        if self.prediction_history is None and self.geo_index is None:
+            return
+        details = analysis_details.to_dict()
+        # the history and the index are secondary copies, don't fail the analysis
+        if self.prediction_history is not None:
+            try:
+                self.prediction_history.record(details)
+            except Exception as e:
+                self.logger.warning(f"unable to record prediction history: {e}")
+        if self.geo_index is not None:
+            try:
+                self.geo_index.record(details)
+            except Exception as e:
+                self.logger.warning(f"unable to record the location: {e}")
+
+    def create_analysis_details(
+        self,
+        marked_areas: List[MarkedDetectedArea],
+        predictions_image_url: str,
+        predictions_info_url: str,
+        weed_coverage: WeedCoverage = None,
+        prescreen_result: PrescreenResult = None,
+        location: dict = None,
+    ) -> GrassAnalysisDetails:
+        """
+        Creates the prediction details with a simple summary of the detections.
+        """
         grass_confidence = 0.0
         weed_confidence = 0.0
 
@@ -204,50 +630,122 @@ class GrassWeedDetector:
         )
 
         self.logger.debug("creating a simple prediction summary information...")
-        summary = create_grass_detection_summary(grass_confidence, weed_confidence)
-        self.logger.debug(summary)
-
-        self.logger.debug(
-            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME)
-        )
-        self.logger.debug(
-            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME)
+        coverage = None
+        weed_detections = None
+        if weed_coverage is not None:
+            coverage = weed_coverage.coverage
+            weed_detections = weed_coverage.detections
+
+        summary = create_grass_detection_summary(
+            grass_confidence, weed_confidence, coverage
         )
+        self.logger.debug(summary)
 
-        analysis_details = GrassAnalysisDetails(
-            predictions_image_url=self.config.get(
-                constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME
-            ),
-            predictions_info_url=self.config.get(
-                constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME
-            ),
+        return GrassAnalysisDetails(
+            predictions_image_url=predictions_image_url,
+            predictions_info_url=predictions_info_url,
             timestamp=datetime.today().strftime("%Y-%m-%d %H:%M:%S"),
             top_n=len(marked_areas),
             summary=summary,
             detected_details=marked_areas,
+            weed_coverage=coverage,
+            weed_detections=weed_detections,
+            prescreen=None if prescreen_result is None else prescreen_result.to_dict(),
+            location=location,
         )
-        prediction_details = json.dumps(analysis_details.to_dict())
-        # write the prediction details to file for later use
-        with open(
-            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME), "w"
-        ) as f:
-            f.write(prediction_details)
 
-        self.logger.debug(prediction_details)
-
-        self.logger.debug("saving prediction information (json) to azure storage...")
+    def detect_batch_image(
+        self, image_data: bytes, top_n: int, deadline: Deadline = None
+    ) -> BatchImageAnalysis:
+        """
+        Detects the objects in an image of the watch folder or the bulk analysis.
+        The detection waits behind the analyses of the api (batch priority), an
+        unusable image is rejected before, without taking a slot.
+        """
+        prescreen_result = self.prescreen_image(image_data)
+        location = read_location(image_data)
+        with self.analysis_slot(constants.AnalysisPriority.BATCH):
+            predictions = self.detect_predictions(image_data, deadline=deadline)
+        return BatchImageAnalysis(
+            prescreen_result,
+            location,
+            self.get_top_n_predictions(predictions, top_n),
+            self.compute_weed_coverage(predictions),
+        )
 
-        # use method from comoom to generate rendom file name for the prediction information
-        # random_file_name = generate_random_filename("json")
+    def save_batch_image(
+        self,
+        image_data: bytes,
+        analysis: BatchImageAnalysis,
+        image_name: str,
+        local_folder: str,
+    ) -> None:
+        """
+        Saves the annotated image, its derivatives and the details (image_name
+        + .json) under the local folder, for upload_batch_image.
+        """
+        image_filename = batch_file_path(local_folder, image_name)
+        heatmap = None
+        if self.config.get_bool(constants.CONFIG_COVERAGE_HEATMAP_ENABLED):
+            heatmap = analysis.weed_coverage.heatmap
 
-        self.azure_storage_helper.write_prediction_details(
-            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME)
+        if self.render_pool is not None:
+            annotated_image_data = self.render_pool.render(
+                image_data,
+                analysis.selected_predictions,
+                constants.DetectionType.WEED,
+                heatmap=heatmap,
+                output_filename=image_filename,
+            )
+        else:
+            annotated_image_data = mark_image_with_rectangle(
+                image_data,
+                analysis.selected_predictions,
+                self.config,
+                self.logger,
+                constants.DetectionType.WEED,
+                heatmap,
+                image_filename,
+            )
+        annotated_image_data.release()
+
+        details_name = image_name + ".json"
+        analysis.details = self.create_analysis_details(
+            annotated_image_data.marked_areas,
+            image_name,
+            details_name,
+            analysis.weed_coverage,
+            analysis.prescreen_result,
+            analysis.location,
         )
+        details_filename = batch_file_path(local_folder, details_name)
+        with open(details_filename, "wb") as f:
+            f.write(analysis.details.to_json_bytes())
+
+        analysis.local_files = [
+            image_filename,
+            *annotated_image_data.derivative_files,
+            details_filename,
+        ]
 
-        self.azure_storage_helper.write_prediction_image(
-            self.config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME)
-        )
+    def upload_batch_image(
+        self, analysis: BatchImageAnalysis, local_folder: str, timeout: float = None
+    ) -> None:
+        """
+        Uploads the files saved by save_batch_image, under their path relative
+        to the local folder.
+        """
 
-        self.logger.debug("done saving prediction information (json) to azure storage.")
+        def blob_name(path: str) -> str:
+            return os.path.relpath(path, local_folder).replace(os.sep, "/")
 
-        return analysis_details
+        image_files = analysis.local_files[:-1]
+        details_filename = analysis.local_files[-1]
+        for path in image_files:
+            self.storage_helper.write_prediction_image(
+                blob_name(path), local_path=path, timeout=timeout
+            )
+        # the details last, once they exist the images are there as well
+        self.storage_helper.write_prediction_details(
+            blob_name(details_filename), local_path=details_filename, timeout=timeout
+        )
@@ -0,0 +1,124 @@
+####################################################################
+# Reads the location and the capture time of an image from its exif
+# metadata (GPS IFD, DateTimeOriginal), as written by the cameras of
+# the drones and the phones.
+# Only the header of the image is parsed, the pixels are not decoded.
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+from datetime import datetime, timedelta
+
+# 2. import libraries that require inbstallation
+from PIL import ExifTags, Image
+
+# 3. import my own libraries
+from common_modules.common.image_buffer import open_image_data
+
+# GPS IFD tags
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+GPS_ALTITUDE_REF = 5
+GPS_ALTITUDE = 6
+GPS_TIME_STAMP = 7
+GPS_DATE_STAMP = 29
+
+# exif tags of the capture time, "YYYY:MM:DD HH:MM:SS"
+EXIF_DATE_TIME_ORIGINAL = 0x9003
+IMAGE_DATE_TIME = 0x0132
+
+
+def dms_to_degrees(dms: tuple, ref: str, negative_ref: str) -> float:
+    """
+    Converts exif degrees, minutes, seconds to signed decimal degrees.
+    """
+    degrees, minutes, seconds = (float(value) for value in dms)
+    value = degrees + minutes / 60 + seconds / 3600
+    if isinstance(ref, bytes):
+        ref = ref.decode("ascii", "ignore")
+    if ref and ref.strip("\x00 ").upper() == negative_ref:
+        value = -value
+    return value
+
+
+def parse_exif_datetime(value: str) -> str:
+    """
+    Returns the exif date time as "YYYY-MM-DD HH:MM:SS", like the timestamps
+    of the details, None if it can't be parsed.
+    """
+    try:
+        parsed = datetime.strptime(value.strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except (AttributeError, ValueError):
+        return None
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def gps_datetime(gps: dict) -> str:
+    """
+    Returns the UTC time of the GPS fix, None if it is not in the metadata.
+    """
+    date = gps.get(GPS_DATE_STAMP)
+    time = gps.get(GPS_TIME_STAMP)
+    if date is None or time is None:
+        return None
+    try:
+        hours, minutes, seconds = (float(value) for value in time)
+        day = datetime.strptime(date.strip("\x00 "), "%Y:%m:%d")
+    except (TypeError, ValueError):
+        return None
+    fix = day + timedelta(hours=hours, minutes=minutes, seconds=int(seconds))
+    return fix.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def read_location(image_data: any) -> dict:
+    """
+    Returns the location of the image from its exif metadata:
+        {"latitude", "longitude", "altitude", "captured_at"}
+    None when the image has no GPS position. The altitude (meters) and the
+    capture time are None when they are missing, the capture time is the
+    local time of the camera, or the UTC time of the GPS fix without it.
+    """
+    try:
+        with Image.open(open_image_data(image_data)) as image:
+            exif = image.getexif()
+            gps = exif.get_ifd(ExifTags.IFD.GPSInfo)
+            if GPS_LATITUDE not in gps or GPS_LONGITUDE not in gps:
+                return None
+            captured_at = parse_exif_datetime(
+                exif.get_ifd(ExifTags.IFD.Exif).get(EXIF_DATE_TIME_ORIGINAL)
+            )
+            captured_at = (
+                captured_at
+                or gps_datetime(gps)
+                or parse_exif_datetime(exif.get(IMAGE_DATE_TIME))
+            )
+
+            latitude = dms_to_degrees(
+                gps[GPS_LATITUDE], gps.get(GPS_LATITUDE_REF), "S"
+            )
+            longitude = dms_to_degrees(
+                gps[GPS_LONGITUDE], gps.get(GPS_LONGITUDE_REF), "W"
+            )
+            altitude = None
+            if GPS_ALTITUDE in gps:
+                altitude = float(gps[GPS_ALTITUDE])
+                # 1: below sea level
+                if gps.get(GPS_ALTITUDE_REF) in (1, b"\x01"):
+                    altitude = -altitude
+    except (OSError, ValueError, TypeError, ZeroDivisionError):
+        # not an image, or broken metadata, the analysis goes on without a location
+        return None
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None
+    if latitude == 0 and longitude == 0:
+        # the position of a camera without a GPS fix
+        return None
+    return {
+        "latitude": round(latitude, 7),
+        "longitude": round(longitude, 7),
+        "altitude": None if altitude is None else round(altitude, 2),
+        "captured_at": captured_at,
+    }
@@ -0,0 +1,183 @@
+####################################################################
+# This file contains the utility functions that create the smaller and
+# modern-format copies (derivatives) of the annotated image, e.g. a
+# webp thumbnail for the results list of the mobile app.
+#
+# Derivatives are stored next to the annotated image:
+#   predictions.jpg            - the annotated image (full size, jpeg)
+#   predictions_full.webp      - full size, webp
+#   predictions_thumbnail.jpg  - thumbnail, jpeg
+#   predictions_thumbnail.webp - thumbnail, webp
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+import os
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+
+# 2. import libraries that require inbstallation
+from PIL import Image
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.serialization import accept_quality, parse_accept
+
+# format name -> (PIL format, file extension, media type)
+DERIVATIVE_FORMATS = {
+    constants.IMAGE_FORMAT_JPEG: ("JPEG", "jpg", "image/jpeg"),
+    constants.IMAGE_FORMAT_WEBP: ("WEBP", "webp", "image/webp"),
+}
+
+
+def get_derivative_sizes(config: Config) -> dict[str, int]:
+    """
+    Reads the derivative sizes from the configuration,
+    e.g. thumbnail:160,medium:640,full:0 - the number is the width in pixels,
+    0 keeps the size of the annotated image.
+    """
+    value = config.get(constants.CONFIG_IMAGE_DERIVATIVE_SIZES)
+    if value is None or value == "":
+        value = constants.DEFAULT_IMAGE_DERIVATIVE_SIZES
+
+    sizes = {}
+    for item in value.split(","):
+        name, _, width = item.partition(":")
+        if name.strip():
+            sizes[name.strip()] = int(width or 0)
+    return sizes
+
+
+def get_derivative_formats(config: Config) -> list[str]:
+    value = config.get(constants.CONFIG_IMAGE_DERIVATIVE_FORMATS)
+    if value is None or value == "":
+        value = constants.DEFAULT_IMAGE_DERIVATIVE_FORMATS
+    return [
+        item.strip().lower()
+        for item in value.split(",")
+        if item.strip().lower() in DERIVATIVE_FORMATS
+    ]
+
+
+def derivative_filename(filename: str, size: str, image_format: str) -> str:
+    """
+    Returns the name of a derivative of the annotated image.
+    The full size jpeg is the annotated image itself.
+    """
+    if size == constants.IMAGE_SIZE_FULL and image_format == constants.IMAGE_FORMAT_JPEG:
+        return filename
+
+    name, _ = os.path.splitext(filename)
+    extension = DERIVATIVE_FORMATS[image_format][1]
+    return f"{name}_{size}.{extension}"
+
+
+def derivative_media_type(image_format: str) -> str:
+    return DERIVATIVE_FORMATS[image_format][2]
+
+
+def encode_derivative(
+    image: Image.Image, width: int, image_format: str, quality: int, filename: str
+) -> str:
+    if width > 0 and width < image.width:
+        height = max(1, round(image.height * width / image.width))
+        image = image.resize(
+            (width, height), Image.Resampling.LANCZOS, reducing_gap=3.0
+        )
+
+    image.save(filename, format=DERIVATIVE_FORMATS[image_format][0], quality=quality)
+    return filename
+
+
+def create_image_derivatives(
+    image: Image.Image, filename: str, config: Config, logger: Logger
+) -> list[str]:
+    """
+    Creates the configured derivatives of the annotated image.
+    The derivatives are resized and encoded in parallel, Pillow releases
+    the GIL while it resizes and encodes.
+
+    parameters:
+    - image: Image - the annotated image
+    - filename: str - name of the annotated image, the derivatives are saved next to it
+
+    returns the file names of the derivatives.
+    """
+    quality = config.get_int(
+        constants.CONFIG_IMAGE_DERIVATIVE_QUALITY,
+        constants.DEFAULT_IMAGE_DERIVATIVE_QUALITY,
+    )
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    jobs = []
+    for size, width in get_derivative_sizes(config).items():
+        for image_format in get_derivative_formats(config):
+            derivative = derivative_filename(filename, size, image_format)
+            # the full size jpeg has already been saved
+            if derivative != filename:
+                jobs.append((width, image_format, derivative))
+
+    if len(jobs) == 0:
+        return []
+
+    # the image is only read by the encoders, it can be shared between threads
+    image.load()
+    with ThreadPoolExecutor(max_workers=len(jobs)) as executor:
+        futures = [
+            executor.submit(
+                encode_derivative, image, width, image_format, quality, derivative
+            )
+            for width, image_format, derivative in jobs
+        ]
+        derivative_files = [future.result() for future in futures]
+
+    logger.debug(f"image derivatives created: {derivative_files}")
+    return derivative_files
+
+
+def select_derivative(
+    filename: str, size: str, accept: str, config: Config
+) -> tuple[str, str]:
+    """
+    Picks the derivative to serve for a request.
+
+    parameters:
+    - size: str - requested size, e.g. thumbnail; None for the full size
+    - accept: str - the Accept header of the request, webp is served to
+      clients that list it (q > 0) at least as high as jpeg
+
+    returns the file name and the media type of the derivative.
+    Raises ValueError if the size is not configured.
+    """
+    if size is None or size == "":
+        size = constants.IMAGE_SIZE_FULL
+
+    if not config.get_bool(constants.CONFIG_IMAGE_DERIVATIVES_ENABLED):
+        if size != constants.IMAGE_SIZE_FULL:
+            raise ValueError("image derivatives are not enabled.")
+        return filename, derivative_media_type(constants.IMAGE_FORMAT_JPEG)
+
+    sizes = get_derivative_sizes(config)
+    if size != constants.IMAGE_SIZE_FULL and size not in sizes:
+        raise ValueError(f"unsupported image size: {size}, use one of {list(sizes)}")
+
+    image_format = constants.IMAGE_FORMAT_JPEG
+    if constants.IMAGE_FORMAT_WEBP in get_derivative_formats(config):
+        qualities = parse_accept(accept)
+        # only an explicit image/webp, */* doesn't mean the client decodes it
+        webp_quality = qualities.get(
+            derivative_media_type(constants.IMAGE_FORMAT_WEBP), 0.0
+        )
+        jpeg_quality = accept_quality(
+            qualities,
+            (derivative_media_type(constants.IMAGE_FORMAT_JPEG), "image/*", "*/*"),
+        )
+        if webp_quality > 0 and webp_quality >= jpeg_quality:
+            image_format = constants.IMAGE_FORMAT_WEBP
+
+    return (
+        derivative_filename(filename, size, image_format),
+        derivative_media_type(image_format),
+    )
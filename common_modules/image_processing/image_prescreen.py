@@ -0,0 +1,283 @@
+####################################################################
+# Pre-screening of the images before the detection backend is called.
+# Blurry, dark or overexposed images and images without vegetation
+# (e.g. pavement) can't be analyzed, but each of them would still cost
+# a Custom Vision call and the uploads of the results.
+#
+# The checks run on a small copy of the image (jpeg images are decoded
+# at a reduced scale, which is much faster than a full decode) and are
+# a few vectorized numpy operations, a few milliseconds per image:
+# - sharpness: variance of the laplacian of the brightness, the edges of
+#   a blurry image are weak so the variance is low
+# - brightness: mean of the brightness histogram (0-255)
+# - vegetation ratio: fraction of the pixels that are green, with the
+#   excess green index 2G - R - B above a threshold
+# The thresholds depend on the size of the copy, keep PrescreenSize
+# when tuning them.
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+import threading
+import time
+from logging import Logger
+
+# 2. import libraries that require inbstallation
+import numpy as np
+from PIL import Image
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.image_buffer import open_image_data
+
+# excess green (2G - R - B) of a vegetation pixel
+VEGETATION_EXCESS_GREEN = 20
+# brightness levels counted as dark / clipped in the result
+DARK_LEVEL = 32
+BRIGHT_LEVEL = 224
+
+REASON_BLURRY = "blurry"
+REASON_TOO_DARK = "too dark"
+REASON_TOO_BRIGHT = "too bright"
+REASON_NO_VEGETATION = "no vegetation"
+
+
+class ImageRejectedError(Exception):
+    """
+    Raised when the pre-screen rejects the image, the model is not called.
+    """
+
+    def __init__(self, result: "PrescreenResult") -> None:
+        reasons = ", ".join(result.reasons)
+        super().__init__(f"image rejected by the pre-screen: {reasons}")
+        self.result = result
+
+
+class PrescreenResult:
+    """
+    Measures of the image and the reasons it is unusable, empty if it passed.
+    """
+
+    __slots__ = (
+        "sharpness",
+        "brightness",
+        "dark_fraction",
+        "bright_fraction",
+        "vegetation_ratio",
+        "reasons",
+        "duration",
+    )
+
+    def __init__(
+        self,
+        sharpness: float,
+        brightness: float,
+        dark_fraction: float,
+        bright_fraction: float,
+        vegetation_ratio: float,
+    ) -> None:
+        self.sharpness = sharpness
+        self.brightness = brightness
+        self.dark_fraction = dark_fraction
+        self.bright_fraction = bright_fraction
+        self.vegetation_ratio = vegetation_ratio
+        self.reasons = []
+        self.duration = 0.0
+
+    @property
+    def passed(self) -> bool:
+        return len(self.reasons) == 0
+
+    def to_dict(self):
+        return {
+            "passed": self.passed,
+            "reasons": self.reasons,
+            "sharpness": round(self.sharpness, 1),
+            "brightness": round(self.brightness, 1),
+            "dark_fraction": round(self.dark_fraction, 3),
+            "bright_fraction": round(self.bright_fraction, 3),
+            "vegetation_ratio": round(self.vegetation_ratio, 3),
+        }
+
+
+def measure_image(image_data: any, size: int) -> PrescreenResult:
+    """
+    Measures the sharpness, brightness and vegetation of a copy of the
+    image that fits in size x size pixels.
+    """
+    image = Image.open(open_image_data(image_data))
+    # jpeg: decode at 1/2, 1/4 or 1/8 of the size, at least size x size
+    image.draft("RGB", (size, size))
+    image = image.convert("RGB")
+    image.thumbnail((size, size), Image.BILINEAR)
+
+    pixels = np.asarray(image, dtype=np.float32)
+    red = pixels[:, :, 0]
+    green = pixels[:, :, 1]
+    blue = pixels[:, :, 2]
+    luma = 0.299 * red + 0.587 * green + 0.114 * blue
+
+    # 4-neighbour laplacian of the inner pixels
+    sharpness = 0.0
+    if min(luma.shape) >= 3:
+        laplacian = (
+            luma[:-2, 1:-1]
+            + luma[2:, 1:-1]
+            + luma[1:-1, :-2]
+            + luma[1:-1, 2:]
+            - 4 * luma[1:-1, 1:-1]
+        )
+        sharpness = float(laplacian.var())
+
+    histogram = np.bincount(luma.astype(np.uint8).ravel(), minlength=256)
+    count = luma.size
+    brightness = float(histogram @ np.arange(256)) / count
+
+    vegetation = (2 * green - red - blue) > VEGETATION_EXCESS_GREEN
+
+    return PrescreenResult(
+        sharpness=sharpness,
+        brightness=brightness,
+        dark_fraction=float(histogram[:DARK_LEVEL].sum()) / count,
+        bright_fraction=float(histogram[BRIGHT_LEVEL:].sum()) / count,
+        vegetation_ratio=float(vegetation.mean()),
+    )
+
+
+class ImagePrescreen:
+    """
+    Checks the images against the thresholds and counts the results.
+
+    usage:
+        prescreen = ImagePrescreen.from_config(config, logger)
+        if prescreen is not None:
+            result = prescreen.screen(image_data)
+            if not result.passed: ...
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        size: int = constants.DEFAULT_PRESCREEN_SIZE,
+        min_sharpness: float = constants.DEFAULT_PRESCREEN_MIN_SHARPNESS,
+        min_brightness: float = constants.DEFAULT_PRESCREEN_MIN_BRIGHTNESS,
+        max_brightness: float = constants.DEFAULT_PRESCREEN_MAX_BRIGHTNESS,
+        min_vegetation_ratio: float = constants.DEFAULT_PRESCREEN_MIN_VEGETATION_RATIO,
+        reject: bool = True,
+    ) -> None:
+        self.logger = logger
+        self.size = size
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.min_vegetation_ratio = min_vegetation_ratio
+        self.reject = reject
+
+        self.lock = threading.Lock()
+        self.screened = 0
+        self.rejected = 0
+        self.flagged = 0
+        self.reason_counts = {}
+        self.total_duration = 0.0
+
+    @staticmethod
+    def from_config(config: Config, logger: Logger) -> "ImagePrescreen":
+        """
+        Creates the pre-screen, None if it is not enabled.
+        """
+        if not config.get_bool(constants.CONFIG_PRESCREEN_ENABLED):
+            return None
+        action = (
+            config.get(constants.CONFIG_PRESCREEN_ACTION)
+            or constants.PRESCREEN_ACTION_REJECT
+        ).lower()
+        if action not in (
+            constants.PRESCREEN_ACTION_REJECT,
+            constants.PRESCREEN_ACTION_FLAG,
+        ):
+            raise ValueError(f"invalid {constants.CONFIG_PRESCREEN_ACTION}: {action}")
+        return ImagePrescreen(
+            logger,
+            config.get_int(
+                constants.CONFIG_PRESCREEN_SIZE, constants.DEFAULT_PRESCREEN_SIZE
+            ),
+            config.get_float(
+                constants.CONFIG_PRESCREEN_MIN_SHARPNESS,
+                constants.DEFAULT_PRESCREEN_MIN_SHARPNESS,
+            ),
+            config.get_float(
+                constants.CONFIG_PRESCREEN_MIN_BRIGHTNESS,
+                constants.DEFAULT_PRESCREEN_MIN_BRIGHTNESS,
+            ),
+            config.get_float(
+                constants.CONFIG_PRESCREEN_MAX_BRIGHTNESS,
+                constants.DEFAULT_PRESCREEN_MAX_BRIGHTNESS,
+            ),
+            config.get_float(
+                constants.CONFIG_PRESCREEN_MIN_VEGETATION_RATIO,
+                constants.DEFAULT_PRESCREEN_MIN_VEGETATION_RATIO,
+            ),
+            action == constants.PRESCREEN_ACTION_REJECT,
+        )
+
+    def screen(self, image_data: any) -> PrescreenResult:
+        """
+        Measures the image and lists the reasons it is unusable.
+        Raises ImageRejectedError if it is unusable and the action is reject.
+        """
+        started = time.perf_counter()
+        result = measure_image(image_data, self.size)
+
+        if self.min_sharpness > 0 and result.sharpness < self.min_sharpness:
+            result.reasons.append(REASON_BLURRY)
+        if self.min_brightness > 0 and result.brightness < self.min_brightness:
+            result.reasons.append(REASON_TOO_DARK)
+        if self.max_brightness > 0 and result.brightness > self.max_brightness:
+            result.reasons.append(REASON_TOO_BRIGHT)
+        if (
+            self.min_vegetation_ratio > 0
+            and result.vegetation_ratio < self.min_vegetation_ratio
+        ):
+            result.reasons.append(REASON_NO_VEGETATION)
+        result.duration = time.perf_counter() - started
+
+        with self.lock:
+            self.screened += 1
+            self.total_duration += result.duration
+            if not result.passed:
+                if self.reject:
+                    self.rejected += 1
+                else:
+                    self.flagged += 1
+                for reason in result.reasons:
+                    self.reason_counts[reason] = self.reason_counts.get(reason, 0) + 1
+
+        if not result.passed:
+            self.logger.info(
+                f"pre-screen - unusable image ({', '.join(result.reasons)}): {result.to_dict()}"
+            )
+            if self.reject:
+                raise ImageRejectedError(result)
+        return result
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "action": (
+                    constants.PRESCREEN_ACTION_REJECT
+                    if self.reject
+                    else constants.PRESCREEN_ACTION_FLAG
+                ),
+                "screened": self.screened,
+                "rejected": self.rejected,
+                "flagged": self.flagged,
+                # the rejected images never reach the detection backend
+                "vision_calls_saved": self.rejected,
+                "reasons": dict(self.reason_counts),
+                "average_milliseconds": (
+                    round(self.total_duration / self.screened * 1000, 2)
+                    if self.screened > 0
+                    else None
+                ),
+            }
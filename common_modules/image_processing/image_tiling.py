@@ -0,0 +1,184 @@
+####################################################################
+# This file contains the utility functions used for tiled detection.
+# High resolution images are split into overlapping tiles so that small
+# objects are not lost when the vision service downsizes the image.
+# The detections of each tile are mapped back to the full image and the
+# duplicates found on the tile borders are merged with non-maximum
+# suppression.
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+import io
+
+# 2. import libraries that require inbstallation
+import numpy as np
+from PIL import Image
+
+# 3. import my own libraries
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+
+
+def compute_tiles(
+    image_width: int, image_height: int, tile_size: int, overlap: float
+) -> list[tuple[int, int, int, int]]:
+    """
+    Computes the overlapping tiles covering the image.
+
+    parameters:
+    - tile_size: int - width and height of a tile in pixels
+    - overlap: float - fraction of the tile shared with its neighbour, e.g. 0.2
+
+    returns a list of tiles as (left, top, right, bottom) in pixels.
+    The last row/column of tiles is aligned with the image border, so every
+    tile has the full tile size unless the image itself is smaller.
+    """
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+
+    def positions(length: int) -> list[int]:
+        if length <= tile_size:
+            return [0]
+        starts = list(range(0, length - tile_size, stride))
+        starts.append(length - tile_size)
+        return starts
+
+    tiles = []
+    for top in positions(image_height):
+        for left in positions(image_width):
+            tiles.append(
+                (
+                    left,
+                    top,
+                    min(left + tile_size, image_width),
+                    min(top + tile_size, image_height),
+                )
+            )
+    return tiles
+
+
+def crop_tiles(
+    image: Image.Image, tiles: list[tuple[int, int, int, int]]
+) -> list[bytes]:
+    """
+    Crops the tiles out of the image and encodes each of them as jpeg,
+    ready to be sent to the detection backend.
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    tile_images = []
+    for tile in tiles:
+        byte_stream = io.BytesIO()
+        image.crop(tile).save(byte_stream, format="JPEG", quality=95)
+        tile_images.append(byte_stream.getvalue())
+    return tile_images
+
+
+def map_tile_predictions(
+    tile_predictions: list,
+    tile: tuple[int, int, int, int],
+    image_width: int,
+    image_height: int,
+) -> list[DetectionPrediction]:
+    """
+    Converts the predictions of a tile (bounding boxes relative to the tile)
+    into predictions relative to the full image.
+    """
+    left, top, right, bottom = tile
+    tile_width = right - left
+    tile_height = bottom - top
+
+    mapped = []
+    for prediction in tile_predictions:
+        box = prediction.bounding_box
+        mapped.append(
+            DetectionPrediction(
+                tag_name=prediction.tag_name,
+                probability=prediction.probability,
+                bounding_box=PredictionBoundingBox(
+                    left=(left + box.left * tile_width) / image_width,
+                    top=(top + box.top * tile_height) / image_height,
+                    width=box.width * tile_width / image_width,
+                    height=box.height * tile_height / image_height,
+                ),
+            )
+        )
+    return mapped
+
+
+def non_max_suppression(
+    boxes: np.ndarray, scores: np.ndarray, iou_threshold: float
+) -> np.ndarray:
+    """
+    Greedy non-maximum suppression.
+
+    parameters:
+    - boxes: np.ndarray - [N, 4] boxes as (x1, y1, x2, y2)
+    - scores: np.ndarray - [N] confidence of each box
+
+    returns the indices of the boxes to keep, highest score first.
+    The overlap of the kept box with all remaining boxes is computed in one
+    vectorized step, so the loop only runs once per kept box.
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = np.argsort(-scores, kind="stable")
+
+    keep = []
+    while order.size > 0:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+
+        inter_w = np.maximum(
+            0.0, np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest])
+        )
+        inter_h = np.maximum(
+            0.0, np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest])
+        )
+        intersection = inter_w * inter_h
+        union = areas[best] + areas[rest] - intersection
+        iou = np.divide(
+            intersection, union, out=np.zeros_like(intersection), where=union > 0
+        )
+
+        order = rest[iou <= iou_threshold]
+
+    return np.asarray(keep, dtype=np.int64)
+
+
+def merge_tile_predictions(
+    predictions: list[DetectionPrediction], iou_threshold: float
+) -> list[DetectionPrediction]:
+    """
+    Merges the duplicate detections found on the tile borders.
+    Boxes are only suppressed by boxes with the same label.
+    """
+    if len(predictions) == 0:
+        return []
+
+    boxes = np.array(
+        [
+            (
+                p.bounding_box.left,
+                p.bounding_box.top,
+                p.bounding_box.left + p.bounding_box.width,
+                p.bounding_box.top + p.bounding_box.height,
+            )
+            for p in predictions
+        ],
+        dtype=np.float64,
+    )
+    scores = np.array([p.probability for p in predictions], dtype=np.float64)
+
+    # offset each label into its own region so that boxes with different
+    # labels never overlap, then a single suppression pass covers all labels
+    label_ids = {}
+    labels = np.array(
+        [label_ids.setdefault(p.tag_name.lower(), len(label_ids)) for p in predictions],
+        dtype=np.float64,
+    )
+    offset_boxes = boxes + (labels * 2.0)[:, np.newaxis]
+
+    keep = non_max_suppression(offset_boxes, scores, iou_threshold)
+    return [predictions[i] for i in keep]
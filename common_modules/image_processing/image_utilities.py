@@ -6,16 +6,12 @@
 
 # IMPORT LIBRARIES
 # 1. import libraries that are part of the standard python library
-import io
 from logging import Logger
 from typing import List
 
 # 2. import libraries that require inbstallation
 from PIL import Image, ImageDraw
 
-# from the matplotlib library
-from matplotlib import pyplot as plt
-
 # 3. import my own libraries
 from common_modules.common.models import (
     AnnotatedImageData,
@@ -24,49 +20,39 @@ from common_modules.common.models import (
 )
 from common_modules.common.common_config import Config
 from common_modules.common import constants
+from common_modules.common.image_buffer import open_image_data
+from common_modules.image_processing.image_derivatives import create_image_derivatives
+from common_modules.image_processing.weed_coverage import blend_heatmap
 
 
-def mark_image_with_rectangle(
-    image_data: bytes,
-    image_properties: list[GrassPredictionData],
-    config: Config,
-    logger: Logger,
-    markWhat: constants.DetectionType = constants.DetectionType.WEED,
-) -> AnnotatedImageData:
+def get_marked_color(name: str, config: Config) -> str:
     """
-    Marks the image with rectangles around detected objects.
-    It called after an image has been processed by the model
-    and the detected objects are returned.
-
-    parameters:
-    - image_data: bytes - the image im PIL format
-    - image_properties: list[GrassPredictionData] - the detected objects
+    Returns the color used to mark the detected objects with the given label.
     """
+    color: str = None
+    if name == constants.DETECTED_TYPE_GRASS:
+        color = config.get(constants.COLOR_CODE_GRASS)
+    elif name == constants.DETECTED_TYPE_WEED:
+        color = config.get(constants.COLOR_CODE_WEED)
 
-    logger.debug("marking detected areas of the image with rectangles...")
-
-    # open the image from the url to mark the detected areas
-    byte_stream = io.BytesIO(image_data)
-
-    # Open the image file
-    image = Image.open(byte_stream)
+    # if color is not found in the configuration, use the default color
+    if color == "" or color == None:
+        color = constants.COLOR_LIST.get(name, constants.DEFAULT_MARKED_COLOR)
 
-    # get basic image properties
-    # the image dimensions are given as a tuple (width, height)
-    image_width = image.size[0]
-    image_height = image.size[1]
+    return color
 
-    # prepare the plotting for the inmemory editing to take place
-    fig = plt.figure(figsize=(image.width / 100, image.height / 100))
-    plt.axis("off")
-    draw = ImageDraw.Draw(image)
-
-    color = constants.BOUNDING_BOX_COLOR_GRASS
 
+def compute_marked_areas(
+    image_width: int,
+    image_height: int,
+    image_properties: list[GrassPredictionData],
+    config: Config,
+) -> list[MarkedDetectedArea]:
+    """
+    Returns the areas to mark for the detected objects, with the bounding
+    boxes in pixels of the image. Nothing is drawn, e.g. for the live feed.
+    """
     marked_areas = []
-
-    count = 0
-    # Draw object bounding box
     for detected_object in image_properties:
         rect = detected_object.bounding_box
 
@@ -93,34 +79,97 @@ def mark_image_with_rectangle(
             ),
         )
 
-        color: str = None
-        if detected_object.name == constants.DETECTED_TYPE_GRASS:
-            color = config.get(constants.COLOR_CODE_GRASS)
-        elif detected_object.name == constants.DETECTED_TYPE_WEED:
-            color = config.get(constants.COLOR_CODE_WEED)
-
-        # if color is not found in the configuration, use the default color
-        if color == "" or color == None:
-            color = constants.COLOR_LIST[detected_object.name]
-
-        draw.rectangle(bounding_box, outline=color, width=7)
-
         marked_area = MarkedDetectedArea(
             name=detected_object.name,
             confidence_level=detected_object.confidence_level,
-            marked_color=color,
+            marked_color=get_marked_color(detected_object.name, config),
             bounding_box=bounding_box,
         )
         marked_areas.append(marked_area)
-        count += 1
+
+    return marked_areas
+
+
+def mark_image_with_rectangle(
+    image_data: bytes,
+    image_properties: list[GrassPredictionData],
+    config: Config,
+    logger: Logger,
+    markWhat: constants.DetectionType = constants.DetectionType.WEED,
+    heatmap: any = None,
+    output_filename: str = None,
+) -> AnnotatedImageData:
+    """
+    Marks the image with rectangles around detected objects.
+    It called after an image has been processed by the model
+    and the detected objects are returned.
+
+    parameters:
+    - image_data: bytes, memoryview or ImageBuffer - the encoded image
+    - image_properties: list[GrassPredictionData] - the detected objects
+    - heatmap: the weed density grid (see weed_coverage), blended into the image
+    - output_filename: str - where to save the annotated image, defaults to
+      PredictionsImageFileName
+    """
+
+    logger.debug("marking detected areas of the image with rectangles...")
+
+    # open the image to mark the detected areas, the decoder reads the
+    # image data in chunks, without a copy of all of it
+    image = Image.open(open_image_data(image_data))
+    if image.mode not in ("RGB", "L"):
+        # e.g. a png with transparency, the annotated image is saved as jpeg
+        image = image.convert("RGB")
+
+    # get basic image properties
+    # the image dimensions are given as a tuple (width, height)
+    image_width = image.size[0]
+    image_height = image.size[1]
+
+    # tint the image with the weed density, under the rectangles
+    if heatmap is not None:
+        image = blend_heatmap(
+            image,
+            heatmap,
+            get_marked_color(constants.DETECTED_TYPE_WEED, config),
+            config.get_float(
+                constants.CONFIG_COVERAGE_HEATMAP_OPACITY,
+                constants.DEFAULT_COVERAGE_HEATMAP_OPACITY,
+            ),
+        )
+
+    draw = ImageDraw.Draw(image)
+
+    marked_areas = compute_marked_areas(
+        image_width, image_height, image_properties, config
+    )
+
+    # Draw object bounding box
+    for marked_area in marked_areas:
+        draw.rectangle(
+            marked_area.bounding_box, outline=marked_area.marked_color, width=7
+        )
 
     # save the image with the marked areas
-    # Save annotated image
-    plt.imshow(image)
-    plt.tight_layout(pad=0)
-    fig.savefig(config.get(constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME))
+    # the image is saved as is, plotting it in a matplotlib figure of the same
+    # size gave the same file but converted the image to float rgba arrays
+    # on the way, more than 1 GB for a 12 megapixel photo
+    image_filename = output_filename or config.get(
+        constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME
+    )
+    image.save(image_filename)
+    del draw
+
+    # smaller and webp copies of the annotated image, e.g. for mobile clients
+    derivative_files = []
+    if config.get_bool(constants.CONFIG_IMAGE_DERIVATIVES_ENABLED):
+        derivative_files = create_image_derivatives(
+            image, image_filename, config, logger
+        )
 
-    annotated_image_data = AnnotatedImageData(image=image, marked_areas=marked_areas)
+    annotated_image_data = AnnotatedImageData(
+        image=image, marked_areas=marked_areas, derivative_files=derivative_files
+    )
 
     logger.debug("--------- image processing complete. ------------")
     return annotated_image_data
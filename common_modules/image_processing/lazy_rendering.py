@@ -0,0 +1,484 @@
+####################################################################
+# Lazy rendering of the annotated images.
+# Many clients only read the prediction details and never fetch the
+# annotated image, yet every analysis decoded the image, drew the boxes,
+# encoded the jpeg and uploaded it. With LazyRenderingEnabled the
+# analysis saves a render manifest (<image>.render) instead:
+# - the source image, the name of the test image or a copy of the
+#   uploaded image (<image>.source), saved as it is without decoding it
+# - the selected predictions, the detection type and the heatmap
+# The copy of an uploaded image is uploaded in the background with
+# write-behind. Without write-behind it stays on the local disk until the
+# image is rendered, the analysis only uploads the manifest; an image that
+# is read after the local copy was lost (e.g. a new instance) can't be
+# rendered.
+# The marked areas of the details only need the size of the image,
+# which is read from the image header.
+#
+# The annotated image (and its derivatives) is rendered the first time
+# it is read, saved like an eagerly rendered image and the manifest is
+# marked as rendered, later reads get the saved file. The state of an
+# image (rendered, or no manifest because it was rendered eagerly) is
+# trusted for MANIFEST_CACHE_SECONDS, the reads don't get the manifest
+# from the storage each time. After that the stored manifest is read
+# again: another worker may have saved a newer analysis under the name.
+# Concurrent first reads of an image are coalesced: one of them renders
+# it, the others wait for it and read the result. A newer analysis saved
+# under the same name replaces the manifest, its image is rendered again
+# on the next read.
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+import base64
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from logging import Logger
+
+# 2. import libraries that require inbstallation
+import numpy as np
+from PIL import Image
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.image_buffer import image_data_view, open_image_data
+from common_modules.common.models import (
+    AnnotatedImageData,
+    GrassPredictionData,
+    PredictionBoundingBox,
+)
+from common_modules.common.serialization import dumps_json_bytes
+from common_modules.image_processing.image_utilities import (
+    compute_marked_areas,
+    mark_image_with_rectangle,
+)
+
+MANIFEST_EXTENSION = ".render"
+SOURCE_EXTENSION = ".source"
+# images whose state is kept in memory, the rendered ones are forgotten
+# first, their manifest is read again the next time they are requested
+MAX_TRACKED_IMAGES = 10000
+# seconds the known state of an image is trusted, an analysis of another
+# worker saved under its name is found after that
+MANIFEST_CACHE_SECONDS = 10.0
+
+
+def encode_heatmap(heatmap: np.ndarray) -> dict:
+    """
+    Encodes the heatmap (0-1 per cell) as one byte per cell, the blend
+    uses 8 bit alpha values anyway.
+    """
+    if heatmap is None:
+        return None
+    cells = np.clip(np.rint(heatmap * 255), 0, 255).astype(np.uint8)
+    return {
+        "shape": list(cells.shape),
+        "data": base64.b64encode(cells.tobytes()).decode("ascii"),
+    }
+
+
+def decode_heatmap(encoded: dict) -> np.ndarray:
+    if encoded is None:
+        return None
+    cells = np.frombuffer(base64.b64decode(encoded["data"]), dtype=np.uint8)
+    return cells.reshape(encoded["shape"]).astype(np.float32) / 255
+
+
+class RenderEntry:
+    """
+    State of one annotated image. The lock is held while its manifest is
+    saved or its image rendered, users counts the threads using the entry.
+    checked is the time the manifest was known to be the stored one.
+    """
+
+    __slots__ = ("lock", "manifest", "rendered", "rendering", "users", "checked")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.manifest = None
+        self.rendered = False
+        self.rendering = False
+        self.users = 0
+        self.checked = 0.0
+
+    def current(self) -> bool:
+        return time.monotonic() - self.checked < MANIFEST_CACHE_SECONDS
+
+
+class LazyRenderer:
+    """
+    Defers the rendering of the annotated images until they are read.
+
+    usage:
+        lazy_renderer = LazyRenderer.from_config(config, logger, storage_helper)
+        if lazy_renderer is not None:
+            # analysis: marked areas without an annotated image
+            annotated_image_data = lazy_renderer.defer(filename, image_data, ...)
+            # read: renders the image if it wasn't yet
+            lazy_renderer.ensure_rendered(filename)
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        logger: Logger,
+        storage_helper,
+        write_behind=None,
+        render_pool=None,
+    ) -> None:
+        self.config = config
+        self.logger = logger
+        self.storage_helper = storage_helper
+        self.write_behind = write_behind
+        self.render_pool = render_pool
+
+        self.lock = threading.Lock()
+        # image name -> RenderEntry, least recently used first
+        self.entries = OrderedDict()
+        # image name -> time its manifest was found missing, oldest first
+        self.missing_manifests = OrderedDict()
+        self.deferred = 0
+        self.rendered = 0
+        self.coalesced = 0
+        self.cached = 0
+        self.superseded = 0
+        self.render_duration = 0.0
+
+    @staticmethod
+    def from_config(
+        config: Config,
+        logger: Logger,
+        storage_helper,
+        write_behind=None,
+        render_pool=None,
+    ) -> "LazyRenderer":
+        """
+        Creates the lazy renderer, None if it is not enabled.
+        """
+        if not config.get_bool(constants.CONFIG_LAZY_RENDERING_ENABLED):
+            return None
+        return LazyRenderer(config, logger, storage_helper, write_behind, render_pool)
+
+    def acquire(self, filename: str) -> RenderEntry:
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None:
+                entry = self.entries[filename] = RenderEntry()
+            self.entries.move_to_end(filename)
+            entry.users += 1
+            return entry
+
+    def release(self, filename: str, entry: RenderEntry) -> None:
+        with self.lock:
+            entry.users -= 1
+            if entry.users == 0 and entry.manifest is None:
+                # not a lazily rendered image, don't keep it
+                self.entries.pop(filename, None)
+            if len(self.entries) > MAX_TRACKED_IMAGES:
+                for name, other in list(self.entries.items()):
+                    if len(self.entries) <= MAX_TRACKED_IMAGES:
+                        break
+                    if other.users == 0:
+                        del self.entries[name]
+
+    def defer(
+        self,
+        filename: str,
+        image_data: any,
+        image_properties: list[GrassPredictionData],
+        markWhat: constants.DetectionType = constants.DetectionType.WEED,
+        heatmap: np.ndarray = None,
+        test_image: str = None,
+    ) -> AnnotatedImageData:
+        """
+        Saves the render manifest of the annotated image instead of rendering it.
+        Returns the marked areas, without an image or derivatives.
+
+        parameters:
+        - filename: str - name of the annotated image
+        - image_data: bytes, memoryview or ImageBuffer - the encoded image
+        - test_image: str - name of the test image the image data was read
+          from, the image data isn't saved again
+        """
+        # only the header is read, the image is not decoded
+        image_width, image_height = Image.open(open_image_data(image_data)).size
+        marked_areas = compute_marked_areas(
+            image_width, image_height, image_properties, self.config
+        )
+
+        manifest = {
+            "id": uuid.uuid4().hex,
+            "source": None,
+            "detection_type": markWhat.name,
+            "predictions": [
+                [
+                    p.name,
+                    float(p.confidence_level),
+                    [
+                        float(p.bounding_box.left),
+                        float(p.bounding_box.top),
+                        float(p.bounding_box.width),
+                        float(p.bounding_box.height),
+                    ],
+                ]
+                for p in image_properties
+            ],
+            "heatmap": encode_heatmap(heatmap),
+            "rendered": False,
+        }
+
+        entry = self.acquire(filename)
+        try:
+            # a render of the previous analysis saved under this name finishes
+            # first, it doesn't overwrite the new source or manifest
+            with entry.lock:
+                if test_image is not None:
+                    manifest["source"] = {"test_image": test_image}
+                else:
+                    source_filename = filename + SOURCE_EXTENSION
+                    with open(source_filename, "wb") as f:
+                        f.write(image_data_view(image_data))
+                    if self.write_behind is not None:
+                        self.write_behind.enqueue(source_filename)
+                        manifest["source"] = {"prediction_file": source_filename}
+                    else:
+                        # not uploaded, the analysis waits for a single upload
+                        manifest["source"] = {"local_file": source_filename}
+                self.save_manifest(filename, manifest)
+
+                superseded = entry.manifest is not None and not entry.rendered
+                entry.manifest = manifest
+                entry.rendered = False
+                entry.checked = time.monotonic()
+        finally:
+            self.release(filename, entry)
+
+        with self.lock:
+            self.missing_manifests.pop(filename, None)
+            self.deferred += 1
+            if superseded:
+                self.superseded += 1
+        self.logger.debug(f"LazyRenderer - rendering of {filename} deferred.")
+
+        return AnnotatedImageData(image=None, marked_areas=marked_areas)
+
+    def ensure_rendered(self, filename: str) -> bool:
+        """
+        Renders and saves the annotated image if its rendering was deferred
+        and it wasn't rendered yet. Returns False if the image was not
+        analyzed with lazy rendering, it is read as it is.
+        """
+        with self.lock:
+            entry = self.entries.get(filename)
+            if (
+                entry is not None
+                and entry.rendered
+                and not entry.rendering
+                and entry.current()
+            ):
+                self.entries.move_to_end(filename)
+                self.cached += 1
+                return True
+            missing_since = self.missing_manifests.get(filename)
+            if (
+                missing_since is not None
+                and time.monotonic() - missing_since < MANIFEST_CACHE_SECONDS
+            ):
+                return False
+        entry = self.acquire(filename)
+        try:
+            # another request is rendering the image, wait for it
+            waited = entry.rendering
+            with entry.lock:
+                if entry.manifest is None or not entry.current():
+                    # e.g. the app was restarted since the analysis, or another
+                    # worker saved a newer analysis (or rendered it)
+                    if not self.load_stored_manifest(filename, entry):
+                        return False
+
+                if entry.rendered:
+                    with self.lock:
+                        if waited:
+                            self.coalesced += 1
+                        else:
+                            self.cached += 1
+                    return True
+
+                entry.rendering = True
+                try:
+                    entry.manifest = self.render(filename, entry.manifest)
+                finally:
+                    entry.rendering = False
+                entry.rendered = True
+                entry.checked = time.monotonic()
+                return True
+        finally:
+            self.release(filename, entry)
+
+    def load_stored_manifest(self, filename: str, entry: RenderEntry) -> bool:
+        """
+        Updates the entry from the stored manifest. Called with the lock of
+        the entry held. Returns False if there is no manifest.
+        """
+        stored = self.read_manifest(filename)
+        if stored is None:
+            entry.manifest = None
+            entry.rendered = False
+            self.remember_missing_manifest(filename)
+            return False
+
+        if entry.manifest is None or stored["id"] != entry.manifest["id"]:
+            entry.manifest = stored
+            entry.rendered = stored.get("rendered", False)
+        elif stored.get("rendered", False):
+            entry.rendered = True
+        entry.checked = time.monotonic()
+        return True
+
+    def remember_missing_manifest(self, filename: str) -> None:
+        with self.lock:
+            self.missing_manifests.pop(filename, None)
+            self.missing_manifests[filename] = time.monotonic()
+            while len(self.missing_manifests) > MAX_TRACKED_IMAGES:
+                self.missing_manifests.popitem(last=False)
+
+    def render(self, filename: str, manifest: dict) -> dict:
+        """
+        Renders the annotated image of the manifest and saves it with its
+        derivatives. Returns the manifest marked as rendered.
+        """
+        start = time.perf_counter()
+        image_data = self.read_source(manifest["source"])
+        image_properties = [
+            GrassPredictionData(name, confidence_level, PredictionBoundingBox(*box))
+            for name, confidence_level, box in manifest["predictions"]
+        ]
+        markWhat = constants.DetectionType[manifest["detection_type"]]
+        heatmap = decode_heatmap(manifest.get("heatmap"))
+
+        if self.render_pool is not None:
+            annotated_image_data = self.render_pool.render(
+                image_data,
+                image_properties,
+                markWhat,
+                heatmap=heatmap,
+                output_filename=filename,
+            )
+        else:
+            annotated_image_data = mark_image_with_rectangle(
+                image_data,
+                image_properties,
+                self.config,
+                self.logger,
+                markWhat,
+                heatmap,
+                filename,
+            )
+        annotated_image_data.release()
+
+        for image_filename in [filename, *annotated_image_data.derivative_files]:
+            self.save_file(image_filename)
+        manifest = {**manifest, "rendered": True}
+        self.save_manifest(filename, manifest)
+        if "local_file" in manifest["source"]:
+            # the annotated image is saved, the local copy isn't needed anymore
+            os.remove(manifest["source"]["local_file"])
+
+        duration = time.perf_counter() - start
+        with self.lock:
+            self.rendered += 1
+            self.render_duration += duration
+        self.logger.debug(
+            f"LazyRenderer - {filename} rendered on first read in {duration * 1000:.1f} ms."
+        )
+        return manifest
+
+    def read_source(self, source: dict) -> bytes:
+        if "test_image" in source:
+            return self.storage_helper.read_test_data_image_with_url_anonymous(
+                source["test_image"]
+            )
+        if "local_file" in source:
+            try:
+                with open(source["local_file"], "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                raise FileNotFoundError(
+                    f"source image not found on this instance: {source['local_file']}"
+                )
+        image_data = self.read_prediction_file(source["prediction_file"])
+        if image_data is None:
+            raise FileNotFoundError(
+                f"source image not found: {source['prediction_file']}"
+            )
+        return image_data
+
+    def read_manifest(self, filename: str) -> dict:
+        """
+        Returns the saved manifest of the image, None if there is none.
+        """
+        data = self.read_prediction_file(filename + MANIFEST_EXTENSION)
+        if data is None:
+            return None
+        return json.loads(data)
+
+    def read_prediction_file(self, filename: str) -> bytes:
+        """
+        Reads the saved file, from the write-behind spool if its upload is
+        still pending. None if the file doesn't exist.
+        """
+        if self.write_behind is not None:
+            data = self.write_behind.read_pending(filename)
+            if data is not None:
+                return data
+        path = self.storage_helper.prediction_file_path(filename)
+        if path is not None:
+            with open(path, "rb") as f:
+                return f.read()
+        try:
+            return self.storage_helper.read_prediction_image(filename)
+        except Exception as e:
+            # e.g. ResourceNotFoundError (azure storage), FileNotFoundError (local)
+            self.logger.debug(f"LazyRenderer - unable to read {filename}: {e}")
+            return None
+
+    def save_manifest(self, filename: str, manifest: dict) -> None:
+        manifest_filename = filename + MANIFEST_EXTENSION
+        with open(manifest_filename, "wb") as f:
+            f.write(dumps_json_bytes(manifest))
+        self.save_file(manifest_filename)
+
+    def save_file(self, filename: str) -> None:
+        """
+        Uploads the local file to the prediction storage, in the background
+        when write-behind is enabled.
+        """
+        if self.write_behind is not None:
+            self.write_behind.enqueue(filename)
+        else:
+            self.storage_helper.write_prediction_image(filename)
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "deferred": self.deferred,
+                "rendered": self.rendered,
+                # the deferred images nobody has read (yet)
+                "renders_avoided": max(0, self.deferred - self.rendered),
+                # replaced by a newer analysis before they were read
+                "superseded": self.superseded,
+                "coalesced": self.coalesced,
+                "cached": self.cached,
+                "average_render_milliseconds": (
+                    round(self.render_duration / self.rendered * 1000, 2)
+                    if self.rendered > 0
+                    else None
+                ),
+                "tracked_images": len(self.entries),
+                "missing_manifests": len(self.missing_manifests),
+            }
@@ -0,0 +1,187 @@
+####################################################################
+# Process pool for rendering the annotated images.
+# mark_image_with_rectangle() decodes, draws and encodes the image, all
+# CPU bound work that holds the GIL. Rendering in a pool of worker
+# processes lets concurrent requests use all the cores of the machine.
+#
+# The image bytes are handed over to the worker through shared memory
+# instead of being pickled. The worker saves the annotated image and its
+# derivatives itself, only the marked areas and the names of the saved
+# files are sent back.
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from logging import Logger
+from multiprocessing.shared_memory import SharedMemory
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config, StaticConfig
+from common_modules.common.image_buffer import image_data_view
+from common_modules.common.models import (
+    AnnotatedImageData,
+    GrassPredictionData,
+    PredictionBoundingBox,
+)
+from common_modules.image_processing.image_utilities import mark_image_with_rectangle
+
+# configuration values used while rendering, copied to the worker processes
+RENDER_CONFIG_KEYS = [
+    constants.COLOR_CODE_GRASS,
+    constants.COLOR_CODE_WEED,
+    constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME,
+    constants.CONFIG_IMAGE_DERIVATIVES_ENABLED,
+    constants.CONFIG_IMAGE_DERIVATIVE_SIZES,
+    constants.CONFIG_IMAGE_DERIVATIVE_FORMATS,
+    constants.CONFIG_IMAGE_DERIVATIVE_QUALITY,
+    constants.CONFIG_COVERAGE_HEATMAP_OPACITY,
+]
+
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """
+    Attaches to a shared memory block created by the parent process.
+    The parent owns (and unlinks) the block. Spawned workers share the
+    resource tracker of the parent, so registering the block again from the
+    worker is harmless. Python 3.13 and later can skip the tracking altogether.
+    """
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=name, track=False)
+    return SharedMemory(name=name)
+
+
+def render_in_worker(
+    shared_memory_name: str,
+    size: int,
+    prediction_rows: list[tuple],
+    config: StaticConfig,
+    mark_what: str,
+    heatmap: any = None,
+    output_filename: str = None,
+) -> tuple:
+    """
+    Runs in the worker process, renders the image found in shared memory.
+    """
+    logger = logging.getLogger(__name__)
+    image_properties = [
+        GrassPredictionData(name, confidence_level, PredictionBoundingBox(*box))
+        for name, confidence_level, box in prediction_rows
+    ]
+
+    shared_memory = attach_shared_memory(shared_memory_name)
+    try:
+        with shared_memory.buf[:size] as image_data:
+            annotated_image_data = mark_image_with_rectangle(
+                image_data,
+                image_properties,
+                config,
+                logger,
+                constants.DetectionType[mark_what],
+                heatmap,
+                output_filename,
+            )
+    finally:
+        shared_memory.close()
+
+    return annotated_image_data.marked_areas, annotated_image_data.derivative_files
+
+
+def warm_up_worker() -> None:
+    """
+    Nothing to do, the imports of this module are the expensive part.
+    """
+    return None
+
+
+class AnnotationRenderPool:
+    """
+    Renders annotated images in a pool of worker processes.
+    """
+
+    def __init__(self, config: Config, logger: Logger, pool_size: int) -> None:
+        self.logger = logger
+        self.pool_size = pool_size
+        self.worker_config = config.snapshot(RENDER_CONFIG_KEYS)
+
+        # spawn fresh interpreters, forking a process with running threads
+        # (uvicorn, azure sdk) is not safe
+        self.executor = ProcessPoolExecutor(
+            max_workers=pool_size, mp_context=multiprocessing.get_context("spawn")
+        )
+        self.logger.debug(f"AnnotationRenderPool - started with {pool_size} workers.")
+
+    def warm_up(self) -> None:
+        """
+        Starts all the worker processes, so the first requests don't pay for it.
+        """
+        futures = [
+            self.executor.submit(warm_up_worker) for _ in range(self.pool_size)
+        ]
+        for future in futures:
+            future.result()
+
+    def render(
+        self,
+        image_data: any,
+        image_properties: list[GrassPredictionData],
+        markWhat: constants.DetectionType = constants.DetectionType.WEED,
+        timeout: float = None,
+        heatmap: any = None,
+        output_filename: str = None,
+    ) -> AnnotatedImageData:
+        """
+        Same as mark_image_with_rectangle(), but rendered by a worker process.
+        The decoded image stays in the worker, so the returned
+        AnnotatedImageData has no image.
+        Raises concurrent.futures.TimeoutError if the image is not rendered
+        within timeout seconds.
+        """
+        prediction_rows = [
+            (
+                p.name,
+                p.confidence_level,
+                (
+                    p.bounding_box.left,
+                    p.bounding_box.top,
+                    p.bounding_box.width,
+                    p.bounding_box.height,
+                ),
+            )
+            for p in image_properties
+        ]
+
+        size = len(image_data)
+        shared_memory = SharedMemory(create=True, size=max(1, size))
+        try:
+            shared_memory.buf[:size] = image_data_view(image_data)
+            future = self.executor.submit(
+                render_in_worker,
+                shared_memory.name,
+                size,
+                prediction_rows,
+                self.worker_config,
+                markWhat.name,
+                heatmap,
+                output_filename,
+            )
+            try:
+                marked_areas, derivative_files = future.result(timeout=timeout)
+            except BaseException:
+                # don't start rendering an image nobody waits for anymore
+                future.cancel()
+                raise
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+
+        return AnnotatedImageData(
+            image=None, marked_areas=marked_areas, derivative_files=derivative_files
+        )
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,80 @@
+####################################################################
+# This file contains the utility functions that are used to process
+# the uploaded videos: decoding and sampling the frames, and the
+# perceptual hash used to skip frames that are nearly identical.
+####################################################################
+
+# IMPORT LIBRARIES
+# 1. import libraries that are part of the standard python library
+import io
+from typing import BinaryIO, Iterator
+
+# 2. import libraries that require inbstallation
+import av
+import numpy as np
+
+# size of the difference hash, 8x8 = 64 bits
+HASH_SIZE = 8
+
+
+def sample_video_frames(
+    video_file: BinaryIO, sample_fps: float
+) -> Iterator[tuple[float, av.VideoFrame]]:
+    """
+    Decodes the first video stream of the file and yields (timestamp, frame)
+    for the frames sampled at sample_fps frames per second of video.
+    The timestamp is in seconds from the start of the video.
+
+    The frames are not converted to images here, frames that end up being
+    skipped never pay for the conversion.
+    """
+    sample_interval = 1.0 / sample_fps if sample_fps > 0 else 0.0
+
+    with av.open(video_file, mode="r") as container:
+        stream = container.streams.video[0]
+        # decode with multiple threads where the codec supports it
+        stream.thread_type = "AUTO"
+
+        next_sample_time = 0.0
+        for frame in container.decode(stream):
+            if frame.time is None:
+                continue
+            if frame.time + 1e-6 < next_sample_time:
+                continue
+
+            yield frame.time, frame
+            next_sample_time = frame.time + sample_interval
+
+
+def difference_hash(frame: av.VideoFrame) -> int:
+    """
+    Returns the 64 bit difference hash (dHash) of the frame.
+    The frame is scaled down to 9x8 grayscale pixels by the decoder and each
+    bit tells whether a pixel is brighter than its right neighbour, so small
+    changes (noise, compression, slight movement) keep most bits the same.
+    """
+    pixels = frame.reformat(
+        width=HASH_SIZE + 1, height=HASH_SIZE, format="gray"
+    ).to_ndarray()
+
+    # the decoder may pad the rows, only keep the pixels of the 9x8 image
+    pixels = pixels[:HASH_SIZE, : HASH_SIZE + 1].astype(np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """
+    Returns the number of bits that differ between the two hashes.
+    """
+    return (hash1 ^ hash2).bit_count()
+
+
+def encode_frame(frame: av.VideoFrame, quality: int = 90) -> bytes:
+    """
+    Encodes the frame as a jpeg, the format the detector expects for still images.
+    """
+    buffer = io.BytesIO()
+    frame.to_image().save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
@@ -0,0 +1,147 @@
+####################################################################
+# Weed coverage and density heatmap of an analyzed image.
+# All the weed boxes returned by the detection backend are rasterized
+# into a small grid over the image (e.g. 64x64 cells), each box weighted
+# by its confidence. The boxes are added with a 2D difference array: the
+# four corners of every box are accumulated in one np.bincount and two
+# cumulative sums turn the corners into filled boxes, so the cost doesn't
+# grow with the size of the boxes and there is no loop per box.
+#
+# The value of a cell is the chance that it holds weed, assuming the
+# boxes covering it are independent: 1 - prod(1 - confidence). The
+# product is computed as a sum of logs, which the difference array can
+# accumulate. The coverage is the average of the cells.
+####################################################################
+
+# IMPORT LIBRARIES
+# 2. import libraries that require inbstallation
+import numpy as np
+from PIL import Image
+
+# 3. import my own libraries
+from common_modules.common import constants
+
+# a box with confidence 1.0 would add log(0)
+MAX_CONFIDENCE = 0.999999
+
+
+class WeedCoverage:
+    """
+    Coverage of the image by the detected label.
+
+    - coverage: percentage of the image covered, weighted by confidence
+    - detections: number of boxes that were rasterized
+    - heatmap: grid_size x grid_size array with the chance (0-1) of each cell
+    """
+
+    __slots__ = ("coverage", "detections", "heatmap")
+
+    def __init__(self, coverage: float, detections: int, heatmap: np.ndarray) -> None:
+        self.coverage = coverage
+        self.detections = detections
+        self.heatmap = heatmap
+
+
+def label_boxes(
+    predictions: list, label: str, min_confidence: float = 0.0
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the boxes (left, top, width, height as a fraction of the image)
+    and the confidences of the predictions with the label, as arrays.
+    """
+    label = label.lower()
+    rows = [
+        (
+            p.bounding_box.left,
+            p.bounding_box.top,
+            p.bounding_box.width,
+            p.bounding_box.height,
+            p.probability,
+        )
+        for p in predictions
+        if p.probability >= min_confidence and p.tag_name.lower() == label
+    ]
+    if len(rows) == 0:
+        return np.empty((0, 4), dtype=np.float64), np.empty(0, dtype=np.float64)
+
+    values = np.array(rows, dtype=np.float64)
+    return values[:, :4], values[:, 4]
+
+
+def rasterize_boxes(
+    boxes: np.ndarray, values: np.ndarray, grid_size: int
+) -> np.ndarray:
+    """
+    Adds the value of each box to the grid cells it covers and returns the
+    grid_size x grid_size grid. A cell is covered if its center is inside
+    the box, a box smaller than a cell still covers the cell it is in.
+    """
+    if len(boxes) == 0:
+        return np.zeros((grid_size, grid_size), dtype=np.float64)
+
+    left = np.clip(boxes[:, 0], 0.0, 1.0)
+    top = np.clip(boxes[:, 1], 0.0, 1.0)
+    right = np.clip(boxes[:, 0] + boxes[:, 2], 0.0, 1.0)
+    bottom = np.clip(boxes[:, 1] + boxes[:, 3], 0.0, 1.0)
+
+    # first and last + 1 cell of each box
+    def cells(position: np.ndarray) -> np.ndarray:
+        return np.floor(position * grid_size + 0.5).astype(np.int64)
+
+    x0 = np.minimum(cells(left), grid_size - 1)
+    y0 = np.minimum(cells(top), grid_size - 1)
+    x1 = np.clip(cells(right), x0 + 1, grid_size)
+    y1 = np.clip(cells(bottom), y0 + 1, grid_size)
+
+    # +value at the top left and bottom right corners, -value at the other two
+    stride = grid_size + 1
+    corners = np.concatenate(
+        (y0 * stride + x0, y0 * stride + x1, y1 * stride + x0, y1 * stride + x1)
+    )
+    weights = np.concatenate((values, -values, -values, values))
+    difference = np.bincount(corners, weights=weights, minlength=stride * stride)
+
+    difference = difference.reshape(stride, stride)
+    return difference.cumsum(axis=0).cumsum(axis=1)[:grid_size, :grid_size]
+
+
+def compute_weed_coverage(
+    predictions: list,
+    grid_size: int = constants.DEFAULT_COVERAGE_GRID_SIZE,
+    min_confidence: float = constants.DEFAULT_COVERAGE_MIN_CONFIDENCE,
+    label: str = constants.DETECTED_TYPE_WEED,
+) -> WeedCoverage:
+    """
+    Computes the coverage of the image by the label from all the predictions
+    returned by the detection backend, not only the top n.
+    """
+    boxes, confidences = label_boxes(predictions, label, min_confidence)
+
+    # sum of log(1 - confidence) of the boxes covering each cell
+    log_miss = rasterize_boxes(
+        boxes, np.log1p(-np.minimum(confidences, MAX_CONFIDENCE)), grid_size
+    )
+    # the cumulative sums leave rounding errors around 0
+    heatmap = np.clip(-np.expm1(log_miss), 0.0, 1.0)
+
+    return WeedCoverage(
+        coverage=round(float(heatmap.mean()) * 100, 2),
+        detections=len(confidences),
+        heatmap=heatmap.astype(np.float32),
+    )
+
+
+def blend_heatmap(
+    image: Image.Image, heatmap: np.ndarray, color: str, opacity: float
+) -> Image.Image:
+    """
+    Tints the image with the color, the tint of each cell grows with its
+    value in the heatmap. Returns the blended image.
+    """
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+
+    alpha = np.clip(heatmap * opacity * 255, 0, 255).astype(np.uint8)
+    mask = Image.fromarray(alpha).resize(image.size, Image.BILINEAR)
+    image.paste(color, (0, 0, image.width, image.height), mask)
+    return image
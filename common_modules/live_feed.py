@@ -0,0 +1,152 @@
+#####################################################################
+# Analysis of a live camera feed over a websocket.
+# The client sends jpeg frames as binary messages and receives the
+# marked areas of each analyzed frame. A single frame is analyzed at a
+# time, if the client sends frames faster than they can be analyzed,
+# the oldest waiting frame is dropped so the results stay close to live.
+# A text message closes the connection (1003, unsupported data).
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import asyncio
+import io
+import time
+from logging import Logger
+
+# 2. import azure libraries and other third party libraries
+from fastapi import WebSocket, WebSocketDisconnect, status
+from PIL import Image
+
+# 3. import my own libraries
+from common_modules.common.common_config import Config
+from common_modules.common.models import MarkedDetectedArea
+from common_modules.grass_weed_detection import GrassWeedDetector
+from common_modules.image_processing.image_utilities import compute_marked_areas
+
+
+class LatestFrameSlot:
+    """
+    Holds the latest frame waiting to be analyzed.
+    Putting a frame into a full slot replaces (drops) the waiting frame.
+    """
+
+    def __init__(self) -> None:
+        self.frame = None
+        self.available = asyncio.Event()
+
+    def put(self, frame_number: int, frame_data: bytes) -> bool:
+        """
+        Stores the frame, returns True if a waiting frame was dropped.
+        """
+        dropped = self.frame is not None
+        self.frame = (frame_number, frame_data)
+        self.available.set()
+        return dropped
+
+    async def get(self) -> tuple[int, bytes]:
+        await self.available.wait()
+        frame = self.frame
+        self.frame = None
+        self.available.clear()
+        return frame
+
+
+class LiveFeedSession:
+    """
+    Analyzes the frames received on one websocket connection.
+
+    For each analyzed frame the client receives:
+    - frame: number of the frame, counting the received frames from 1
+    - detected_details: the marked areas, bounding boxes in pixels of the frame
+    - stats: received, processed and dropped frames, and processed frames per second
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        detector: GrassWeedDetector,
+        config: Config,
+        logger: Logger,
+        top_n: int,
+    ) -> None:
+        self.websocket = websocket
+        self.detector = detector
+        self.config = config
+        self.logger = logger
+        self.top_n = top_n
+
+        self.slot = LatestFrameSlot()
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.started = time.monotonic()
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "fps": round(self.processed / elapsed, 2) if elapsed > 0 else 0.0,
+        }
+
+    async def analyze_frame(self, frame_data: bytes) -> list[MarkedDetectedArea]:
+        # Custom Vision is called from the event loop, the local model in a thread
+        predictions = await self.detector.detect_async(frame_data, self.top_n)
+        # only the header is read, the frame is decoded by the detector
+        image_width, image_height = Image.open(io.BytesIO(frame_data)).size
+        return compute_marked_areas(
+            image_width, image_height, predictions, self.config
+        )
+
+    async def receive_frames(self) -> None:
+        while True:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            frame_data = message.get("bytes")
+            if frame_data is None:
+                self.logger.info("live feed - text message received, closing.")
+                await self.websocket.close(
+                    code=status.WS_1003_UNSUPPORTED_DATA,
+                    reason="frames are sent as binary messages",
+                )
+                return
+            self.received += 1
+            if self.slot.put(self.received, frame_data):
+                self.dropped += 1
+
+    async def process_frames(self) -> None:
+        while True:
+            frame_number, frame_data = await self.slot.get()
+            try:
+                marked_areas = await self.analyze_frame(frame_data)
+                self.processed += 1
+                message = {
+                    "frame": frame_number,
+                    "detected_details": [area.to_dict() for area in marked_areas],
+                }
+            except Exception as e:
+                self.logger.error(f"live feed - unable to analyze frame: {e}")
+                message = {"frame": frame_number, "error": "unable to analyze frame"}
+
+            message["stats"] = self.stats()
+            await self.websocket.send_json(message)
+
+    async def run(self) -> None:
+        """
+        Receives and analyzes frames until the client disconnects.
+        """
+        receiver = asyncio.create_task(self.receive_frames())
+        processor = asyncio.create_task(self.process_frames())
+        try:
+            done, _ = await asyncio.wait(
+                [receiver, processor], return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                task.result()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            receiver.cancel()
+            processor.cancel()
+            self.logger.info(f"live feed closed - {self.stats()}")
@@ -0,0 +1,114 @@
+#####################################################################
+# Analysis of the videos recorded by the mowers.
+# Frames are sampled from the video at a configurable rate, frames that
+# are nearly identical to the last analyzed frame are skipped, and the
+# remaining frames are sent to the detector a few at a time.
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from logging import Logger
+from typing import BinaryIO
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.models import VideoAnalysisDetails, VideoFrameDetections
+from common_modules.grass_weed_detection import GrassWeedDetector
+from common_modules.image_processing.video_utilities import (
+    difference_hash,
+    encode_frame,
+    hamming_distance,
+    sample_video_frames,
+)
+
+
+class VideoAnalyzer:
+    def __init__(
+        self, config: Config, logger: Logger, detector: GrassWeedDetector
+    ) -> None:
+        self.config = config
+        self.logger = logger
+        self.detector = detector
+        self.sample_fps = config.get_float(
+            constants.CONFIG_VIDEO_SAMPLE_FPS, constants.DEFAULT_VIDEO_SAMPLE_FPS
+        )
+        self.duplicate_hash_distance = config.get_int(
+            constants.CONFIG_VIDEO_DUPLICATE_HASH_DISTANCE,
+            constants.DEFAULT_VIDEO_DUPLICATE_HASH_DISTANCE,
+        )
+        self.max_concurrency = max(
+            1,
+            config.get_int(
+                constants.CONFIG_VIDEO_MAX_CONCURRENCY,
+                constants.DEFAULT_VIDEO_MAX_CONCURRENCY,
+            ),
+        )
+
+    def analyze(self, video_file: BinaryIO, top_n: int) -> VideoAnalysisDetails:
+        """
+        Analyzes the sampled frames of the video and returns the detections
+        of each analyzed frame, ordered by timestamp.
+
+        parameters:
+        - video_file: file object with the video, e.g. the uploaded file
+        - top_n: int - number of predictions to keep for each label in a frame
+        """
+        self.logger.debug(
+            f"VideoAnalyzer.analyze() - sampling frames at {self.sample_fps} fps..."
+        )
+
+        sampled_frames = 0
+        skipped_frames = 0
+        duration = 0.0
+        last_hash = None
+        pending = []
+
+        # the decoder waits while max_concurrency frames are being analyzed,
+        # so a long video doesn't pile up encoded frames in memory
+        slots = threading.BoundedSemaphore(self.max_concurrency)
+
+        def detect_frame(frame_data: bytes) -> list:
+            try:
+                # the frames of a video are bulk work next to single image uploads
+                with self.detector.analysis_slot(constants.AnalysisPriority.BATCH):
+                    return self.detector.detect(frame_data, top_n)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for timestamp, frame in sample_video_frames(video_file, self.sample_fps):
+                sampled_frames += 1
+                duration = timestamp
+
+                frame_hash = difference_hash(frame)
+                if (
+                    last_hash is not None
+                    and hamming_distance(frame_hash, last_hash)
+                    <= self.duplicate_hash_distance
+                ):
+                    skipped_frames += 1
+                    continue
+                last_hash = frame_hash
+
+                frame_data = encode_frame(frame)
+                slots.acquire()
+                pending.append((timestamp, executor.submit(detect_frame, frame_data)))
+
+            frames = [
+                VideoFrameDetections(timestamp, future.result())
+                for timestamp, future in pending
+            ]
+
+        self.logger.debug(
+            f"VideoAnalyzer.analyze() - sampled frames: {sampled_frames}, skipped: {skipped_frames}, analyzed: {len(frames)}"
+        )
+
+        return VideoAnalysisDetails(
+            timestamp=datetime.today().strftime("%Y-%m-%d %H:%M:%S"),
+            duration=duration,
+            sampled_frames=sampled_frames,
+            skipped_frames=skipped_frames,
+            frames=frames,
+        )
@@ -0,0 +1,583 @@
+#####################################################################
+# Watch folder mode of the command line app, e.g. on the edge box of
+# the camera rig where the images land in a folder continuously.
+#
+# - the folder is watched with filesystem events (inotify through
+#   watchdog, when it is installed) and scanned at an interval, the scan
+#   picks up the files written while the app was down, missed events and
+#   the files to retry. Without watchdog only the scan is used (polling).
+# - an image is analyzed once it is fully written: its writer closed it,
+#   or its size and modification time haven't changed for a while
+# - a few workers analyze the images, the queue in front of them is
+#   bounded so a burst of images doesn't pile up in memory
+# - the results are uploaded in batches, the uploaded images are then
+#   appended to the checkpoint in one write, a restart skips them
+# - an image that can't be analyzed (e.g. rejected by the pre-screen, or
+#   a truncated jpeg after a few attempts) is added to the checkpoint
+#   with its error, it is analyzed again once it is written again
+#####################################################################
+# 1. import libraries that are part of the standard python library
+import json
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+
+# 2. import azure libraries and other third party libraries
+from PIL import UnidentifiedImageError
+
+# 3. import my own libraries
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.grass_weed_detection import BatchImageAnalysis, GrassWeedDetector
+from common_modules.image_processing.image_prescreen import ImageRejectedError
+
+# filesystem events are optional, without watchdog the folder is polled
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# tells the workers and the uploader that there are no more images
+END_OF_ITEMS = None
+
+# errors that would happen again for the same file, the file isn't retried
+PERMANENT_ERRORS = (ImageRejectedError, UnidentifiedImageError)
+
+# analyses of a file that fail with another error, e.g. a truncated jpeg
+# (OSError) or an unreachable detection backend, before it is given up
+MAX_ANALYSIS_ATTEMPTS = 3
+
+# parallel uploads of a batch
+UPLOAD_THREADS = 4
+
+
+class WatchCheckpoint:
+    """
+    The processed files, one json line per file with its path (relative to
+    the folder), size and modification time. A file that is written again
+    gets a new modification time and is processed again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.files = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line was cut short by a crash
+                        continue
+                    self.files[entry["path"]] = (entry["size"], entry["mtime"])
+
+    def is_processed(self, path: str, size: int, mtime: int) -> bool:
+        with self.lock:
+            return self.files.get(path) == (size, mtime)
+
+    def add(self, entries: list[dict]) -> None:
+        """
+        Appends the entries (path, size, mtime, optional error) in one write.
+        """
+        if len(entries) == 0:
+            return
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            for entry in entries:
+                self.files[entry["path"]] = (entry["size"], entry["mtime"])
+
+    def compact(self, existing_paths: set) -> None:
+        """
+        Rewrites the checkpoint without the files removed from the folder.
+        """
+        with self.lock:
+            self.files = {
+                path: value
+                for path, value in self.files.items()
+                if path in existing_paths
+            }
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w") as f:
+                for path, (size, mtime) in self.files.items():
+                    f.write(json.dumps({"path": path, "size": size, "mtime": mtime}))
+                    f.write("\n")
+            os.replace(temp_path, self.path)
+
+
+class WatchResult:
+    """
+    An analyzed image waiting for its upload.
+    """
+
+    __slots__ = ("path", "size", "mtime", "analysis")
+
+    def __init__(
+        self, path: str, size: int, mtime: int, analysis: BatchImageAnalysis
+    ) -> None:
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.analysis = analysis
+
+    def checkpoint_entry(self) -> dict:
+        return {"path": self.path, "size": self.size, "mtime": self.mtime}
+
+
+class WatchEventHandler(FileSystemEventHandler):
+    """
+    Passes the file events of the observer to the watcher.
+    """
+
+    def __init__(self, watcher: "FolderWatcher") -> None:
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event) -> None:
+        if not event.is_directory:
+            self.watcher.notice_file(event.src_path)
+
+    def on_modified(self, event) -> None:
+        if not event.is_directory:
+            self.watcher.notice_file(event.src_path)
+
+    def on_closed(self, event) -> None:
+        # closed after writing, the file is complete
+        if not event.is_directory:
+            self.watcher.notice_file(event.src_path, closed=True)
+
+    def on_moved(self, event) -> None:
+        # e.g. written to a temporary name, then renamed
+        if not event.is_directory:
+            self.watcher.notice_file(event.dest_path, closed=True)
+
+
+class FolderWatcher:
+    """
+    Analyzes the new images in the folder until it is stopped.
+
+    usage:
+        watcher = FolderWatcher(config, logger, detector, "/data/camera")
+        watcher.start()
+        ...
+        watcher.stop()
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        logger: Logger,
+        detector: GrassWeedDetector,
+        folder: str = None,
+        top_n: int = 1,
+    ) -> None:
+        self.config = config
+        self.logger = logger
+        self.detector = detector
+        self.top_n = top_n
+
+        self.folder = os.path.abspath(
+            folder
+            or config.get(constants.CONFIG_WATCH_FOLDER)
+            or constants.DEFAULT_WATCH_FOLDER
+        )
+        if not os.path.isdir(self.folder):
+            raise ValueError(f"folder not found: {self.folder}")
+
+        self.use_events = Observer is not None and not config.get_bool(
+            constants.CONFIG_WATCH_USE_POLLING
+        )
+        if self.use_events:
+            self.scan_interval = config.get_float(
+                constants.CONFIG_WATCH_SCAN_SECONDS,
+                constants.DEFAULT_WATCH_SCAN_SECONDS,
+            )
+        else:
+            self.scan_interval = config.get_float(
+                constants.CONFIG_WATCH_POLL_SECONDS,
+                constants.DEFAULT_WATCH_POLL_SECONDS,
+            )
+        self.settle_seconds = config.get_float(
+            constants.CONFIG_WATCH_SETTLE_SECONDS,
+            constants.DEFAULT_WATCH_SETTLE_SECONDS,
+        )
+        self.workers = max(
+            1,
+            config.get_int(
+                constants.CONFIG_WATCH_WORKERS, constants.DEFAULT_WATCH_WORKERS
+            ),
+        )
+        self.output_prefix = (
+            config.get(constants.CONFIG_WATCH_OUTPUT_PREFIX)
+            or constants.DEFAULT_WATCH_OUTPUT_PREFIX
+        )
+        self.batch_size = config.get_int(
+            constants.CONFIG_WATCH_UPLOAD_BATCH_SIZE,
+            constants.DEFAULT_WATCH_UPLOAD_BATCH_SIZE,
+        )
+        self.batch_seconds = config.get_float(
+            constants.CONFIG_WATCH_UPLOAD_BATCH_SECONDS,
+            constants.DEFAULT_WATCH_UPLOAD_BATCH_SECONDS,
+        )
+        self.checkpoint = WatchCheckpoint(
+            config.get(constants.CONFIG_WATCH_CHECKPOINT_PATH)
+            or constants.DEFAULT_WATCH_CHECKPOINT_PATH
+        )
+
+        self.lock = threading.Lock()
+        # files that may still be written: path -> (size, mtime, closed)
+        self.pending = {}
+        # queued, analyzed or uploading files, not in the checkpoint yet
+        self.in_flight = set()
+        # failed analyses of the files: path -> (size, mtime, attempts)
+        self.failed_attempts = {}
+        self.work_queue = queue.Queue(
+            maxsize=max(
+                1,
+                config.get_int(
+                    constants.CONFIG_WATCH_QUEUE_SIZE,
+                    constants.DEFAULT_WATCH_QUEUE_SIZE,
+                ),
+            )
+        )
+        self.upload_queue = queue.Queue()
+        self.stopping = threading.Event()
+        self.observer = None
+        self.threads = []
+        self.upload_executor = None
+        self.temp_folder = None
+
+        self.analyzed = 0
+        self.failed = 0
+        self.uploaded = 0
+        self.batches = 0
+
+    def relative_path(self, path: str) -> str:
+        """
+        Returns the path relative to the folder, None if it isn't an image.
+        """
+        relative_path = os.path.relpath(path, self.folder).replace(os.sep, "/")
+        if relative_path.startswith("../"):
+            return None
+        if not relative_path.lower().endswith(constants.IMAGE_EXTENSIONS):
+            return None
+        return relative_path
+
+    def notice_file(self, path: str, closed: bool = False) -> None:
+        """
+        Adds the file to the pending files, it is queued once fully written.
+        """
+        relative_path = self.relative_path(path)
+        if relative_path is None:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        if self.checkpoint.is_processed(relative_path, stat.st_size, stat.st_mtime_ns):
+            return
+
+        with self.lock:
+            if relative_path in self.in_flight:
+                return
+            previous = self.pending.get(relative_path)
+            if closed or previous is None or previous[:2] != (
+                stat.st_size,
+                stat.st_mtime_ns,
+            ):
+                self.pending[relative_path] = (stat.st_size, stat.st_mtime_ns, closed)
+
+    def scan(self) -> set:
+        """
+        Notices all the images in the folder, returns their paths.
+        """
+        paths = set()
+        for root, _, filenames in os.walk(self.folder):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                relative_path = self.relative_path(path)
+                if relative_path is not None:
+                    paths.add(relative_path)
+                    self.notice_file(path)
+        return paths
+
+    def queue_settled_files(self) -> None:
+        """
+        Queues the pending files that are fully written: closed by their writer,
+        or unchanged since the last check and not modified for settle seconds.
+        """
+        with self.lock:
+            pending = list(self.pending.items())
+
+        for relative_path, (size, mtime, closed) in pending:
+            try:
+                stat = os.stat(os.path.join(self.folder, relative_path))
+            except FileNotFoundError:
+                with self.lock:
+                    self.pending.pop(relative_path, None)
+                continue
+
+            changed = (stat.st_size, stat.st_mtime_ns) != (size, mtime)
+            age = time.time() - stat.st_mtime_ns / 1e9
+            if changed or stat.st_size == 0 or not (
+                closed or age >= self.settle_seconds
+            ):
+                if changed:
+                    with self.lock:
+                        self.pending[relative_path] = (
+                            stat.st_size,
+                            stat.st_mtime_ns,
+                            False,
+                        )
+                continue
+
+            with self.lock:
+                if self.pending.get(relative_path, (None, None))[:2] != (size, mtime):
+                    # noticed again in the meantime, checked next time
+                    continue
+                del self.pending[relative_path]
+                if relative_path in self.in_flight:
+                    continue
+                self.in_flight.add(relative_path)
+            # waits while the workers are busy
+            self.work_queue.put((relative_path, size, mtime))
+
+    def start(self) -> None:
+        self.temp_folder = tempfile.mkdtemp(prefix="watch-")
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=UPLOAD_THREADS, thread_name_prefix="watch-upload"
+        )
+
+        # forget the files that are gone, then pick up the ones not processed yet
+        self.checkpoint.compact(self.scan())
+
+        threads = [
+            threading.Thread(target=self.run_watch, name="watch-folder"),
+            threading.Thread(target=self.run_uploader, name="watch-upload"),
+        ]
+        for _ in range(self.workers):
+            threads.append(
+                threading.Thread(target=self.run_worker, name="watch-worker")
+            )
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.threads = threads
+
+        if self.use_events:
+            self.observer = Observer()
+            self.observer.schedule(WatchEventHandler(self), self.folder, recursive=True)
+            self.observer.start()
+
+        self.logger.info(
+            f"watching {self.folder} ({'events' if self.use_events else 'polling'})"
+        )
+
+    def stop(self) -> None:
+        """
+        Stops watching, the queued images are analyzed and uploaded.
+        """
+        self.stopping.set()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+
+        watch_thread, upload_thread, *worker_threads = self.threads
+        watch_thread.join()
+        for _ in worker_threads:
+            self.work_queue.put(END_OF_ITEMS)
+        for worker_thread in worker_threads:
+            worker_thread.join()
+        self.upload_queue.put(END_OF_ITEMS)
+        upload_thread.join()
+
+        self.upload_executor.shutdown()
+        shutil.rmtree(self.temp_folder, ignore_errors=True)
+
+    def run_watch(self) -> None:
+        next_scan = time.monotonic() + self.scan_interval
+        # checks the pending files a few times per settle period
+        check_interval = min(max(self.settle_seconds / 4, 0.05), 1.0)
+        while not self.stopping.wait(check_interval):
+            if time.monotonic() >= next_scan:
+                self.scan()
+                next_scan = time.monotonic() + self.scan_interval
+            self.queue_settled_files()
+
+    def run_worker(self) -> None:
+        while True:
+            item = self.work_queue.get()
+            if item is END_OF_ITEMS:
+                return
+            relative_path, size, mtime = item
+            try:
+                result = self.analyze(relative_path, size, mtime)
+            except PERMANENT_ERRORS as e:
+                self.logger.warning(f"watch - {relative_path} can't be analyzed: {e}")
+                self.give_up(relative_path, size, mtime, e)
+            except Exception as e:
+                attempts = self.count_failed_attempt(relative_path, size, mtime)
+                if attempts >= MAX_ANALYSIS_ATTEMPTS:
+                    self.logger.warning(
+                        f"watch - analysis of {relative_path} failed {attempts} times: {e}"
+                    )
+                    self.give_up(relative_path, size, mtime, e)
+                else:
+                    # retried at the next scan
+                    self.logger.warning(
+                        f"watch - analysis of {relative_path} failed: {e}"
+                    )
+                    self.finish([relative_path], failed=1)
+            else:
+                with self.lock:
+                    self.analyzed += 1
+                    self.failed_attempts.pop(relative_path, None)
+                self.upload_queue.put(result)
+
+    def count_failed_attempt(self, relative_path: str, size: int, mtime: int) -> int:
+        """
+        Returns the number of failed analyses of the file, including this one.
+        """
+        with self.lock:
+            previous_size, previous_mtime, attempts = self.failed_attempts.get(
+                relative_path, (size, mtime, 0)
+            )
+            if (previous_size, previous_mtime) != (size, mtime):
+                # written again since
+                attempts = 0
+            self.failed_attempts[relative_path] = (size, mtime, attempts + 1)
+            return attempts + 1
+
+    def give_up(
+        self, relative_path: str, size: int, mtime: int, error: Exception
+    ) -> None:
+        """
+        Adds the file to the checkpoint with its error, it isn't retried.
+        """
+        self.checkpoint.add(
+            [
+                {
+                    "path": relative_path,
+                    "size": size,
+                    "mtime": mtime,
+                    "error": str(error),
+                }
+            ]
+        )
+        with self.lock:
+            self.failed_attempts.pop(relative_path, None)
+        self.finish([relative_path], failed=1)
+
+    def analyze(self, relative_path: str, size: int, mtime: int) -> WatchResult:
+        with open(os.path.join(self.folder, relative_path), "rb") as f:
+            image_data = f.read()
+
+        analysis = self.detector.detect_batch_image(image_data, self.top_n)
+        self.detector.save_batch_image(
+            image_data,
+            analysis,
+            f"{self.output_prefix}/{relative_path}",
+            self.temp_folder,
+        )
+        return WatchResult(relative_path, size, mtime, analysis)
+
+    def run_uploader(self) -> None:
+        batch = []
+        batch_started = None
+        while True:
+            timeout = None
+            if batch:
+                batch_end = batch_started + self.batch_seconds
+                timeout = max(0.0, batch_end - time.monotonic())
+            try:
+                result = self.upload_queue.get(timeout=timeout)
+            except queue.Empty:
+                result = None
+                timed_out = True
+            else:
+                timed_out = False
+                if result is END_OF_ITEMS:
+                    self.upload_batch(batch)
+                    return
+
+            if result is not None:
+                if not batch:
+                    batch_started = time.monotonic()
+                batch.append(result)
+            if batch and (timed_out or len(batch) >= self.batch_size):
+                self.upload_batch(batch)
+                batch = []
+
+    def upload_result(self, result: WatchResult) -> None:
+        self.detector.upload_batch_image(result.analysis, self.temp_folder)
+
+    def upload_batch(self, batch: list[WatchResult]) -> None:
+        """
+        Uploads the results of the batch in parallel, then adds the uploaded
+        images to the checkpoint in one write.
+        """
+        if len(batch) == 0:
+            return
+
+        futures = [
+            (self.upload_executor.submit(self.upload_result, result), result)
+            for result in batch
+        ]
+        uploaded = []
+        for future, result in futures:
+            try:
+                future.result()
+                uploaded.append(result)
+            except Exception as e:
+                # retried at the next scan
+                self.logger.warning(f"watch - upload of {result.path} failed: {e}")
+
+        self.checkpoint.add([result.checkpoint_entry() for result in uploaded])
+
+        for result in uploaded:
+            self.detector.record_analysis(result.analysis.details)
+
+        for result in batch:
+            for path in result.analysis.local_files:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        with self.lock:
+            self.uploaded += len(uploaded)
+            self.batches += 1
+        self.finish(
+            [result.path for result in batch], failed=len(batch) - len(uploaded)
+        )
+        self.logger.info(f"watch - uploaded {len(uploaded)}/{len(batch)} results")
+
+    def finish(self, relative_paths: list[str], failed: int = 0) -> None:
+        with self.lock:
+            self.in_flight.difference_update(relative_paths)
+            self.failed += failed
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "folder": self.folder,
+                "mode": "events" if self.use_events else "polling",
+                "pending": len(self.pending),
+                "in_flight": len(self.in_flight),
+                "queued": self.work_queue.qsize(),
+                "analyzed": self.analyzed,
+                "uploaded": self.uploaded,
+                "failed": self.failed,
+                "upload_batches": self.batches,
+            }
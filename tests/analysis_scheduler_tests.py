@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.analysis_scheduler import (
+    AnalysisScheduler,
+    parse_class_values,
+)
+from common_modules.common.deadline import Deadline, DeadlineExceededError
+
+INTERACTIVE = constants.AnalysisPriority.INTERACTIVE
+BATCH = constants.AnalysisPriority.BATCH
+BACKGROUND = constants.AnalysisPriority.BACKGROUND
+
+
+class TestAnalysisScheduler:
+    """
+    Unit tests for the priority scheduling of the analyses.
+    """
+
+    def run_queued(self, scheduler, priorities):
+        """
+        Queues the analyses while the only slot is taken, then returns
+        the order in which they ran.
+        """
+        order = []
+
+        def analyze(priority):
+            with scheduler.slot(priority):
+                order.append(priority)
+
+        scheduler.acquire(INTERACTIVE)
+        threads = [threading.Thread(target=analyze, args=(p,)) for p in priorities]
+        for thread in threads:
+            thread.start()
+        while sum(len(c.waiting) for c in scheduler.classes.values()) < len(threads):
+            time.sleep(0.01)
+        scheduler.release(INTERACTIVE)
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_slots_are_shared_by_weight(self):
+        scheduler = AnalysisScheduler(1, {INTERACTIVE: 4, BATCH: 1})
+
+        order = self.run_queued(scheduler, [BATCH] * 10 + [INTERACTIVE] * 10)
+
+        # 4 interactive analyses for each batch analysis while both are waiting
+        assert order[:10].count(INTERACTIVE) == 8
+        assert order[:10].count(BATCH) == 2
+
+    def test_class_limit_caps_running_analyses(self):
+        scheduler = AnalysisScheduler(3, limits={BATCH: 1})
+        scheduler.acquire(BATCH)
+
+        deadline = Deadline(0.05)
+        with pytest.raises(DeadlineExceededError):
+            scheduler.acquire(BATCH, deadline)
+
+        metrics = scheduler.metrics()["classes"]["batch"]
+        assert metrics["running"] == 1
+        assert metrics["waiting"] == 0
+        assert metrics["timed_out"] == 1
+
+    def test_async_waiters_are_granted_by_weight(self):
+        scheduler = AnalysisScheduler(1, {INTERACTIVE: 4, BATCH: 1})
+        priorities = [BATCH] * 10 + [INTERACTIVE] * 10
+        order = []
+
+        async def analyze(priority):
+            await scheduler.acquire_async(priority)
+            with scheduler.held_slot(priority):
+                order.append(priority)
+                await asyncio.sleep(0)
+
+        async def run():
+            # all the waiters share the thread of the event loop
+            scheduler.acquire(INTERACTIVE)
+            tasks = [asyncio.create_task(analyze(p)) for p in priorities]
+            while sum(len(c.waiting) for c in scheduler.classes.values()) < 20:
+                await asyncio.sleep(0.01)
+            scheduler.release(INTERACTIVE)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(run())
+
+        assert order[:10].count(INTERACTIVE) == 8
+        assert order[:10].count(BATCH) == 2
+
+    def test_async_waiter_leaves_the_queue(self):
+        scheduler = AnalysisScheduler(1)
+
+        async def run():
+            scheduler.acquire(INTERACTIVE)
+            with pytest.raises(DeadlineExceededError):
+                await scheduler.acquire_async(BATCH, Deadline(0.05))
+
+            # e.g. the client disconnected
+            task = asyncio.create_task(scheduler.acquire_async(BATCH))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            scheduler.release(INTERACTIVE)
+            await asyncio.wait_for(scheduler.acquire_async(BATCH), 1)
+
+        asyncio.run(run())
+
+        metrics = scheduler.metrics()["classes"]["batch"]
+        assert metrics["running"] == 1
+        assert metrics["waiting"] == 0
+        assert metrics["timed_out"] == 1
+
+    def test_parse_class_values(self):
+        assert parse_class_values("interactive:8, Batch:2", "Weights") == {
+            INTERACTIVE: 8,
+            BATCH: 2,
+        }
+        assert parse_class_values(None, "Limits") == {}
+        with pytest.raises(ValueError, match="SchedulerWeights"):
+            parse_class_values("urgent:1", constants.CONFIG_SCHEDULER_WEIGHTS)
+        with pytest.raises(ValueError, match="SchedulerClassLimits.*batch"):
+            parse_class_values("batch", constants.CONFIG_SCHEDULER_CLASS_LIMITS)
@@ -0,0 +1,294 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.image_buffer import ImageBuffer
+from common_modules.detection.async_prediction_client import (
+    DEFAULT_HTTP_TIMEOUT,
+    AsyncCustomVisionPredictionClient,
+    PredictionHttpError,
+)
+from common_modules.detection.detection_backends import CustomVisionDetectionBackend
+from common_modules.detection.prediction_routing import is_target_error
+
+httpx = pytest.importorskip("httpx")
+
+PREDICTION_KEY = "test-key"
+PREDICTION_PATH = (
+    "/customvision/v3.0/Prediction/project-1/detect/iterations/iteration-1/image"
+)
+
+
+class PredictionHttpServer(ThreadingHTTPServer):
+    # the default listen backlog (5) drops connections of a burst of calls
+    request_queue_size = 128
+
+
+class FakePredictionServer:
+    """
+    Local stand-in for a Custom Vision prediction resource.
+    Answers with one Weed prediction per call, after delay seconds, or with
+    the status and an error body when status is set.
+    """
+
+    def __init__(self, delay: float = 0.0, status: int = 200) -> None:
+        self.delay = delay
+        self.status = status
+        self.requests = []
+        self.connections = set()
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                with server.lock:
+                    server.requests.append((self.path, dict(self.headers), body))
+                    server.connections.add(self.client_address)
+                time.sleep(server.delay)
+                if server.status != 200:
+                    payload = {"code": "Error", "message": "no prediction"}
+                elif (
+                    self.path != PREDICTION_PATH
+                    or self.headers["Prediction-Key"] != PREDICTION_KEY
+                ):
+                    self.send_error(404)
+                    return
+                else:
+                    payload = {
+                        "id": "1",
+                        "project": "project-1",
+                        "iteration": "iteration-1",
+                        "predictions": [
+                            {
+                                "probability": 0.9,
+                                "tagId": "t1",
+                                "tagName": "Weed",
+                                "boundingBox": {
+                                    "left": 0.1,
+                                    "top": 0.2,
+                                    "width": 0.3,
+                                    "height": 0.4,
+                                },
+                            }
+                        ],
+                    }
+                data = json.dumps(payload).encode()
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = PredictionHttpServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.endpoint = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    fake_server = FakePredictionServer()
+    yield fake_server
+    fake_server.close()
+
+
+def detect(client, image_data, timeout=None):
+    return client.detect_image("project-1", "iteration-1", image_data, timeout)
+
+
+class TestAsyncCustomVisionPredictionClient:
+    """
+    Runs the async prediction client against a local fake prediction server.
+    """
+
+    def test_image_is_posted_and_predictions_parsed(self, server):
+        async def run():
+            client = AsyncCustomVisionPredictionClient(server.endpoint, PREDICTION_KEY)
+            try:
+                return await detect(client, b"jpeg bytes")
+            finally:
+                await client.aclose()
+
+        (prediction,) = asyncio.run(run())
+
+        assert prediction.tag_name == "Weed"
+        assert prediction.probability == 0.9
+        assert prediction.bounding_box.left == 0.1
+        assert prediction.bounding_box.height == 0.4
+        path, headers, body = server.requests[0]
+        assert path == PREDICTION_PATH
+        assert headers["Content-Type"] == "application/octet-stream"
+        assert body == b"jpeg bytes"
+
+    def test_image_buffer_is_sent(self, server):
+        async def run():
+            client = AsyncCustomVisionPredictionClient(server.endpoint, PREDICTION_KEY)
+            try:
+                with ImageBuffer.from_bytes(b"buffered jpeg") as image_buffer:
+                    return await detect(client, image_buffer)
+            finally:
+                await client.aclose()
+
+        assert len(asyncio.run(run())) == 1
+        assert server.requests[0][2] == b"buffered jpeg"
+
+    def test_error_status_is_raised(self, server):
+        server.status = 400
+
+        async def run():
+            client = AsyncCustomVisionPredictionClient(server.endpoint, PREDICTION_KEY)
+            try:
+                return await detect(client, b"jpeg bytes")
+            finally:
+                await client.aclose()
+
+        with pytest.raises(PredictionHttpError) as error:
+            asyncio.run(run())
+
+        assert error.value.status_code == 400
+        assert "no prediction" in str(error.value)
+        # an invalid image fails on every target
+        assert not is_target_error(error.value)
+        assert is_target_error(PredictionHttpError(503, "unavailable"))
+
+    def test_timeout_limits_the_call(self, server):
+        server.delay = 1.0
+
+        async def run():
+            client = AsyncCustomVisionPredictionClient(server.endpoint, PREDICTION_KEY)
+            try:
+                return await detect(client, b"jpeg bytes", timeout=0.1)
+            finally:
+                await client.aclose()
+
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            asyncio.run(run())
+        assert time.monotonic() - started < 0.9
+
+    def test_call_without_deadline_has_a_default_timeout(self, server):
+        async def run():
+            client = AsyncCustomVisionPredictionClient(server.endpoint, PREDICTION_KEY)
+            try:
+                await detect(client, b"jpeg bytes")
+                return client.client.timeout
+            finally:
+                await client.aclose()
+
+        timeout = asyncio.run(run())
+
+        assert timeout.read == DEFAULT_HTTP_TIMEOUT
+        assert timeout.connect == DEFAULT_HTTP_TIMEOUT
+
+    def test_client_of_another_loop_is_closed(self, server):
+        client = AsyncCustomVisionPredictionClient(server.endpoint, PREDICTION_KEY)
+        first_loop = asyncio.new_event_loop()
+        try:
+            first_loop.run_until_complete(detect(client, b"jpeg bytes"))
+            first_client = client.client
+
+            async def run():
+                try:
+                    return await detect(client, b"jpeg bytes")
+                finally:
+                    await client.aclose()
+
+            asyncio.run(run())
+            # the close was handed to the first loop, it runs there
+            first_loop.run_until_complete(asyncio.sleep(0.05))
+            assert first_client.is_closed
+            assert client.client is None
+        finally:
+            first_loop.close()
+
+    def test_many_calls_in_flight_on_one_thread(self, server):
+        server.delay = 0.2
+        calls = 100
+
+        async def run():
+            client = AsyncCustomVisionPredictionClient(
+                server.endpoint, PREDICTION_KEY, max_connections=50
+            )
+            try:
+                return await asyncio.gather(
+                    *(detect(client, b"jpeg bytes") for _ in range(calls))
+                )
+            finally:
+                await client.aclose()
+
+        threads = threading.active_count()
+        started = time.monotonic()
+        results = asyncio.run(run())
+        elapsed = time.monotonic() - started
+
+        assert len(results) == calls
+        # two rounds of 50 concurrent calls, one by one it would take 20 seconds
+        assert elapsed < 2.0
+        # the connections are kept open and reused
+        assert len(server.connections) <= 50
+        # no thread per call on the client side (the fake server has them)
+        assert threading.active_count() - threads < calls
+
+
+class TestCustomVisionDetectAsync:
+    """
+    Calls the Custom Vision backend with detect_async() across fake targets.
+    """
+
+    def test_failed_target_fails_over(self):
+        failing = FakePredictionServer(status=503)
+        working = FakePredictionServer()
+        try:
+            config = StaticConfig(
+                {
+                    constants.CONFIG_PROJECT_ID: "project-1",
+                    constants.CONFIG_DEPLOYED_NAME: "iteration-1",
+                    constants.CONFIG_PREDICTION_TARGETS: json.dumps(
+                        [
+                            {
+                                "name": name,
+                                "endpoint": fake_server.endpoint,
+                                "key": PREDICTION_KEY,
+                            }
+                            for name, fake_server in [
+                                ("failing", failing),
+                                ("working", working),
+                            ]
+                        ]
+                    ),
+                }
+            )
+            backend = CustomVisionDetectionBackend(config, logging.getLogger(__name__))
+
+            predictions = asyncio.run(backend.detect_async(b"jpeg bytes", timeout=5))
+
+            assert [prediction.tag_name for prediction in predictions] == ["Weed"]
+            assert len(failing.requests) == 1
+            assert len(working.requests) == 1
+            metrics = backend.router.metrics()
+            assert metrics["failing"]["errors"] == 1
+            assert metrics["working"]["calls"] == 1
+        finally:
+            failing.close()
+            working.close()
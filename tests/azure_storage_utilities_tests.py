@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 from datetime import datetime
@@ -6,7 +7,10 @@ from unittest.mock import patch
 from pydantic import Json
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from common_modules.common.azure_storage_utilities import AzureBlobStorageHelper
+from common_modules.common.azure_storage_utilities import (
+    DEFAULT_DOWNLOAD_TIMEOUT,
+    AzureBlobStorageHelper,
+)
 
 TEST_PREDICTION_DETAILS_FILENAME = "predictions.json"
 TEST_PREDICTION_IMAGE_FILENAME = "predictions.jpg"
@@ -79,3 +83,15 @@ class TestAzureBlobStorageHelper:
         assert result == {"error": TEST_FILE_NOT_FOUND}
 
     # Add more tests here using the same mock setup
+
+
+def test_anonymous_download_has_a_default_timeout():
+    helper = AzureBlobStorageHelper.__new__(AzureBlobStorageHelper)
+    helper.logger = logging.getLogger(__name__)
+
+    with patch("common_modules.common.azure_storage_utilities.requests.get") as get:
+        helper.read_image_with_url_anonymous("https://example.invalid/", "a.jpg")
+        helper.read_image_with_url_anonymous("https://example.invalid/", "a.jpg", 2)
+
+    timeouts = [call.kwargs["timeout"] for call in get.call_args_list]
+    assert timeouts == [DEFAULT_DOWNLOAD_TIMEOUT, 2]
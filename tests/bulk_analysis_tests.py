@@ -0,0 +1,130 @@
+import io
+import json
+import logging
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.bulk_analysis import BulkAnalysis
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.grass_weed_detection import GrassWeedDetector
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+IMAGE_NAMES = ["a.jpg", "b.jpg", "field-1/c.jpg", "field-1/d.png", "field-2/e.jpg"]
+
+
+def create_test_image(format: str = "JPEG") -> bytes:
+    image = Image.new("RGB", (64, 48), color=(40, 160, 40))
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format=format)
+    return byte_stream.getvalue()
+
+
+class TestBulkAnalysis:
+    """
+    Runs the bulk analysis pipeline with the local storage and the dummy onnx model.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, local_onnx_environment):
+        self.test_data = tmp_path / "test-images"
+        for name in IMAGE_NAMES:
+            path = self.test_data / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            format = "PNG" if name.endswith(".png") else "JPEG"
+            path.write_bytes(create_test_image(format))
+        (self.test_data / "notes.txt").write_text("not an image")
+
+        self.predictions = tmp_path / "predictions"
+        self.checkpoints = tmp_path / "checkpoints"
+        local_onnx_environment(
+            {
+                constants.CONFIG_BULK_CHECKPOINT_FOLDER: str(self.checkpoints),
+                constants.CONFIG_BULK_PAGE_SIZE: "2",
+                constants.CONFIG_BULK_QUEUE_SIZE: "1",
+                constants.CONFIG_BULK_CHECKPOINT_INTERVAL: "1",
+            }
+        )
+        self.config = Config()
+        self.logger = logging.getLogger(__name__)
+        self.detector = GrassWeedDetector(self.config, self.logger)
+
+    def run_job(self, job: str = "job-1", prefix: str = None) -> BulkAnalysis:
+        bulk_analysis = BulkAnalysis(
+            self.config, self.logger, self.detector, job, prefix
+        )
+        bulk_analysis.start()
+        assert bulk_analysis.done.wait(60)
+        return bulk_analysis
+
+    def read_checkpoint(self, job: str = "job-1") -> dict:
+        with open(self.checkpoints / f"{job}.json") as f:
+            return json.load(f)
+
+    def test_all_images_are_analyzed_and_uploaded(self):
+        bulk_analysis = self.run_job()
+
+        metrics = bulk_analysis.metrics()
+        assert metrics["state"] == "complete"
+        assert metrics["completed"] == len(IMAGE_NAMES)
+        assert metrics["bottleneck"] in ("download", "detect", "annotate", "upload")
+        for stage in metrics["stages"].values():
+            assert stage["processed"] == len(IMAGE_NAMES)
+            assert 0.0 <= stage["utilization"] <= 1.0
+
+        output_folder = self.predictions / "bulk" / "job-1"
+        for name in IMAGE_NAMES:
+            assert (output_folder / name).is_file()
+            details = json.loads((output_folder / (name + ".json")).read_text())
+            assert details["prediction_image_url"] == f"bulk/job-1/{name}"
+
+        checkpoint = self.read_checkpoint()
+        assert checkpoint["complete"] is True
+        assert checkpoint["processed"] == len(IMAGE_NAMES)
+        assert checkpoint["completed_through"] == "field-2/e.jpg"
+
+    def test_prefix_limits_the_images(self):
+        bulk_analysis = self.run_job(prefix="field-1/")
+
+        assert bulk_analysis.metrics()["completed"] == 2
+        assert not (self.predictions / "bulk" / "job-1" / "a.jpg").exists()
+
+    def test_resume_continues_after_the_checkpoint(self):
+        self.checkpoints.mkdir()
+        checkpoint = {"page_token": "a.jpg", "completed_through": "field-1/c.jpg"}
+        (self.checkpoints / "job-1.json").write_text(json.dumps(checkpoint))
+
+        bulk_analysis = self.run_job()
+
+        assert bulk_analysis.metrics()["completed"] == 2
+        assert not (self.predictions / "bulk" / "job-1" / "b.jpg").exists()
+        assert (self.predictions / "bulk" / "job-1" / "field-1" / "d.png").is_file()
+        assert self.read_checkpoint()["complete"] is True
+
+    def test_failed_image_is_recorded_and_skipped(self):
+        (self.test_data / "b.jpg").write_bytes(b"not a jpeg")
+
+        bulk_analysis = self.run_job()
+
+        checkpoint = self.read_checkpoint()
+        assert checkpoint["processed"] == len(IMAGE_NAMES) - 1
+        assert checkpoint["failed"] == 1
+        assert checkpoint["failures"][0]["name"] == "b.jpg"
+        assert checkpoint["failures"][0]["error"].startswith("detect")
+        assert bulk_analysis.metrics()["stages"]["upload"]["processed"] == 4
+
+    def test_completed_job_is_not_run_again(self):
+        self.run_job()
+        bulk_analysis = self.run_job()
+
+        assert bulk_analysis.metrics()["completed"] == 0
+        assert bulk_analysis.metrics()["state"] == "complete"
+
+    def test_invalid_job_name_is_refused(self):
+        with pytest.raises(ValueError):
+            BulkAnalysis(self.config, self.logger, self.detector, "../job")
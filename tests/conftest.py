@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+@pytest.fixture
+def local_onnx_environment(tmp_path, monkeypatch):
+    """
+    Runs the test in tmp_path and returns a function that configures the app
+    (environment variables) for the dummy onnx model and the local storage:
+      - test images: tmp_path/test-images
+      - prediction files: tmp_path/predictions, saved as p.jpg and p.json
+    The function takes the configuration values of the test, e.g.
+        local_onnx_environment({constants.CONFIG_LAZY_RENDERING_ENABLED: "true"})
+    """
+    monkeypatch.chdir(tmp_path)
+
+    def configure(overrides: dict = None) -> None:
+        values = {
+            constants.CONFIG_DETECTION_BACKEND: constants.DETECTION_BACKEND_ONNX,
+            constants.CONFIG_ONNX_MODEL_PATH: os.path.join(
+                TEST_DATA_DIR, "dummy_detector.onnx"
+            ),
+            constants.CONFIG_ONNX_LABELS_PATH: os.path.join(
+                TEST_DATA_DIR, "dummy_labels.txt"
+            ),
+            constants.CONFIG_STORAGE_BACKEND: constants.STORAGE_BACKEND_LOCAL_FILE,
+            constants.CONFIG_LOCAL_TEST_DATA_FOLDER: str(tmp_path / "test-images"),
+            constants.CONFIG_LOCAL_PREDICTIONS_FOLDER: str(tmp_path / "predictions"),
+            constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME: "p.jpg",
+            constants.CONFIG_DEFAULT_PREDICTION_INFO_FILE_NAME: "p.json",
+            **(overrides or {}),
+        }
+        for key, value in values.items():
+            monkeypatch.setenv(key, value)
+
+    return configure
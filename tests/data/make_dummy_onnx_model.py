@@ -0,0 +1,98 @@
+#####################################################################
+# Generates the tiny dummy object detection model used by the tests.
+# The model has the same inputs/outputs as the Custom Vision ONNX export
+# (compact [S1] domain), but always returns the same three detections.
+#
+#   python tests/data/make_dummy_onnx_model.py
+#
+# requires: pip install onnx
+#####################################################################
+import os
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_FILENAME = os.path.join(DATA_DIR, "dummy_detector.onnx")
+LABELS_FILENAME = os.path.join(DATA_DIR, "dummy_labels.txt")
+
+LABELS = ["Grass", "Weed"]
+INPUT_SIZE = 32
+
+# (x1, y1, x2, y2) as a fraction of the image size
+DETECTED_BOXES = [
+    [0.10, 0.10, 0.50, 0.50],
+    [0.50, 0.50, 0.90, 0.80],
+    [0.20, 0.60, 0.30, 0.70],
+]
+DETECTED_CLASSES = [0, 1, 0]
+DETECTED_SCORES = [0.90, 0.75, 0.005]
+
+
+def constant_node(name: str, value: np.ndarray) -> onnx.NodeProto:
+    return helper.make_node(
+        "Constant",
+        inputs=[],
+        outputs=[name],
+        value=numpy_helper.from_array(value, name=f"{name}_value"),
+    )
+
+
+def main():
+    nodes = [
+        constant_node(
+            "detected_boxes", np.array([DETECTED_BOXES], dtype=np.float32)
+        ),
+        constant_node(
+            "detected_classes", np.array([DETECTED_CLASSES], dtype=np.int64)
+        ),
+        constant_node(
+            "detected_scores", np.array([DETECTED_SCORES], dtype=np.float32)
+        ),
+    ]
+    count = len(DETECTED_SCORES)
+    graph = helper.make_graph(
+        nodes,
+        "dummy_detector",
+        inputs=[
+            helper.make_tensor_value_info(
+                "image_tensor", TensorProto.FLOAT, [1, 3, INPUT_SIZE, INPUT_SIZE]
+            )
+        ],
+        outputs=[
+            helper.make_tensor_value_info(
+                "detected_boxes", TensorProto.FLOAT, [1, count, 4]
+            ),
+            helper.make_tensor_value_info(
+                "detected_classes", TensorProto.INT64, [1, count]
+            ),
+            helper.make_tensor_value_info(
+                "detected_scores", TensorProto.FLOAT, [1, count]
+            ),
+        ],
+    )
+    model = helper.make_model(
+        graph,
+        producer_name="AIWeedDetectionAPI tests",
+        opset_imports=[helper.make_opsetid("", 13)],
+    )
+    model.ir_version = 7
+    helper.set_model_props(
+        model,
+        {
+            "Image.BitmapPixelFormat": "Rgb8",
+            "Image.NominalPixelRange": "NominalRange_0_255",
+        },
+    )
+    onnx.checker.check_model(model)
+    onnx.save(model, MODEL_FILENAME)
+
+    with open(LABELS_FILENAME, "w") as f:
+        f.write("\n".join(LABELS) + "\n")
+
+    print(f"dummy model saved to: {MODEL_FILENAME}")
+
+
+if __name__ == "__main__":
+    main()
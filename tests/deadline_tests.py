@@ -0,0 +1,202 @@
+import asyncio
+import importlib
+import io
+import logging
+import os
+import sys
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.common.deadline import (
+    Deadline,
+    DeadlineExceededError,
+    stage_timeout,
+)
+from common_modules.grass_weed_detection import GrassWeedDetector
+
+
+class TestDeadline:
+    """
+    Unit tests for the request deadline.
+    """
+
+    def test_timeout_is_the_remaining_budget(self):
+        deadline = Deadline(10)
+
+        timeout = deadline.timeout("detection")
+
+        assert 9 < timeout <= 10
+        assert stage_timeout(None, "detection") is None
+
+    def test_expired_deadline_stops_the_stage(self):
+        deadline = Deadline(0.01)
+        time.sleep(0.02)
+
+        with pytest.raises(DeadlineExceededError) as error:
+            deadline.check("upload")
+
+        assert error.value.stage == "upload"
+        assert not error.value.cancelled
+
+    def test_cancelled_deadline_stops_the_stage(self):
+        deadline = Deadline(10)
+        deadline.cancel()
+
+        assert deadline.expired
+        with pytest.raises(DeadlineExceededError) as error:
+            stage_timeout(deadline, "rendering")
+        assert error.value.cancelled
+
+
+def create_test_image() -> bytes:
+    image = Image.new("RGB", (64, 48), color=(40, 160, 40))
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format="JPEG")
+    return byte_stream.getvalue()
+
+
+class SlowDetectionBackend:
+    """
+    Wraps the detection backend of the detector, records the timeout of the
+    calls and takes the given time to answer.
+    """
+
+    def __init__(self, detection_backend, seconds: float = 0) -> None:
+        self.detection_backend = detection_backend
+        self.seconds = seconds
+        self.timeouts = []
+
+    def detect(self, image_data: bytes, timeout: float = None) -> list:
+        self.timeouts.append(timeout)
+        time.sleep(self.seconds)
+        return self.detection_backend.detect(image_data, timeout)
+
+
+class TestDeadlineStages:
+    """
+    Runs the analysis with a deadline, the dummy onnx model and the local storage.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, local_onnx_environment):
+        pytest.importorskip("onnxruntime")
+        local_onnx_environment()
+        self.detector = GrassWeedDetector(Config(), logging.getLogger(__name__))
+
+        # records the timeout of the uploads
+        self.upload_timeouts = []
+        storage_helper = self.detector.storage_helper
+        for name in ["write_prediction_details", "write_prediction_image"]:
+            write = getattr(storage_helper, name)
+
+            def write_and_record(filename, timeout=None, write=write):
+                self.upload_timeouts.append(timeout)
+                return write(filename, timeout=timeout)
+
+            setattr(storage_helper, name, write_and_record)
+
+    def test_remaining_budget_is_the_timeout_of_each_stage(self):
+        backend = SlowDetectionBackend(self.detector.detection_backend, 0.1)
+        self.detector.detection_backend = backend
+
+        self.detector.analyze(create_test_image(), 1, deadline=Deadline(10))
+
+        # details and annotated image
+        assert len(backend.timeouts) == 1
+        assert len(self.upload_timeouts) == 2
+        assert 9 < backend.timeouts[0] <= 10
+        # the detection used up a part of the budget
+        assert self.upload_timeouts[0] <= backend.timeouts[0] - 0.1
+        assert self.upload_timeouts[1] <= self.upload_timeouts[0]
+
+    def test_expired_deadline_stops_before_the_upload(self):
+        self.detector.detection_backend = SlowDetectionBackend(
+            self.detector.detection_backend, 0.3
+        )
+
+        with pytest.raises(DeadlineExceededError) as error:
+            self.detector.analyze(create_test_image(), 1, deadline=Deadline(0.1))
+
+        assert error.value.stage == "rendering"
+        assert self.upload_timeouts == []
+
+
+class DisconnectedRequest:
+    """
+    Request of a client that went away.
+    """
+
+    headers = {}
+
+    async def is_disconnected(self) -> bool:
+        return True
+
+
+class TestAnalyzeImageDeadline:
+    """
+    Calls the analysis endpoint with a slow detection backend.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, local_onnx_environment, monkeypatch):
+        pytest.importorskip("onnxruntime")
+        local_onnx_environment({constants.CONFIG_APP_VERSION: "1"})
+        (tmp_path / "test-images").mkdir()
+        (tmp_path / "test-images" / "a.jpg").write_bytes(create_test_image())
+
+        # the api reads the configuration when it is imported
+        monkeypatch.delitem(sys.modules, "api", raising=False)
+        self.api = importlib.import_module("api")
+        monkeypatch.setattr(self.api, "DISCONNECT_POLL_INTERVAL", 0.05)
+        detector = self.api.detector
+        detector.detection_backend = SlowDetectionBackend(
+            detector.detection_backend, 0.5
+        )
+
+        # the analysis runs on in the thread pool after the response
+        self.analysis_done = threading.Event()
+        analyze_now = detector.analyze_now
+
+        def analyze_now_and_signal(*args):
+            try:
+                return analyze_now(*args)
+            finally:
+                self.analysis_done.set()
+
+        monkeypatch.setattr(detector, "analyze_now", analyze_now_and_signal)
+        self.predictions = tmp_path / "predictions"
+
+    def test_expired_deadline_answers_504(self):
+        client = TestClient(self.api.app)
+
+        response = client.post(
+            "/prediction/analyze/filename/a.jpg",
+            headers={constants.REQUEST_DEADLINE_HEADER: "0.2"},
+        )
+
+        assert response.status_code == 504
+        # the analysis stops before the rendering, nothing is uploaded
+        assert self.analysis_done.wait(5)
+        assert os.listdir(self.predictions) == []
+
+    def test_disconnected_client_stops_the_analysis(self):
+        deadline = Deadline(10)
+
+        with pytest.raises(HTTPException):
+            asyncio.run(
+                self.api.PredictionEndpoint.analyze_image(
+                    DisconnectedRequest(), "a.jpg", deadline
+                )
+            )
+
+        assert deadline.cancelled
+        assert self.analysis_done.wait(5)
+        assert os.listdir(self.predictions) == []
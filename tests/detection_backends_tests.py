@@ -0,0 +1,134 @@
+import io
+import logging
+import os
+import sys
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import Config, StaticConfig
+from common_modules.detection.detection_backends import (
+    CustomVisionDetectionBackend,
+    OnnxDetectionBackend,
+    create_detection_backend,
+)
+from common_modules.grass_weed_detection import GrassWeedDetector
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+TEST_MODEL_FILENAME = os.path.join(TEST_DATA_DIR, "dummy_detector.onnx")
+TEST_LABELS_FILENAME = os.path.join(TEST_DATA_DIR, "dummy_labels.txt")
+
+
+def create_test_image(width: int = 64, height: int = 48) -> bytes:
+    image = Image.new("RGB", (width, height), color=(40, 160, 40))
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format="JPEG")
+    return byte_stream.getvalue()
+
+
+class TestOnnxDetectionBackend:
+    """
+    Unit tests for the local ONNX detection backend.
+    The bundled dummy model always returns the same three detections,
+    see tests/data/make_dummy_onnx_model.py
+    """
+
+    def setup_method(self, method):
+        self.patcher = patch.dict(
+            os.environ,
+            {
+                constants.CONFIG_DETECTION_BACKEND: constants.DETECTION_BACKEND_ONNX,
+                constants.CONFIG_ONNX_MODEL_PATH: TEST_MODEL_FILENAME,
+                constants.CONFIG_ONNX_LABELS_PATH: TEST_LABELS_FILENAME,
+            },
+        )
+        self.patcher.start()
+        self.config = Config()
+        self.logger = logging.getLogger(__name__)
+
+    def teardown_method(self, method):
+        self.patcher.stop()
+
+    def test_create_detection_backend_selects_onnx(self):
+        backend = create_detection_backend(self.config, self.logger)
+
+        assert isinstance(backend, OnnxDetectionBackend)
+
+    def test_create_detection_backend_defaults_to_custom_vision(self):
+        with patch.dict(
+            os.environ,
+            {
+                constants.CONFIG_DETECTION_BACKEND: "",
+                constants.CONFIG_PREDICTION_ENDPOINT: "https://localhost",
+            },
+        ):
+            backend = create_detection_backend(Config(), self.logger)
+
+        assert isinstance(backend, CustomVisionDetectionBackend)
+
+    def test_preprocess_matches_model_input(self):
+        backend = OnnxDetectionBackend(self.config, self.logger)
+
+        input_array = backend.preprocess(create_test_image())
+
+        assert input_array.shape == (1, 3, 32, 32)
+        # the dummy model expects pixel values in the 0-255 range
+        assert input_array.max() > 1.0
+
+    def test_detect_returns_custom_vision_shaped_predictions(self):
+        backend = OnnxDetectionBackend(self.config, self.logger)
+
+        predictions = backend.detect(create_test_image())
+
+        # the third detection is below the default probability threshold
+        assert [p.tag_name for p in predictions] == ["Grass", "Weed"]
+        assert predictions[0].probability == pytest.approx(0.90)
+        box = predictions[1].bounding_box
+        assert box.left == pytest.approx(0.5)
+        assert box.top == pytest.approx(0.5)
+        assert box.width == pytest.approx(0.4)
+        assert box.height == pytest.approx(0.3)
+
+    def test_predictions_feed_get_top_n_predictions(self):
+        detector = GrassWeedDetector(self.config, self.logger)
+
+        predictions = detector.detection_backend.detect(create_test_image())
+        selected = detector.get_top_n_predictions(predictions, 1)
+
+        assert [p.name for p in selected] == ["Grass", "Weed"]
+
+
+class TestCustomVisionDetectionBackend:
+    """
+    Unit tests for the arguments of the Custom Vision calls.
+    """
+
+    def setup_method(self, method):
+        config = StaticConfig(
+            {
+                constants.CONFIG_PREDICTION_ENDPOINT: "https://example.invalid",
+                constants.CONFIG_PREDICTION_KEY: "key",
+                constants.CONFIG_PROJECT_ID: "project",
+                constants.CONFIG_DEPLOYED_NAME: "iteration",
+            }
+        )
+        self.backend = CustomVisionDetectionBackend(config, logging.getLogger(__name__))
+        (self.target,) = self.backend.router.targets
+        self.target.client = MagicMock()
+
+    def test_timeout_is_passed_on(self):
+        self.backend.detect(create_test_image(), timeout=5)
+
+        assert self.target.client.detect_image.call_args.kwargs["timeout"] <= 5
+
+    def test_no_timeout_keeps_the_default_of_the_sdk(self):
+        # msrest would replace its default timeout with None, i.e. no limit
+        self.backend.detect(create_test_image())
+
+        assert "timeout" not in self.target.client.detect_image.call_args.kwargs
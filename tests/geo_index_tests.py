@@ -0,0 +1,219 @@
+import io
+import os
+import random
+import sys
+
+import pytest
+from PIL import ExifTags, Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.geo_index import GeoIndex, haversine_meters, to_world
+from common_modules.image_processing.exif_utilities import read_location
+
+
+def create_geotagged_image(gps: dict, date_time_original: str = None) -> bytes:
+    exif = Image.Exif()
+    exif[ExifTags.IFD.GPSInfo] = gps
+    if date_time_original is not None:
+        exif.get_ifd(ExifTags.IFD.Exif)[0x9003] = date_time_original
+    byte_stream = io.BytesIO()
+    Image.new("RGB", (32, 24), (40, 160, 40)).save(byte_stream, "JPEG", exif=exif)
+    return byte_stream.getvalue()
+
+
+def create_details(index, latitude, longitude, weed_confidence=None, coverage=None):
+    detections = [{"predictedLabel": "Grass", "confidenceLevel": 0.9}]
+    if weed_confidence is not None:
+        detections.append(
+            {"predictedLabel": "Weed", "confidenceLevel": weed_confidence}
+        )
+    return {
+        "prediction_image_url": f"p{index}.jpg",
+        "prediction_info_url": f"p{index}.json",
+        "timestamp": "2024-05-01 10:00:00",
+        "weed_coverage": coverage,
+        "weed_detections": None if coverage is None else 1,
+        "location": {
+            "latitude": latitude,
+            "longitude": longitude,
+            "altitude": None,
+            "captured_at": None,
+        },
+        "detected_details": detections,
+    }
+
+
+class TestReadLocation:
+    """
+    Unit tests for the exif location of the images.
+    """
+
+    def test_gps_position_and_capture_time(self):
+        image_data = create_geotagged_image(
+            {
+                1: "S",
+                2: (33.0, 51.0, 54.36),
+                3: "W",
+                4: (70.0, 30.0, 0.0),
+                5: b"\x01",
+                6: 12.5,
+            },
+            "2024:05:01 13:04:05",
+        )
+
+        location = read_location(image_data)
+
+        assert location == {
+            "latitude": pytest.approx(-33.8651),
+            "longitude": pytest.approx(-70.5),
+            "altitude": -12.5,
+            "captured_at": "2024-05-01 13:04:05",
+        }
+
+    def test_gps_time_is_used_without_capture_time(self):
+        image_data = create_geotagged_image(
+            {
+                1: "N",
+                2: (52.0, 30.0, 0.0),
+                3: "E",
+                4: (4.0, 54.0, 0.0),
+                7: (6.0, 7.0, 8.0),
+                29: "2024:05:02",
+            }
+        )
+
+        location = read_location(image_data)
+
+        assert location["latitude"] == pytest.approx(52.5)
+        assert location["captured_at"] == "2024-05-02 06:07:08"
+
+    def test_image_without_gps_has_no_location(self):
+        byte_stream = io.BytesIO()
+        Image.new("RGB", (32, 24)).save(byte_stream, "PNG")
+
+        assert read_location(byte_stream.getvalue()) is None
+        assert read_location(b"not an image") is None
+
+
+class TestGeoIndex:
+    """
+    Unit tests for the spatial queries of the geo index.
+    """
+
+    def setup_method(self):
+        self.geo_index = GeoIndex(":memory:")
+
+    def teardown_method(self):
+        self.geo_index.close()
+
+    def test_details_without_location_are_skipped(self):
+        details = create_details(1, 52.0, 5.0)
+        details["location"] = None
+
+        assert not self.geo_index.record(details)
+        assert self.geo_index.record(create_details(1, 52.0, 5.0))
+        assert not self.geo_index.record(
+            create_details(1, 52.0, 5.0), skip_existing=True
+        )
+        assert self.geo_index.count() == 1
+
+    def test_area_returns_the_analyses_in_the_box(self):
+        self.geo_index.record(create_details(1, 52.10, 5.10, 0.8))
+        self.geo_index.record(create_details(2, 52.20, 5.20))
+        self.geo_index.record(create_details(3, 52.30, 5.30, 0.4))
+
+        area = self.geo_index.query_area(52.0, 5.0, 52.25, 5.25)
+        assert sorted(item["prediction_info_url"] for item in area["items"]) == [
+            "p1.json",
+            "p2.json",
+        ]
+        assert area["truncated"] is False
+
+        area = self.geo_index.query_area(52.0, 5.0, 53.0, 6.0, min_weed_confidence=0.5)
+        assert [item["weed_confidence"] for item in area["items"]] == [0.8]
+
+        area = self.geo_index.query_area(52.0, 5.0, 53.0, 6.0, limit=2)
+        assert len(area["items"]) == 2
+        assert area["truncated"] is True
+
+    def test_invalid_box_is_refused(self):
+        with pytest.raises(ValueError):
+            self.geo_index.query_area(53.0, 5.0, 52.0, 6.0)
+
+    def test_nearest_matches_a_full_scan(self):
+        rng = random.Random(3)
+        points = [
+            (52.0 + rng.uniform(-0.5, 0.5), 5.0 + rng.uniform(-0.5, 0.5))
+            for _ in range(2000)
+        ]
+        for index, (latitude, longitude) in enumerate(points):
+            self.geo_index.record(create_details(index, latitude, longitude))
+
+        nearest = self.geo_index.query_nearest(52.1, 5.1, count=25, max_distance=50000)
+
+        expected = sorted(
+            haversine_meters(52.1, 5.1, latitude, longitude)
+            for latitude, longitude in points
+        )[:25]
+        assert [item["distance"] for item in nearest["items"]] == [
+            pytest.approx(distance, abs=0.01) for distance in expected
+        ]
+
+    def test_nearest_stops_at_max_distance(self):
+        self.geo_index.record(create_details(1, 52.0, 5.0))
+        self.geo_index.record(create_details(2, 52.1, 5.0))
+
+        nearest = self.geo_index.query_nearest(52.0, 5.001, count=5, max_distance=1000)
+
+        assert [item["prediction_info_url"] for item in nearest["items"]] == ["p1.json"]
+        assert nearest["items"][0]["distance"] == pytest.approx(68.5, abs=1)
+
+    def test_tile_aggregates_the_cells(self):
+        # two analyses in one cell of the tile, one in another tile
+        self.geo_index.record(create_details(1, 52.3701, 4.8901, 0.8, 10.0))
+        self.geo_index.record(create_details(2, 52.3702, 4.8902, None, 0.0))
+        self.geo_index.record(create_details(3, 52.1, 5.1, 0.6, 30.0))
+        zoom = 10
+        x, y = to_world(52.3701, 4.8901)
+        tile_x, tile_y = int(x * 2**zoom), int(y * 2**zoom)
+
+        tile = self.geo_index.query_tile(zoom, tile_x, tile_y, cells=4)
+
+        assert tile["analyses"] == 2
+        assert tile["bounds"]["south"] < 52.3701 < tile["bounds"]["north"]
+        (cell,) = tile["items"]
+        assert cell["analyses"] == 2
+        assert cell["weed_density"] == 0.5
+        assert cell["max_weed_confidence"] == 0.8
+        assert cell["average_weed_coverage"] == 5.0
+
+    def test_aggregated_cells_match_the_points(self):
+        rng = random.Random(5)
+        for index in range(500):
+            weed_confidence = rng.choice([None, rng.uniform(0.5, 1)])
+            coverage = rng.choice([None, rng.uniform(0, 40)])
+            self.geo_index.record(
+                create_details(
+                    index,
+                    52.0 + rng.uniform(-0.05, 0.05),
+                    5.0 + rng.uniform(-0.05, 0.05),
+                    weed_confidence,
+                    coverage,
+                )
+            )
+        zoom = 11
+        x, y = to_world(52.0, 5.0)
+        tile_x, tile_y = int(x * 2**zoom), int(y * 2**zoom)
+
+        cells = self.geo_index.query_tile(zoom, tile_x, tile_y, cells=8)
+        # a minimum confidence of 0 aggregates the same points from the rtree
+        points = self.geo_index.query_tile(
+            zoom, tile_x, tile_y, cells=8, min_weed_confidence=0
+        )
+
+        assert cells["analyses"] > 0
+        assert cells == points
+
+    def test_tile_out_of_range_is_refused(self):
+        with pytest.raises(ValueError):
+            self.geo_index.query_tile(2, 4, 0)
@@ -0,0 +1,91 @@
+import io
+import os
+import sys
+from tempfile import SpooledTemporaryFile
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.image_buffer import (
+    ImageBuffer,
+    held_in_memory,
+    open_image_data,
+)
+
+
+def create_image_data(width=64, height=48):
+    byte_stream = io.BytesIO()
+    Image.new("RGB", (width, height), (10, 200, 30)).save(byte_stream, format="PNG")
+    return byte_stream.getvalue()
+
+
+def create_upload(data, max_size):
+    upload = SpooledTemporaryFile(max_size=max_size)
+    upload.write(data)
+    upload.seek(0)
+    return upload
+
+
+class TestImageBuffer:
+    """
+    Unit tests for the image buffer shared by the analysis stages.
+    """
+
+    def test_upload_in_memory(self):
+        data = create_image_data()
+        upload = create_upload(data, len(data) + 1)
+        assert held_in_memory(upload)
+
+        with ImageBuffer.from_file(upload) as image_buffer:
+            assert image_buffer.mapping is None
+            assert len(image_buffer) == len(data)
+            assert Image.open(image_buffer.open()).size == (64, 48)
+
+        # the upload is not written to disk to map it
+        assert held_in_memory(upload)
+
+    def test_bytes_io_is_read(self):
+        data = create_image_data()
+
+        with ImageBuffer.from_file(io.BytesIO(data)) as image_buffer:
+            assert image_buffer.mapping is None
+            assert image_buffer.open().read() == data
+
+    def test_upload_on_disk_is_mapped(self):
+        data = create_image_data()
+        upload = create_upload(data, 10)
+        assert not held_in_memory(upload)
+
+        with ImageBuffer.from_file(upload) as image_buffer:
+            assert image_buffer.mapping is not None
+            assert image_buffer.open().read() == data
+            assert Image.open(image_buffer.open()).size == (64, 48)
+
+    def test_readers_are_independent(self):
+        image_buffer = ImageBuffer.from_bytes(b"0123456789")
+        first = image_buffer.open()
+        second = image_buffer.open()
+
+        assert first.read(4) == b"0123"
+        assert second.read(2) == b"01"
+        assert first.read() == b"456789"
+        second.seek(-3, io.SEEK_END)
+        assert second.read(10) == b"789"
+
+        chunk = bytearray(4)
+        second.seek(1)
+        assert second.readinto(chunk) == 4
+        assert chunk == b"1234"
+
+    def test_open_image_data(self):
+        data = create_image_data()
+
+        for image_data in (data, memoryview(data), ImageBuffer.from_bytes(data)):
+            assert Image.open(open_image_data(image_data)).size == (64, 48)
+
+    def test_empty_upload(self):
+        upload = create_upload(b"", 0)
+        upload.rollover()
+
+        with ImageBuffer.from_file(upload) as image_buffer:
+            assert len(image_buffer) == 0
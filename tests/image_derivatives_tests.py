@@ -0,0 +1,97 @@
+import logging
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.image_processing.image_derivatives import (
+    create_image_derivatives,
+    select_derivative,
+)
+
+DERIVATIVES_CONFIG = {
+    constants.CONFIG_IMAGE_DERIVATIVES_ENABLED: "true",
+    constants.CONFIG_IMAGE_DERIVATIVE_SIZES: "thumbnail:160,full:0",
+    constants.CONFIG_IMAGE_DERIVATIVE_FORMATS: "jpeg,webp",
+}
+
+
+class TestImageDerivatives:
+    """
+    Unit tests for the creation and the selection of the image derivatives.
+    """
+
+    def test_derivatives_are_created_next_to_the_image(self, tmp_path):
+        filename = str(tmp_path / "p.jpg")
+        image = Image.new("RGB", (640, 480), color=(40, 160, 40))
+        image.save(filename, format="JPEG")
+
+        derivative_files = create_image_derivatives(
+            image, filename, StaticConfig(DERIVATIVES_CONFIG), logging.getLogger()
+        )
+
+        # the full size jpeg is the annotated image itself
+        assert sorted(os.path.basename(f) for f in derivative_files) == [
+            "p_full.webp",
+            "p_thumbnail.jpg",
+            "p_thumbnail.webp",
+        ]
+        with Image.open(tmp_path / "p_thumbnail.webp") as thumbnail:
+            assert thumbnail.format == "WEBP"
+            assert thumbnail.size == (160, 120)
+        with Image.open(tmp_path / "p_full.webp") as full:
+            assert full.size == (640, 480)
+
+    @pytest.mark.parametrize(
+        "size, accept, expected",
+        [
+            (None, None, ("p.jpg", "image/jpeg")),
+            ("full", "image/webp,*/*;q=0.8", ("p_full.webp", "image/webp")),
+            ("thumbnail", None, ("p_thumbnail.jpg", "image/jpeg")),
+            ("thumbnail", "*/*", ("p_thumbnail.jpg", "image/jpeg")),
+            ("thumbnail", "image/webp", ("p_thumbnail.webp", "image/webp")),
+            (
+                "thumbnail",
+                "Image/WebP;q=0.9, */*;q=0.1",
+                ("p_thumbnail.webp", "image/webp"),
+            ),
+            # refused or less preferred than jpeg
+            ("thumbnail", "image/webp;q=0, */*", ("p_thumbnail.jpg", "image/jpeg")),
+            (
+                "thumbnail",
+                "image/webp;q=0.5, image/jpeg",
+                ("p_thumbnail.jpg", "image/jpeg"),
+            ),
+        ],
+    )
+    def test_select_derivative(self, size, accept, expected):
+        config = StaticConfig(DERIVATIVES_CONFIG)
+
+        assert select_derivative("p.jpg", size, accept, config) == expected
+
+    def test_select_derivative_falls_back_to_jpeg(self):
+        # webp derivatives are not created
+        config = StaticConfig(
+            {**DERIVATIVES_CONFIG, constants.CONFIG_IMAGE_DERIVATIVE_FORMATS: "jpeg"}
+        )
+        assert select_derivative("p.jpg", "thumbnail", "image/webp", config) == (
+            "p_thumbnail.jpg",
+            "image/jpeg",
+        )
+
+        # derivatives are disabled, only the annotated image is served
+        config = StaticConfig({})
+        assert select_derivative("p.jpg", None, "image/webp", config) == (
+            "p.jpg",
+            "image/jpeg",
+        )
+        with pytest.raises(ValueError):
+            select_derivative("p.jpg", "thumbnail", None, config)
+
+    def test_select_unknown_size(self):
+        with pytest.raises(ValueError):
+            select_derivative("p.jpg", "huge", None, StaticConfig(DERIVATIVES_CONFIG))
@@ -0,0 +1,117 @@
+import io
+import logging
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.image_processing.image_prescreen import (
+    REASON_BLURRY,
+    REASON_NO_VEGETATION,
+    REASON_TOO_BRIGHT,
+    REASON_TOO_DARK,
+    ImagePrescreen,
+    ImageRejectedError,
+    measure_image,
+)
+
+
+def create_field_image(width: int = 400, height: int = 300) -> Image.Image:
+    """
+    Green grass-like texture with sharp detail.
+    """
+    rng = np.random.default_rng(7)
+    pixels = np.empty((height, width, 3), dtype=np.uint8)
+    pixels[:, :, 0] = rng.integers(20, 90, (height, width))
+    pixels[:, :, 1] = rng.integers(110, 200, (height, width))
+    pixels[:, :, 2] = rng.integers(10, 70, (height, width))
+    return Image.fromarray(pixels)
+
+
+def encode(image: Image.Image, format: str = "JPEG") -> bytes:
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format=format)
+    return byte_stream.getvalue()
+
+
+class TestImagePrescreen:
+    """
+    Unit tests for the pre-screen checks on synthetic images.
+    """
+
+    def setup_method(self, method):
+        self.prescreen = ImagePrescreen(logging.getLogger(__name__))
+
+    def test_usable_image_passes(self):
+        result = self.prescreen.screen(encode(create_field_image()))
+
+        assert result.passed
+        assert result.vegetation_ratio > 0.9
+
+    def test_blurry_image_is_rejected(self):
+        image = create_field_image().filter(ImageFilter.GaussianBlur(8))
+
+        with pytest.raises(ImageRejectedError) as error:
+            self.prescreen.screen(encode(image))
+
+        assert error.value.result.reasons == [REASON_BLURRY]
+
+    def test_dark_and_bright_images_are_rejected(self):
+        dark = create_field_image().point(lambda v: v // 10)
+        bright = Image.new("RGB", (400, 300), (250, 252, 250))
+
+        with pytest.raises(ImageRejectedError) as error:
+            self.prescreen.screen(encode(dark))
+        assert REASON_TOO_DARK in error.value.result.reasons
+
+        with pytest.raises(ImageRejectedError) as error:
+            self.prescreen.screen(encode(bright, "PNG"))
+        assert REASON_TOO_BRIGHT in error.value.result.reasons
+
+    def test_image_without_vegetation_is_rejected(self):
+        pavement = create_field_image().convert("L").convert("RGB")
+
+        with pytest.raises(ImageRejectedError) as error:
+            self.prescreen.screen(encode(pavement))
+
+        assert error.value.result.reasons == [REASON_NO_VEGETATION]
+
+    def test_threshold_of_zero_turns_the_check_off(self):
+        prescreen = ImagePrescreen(logging.getLogger(__name__), min_vegetation_ratio=0)
+        pavement = create_field_image().convert("L").convert("RGB")
+
+        assert prescreen.screen(encode(pavement)).passed
+
+    def test_flag_returns_the_reasons_and_counts(self):
+        prescreen = ImagePrescreen(logging.getLogger(__name__), reject=False)
+        pavement = create_field_image().convert("L").convert("RGB")
+
+        result = prescreen.screen(encode(pavement))
+        prescreen.screen(encode(create_field_image()))
+
+        assert result.reasons == [REASON_NO_VEGETATION]
+        metrics = prescreen.metrics()
+        assert metrics["screened"] == 2
+        assert metrics["flagged"] == 1
+        assert metrics["vision_calls_saved"] == 0
+
+    def test_rejections_are_counted_as_saved_calls(self):
+        pavement = encode(create_field_image().convert("L").convert("RGB"))
+        for _ in range(3):
+            with pytest.raises(ImageRejectedError):
+                self.prescreen.screen(pavement)
+
+        metrics = self.prescreen.metrics()
+        assert metrics["rejected"] == 3
+        assert metrics["vision_calls_saved"] == 3
+        assert metrics["reasons"] == {REASON_NO_VEGETATION: 3}
+
+    def test_large_image_is_measured_on_a_small_copy(self):
+        small = measure_image(encode(create_field_image(400, 300)), 256)
+        large = measure_image(encode(create_field_image(4000, 3000)), 256)
+
+        assert large.brightness == pytest.approx(small.brightness, abs=5)
+        assert large.vegetation_ratio == pytest.approx(small.vegetation_ratio, abs=0.05)
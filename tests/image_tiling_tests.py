@@ -0,0 +1,73 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+from common_modules.image_processing.image_tiling import (
+    compute_tiles,
+    map_tile_predictions,
+    merge_tile_predictions,
+    non_max_suppression,
+)
+
+
+def create_prediction(tag_name, probability, left, top, width, height):
+    return DetectionPrediction(
+        tag_name, probability, PredictionBoundingBox(left, top, width, height)
+    )
+
+
+class TestImageTiling:
+    """
+    Unit tests for the tiled detection helpers.
+    """
+
+    def test_compute_tiles_covers_the_image(self):
+        tiles = compute_tiles(4000, 3000, 1024, 0.2)
+
+        # every tile has the full size and the last ones touch the border
+        assert all(r - l == 1024 and b - t == 1024 for l, t, r, b in tiles)
+        assert max(r for _, _, r, _ in tiles) == 4000
+        assert max(b for _, _, _, b in tiles) == 3000
+        assert min(l for l, _, _, _ in tiles) == 0
+
+    def test_compute_tiles_small_image_is_a_single_tile(self):
+        assert compute_tiles(800, 600, 1024, 0.2) == [(0, 0, 800, 600)]
+
+    def test_map_tile_predictions_to_full_image(self):
+        tile = (1000, 500, 2000, 1500)
+        prediction = create_prediction("Weed", 0.8, 0.5, 0.5, 0.1, 0.2)
+
+        mapped = map_tile_predictions([prediction], tile, 4000, 2000)[0]
+
+        assert mapped.bounding_box.left == pytest.approx(1500 / 4000)
+        assert mapped.bounding_box.top == pytest.approx(1000 / 2000)
+        assert mapped.bounding_box.width == pytest.approx(100 / 4000)
+        assert mapped.bounding_box.height == pytest.approx(200 / 2000)
+
+    def test_non_max_suppression_keeps_highest_score(self):
+        boxes = np.array(
+            [[0.0, 0.0, 1.0, 1.0], [0.05, 0.0, 1.0, 1.0], [2.0, 2.0, 3.0, 3.0]]
+        )
+        scores = np.array([0.6, 0.9, 0.5])
+
+        keep = non_max_suppression(boxes, scores, 0.5)
+
+        assert keep.tolist() == [1, 2]
+
+    def test_merge_tile_predictions_only_merges_same_label(self):
+        predictions = [
+            create_prediction("Weed", 0.7, 0.40, 0.40, 0.2, 0.2),
+            create_prediction("Weed", 0.9, 0.41, 0.40, 0.2, 0.2),
+            create_prediction("Grass", 0.5, 0.40, 0.40, 0.2, 0.2),
+        ]
+
+        merged = merge_tile_predictions(predictions, 0.5)
+
+        assert [(p.tag_name, p.probability) for p in merged] == [
+            ("Weed", 0.9),
+            ("Grass", 0.5),
+        ]
@@ -0,0 +1,226 @@
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.grass_weed_detection import GrassWeedDetector
+from common_modules.image_processing import lazy_rendering
+from common_modules.image_processing.lazy_rendering import (
+    MANIFEST_EXTENSION,
+    SOURCE_EXTENSION,
+    decode_heatmap,
+    encode_heatmap,
+)
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+
+def create_test_image(color: tuple) -> bytes:
+    image = Image.new("RGB", (64, 48), color=color)
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format="JPEG")
+    return byte_stream.getvalue()
+
+
+class TestLazyRendering:
+    """
+    Runs the analysis with lazy rendering, the local storage and the dummy onnx model.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, local_onnx_environment):
+        self.test_data = tmp_path / "test-images"
+        self.test_data.mkdir()
+        (self.test_data / "a.jpg").write_bytes(create_test_image((40, 160, 40)))
+        self.predictions = tmp_path / "predictions"
+        local_onnx_environment({constants.CONFIG_LAZY_RENDERING_ENABLED: "true"})
+        self.logger = logging.getLogger(__name__)
+        self.detector = GrassWeedDetector(Config(), self.logger)
+
+    def read_manifest(self) -> dict:
+        return json.loads((self.predictions / f"p.jpg{MANIFEST_EXTENSION}").read_text())
+
+    def test_analysis_saves_the_manifest_instead_of_the_image(self):
+        details = self.detector.analyze(create_test_image((40, 160, 40)), 3)
+
+        assert not (self.predictions / "p.jpg").exists()
+        assert (self.predictions / "p.json").is_file()
+        manifest = self.read_manifest()
+        assert manifest["rendered"] is False
+        # without write-behind the source stays local, only the manifest is uploaded
+        assert manifest["source"] == {"local_file": f"p.jpg{SOURCE_EXTENSION}"}
+        assert os.path.isfile(f"p.jpg{SOURCE_EXTENSION}")
+        assert not (self.predictions / f"p.jpg{SOURCE_EXTENSION}").exists()
+        assert len(manifest["predictions"]) == len(details.detected_details)
+
+        assert self.detector.lazy_renderer.ensure_rendered("p.jpg")
+
+        with Image.open(self.predictions / "p.jpg") as image:
+            assert image.size == (64, 48)
+        manifest = self.read_manifest()
+        assert manifest["rendered"] is True
+        assert not os.path.exists(f"p.jpg{SOURCE_EXTENSION}")
+        metrics = self.detector.lazy_renderer.metrics()
+        assert metrics["deferred"] == 1
+        assert metrics["rendered"] == 1
+        assert metrics["renders_avoided"] == 0
+
+    def test_rendered_image_matches_the_eager_rendering(self):
+        self.detector.analyze("a.jpg", 3)
+        self.detector.lazy_renderer.ensure_rendered("p.jpg")
+        lazy_image = (self.predictions / "p.jpg").read_bytes()
+        # a test image is referenced by name, it isn't saved again
+        assert not (self.predictions / f"p.jpg{SOURCE_EXTENSION}").exists()
+
+        with patch.dict(os.environ, {constants.CONFIG_LAZY_RENDERING_ENABLED: ""}):
+            eager_detector = GrassWeedDetector(Config(), self.logger)
+        eager_detector.analyze("a.jpg", 3)
+
+        assert (self.predictions / "p.jpg").read_bytes() == lazy_image
+
+    def test_concurrent_first_reads_render_once(self):
+        self.detector.analyze(create_test_image((40, 160, 40)), 3)
+        lazy_renderer = self.detector.lazy_renderer
+        render = lazy_renderer.render
+        renders = []
+
+        def slow_render(filename, manifest):
+            renders.append(filename)
+            time.sleep(0.2)
+            return render(filename, manifest)
+
+        lazy_renderer.render = slow_render
+        barrier = threading.Barrier(8)
+
+        def read():
+            barrier.wait()
+            assert lazy_renderer.ensure_rendered("p.jpg")
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert renders == ["p.jpg"]
+        metrics = lazy_renderer.metrics()
+        assert metrics["rendered"] == 1
+        assert metrics["coalesced"] + metrics["cached"] == 7
+        assert metrics["coalesced"] > 0
+
+    def test_newer_analysis_is_rendered_again(self):
+        self.detector.analyze(create_test_image((40, 160, 40)), 3)
+        self.detector.lazy_renderer.ensure_rendered("p.jpg")
+        # never read, its rendering is avoided
+        self.detector.analyze(create_test_image((160, 40, 40)), 3)
+        self.detector.analyze(create_test_image((40, 40, 160)), 3)
+
+        self.detector.lazy_renderer.ensure_rendered("p.jpg")
+
+        with Image.open(self.predictions / "p.jpg") as image:
+            # the most common color, the boxes cover a part of the image
+            _, (red, green, blue) = max(image.convert("RGB").getcolors(64 * 48))
+        assert blue > red and blue > green
+        metrics = self.detector.lazy_renderer.metrics()
+        assert metrics["deferred"] == 3
+        assert metrics["rendered"] == 2
+        assert metrics["superseded"] == 1
+        assert metrics["renders_avoided"] == 1
+
+    def test_manifest_is_read_after_a_restart(self):
+        self.detector.analyze(create_test_image((40, 160, 40)), 3)
+
+        restarted_detector = GrassWeedDetector(Config(), self.logger)
+        assert restarted_detector.lazy_renderer.ensure_rendered("p.jpg")
+        assert restarted_detector.lazy_renderer.metrics()["rendered"] == 1
+
+        # the manifest is marked as rendered, the image isn't rendered again
+        restarted_detector = GrassWeedDetector(Config(), self.logger)
+        assert restarted_detector.lazy_renderer.ensure_rendered("p.jpg")
+        assert restarted_detector.lazy_renderer.metrics()["rendered"] == 0
+
+    def test_source_is_uploaded_with_write_behind(self, tmp_path):
+        write_behind = {
+            constants.CONFIG_WRITE_BEHIND_ENABLED: "true",
+            constants.CONFIG_WRITE_BEHIND_SPOOL_DIR: str(tmp_path / "spool"),
+        }
+        with patch.dict(os.environ, write_behind):
+            detector = GrassWeedDetector(Config(), self.logger)
+        try:
+            detector.analyze(create_test_image((40, 160, 40)), 3)
+            detector.write_behind.wait_until_idle()
+
+            manifest = self.read_manifest()
+            source = f"p.jpg{SOURCE_EXTENSION}"
+            assert manifest["source"] == {"prediction_file": source}
+            assert (self.predictions / source).is_file()
+            assert detector.lazy_renderer.ensure_rendered("p.jpg")
+        finally:
+            detector.write_behind.close()
+
+    def test_newer_analysis_of_another_worker_is_rendered(self, monkeypatch):
+        # two workers sharing the storage and the image name
+        worker = self.detector
+        other_worker = GrassWeedDetector(Config(), self.logger)
+        worker.analyze(create_test_image((40, 160, 40)), 3)
+        assert worker.lazy_renderer.ensure_rendered("p.jpg")
+
+        other_worker.analyze(create_test_image((40, 40, 160)), 3)
+        # the rendered state is trusted for a while
+        assert worker.lazy_renderer.ensure_rendered("p.jpg")
+        assert worker.lazy_renderer.metrics()["rendered"] == 1
+
+        monkeypatch.setattr(lazy_rendering, "MANIFEST_CACHE_SECONDS", 0.0)
+        assert worker.lazy_renderer.ensure_rendered("p.jpg")
+
+        assert worker.lazy_renderer.metrics()["rendered"] == 2
+        with Image.open(self.predictions / "p.jpg") as image:
+            _, (red, green, blue) = max(image.convert("RGB").getcolors(64 * 48))
+        assert blue > red and blue > green
+        # the other worker finds the manifest rendered, it doesn't render again
+        assert other_worker.lazy_renderer.ensure_rendered("p.jpg")
+        assert other_worker.lazy_renderer.metrics()["rendered"] == 0
+
+    def test_image_without_manifest_is_not_tracked(self):
+        (self.predictions / "other.jpg").write_bytes(create_test_image((0, 0, 0)))
+
+        assert not self.detector.lazy_renderer.ensure_rendered("other.jpg")
+        assert not self.detector.lazy_renderer.ensure_rendered("missing.jpg")
+        metrics = self.detector.lazy_renderer.metrics()
+        assert metrics["tracked_images"] == 0
+        assert metrics["missing_manifests"] == 2
+
+    def test_missing_manifest_is_remembered(self):
+        lazy_renderer = self.detector.lazy_renderer
+        with patch.object(
+            lazy_renderer, "read_manifest", wraps=lazy_renderer.read_manifest
+        ) as read_manifest:
+            for _ in range(3):
+                assert not lazy_renderer.ensure_rendered("p.jpg")
+            assert read_manifest.call_count == 1
+
+            # an analysis saved under the name is found at once
+            self.detector.analyze(create_test_image((40, 160, 40)), 3)
+            assert lazy_renderer.ensure_rendered("p.jpg")
+        assert (self.predictions / "p.jpg").is_file()
+
+    def test_heatmap_round_trip(self):
+        heatmap = np.linspace(0, 1, 64, dtype=np.float32).reshape(8, 8)
+
+        decoded = decode_heatmap(json.loads(json.dumps(encode_heatmap(heatmap))))
+
+        assert decoded.shape == (8, 8)
+        assert np.abs(decoded - heatmap).max() <= 0.5 / 255 + 1e-6
+        assert decode_heatmap(encode_heatmap(None)) is None
@@ -0,0 +1,191 @@
+import asyncio
+import io
+import logging
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.models import GrassPredictionData, PredictionBoundingBox
+from common_modules.live_feed import LatestFrameSlot, LiveFeedSession
+
+
+class TestLatestFrameSlot:
+    """
+    Unit tests for the drop-oldest frame slot of the live feed.
+    """
+
+    def test_newer_frame_replaces_waiting_frame(self):
+        async def run():
+            slot = LatestFrameSlot()
+            assert slot.put(1, b"first") is False
+            assert slot.put(2, b"second") is True
+            return await slot.get()
+
+        assert asyncio.run(run()) == (2, b"second")
+
+    def test_get_waits_for_next_frame(self):
+        async def run():
+            slot = LatestFrameSlot()
+            slot.put(1, b"first")
+            await slot.get()
+
+            waiting = asyncio.create_task(slot.get())
+            await asyncio.sleep(0)
+            assert not waiting.done()
+
+            assert slot.put(2, b"second") is False
+            return await waiting
+
+        assert asyncio.run(run()) == (2, b"second")
+
+
+def create_frame() -> bytes:
+    byte_stream = io.BytesIO()
+    Image.new("RGB", (64, 48), color=(40, 160, 40)).save(byte_stream, format="JPEG")
+    return byte_stream.getvalue()
+
+
+class FakeWebSocket:
+    """
+    Hands out the queued messages and records what the session sends.
+    """
+
+    def __init__(self) -> None:
+        self.incoming = asyncio.Queue()
+        self.sent = []
+        self.closed = None
+
+    def send_frame(self, frame_data: bytes) -> None:
+        self.incoming.put_nowait({"type": "websocket.receive", "bytes": frame_data})
+
+    def disconnect(self) -> None:
+        self.incoming.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+    async def receive(self) -> dict:
+        return await self.incoming.get()
+
+    async def send_json(self, message: dict) -> None:
+        self.sent.append(message)
+
+    async def close(self, code: int = 1000, reason: str = None) -> None:
+        self.closed = code
+
+
+class FakeDetector:
+    """
+    Finds one weed per frame once the gate is open, fails the frames in failing.
+    """
+
+    def __init__(self, failing: tuple = ()) -> None:
+        self.gate = asyncio.Event()
+        self.gate.set()
+        self.failing = failing
+        self.calls = 0
+
+    async def detect_async(self, frame_data: bytes, top_n: int) -> list:
+        self.calls += 1
+        await self.gate.wait()
+        if self.calls in self.failing:
+            raise ValueError("detection failed")
+        return [
+            GrassPredictionData("Weed", 0.9, PredictionBoundingBox(0.1, 0.2, 0.3, 0.4))
+        ]
+
+
+async def wait_until(condition) -> None:
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+class TestLiveFeedSession:
+    """
+    Runs a live feed session against a fake websocket and detector.
+    """
+
+    def create_session(self, websocket, detector) -> LiveFeedSession:
+        return LiveFeedSession(
+            websocket, detector, StaticConfig({}), logging.getLogger(__name__), 3
+        )
+
+    def test_frames_arriving_during_an_analysis_are_dropped(self):
+        websocket = FakeWebSocket()
+        detector = FakeDetector()
+
+        async def run():
+            session = self.create_session(websocket, detector)
+            task = asyncio.create_task(session.run())
+            detector.gate.clear()
+            websocket.send_frame(create_frame())
+            await wait_until(lambda: detector.calls == 1)
+            # the first frame is analyzed, the newest of the others waits
+            for _ in range(3):
+                websocket.send_frame(create_frame())
+            await wait_until(lambda: session.received == 4)
+            detector.gate.set()
+            await wait_until(lambda: len(websocket.sent) == 2)
+            websocket.disconnect()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(run())
+
+        assert [message["frame"] for message in websocket.sent] == [1, 4]
+        assert websocket.sent[0]["detected_details"][0]["predictedLabel"] == "Weed"
+        stats = websocket.sent[-1]["stats"]
+        assert (stats["received"], stats["processed"], stats["dropped"]) == (4, 2, 2)
+        assert websocket.closed is None
+
+    def test_failed_frame_gets_an_error_message(self):
+        websocket = FakeWebSocket()
+        detector = FakeDetector(failing=(1,))
+
+        async def run():
+            session = self.create_session(websocket, detector)
+            task = asyncio.create_task(session.run())
+            websocket.send_frame(create_frame())
+            await wait_until(lambda: len(websocket.sent) == 1)
+            websocket.send_frame(create_frame())
+            await wait_until(lambda: len(websocket.sent) == 2)
+            websocket.disconnect()
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(run())
+
+        failed, analyzed = websocket.sent
+        assert failed["frame"] == 1
+        assert failed["error"] == "unable to analyze frame"
+        assert "detected_details" not in failed
+        assert analyzed["frame"] == 2
+        assert analyzed["stats"]["processed"] == 1
+
+    def test_text_message_closes_the_connection(self):
+        websocket = FakeWebSocket()
+
+        async def run():
+            session = self.create_session(websocket, FakeDetector())
+            websocket.incoming.put_nowait({"type": "websocket.receive", "text": "hi"})
+            await asyncio.wait_for(session.run(), 5)
+            return session
+
+        session = asyncio.run(run())
+
+        assert websocket.closed == 1003
+        assert session.received == 0
+        assert websocket.sent == []
+
+    def test_disconnect_ends_the_session(self):
+        websocket = FakeWebSocket()
+
+        async def run():
+            session = self.create_session(websocket, FakeDetector())
+            websocket.disconnect()
+            await asyncio.wait_for(session.run(), 5)
+
+        asyncio.run(run())
+
+        assert websocket.sent == []
@@ -0,0 +1,83 @@
+import logging
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants, local_storage_utilities
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.local_storage_utilities import LocalFileStorageHelper
+
+
+class TestLocalFileStorageHelper:
+    """
+    Unit tests for the prediction files stored in a local folder.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        self.predictions = tmp_path / "predictions"
+        config = StaticConfig(
+            {
+                constants.CONFIG_LOCAL_PREDICTIONS_FOLDER: str(self.predictions),
+                constants.CONFIG_LOCAL_TEST_DATA_FOLDER: str(tmp_path / "test-images"),
+            }
+        )
+        self.storage = LocalFileStorageHelper(config, logging.getLogger(__name__))
+
+    def test_file_is_written_and_read(self, tmp_path):
+        (tmp_path / "p.json").write_bytes(b"details")
+
+        path = self.storage.write_prediction_details("2024/p.json", "p.json")
+
+        assert path == str(self.predictions / "2024" / "p.json")
+        assert self.storage.read_prediction_details("2024/p.json") == "details"
+        assert self.storage.prediction_file_path("2024/p.json") == path
+        assert self.storage.prediction_file_path("missing.json") is None
+        assert self.storage.list_prediction_details() == [
+            os.path.join("2024", "p.json")
+        ]
+        # no temporary file is left behind
+        assert os.listdir(self.predictions / "2024") == ["p.json"]
+
+    def test_failed_write_keeps_the_previous_file(self, tmp_path, monkeypatch):
+        (tmp_path / "p.jpg").write_bytes(b"old image")
+        self.storage.write_prediction_image("p.jpg")
+        (tmp_path / "p.jpg").write_bytes(b"new image")
+
+        def copy_part(source, target):
+            target.write(source.read(3))
+            raise OSError("disk full")
+
+        monkeypatch.setattr(local_storage_utilities.shutil, "copyfileobj", copy_part)
+        with pytest.raises(OSError):
+            self.storage.write_prediction_image("p.jpg")
+
+        # a reader never sees the partially written file
+        assert self.storage.read_prediction_image("p.jpg") == b"old image"
+        assert os.listdir(self.predictions) == ["p.jpg"]
+
+    @pytest.mark.parametrize(
+        "filename",
+        [
+            "../app.py",
+            "2024/../../app.py",
+            "../predictions-other/p.jpg",
+            "/etc/passwd",
+            "",
+        ],
+    )
+    def test_resolve_path_rejects_names_outside_the_folder(self, filename):
+        with pytest.raises(ValueError):
+            self.storage.resolve_path(self.storage.predictions_folder, filename)
+        with pytest.raises(ValueError):
+            self.storage.read_prediction_image(filename)
+
+    def test_resolve_path_keeps_names_inside_the_folder(self):
+        folder = self.storage.predictions_folder
+
+        assert self.storage.resolve_path(folder, "2024/./p.jpg") == os.path.join(
+            folder, "2024", "p.jpg"
+        )
@@ -0,0 +1,44 @@
+import logging
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.memory_instrumentation import MemoryTracker
+
+
+class TestMemoryTracker:
+    """
+    Unit tests for the memory instrumentation of the requests.
+    """
+
+    def test_measure_records_rss_and_metrics(self):
+        tracker = MemoryTracker(StaticConfig({}), logging.getLogger(__name__))
+
+        with tracker.measure("analyze") as usage:
+            data = bytearray(8 * 1024 * 1024)
+
+        if usage.rss_before is not None:
+            assert usage.rss_after > 0
+            assert usage.rss_delta == usage.rss_after - usage.rss_before
+        assert usage.peak_allocated is None
+
+        metrics = tracker.metrics()
+        assert metrics["requests"] == 1
+        assert metrics["last_request"]["name"] == "analyze"
+        assert tracker.top_allocations() == []
+
+    def test_measure_peak_allocation_when_tracing(self):
+        config = StaticConfig({constants.CONFIG_MEMORY_TRACING_ENABLED: "True"})
+        tracker = MemoryTracker(config, logging.getLogger(__name__))
+        try:
+            with tracker.measure("analyze") as usage:
+                data = bytearray(8 * 1024 * 1024)
+                del data
+
+            assert usage.peak_allocated >= 8 * 1024 * 1024
+            assert len(tracker.top_allocations(5)) > 0
+        finally:
+            tracemalloc.stop()
@@ -0,0 +1,97 @@
+import importlib
+import json
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants, serialization
+from common_modules.common.models import (
+    GrassAnalysisDetails,
+    GrassPredictionData,
+    MarkedDetectedArea,
+    PredictionBoundingBox,
+    VideoAnalysisDetails,
+    VideoFrameDetections,
+)
+
+
+def create_analysis_details() -> GrassAnalysisDetails:
+    marked_areas = [
+        MarkedDetectedArea("Weed", 0.8125, "#D9381E", ((12.4, 30.6), (400.5, 380.2))),
+        MarkedDetectedArea("Grass", 0.4, "#00CC99", ((0.0, 0.0), (816.0, 945.0))),
+    ]
+    return GrassAnalysisDetails(
+        predictions_image_url="predictions.jpg",
+        predictions_info_url="predictions.json",
+        timestamp="2024-09-18 10:11:12",
+        top_n=len(marked_areas),
+        summary="There is a moderate chance that your lawn has weed, é.",
+        detected_details=marked_areas,
+        weed_coverage=12.5,
+        weed_detections=3,
+        prescreen={"action": "warn", "checks": {"blur": 0.25}},
+        location={"latitude": 52.37, "longitude": 4.89},
+    )
+
+
+def create_video_analysis_details() -> VideoAnalysisDetails:
+    frame = VideoFrameDetections(
+        1.23456,
+        [GrassPredictionData("Weed", 0.9, PredictionBoundingBox(0.1, 0.2, 0.3, 0.4))],
+    )
+    return VideoAnalysisDetails("2024-09-18 10:11:12", 2.5, 3, 2, [frame])
+
+
+class TestToJsonBytes:
+    """
+    The json bytes of the models are the json of their to_dict(), with and
+    without orjson.
+    """
+
+    @pytest.fixture(params=["orjson", "json"], autouse=True)
+    def serializer(self, request, monkeypatch):
+        if request.param == "orjson":
+            pytest.importorskip("orjson")
+        else:
+            monkeypatch.setattr(serialization, "orjson", None)
+
+    @pytest.mark.parametrize(
+        "create_details", [create_analysis_details, create_video_analysis_details]
+    )
+    def test_json_bytes_match_the_dict(self, create_details):
+        details = create_details()
+
+        data = details.to_json_bytes()
+
+        assert isinstance(data, bytes)
+        assert json.loads(data) == json.loads(json.dumps(details.to_dict()))
+
+
+class TestReadPredictionDetails:
+    """
+    Reads the stored prediction details through the api, with the local storage.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, local_onnx_environment, monkeypatch):
+        pytest.importorskip("onnxruntime")
+        local_onnx_environment({constants.CONFIG_APP_VERSION: "1"})
+
+        # the api reads the configuration when it is imported
+        monkeypatch.delitem(sys.modules, "api", raising=False)
+        self.client = TestClient(importlib.import_module("api").app)
+        self.predictions = tmp_path / "predictions"
+
+    def test_stored_details_are_passed_through(self):
+        stored = create_analysis_details().to_json_bytes()
+        self.predictions.mkdir(exist_ok=True)
+        (self.predictions / "p.json").write_bytes(stored)
+
+        response = self.client.get("/prediction/details/p.json")
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.content == stored
@@ -0,0 +1,75 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.prediction_history import PredictionHistory
+
+
+def create_details(timestamp, *detections):
+    return {
+        "prediction_image_url": "predictions.jpg",
+        "prediction_info_url": "predictions.json",
+        "timestamp": timestamp,
+        "top_n": len(detections),
+        "summary": "summary",
+        "detected_details": [
+            {"predictedLabel": label, "confidenceLevel": confidence}
+            for label, confidence in detections
+        ],
+    }
+
+
+class TestPredictionHistory:
+    """
+    Unit tests for the local prediction history.
+    """
+
+    def setup_method(self):
+        self.history = PredictionHistory(":memory:")
+        self.history.record(create_details("2024-05-01 10:00:00", ("Weed", 0.8)))
+        self.history.record(
+            create_details("2024-05-02 10:00:00", ("Weed", 0.6), ("Grass", 0.95))
+        )
+        self.history.record(create_details("2024-05-09 10:00:00", ("Weed", 0.75)))
+
+    def teardown_method(self):
+        self.history.close()
+
+    def test_record_skips_existing_analysis(self):
+        assert not self.history.record(
+            create_details("2024-05-01 10:00:00", ("Weed", 0.8)), skip_existing=True
+        )
+        assert self.history.record(
+            create_details("2024-05-01 10:00:00", ("Weed", 0.8))
+        )
+
+    def test_history_pages_newest_first(self):
+        page = self.history.query_history(limit=2)
+        assert [item["timestamp"][:10] for item in page["items"]] == [
+            "2024-05-09",
+            "2024-05-02",
+        ]
+
+        page = self.history.query_history(limit=2, before_id=page["next_cursor"])
+        assert [item["timestamp"][:10] for item in page["items"]] == ["2024-05-01"]
+        assert page["next_cursor"] is None
+
+    def test_history_filters_by_detection(self):
+        page = self.history.query_history(label="Weed", min_confidence=0.7)
+        assert [item["timestamp"][:10] for item in page["items"]] == [
+            "2024-05-09",
+            "2024-05-01",
+        ]
+
+    def test_aggregates_count_and_histogram(self):
+        aggregates = self.history.query_aggregates(
+            start="2024-05-01 00:00:00", end="2024-05-08 00:00:00", bins=4
+        )
+
+        weed = aggregates["labels"]["Weed"]
+        assert weed["count"] == 2
+        assert weed["average_confidence"] == pytest.approx(0.7)
+        assert weed["histogram"] == [0, 0, 1, 1]
+        assert aggregates["labels"]["Grass"]["histogram"] == [0, 0, 0, 1]
@@ -0,0 +1,123 @@
+import logging
+import os
+import sys
+from unittest.mock import MagicMock, patch
+
+import pytest
+from msrest.exceptions import HttpOperationError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.common_config import StaticConfig
+from common_modules.detection.prediction_routing import (
+    PredictionRouter,
+    PredictionTarget,
+    parse_prediction_targets,
+)
+
+
+def create_http_error(status_code):
+    # the real constructor deserializes the response body
+    error = HttpOperationError.__new__(HttpOperationError)
+    error.message = f"status {status_code}"
+    error.response = MagicMock(status_code=status_code)
+    return error
+
+
+class TestPredictionRouter:
+    """
+    Unit tests for the routing of the Custom Vision calls across targets.
+    """
+
+    def setup_method(self):
+        self.east = PredictionTarget("east", "https://east", "key", "project", "it1")
+        self.west = PredictionTarget("west", "https://west", "key", "project", "it1")
+        self.router = PredictionRouter(
+            [self.east, self.west],
+            logging.getLogger(__name__),
+            alpha=0.5,
+            probe_interval=3600,
+        )
+
+    def test_calls_go_to_the_fastest_target(self):
+        self.router.record(self.east, 0.4)
+        self.router.record(self.west, 0.1)
+
+        used = [self.router.call(lambda target, timeout: target.name) for _ in range(3)]
+
+        assert used == ["west", "west", "west"]
+
+    def test_slower_target_is_probed_after_the_interval(self):
+        self.router.record(self.east, 0.4)
+        self.router.record(self.west, 0.1)
+        self.router.probe_interval = 0
+
+        assert self.router.call(lambda target, timeout: target.name) == "east"
+        assert self.east.probes == 1
+
+    def test_first_calls_are_not_probes(self):
+        # a host that has been up for longer than the probe interval
+        clock = "common_modules.detection.prediction_routing.time.monotonic"
+        with patch(clock, return_value=100000.0):
+            east = PredictionTarget("east", "https://east", "key", "project", "it1")
+            west = PredictionTarget("west", "https://west", "key", "project", "it1")
+            router = PredictionRouter(
+                [east, west], logging.getLogger(__name__), probe_interval=3600
+            )
+            router.record(east, 0.4)
+            router.record(west, 0.1)
+
+            assert router.call(lambda target, timeout: target.name) == "west"
+            assert east.probes == 0
+
+        with patch(clock, return_value=100000.0 + 3600):
+            assert router.call(lambda target, timeout: target.name) == "east"
+            assert east.probes == 1
+
+    def test_failed_target_fails_over_and_becomes_unhealthy(self):
+        calls = []
+
+        def call(target, timeout):
+            calls.append(target.name)
+            if target is self.west:
+                raise create_http_error(503)
+            return target.name
+
+        self.router.record(self.east, 0.4)
+        self.router.record(self.west, 0.1)
+        assert self.router.call(call) == "east"
+        assert self.router.call(call) == "east"
+        assert calls == ["west", "east", "west", "east"]
+
+        # unhealthy now, the next call goes straight to the other target
+        assert not self.router.metrics()["west"]["healthy"]
+        calls.clear()
+        assert self.router.call(call) == "east"
+        assert calls == ["east"]
+
+    def test_rejected_request_is_not_retried(self):
+        calls = []
+
+        def call(target, timeout):
+            calls.append(target.name)
+            raise create_http_error(400)
+
+        with pytest.raises(HttpOperationError):
+            self.router.call(call)
+        assert len(calls) == 1
+
+
+def test_parse_prediction_targets():
+    config = StaticConfig(
+        {
+            "ProjectId": "project",
+            "DeployedName": "it1",
+            "PredictionTargets": '[{"name": "east", "endpoint": "https://east", "key": "k1"},'
+            ' {"endpoint": "https://west", "key": "k2", "deployed_name": "it2"}]',
+        }
+    )
+
+    targets = parse_prediction_targets(config)
+
+    assert [t.name for t in targets] == ["east", "target2"]
+    assert [t.deployed_name for t in targets] == ["it1", "it2"]
+    assert targets[1].project_id == "project"
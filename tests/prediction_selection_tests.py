@@ -0,0 +1,81 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+from common_modules.detection.prediction_selection import (
+    PredictionSelector,
+    parse_label_thresholds,
+)
+
+TEST_BOUNDING_BOX = PredictionBoundingBox(0.1, 0.1, 0.2, 0.2)
+
+
+def create_predictions(*items):
+    return [
+        DetectionPrediction(tag_name, probability, TEST_BOUNDING_BOX)
+        for tag_name, probability in items
+    ]
+
+
+class TestPredictionSelector:
+    """
+    Unit tests for the PredictionSelector class
+    """
+
+    def setup_method(self, method):
+        self.selector = PredictionSelector(["Grass", "Weed"])
+
+    def test_select_top_n_of_each_label(self):
+        predictions = create_predictions(
+            ("Weed", 0.4), ("Grass", 0.7), ("Weed", 0.9), ("Grass", 0.8), ("Weed", 0.6)
+        )
+
+        selected = self.selector.select(predictions, 2)
+
+        assert [(p.name, p.confidence_level) for p in selected] == [
+            ("Grass", 0.8),
+            ("Grass", 0.7),
+            ("Weed", 0.9),
+            ("Weed", 0.6),
+        ]
+
+    def test_weed_count_does_not_depend_on_grass_count(self):
+        predictions = create_predictions(
+            ("Grass", 0.9), ("Weed", 0.8), ("Weed", 0.7), ("Weed", 0.6)
+        )
+
+        selected = self.selector.select(predictions, 3)
+
+        assert [p.name for p in selected].count("Weed") == 3
+
+    def test_labels_are_matched_case_insensitively(self):
+        predictions = create_predictions(("weed", 0.5), ("GRASS", 0.4), ("Clover", 0.9))
+
+        selected = self.selector.select(predictions, 1)
+
+        assert [p.name for p in selected] == ["Grass", "Weed"]
+
+    def test_min_confidence_per_label(self):
+        selector = PredictionSelector(
+            ["Grass", "Weed"], parse_label_thresholds("Grass:0.5, weed:0.3")
+        )
+        predictions = create_predictions(("Grass", 0.45), ("Weed", 0.35))
+
+        selected = selector.select(predictions, 1)
+
+        assert [p.name for p in selected] == ["Weed"]
+
+    def test_select_from_thousands_of_predictions(self):
+        random.seed(1)
+        predictions = create_predictions(
+            *[(random.choice(["Grass", "Weed"]), random.random()) for _ in range(5000)]
+        )
+
+        selected = self.selector.select(predictions, 5)
+
+        expected_weed = sorted(
+            (p.probability for p in predictions if p.tag_name == "Weed"), reverse=True
+        )[:5]
+        assert [p.confidence_level for p in selected if p.name == "Weed"] == expected_weed
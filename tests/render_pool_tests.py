@@ -0,0 +1,111 @@
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import TimeoutError
+from multiprocessing.shared_memory import SharedMemory
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.models import GrassPredictionData, PredictionBoundingBox
+from common_modules.image_processing import render_pool
+from common_modules.image_processing.image_utilities import mark_image_with_rectangle
+from common_modules.image_processing.render_pool import AnnotationRenderPool
+
+
+def create_test_image() -> bytes:
+    image = Image.new("RGB", (200, 100), color=(40, 160, 40))
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format="JPEG")
+    return byte_stream.getvalue()
+
+
+PREDICTIONS = [
+    GrassPredictionData("Weed", 0.9, PredictionBoundingBox(0.1, 0.2, 0.3, 0.4)),
+    GrassPredictionData("Grass", 0.8, PredictionBoundingBox(0.5, 0.5, 0.2, 0.2)),
+]
+
+
+class TestAnnotationRenderPool:
+    """
+    Renders through a pool with a single worker process.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, monkeypatch):
+        self.logger = logging.getLogger(__name__)
+        self.config = StaticConfig(
+            {constants.CONFIG_DEFAULT_PREDICTION_IMAGE_FILE_NAME: "p.jpg"}
+        )
+        self.output = str(tmp_path / "p.jpg")
+
+        # records the shared memory blocks created by the pool
+        self.shared_memory_names = []
+        names = self.shared_memory_names
+
+        class RecordingSharedMemory(SharedMemory):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                names.append(self.name)
+
+        monkeypatch.setattr(render_pool, "SharedMemory", RecordingSharedMemory)
+        self.pool = AnnotationRenderPool(self.config, self.logger, 1)
+        yield
+        self.pool.shutdown()
+
+    def assert_shared_memory_released(self):
+        assert len(self.shared_memory_names) == 1
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=self.shared_memory_names[0])
+
+    def test_render_matches_the_in_process_rendering(self, tmp_path):
+        image_data = create_test_image()
+
+        annotated_image_data = self.pool.render(
+            image_data, PREDICTIONS, output_filename=self.output
+        )
+
+        expected = mark_image_with_rectangle(
+            image_data,
+            PREDICTIONS,
+            self.config,
+            self.logger,
+            output_filename=str(tmp_path / "expected.jpg"),
+        )
+        assert annotated_image_data.image is None
+        marked_areas = [area.to_dict() for area in annotated_image_data.marked_areas]
+        assert marked_areas == [area.to_dict() for area in expected.marked_areas]
+        # left/top/width/height as a fraction of the image, in pixels
+        assert marked_areas[0]["boundingBox"] == ((20.0, 20.0), (80.0, 60.0))
+        with Image.open(self.output) as image:
+            assert image.size == (200, 100)
+        self.assert_shared_memory_released()
+
+    def test_shared_memory_is_released_after_a_timeout(self):
+        # keeps the only worker busy
+        busy = self.pool.executor.submit(time.sleep, 1)
+
+        with pytest.raises(TimeoutError):
+            self.pool.render(
+                create_test_image(),
+                PREDICTIONS,
+                timeout=0.1,
+                output_filename=self.output,
+            )
+
+        self.assert_shared_memory_released()
+        busy.result()
+        # the render was cancelled, it didn't run after the worker got free
+        assert not os.path.exists(self.output)
+
+    def test_shared_memory_is_released_after_an_exception(self):
+        with pytest.raises(Exception):
+            self.pool.render(b"not an image", PREDICTIONS, output_filename=self.output)
+
+        self.assert_shared_memory_released()
+        assert not os.path.exists(self.output)
@@ -0,0 +1,78 @@
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.request_profiler import RequestProfiler
+
+
+def busy_work():
+    return sum(i * i for i in range(20000))
+
+
+class TestRequestProfiler:
+    """
+    Unit tests for the on-demand profiling of the requests.
+    """
+
+    def test_header_overrides_sampling(self, tmp_path):
+        profiler = RequestProfiler(
+            logging.getLogger(__name__), tmp_path, 1.0, admin_key="secret"
+        )
+        admin = {constants.ADMIN_KEY_HEADER: "secret"}
+
+        assert profiler.should_profile({})
+        assert profiler.should_profile(
+            {**admin, constants.PROFILE_REQUEST_HEADER: "true"}
+        )
+        assert not profiler.should_profile(
+            {**admin, constants.PROFILE_REQUEST_HEADER: "false"}
+        )
+        profiler.sample_rate = 0.0
+        assert not profiler.should_profile({})
+
+    def test_header_requires_the_admin_key(self, tmp_path):
+        profiler = RequestProfiler(
+            logging.getLogger(__name__), tmp_path, admin_key="secret"
+        )
+        requested = {constants.PROFILE_REQUEST_HEADER: "true"}
+
+        assert not profiler.should_profile(requested)
+        assert not profiler.should_profile(
+            {**requested, constants.ADMIN_KEY_HEADER: "wrong"}
+        )
+        # without a configured admin key nobody can ask for a profile
+        profiler.admin_key = None
+        assert not profiler.should_profile(
+            {**requested, constants.ADMIN_KEY_HEADER: ""}
+        )
+
+    def test_profile_is_stored_under_the_id(self, tmp_path):
+        profiler = RequestProfiler(logging.getLogger(__name__), tmp_path)
+        profile_id = RequestProfiler.new_profile_id()
+
+        with profiler.profile(profile_id):
+            busy_work()
+
+        profiles = profiler.list_profiles()
+        assert len(profiles) == 1
+        assert profiles[0]["name"].startswith(profile_id)
+        assert profiler.profile_path(profiles[0]["name"]) is not None
+
+    def test_only_profile_names_are_served(self, tmp_path):
+        profiler = RequestProfiler(logging.getLogger(__name__), tmp_path)
+        (tmp_path / "secret.txt").write_text("secret")
+
+        assert profiler.profile_path("secret.txt") is None
+        assert profiler.profile_path("../" + "0" * 32 + ".pstats") is None
+        assert profiler.list_profiles() == []
+
+    def test_old_profiles_are_removed(self, tmp_path):
+        profiler = RequestProfiler(logging.getLogger(__name__), tmp_path, 0.0, 2)
+
+        for _ in range(4):
+            with profiler.profile(RequestProfiler.new_profile_id()):
+                busy_work()
+
+        assert len(profiler.list_profiles()) == 2
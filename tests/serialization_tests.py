@@ -0,0 +1,109 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.models import GrassAnalysisDetails, MarkedDetectedArea
+from common_modules.common.serialization import (
+    DETECTION_RECORD,
+    UNKNOWN_LABEL_ID,
+    dumps_compact_details,
+    loads_compact_details,
+    prefers_msgpack,
+)
+
+msgpack = pytest.importorskip("msgpack")
+
+
+def create_analysis_details() -> GrassAnalysisDetails:
+    marked_areas = [
+        MarkedDetectedArea("Weed", 0.8125, "#D9381E", ((12.4, 30.6), (400.5, 380.2))),
+        MarkedDetectedArea("Grass", 0.4, "#00CC99", ((0.0, 0.0), (816.0, 945.0))),
+        MarkedDetectedArea("Clover", 0.3, "#FFFFFF", ((-5.0, 10.0), (70000.0, 20.0))),
+    ]
+    return GrassAnalysisDetails(
+        predictions_image_url="predictions.jpg",
+        predictions_info_url="predictions.json",
+        timestamp="2024-09-18 10:11:12",
+        top_n=len(marked_areas),
+        summary="There is a moderate chance that your lawn has weed.",
+        detected_details=marked_areas,
+        weed_coverage=12.5,
+        weed_detections=3,
+    )
+
+
+class TestCompactDetails:
+    """
+    Unit tests for the compact msgpack format of the prediction details.
+    """
+
+    def test_round_trip(self):
+        details = loads_compact_details(create_analysis_details().to_compact_bytes())
+
+        assert details["timestamp"] == "2024-09-18 10:11:12"
+        assert details["weed_coverage"] == 12.5
+        assert details["weed_detections"] == 3
+        assert details["prediction_info_url"] == "predictions.json"
+        assert details["detections"][0] == {
+            "label": "Weed",
+            "confidence": 0.8125,
+            "box": (12, 31, 400, 380),
+        }
+        assert details["detections"][1]["label"] == "Grass"
+
+    def test_appended_fields_are_ignored(self):
+        message = msgpack.unpackb(create_analysis_details().to_compact_bytes())
+        message.append({"new_field": 1})
+
+        details = loads_compact_details(msgpack.packb(message, use_bin_type=True))
+
+        assert details["weed_detections"] == 3
+        assert len(details["detections"]) == 3
+
+    def test_unknown_label_and_out_of_range_box(self):
+        data = create_analysis_details().to_compact_bytes()
+        records = msgpack.unpackb(data)[7]
+
+        label_id, _, x0, _, x1, _ = list(DETECTION_RECORD.iter_unpack(records))[2]
+        assert label_id == UNKNOWN_LABEL_ID
+        assert x0 == 0
+        assert x1 == 0xFFFF
+
+    def test_stored_json_details_give_the_same_message(self):
+        analysis_details = create_analysis_details()
+        stored = json.loads(analysis_details.to_json_bytes())
+
+        assert dumps_compact_details(stored) == analysis_details.to_compact_bytes()
+
+    def test_compact_is_smaller_than_json(self):
+        analysis_details = create_analysis_details()
+
+        compact = analysis_details.to_compact_bytes()
+        assert len(compact) < len(analysis_details.to_json_bytes()) / 2
+
+
+class TestPrefersMsgpack:
+    """
+    Unit tests for the negotiation of the response format.
+    """
+
+    @pytest.mark.parametrize(
+        "accept, expected",
+        [
+            (None, False),
+            ("", False),
+            ("*/*", False),
+            ("application/json", False),
+            ("application/msgpack", True),
+            ("application/x-msgpack", True),
+            ("application/msgpack, application/json;q=0.5", True),
+            ("application/json, application/msgpack;q=0.5", False),
+            ("application/msgpack;q=0", False),
+            ("Application/MsgPack;q=0.9, */*;q=0.1", True),
+        ],
+    )
+    def test_accept_header(self, accept, expected):
+        assert prefers_msgpack(accept) is expected
@@ -0,0 +1,109 @@
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.models import GrassPredictionData, PredictionBoundingBox
+from common_modules.video_analysis import VideoAnalyzer
+
+sys.path.insert(0, os.path.dirname(__file__))
+from video_utilities_tests import create_video, gradient
+
+
+class FakeDetector:
+    """
+    Labels a frame Weed when it is dark on the left (gradient), Grass
+    otherwise (flipped gradient). The Weed frames take longer, so later
+    frames finish first. Records the calls running at the same time.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def analysis_slot(self, priority, deadline=None):
+        return nullcontext()
+
+    def detect(self, image_data: bytes, top_n: int) -> list:
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            pixels = np.asarray(Image.open(io.BytesIO(image_data)).convert("L"))
+            weed = pixels[:, : pixels.shape[1] // 4].mean() < 128
+            time.sleep(0.2 if weed else 0.05)
+            return [
+                GrassPredictionData(
+                    "Weed" if weed else "Grass",
+                    0.9,
+                    PredictionBoundingBox(0.1, 0.1, 0.2, 0.2),
+                )
+            ]
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class TestVideoAnalyzer:
+    """
+    Runs the video analysis with a fake detector.
+    """
+
+    def create_analyzer(self, detector, max_concurrency=4) -> VideoAnalyzer:
+        config = StaticConfig(
+            {
+                constants.CONFIG_VIDEO_SAMPLE_FPS: "1",
+                constants.CONFIG_VIDEO_MAX_CONCURRENCY: str(max_concurrency),
+            }
+        )
+        return VideoAnalyzer(config, logging.getLogger(__name__), detector)
+
+    def test_duplicate_frames_are_skipped(self):
+        detector = FakeDetector()
+        video = create_video(
+            [gradient(), gradient(), gradient(), gradient(flip=True)], fps=1
+        )
+
+        details = self.create_analyzer(detector).analyze(video, 3)
+
+        assert details.sampled_frames == 4
+        assert details.skipped_frames == 2
+        assert detector.calls == 2
+        assert [frame.timestamp for frame in details.frames] == [0.0, 3.0]
+
+    def test_concurrent_detections_are_bounded(self):
+        detector = FakeDetector()
+        video = create_video([gradient(flip=i % 2 == 1) for i in range(8)], fps=1)
+
+        details = self.create_analyzer(detector, max_concurrency=2).analyze(video, 3)
+
+        assert detector.calls == 8
+        assert detector.max_in_flight == 2
+        assert len(details.frames) == 8
+
+    def test_frames_are_ordered_by_timestamp(self):
+        detector = FakeDetector()
+        video = create_video([gradient(flip=i % 2 == 1) for i in range(6)], fps=1)
+
+        details = self.create_analyzer(detector).analyze(video, 3)
+
+        # the slower Weed frames finish last, the result keeps the video order
+        timestamps = [frame.timestamp for frame in details.frames]
+        assert timestamps == [0.0, 1.0, 2.0, 3.0, 4.0, 5.0]
+        assert [frame.detections[0].name for frame in details.frames] == [
+            "Weed",
+            "Grass",
+        ] * 3
+        assert details.duration == 5.0
@@ -0,0 +1,76 @@
+import io
+import os
+import sys
+
+import av
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.image_processing.video_utilities import (
+    difference_hash,
+    hamming_distance,
+    sample_video_frames,
+)
+
+
+def create_video(frames: list, fps: int = 10) -> io.BytesIO:
+    """
+    Encodes the rgb arrays as a small mp4 video in memory.
+    """
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="mp4") as container:
+        stream = container.add_stream("mpeg4", rate=fps)
+        stream.width = frames[0].shape[1]
+        stream.height = frames[0].shape[0]
+        stream.pix_fmt = "yuv420p"
+        for pixels in frames:
+            frame = av.VideoFrame.from_ndarray(pixels, format="rgb24")
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+    buffer.seek(0)
+    return buffer
+
+
+def gradient(width: int = 64, height: int = 48, flip: bool = False) -> np.ndarray:
+    row = np.linspace(0, 255, width, dtype=np.uint8)
+    if flip:
+        row = row[::-1]
+    pixels = np.tile(row, (height, 1))
+    return np.stack([pixels] * 3, axis=-1)
+
+
+class TestVideoUtilities:
+    """
+    Unit tests for the video frame sampling and the perceptual hash.
+    """
+
+    def test_sample_video_frames_at_the_sample_rate(self):
+        # 3 seconds at 10 fps, sampled at 2 fps
+        video = create_video([gradient()] * 30)
+
+        timestamps = [t for t, _ in sample_video_frames(video, 2.0)]
+
+        assert len(timestamps) == 6
+        assert timestamps[0] == 0.0
+        assert all(b - a >= 0.5 - 1e-6 for a, b in zip(timestamps, timestamps[1:]))
+
+    def test_similar_frames_have_close_hashes(self):
+        noisy = gradient().astype(np.int16) + np.random.default_rng(1).integers(
+            -3, 4, gradient().shape
+        )
+        video = create_video(
+            [gradient(), np.clip(noisy, 0, 255).astype(np.uint8), gradient(flip=True)],
+            fps=1,
+        )
+
+        hashes = [difference_hash(frame) for _, frame in sample_video_frames(video, 1)]
+
+        assert hamming_distance(hashes[0], hashes[1]) <= 6
+        assert hamming_distance(hashes[0], hashes[2]) > 32
+
+    def test_hamming_distance(self):
+        assert hamming_distance(0b1011, 0b0001) == 2
+        assert hamming_distance(2**64 - 1, 0) == 64
@@ -0,0 +1,196 @@
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import Config
+from common_modules.grass_weed_detection import GrassWeedDetector
+from common_modules.watch_folder import (
+    MAX_ANALYSIS_ATTEMPTS,
+    FolderWatcher,
+    Observer,
+    WatchCheckpoint,
+)
+
+onnxruntime = pytest.importorskip("onnxruntime")
+
+
+def create_test_image() -> bytes:
+    image = Image.new("RGB", (64, 48), color=(40, 160, 40))
+    byte_stream = io.BytesIO()
+    image.save(byte_stream, format="JPEG")
+    return byte_stream.getvalue()
+
+
+def wait_for(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestWatchCheckpoint:
+    """
+    Unit tests for the checkpoint of the processed files.
+    """
+
+    def test_entries_survive_a_restart(self, tmp_path):
+        path = str(tmp_path / "checkpoint.jsonl")
+        checkpoint = WatchCheckpoint(path)
+        checkpoint.add([{"path": "a.jpg", "size": 10, "mtime": 5}])
+        # a line cut short by a crash is skipped
+        with open(path, "a") as f:
+            f.write('{"path": "b.jp')
+
+        checkpoint = WatchCheckpoint(path)
+
+        assert checkpoint.is_processed("a.jpg", 10, 5)
+        assert not checkpoint.is_processed("a.jpg", 10, 6)
+        assert not checkpoint.is_processed("b.jpg", 10, 5)
+
+    def test_compact_forgets_removed_files(self, tmp_path):
+        path = str(tmp_path / "checkpoint.jsonl")
+        checkpoint = WatchCheckpoint(path)
+        checkpoint.add(
+            [
+                {"path": "a.jpg", "size": 10, "mtime": 5},
+                {"path": "b.jpg", "size": 10, "mtime": 5},
+            ]
+        )
+
+        checkpoint.compact({"b.jpg"})
+
+        checkpoint = WatchCheckpoint(path)
+        assert not checkpoint.is_processed("a.jpg", 10, 5)
+        assert checkpoint.is_processed("b.jpg", 10, 5)
+
+
+class TestFolderWatcher:
+    """
+    Runs the watch mode with the local storage and the dummy onnx model.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path, local_onnx_environment):
+        self.folder = tmp_path / "camera"
+        self.folder.mkdir()
+        self.predictions = tmp_path / "predictions"
+        self.checkpoint_path = tmp_path / "checkpoint.jsonl"
+        local_onnx_environment(
+            {
+                constants.CONFIG_WATCH_CHECKPOINT_PATH: str(self.checkpoint_path),
+                constants.CONFIG_WATCH_USE_POLLING: "true",
+                constants.CONFIG_WATCH_POLL_SECONDS: "0.1",
+                constants.CONFIG_WATCH_SETTLE_SECONDS: "0.2",
+                constants.CONFIG_WATCH_UPLOAD_BATCH_SIZE: "3",
+                constants.CONFIG_WATCH_UPLOAD_BATCH_SECONDS: "0.5",
+            }
+        )
+        self.config = Config()
+        self.logger = logging.getLogger(__name__)
+        self.detector = GrassWeedDetector(self.config, self.logger)
+        self.watchers = []
+        yield
+        for watcher in self.watchers:
+            watcher.stop()
+
+    def start_watcher(self) -> FolderWatcher:
+        watcher = FolderWatcher(
+            self.config, self.logger, self.detector, str(self.folder)
+        )
+        watcher.start()
+        self.watchers.append(watcher)
+        return watcher
+
+    def write_images(self, *names: str) -> None:
+        for name in names:
+            path = self.folder / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(create_test_image())
+
+    def output(self, name: str):
+        return self.predictions / "watch" / name
+
+    def test_new_images_are_analyzed_and_uploaded(self):
+        watcher = self.start_watcher()
+
+        self.write_images("a.jpg", "b.jpg", "day-1/c.jpg")
+        (self.folder / "notes.txt").write_text("not an image")
+
+        assert wait_for(lambda: watcher.metrics()["uploaded"] == 3)
+        for name in ("a.jpg", "b.jpg", "day-1/c.jpg"):
+            assert self.output(name).is_file()
+            details = json.loads(self.output(name + ".json").read_text())
+            assert details["prediction_image_url"] == f"watch/{name}"
+        # all three results fit in one batch
+        assert watcher.metrics()["upload_batches"] == 1
+
+    def test_partial_batch_is_uploaded_after_the_batch_time(self):
+        watcher = self.start_watcher()
+
+        self.write_images("a.jpg")
+
+        assert wait_for(lambda: watcher.metrics()["uploaded"] == 1)
+
+    def test_restart_skips_the_processed_images(self):
+        self.write_images("a.jpg", "b.jpg")
+        watcher = self.start_watcher()
+        assert wait_for(lambda: watcher.metrics()["uploaded"] == 2)
+        watcher.stop()
+        self.watchers.remove(watcher)
+
+        self.write_images("c.jpg")
+        watcher = self.start_watcher()
+
+        assert wait_for(lambda: watcher.metrics()["uploaded"] == 1)
+        time.sleep(0.5)
+        assert watcher.metrics()["analyzed"] == 1
+
+    def test_unreadable_image_is_not_retried(self):
+        (self.folder / "broken.jpg").write_bytes(b"not a jpeg")
+        watcher = self.start_watcher()
+
+        assert wait_for(lambda: watcher.metrics()["failed"] == 1)
+        time.sleep(0.5)
+
+        assert watcher.metrics()["failed"] == 1
+        assert "error" in self.checkpoint_path.read_text()
+
+    def test_truncated_image_is_given_up_after_a_few_attempts(self):
+        (self.folder / "truncated.jpg").write_bytes(create_test_image()[:300])
+        watcher = self.start_watcher()
+
+        assert wait_for(lambda: watcher.metrics()["failed"] == MAX_ANALYSIS_ATTEMPTS)
+        time.sleep(0.5)
+
+        assert watcher.metrics()["failed"] == MAX_ANALYSIS_ATTEMPTS
+        entry = json.loads(self.checkpoint_path.read_text())
+        assert entry["path"] == "truncated.jpg"
+        assert "truncated" in entry["error"].lower()
+
+    @pytest.mark.skipif(Observer is None, reason="watchdog is not installed")
+    def test_filesystem_events_pick_up_new_images(self):
+        with patch.dict(
+            os.environ,
+            {
+                constants.CONFIG_WATCH_USE_POLLING: "false",
+                constants.CONFIG_WATCH_SCAN_SECONDS: "3600",
+            },
+        ):
+            watcher = self.start_watcher()
+        assert watcher.use_events
+
+        self.write_images("a.jpg")
+
+        assert wait_for(lambda: watcher.metrics()["uploaded"] == 1)
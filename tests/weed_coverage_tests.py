@@ -0,0 +1,95 @@
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common.models import DetectionPrediction, PredictionBoundingBox
+from common_modules.image_processing.weed_coverage import (
+    blend_heatmap,
+    compute_weed_coverage,
+    rasterize_boxes,
+)
+
+
+def create_prediction(tag_name, probability, left, top, width, height):
+    return DetectionPrediction(
+        tag_name, probability, PredictionBoundingBox(left, top, width, height)
+    )
+
+
+def rasterize_with_loop(boxes, values, grid_size):
+    """
+    The same rasterization, one box at a time.
+    """
+    def cell(position):
+        return int(np.floor(position * grid_size + 0.5))
+
+    grid = np.zeros((grid_size, grid_size))
+    for (left, top, width, height), value in zip(boxes, values):
+        x0 = min(cell(left), grid_size - 1)
+        y0 = min(cell(top), grid_size - 1)
+        x1 = min(max(cell(left + width), x0 + 1), grid_size)
+        y1 = min(max(cell(top + height), y0 + 1), grid_size)
+        grid[y0:y1, x0:x1] += value
+    return grid
+
+
+class TestWeedCoverage:
+    """
+    Unit tests for the weed coverage and the density heatmap.
+    """
+
+    def test_rasterize_matches_a_loop_over_the_boxes(self):
+        random = np.random.default_rng(42)
+        boxes = np.column_stack(
+            (random.random((500, 2)) * 0.9, random.random((500, 2)) * 0.3)
+        )
+        values = random.random(500)
+
+        grid = rasterize_boxes(boxes, values, 32)
+
+        assert np.allclose(grid, rasterize_with_loop(boxes, values, 32))
+
+    def test_coverage_of_a_certain_box(self):
+        predictions = [
+            create_prediction("Weed", 1.0, 0.0, 0.0, 0.5, 0.5),
+            create_prediction("Grass", 0.9, 0.5, 0.5, 0.5, 0.5),
+        ]
+
+        weed_coverage = compute_weed_coverage(predictions, grid_size=8)
+
+        assert weed_coverage.coverage == 25.0
+        assert weed_coverage.detections == 1
+        assert weed_coverage.heatmap.shape == (8, 8)
+
+    def test_overlapping_boxes_add_up_as_independent_chances(self):
+        predictions = [
+            create_prediction("Weed", 0.5, 0.0, 0.0, 1.0, 1.0),
+            create_prediction("weed", 0.5, 0.0, 0.0, 1.0, 1.0),
+            create_prediction("Weed", 0.05, 0.0, 0.0, 1.0, 1.0),
+        ]
+
+        weed_coverage = compute_weed_coverage(
+            predictions, grid_size=4, min_confidence=0.1
+        )
+
+        assert weed_coverage.coverage == 75.0
+        assert weed_coverage.detections == 2
+
+    def test_no_weed_no_coverage(self):
+        weed_coverage = compute_weed_coverage([], grid_size=4)
+
+        assert weed_coverage.coverage == 0.0
+        assert weed_coverage.detections == 0
+
+    def test_heatmap_tints_only_the_weed_cells(self):
+        heatmap = np.zeros((2, 2), dtype=np.float32)
+        heatmap[0, 0] = 1.0
+        image = Image.new("RGB", (200, 200), (0, 0, 0))
+
+        blended = blend_heatmap(image, heatmap, "#FF0000", 1.0)
+
+        assert blended.getpixel((10, 10)) == (255, 0, 0)
+        assert blended.getpixel((190, 190)) == (0, 0, 0)
@@ -0,0 +1,164 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common_modules.common import constants
+from common_modules.common.common_config import StaticConfig
+from common_modules.common.write_behind import STALE_TEMP_SECONDS, WriteBehindUploader
+
+
+class FakeStorage:
+    """
+    Records the uploaded files, fails the first failures uploads. When the
+    gate is set, each upload waits for it after reading the file.
+    """
+
+    def __init__(self, failures: int = 0) -> None:
+        self.failures = failures
+        self.uploads = []
+        self.gate = None
+        self.started = threading.Event()
+
+    def write_prediction_image(self, filename, local_path=None, timeout=None):
+        self.upload(filename, local_path)
+
+    def write_prediction_details(self, filename, local_path=None, timeout=None):
+        self.upload(filename, local_path)
+
+    def upload(self, filename, local_path):
+        with open(local_path, "rb") as f:
+            content = f.read()
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("storage unavailable")
+        self.uploads.append((filename, content))
+
+
+class TestWriteBehindUploader:
+    """
+    Runs the write-behind uploads against a fake storage.
+    """
+
+    def setup_method(self):
+        self.logger = logging.getLogger(__name__)
+        self.uploaders = []
+
+    def teardown_method(self):
+        for uploader in self.uploaders:
+            uploader.close()
+
+    def create_uploader(self, tmp_path, storage) -> WriteBehindUploader:
+        config = StaticConfig(
+            {
+                constants.CONFIG_WRITE_BEHIND_SPOOL_DIR: str(tmp_path / "spool"),
+                constants.CONFIG_WRITE_BEHIND_MAX_RETRIES: "3",
+                constants.CONFIG_WRITE_BEHIND_RETRY_DELAY_SECONDS: "0",
+            }
+        )
+        uploader = WriteBehindUploader(config, self.logger, storage)
+        self.uploaders.append(uploader)
+        return uploader
+
+    def test_spooled_file_is_served_until_it_is_uploaded(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        storage = FakeStorage()
+        storage.gate = threading.Event()
+        uploader = self.create_uploader(tmp_path, storage)
+        (tmp_path / "p.json").write_bytes(b"details")
+
+        uploader.enqueue("p.json")
+        assert uploader.read_pending("p.json") == b"details"
+
+        storage.gate.set()
+        uploader.wait_until_idle()
+        assert storage.uploads == [("p.json", b"details")]
+        assert uploader.read_pending("p.json") is None
+        assert os.listdir(tmp_path / "spool") == []
+
+    def test_failed_upload_is_retried(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        storage = FakeStorage(failures=2)
+        uploader = self.create_uploader(tmp_path, storage)
+        (tmp_path / "p.jpg").write_bytes(b"image")
+
+        uploader.enqueue("p.jpg")
+        uploader.wait_until_idle()
+
+        assert storage.uploads == [("p.jpg", b"image")]
+        assert uploader.read_pending("p.jpg") is None
+
+    def test_file_stays_spooled_after_the_last_retry(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        storage = FakeStorage(failures=3)
+        uploader = self.create_uploader(tmp_path, storage)
+        (tmp_path / "p.jpg").write_bytes(b"image")
+
+        uploader.enqueue("p.jpg")
+        uploader.wait_until_idle()
+
+        assert storage.uploads == []
+        assert uploader.read_pending("p.jpg") == b"image"
+
+    def test_newer_file_replaces_the_pending_one(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        storage = FakeStorage()
+        storage.gate = threading.Event()
+        uploader = self.create_uploader(tmp_path, storage)
+        (tmp_path / "other.json").write_bytes(b"other")
+        # keeps the worker busy while p.json is spooled twice
+        uploader.enqueue("other.json")
+        assert storage.started.wait(5)
+        for content in (b"old", b"new"):
+            (tmp_path / "p.json").write_bytes(content)
+            uploader.enqueue("p.json")
+
+        storage.gate.set()
+        uploader.wait_until_idle()
+
+        assert storage.uploads == [("other.json", b"other"), ("p.json", b"new")]
+
+    def test_file_spooled_by_another_worker_is_not_removed(
+        self, tmp_path, monkeypatch
+    ):
+        monkeypatch.chdir(tmp_path)
+        storage = FakeStorage()
+        storage.gate = threading.Event()
+        uploader = self.create_uploader(tmp_path, storage)
+        (tmp_path / "p.json").write_bytes(b"old")
+        uploader.enqueue("p.json")
+        assert storage.started.wait(5)
+
+        # another worker renames a newer file into place during the upload
+        spool_path = uploader.spool_path("p.json")
+        (tmp_path / "newer.tmp").write_bytes(b"new")
+        os.replace(tmp_path / "newer.tmp", spool_path)
+        storage.gate.set()
+        uploader.wait_until_idle()
+
+        assert storage.uploads == [("p.json", b"old")]
+        assert uploader.read_pending("p.json") == b"new"
+
+    def test_recovery_uploads_the_spooled_files(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        spool = tmp_path / "spool"
+        spool.mkdir()
+        (spool / "p.json").write_bytes(b"left over")
+        # an interrupted copy, and a copy in progress of another worker
+        stale = spool / "123-stale.tmp"
+        stale.write_bytes(b"partial")
+        stale_time = time.time() - STALE_TEMP_SECONDS - 10
+        os.utime(stale, (stale_time, stale_time))
+        (spool / "456-copying.tmp").write_bytes(b"partial")
+
+        storage = FakeStorage()
+        uploader = self.create_uploader(tmp_path, storage)
+        uploader.wait_until_idle()
+
+        assert storage.uploads == [("p.json", b"left over")]
+        assert sorted(os.listdir(spool)) == ["456-copying.tmp"]